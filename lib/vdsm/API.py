@@ -1436,6 +1436,23 @@ class Global(APIBase):
         return {'status': doneCode,
                 'statsList': logutils.Suppressed(statsList)}
 
+    @api.logged(on="api.host")
+    def getAllVmStatsDelta(self, since=0):
+        """
+        Get statistics of all running VMs changed since generation since.
+        """
+        hooks.before_get_all_vm_stats()
+        statsList = self._cif.getAllVmStats()
+        statsList = hooks.after_get_all_vm_stats(statsList)
+        delta = self._cif.vm_stats_tracker.delta(statsList, since)
+        throttledlog.info('getAllVmStats', "Current getAllVmStatsDelta: %s",
+                          logutils.AllVmStatsValue(delta.stats_list))
+        return {'status': doneCode,
+                'generation': delta.generation,
+                'full': delta.full,
+                'statsList': logutils.Suppressed(delta.stats_list),
+                'removedVms': delta.removed}
+
     @api.logged(on="api.host")
     def getAllVmIoTunePolicies(self):
         """
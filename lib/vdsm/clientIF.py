@@ -50,6 +50,7 @@ from vdsm.virt import events
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import secret
+from vdsm.virt import statsdelta
 from vdsm.virt import vmstatus
 from vdsm.virt.vmchannels import Listener
 from vdsm.virt.vmdevices.storage import DISK_TYPE
@@ -115,6 +116,7 @@ class clientIF(object):
         self._subscriptions = defaultdict(list)
         self._scheduler = scheduler
         self._unknown_vm_ids = set()
+        self.vm_stats_tracker = statsdelta.StatsTracker()
         if _glusterEnabled:
             self.gluster = gapi.GlusterApi()
         else:
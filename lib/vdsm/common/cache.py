@@ -21,6 +21,8 @@ from __future__ import absolute_import
 from __future__ import division
 
 import functools
+import threading
+import time
 
 
 class memoized(object):
@@ -52,3 +54,98 @@ class memoized(object):
         wrapper = functools.partial(self.__call__, obj)
         wrapper.invalidate = self.cache.clear
         return wrapper
+
+
+class TTLCache(object):
+    """
+    Cache values returned by expensive calls for ttl seconds.
+
+    Concurrent calls with the same key are coalesced; the first caller runs
+    the function, and the other callers wait for its result. Errors are not
+    cached, but are raised in all waiting callers.
+
+    If ttl is 0, values are not cached, but concurrent calls are still
+    coalesced.
+
+    Cached values are shared by all callers, and must not be modified.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+        self._running = {}
+
+    def get(self, key, func):
+        """
+        Return the cached value for key, or call func() to get the value.
+        """
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                expires, value = entry
+                if self._clock() < expires:
+                    return value
+                del self._values[key]
+
+            call = self._running.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self._running[key] = _Call()
+                leader = True
+
+        if not leader:
+            return call.wait()
+
+        try:
+            value = func()
+        except Exception as e:
+            with self._lock:
+                self._finish(key, call)
+            call.set(error=e)
+            raise
+
+        with self._lock:
+            # If the cache was invalidated while we were running, the value
+            # may be stale.
+            if self._finish(key, call) and self._ttl > 0:
+                self._values[key] = (self._clock() + self._ttl, value)
+        call.set(value=value)
+        return value
+
+    def invalidate(self):
+        """
+        Drop all cached values. Calls started before invalidate() are not
+        joined by new callers, and their values are not cached.
+        """
+        with self._lock:
+            self._values.clear()
+            self._running.clear()
+
+    def _finish(self, key, call):
+        # Must be called with _lock held.
+        if self._running.get(key) is call:
+            del self._running[key]
+            return True
+        return False
+
+
+class _Call(object):
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def set(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
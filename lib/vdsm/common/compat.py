@@ -75,6 +75,13 @@ except ImportError:
     # no big deal, fallback to standard library
     import json  # NOQA: F401 (unused import)
 
+try:
+    # orjson is much faster than json and encodes directly to bytes, avoiding
+    # large temporary strings when encoding big responses.
+    import orjson
+except ImportError:
+    orjson = None
+
 if six.PY2:
     import subprocess32 as subprocess  # pylint: disable=import-error
 else:
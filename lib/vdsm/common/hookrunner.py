@@ -0,0 +1,268 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Persistent runner for Python hooks.
+
+Starting a new Python interpreter for every hook script is expensive, and
+some hooks run on every engine poll (e.g. before_get_all_vm_stats). The
+persistent runner keeps worker processes running a Python interpreter with
+vdsm.hook.hooking loaded, and executes Python hook scripts inside the
+worker.
+
+The hook data (domain xml or json) is sent to the worker with the request
+and kept in memory, instead of passing it in a temporary file.
+
+Requests and replies are sent as single line json messages over the worker
+stdin and stdout. The worker redirects the hook standard output and error,
+so hook output cannot break the protocol.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import traceback
+
+from vdsm.common import commands
+
+# Scripts are considered Python hooks if they start with a python shebang
+# and use the hooking module.
+_HEADER_SIZE = 4096
+
+log = logging.getLogger("hooks.runner")
+
+
+class WorkerError(Exception):
+    """
+    Raised when a worker died or sent an invalid reply.
+    """
+
+
+class Runner(object):
+    """
+    Run Python hook scripts in a pool of persistent worker processes.
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._idle = []
+        self._workers = 0
+        self._python_hooks = {}
+
+    def is_python_hook(self, path):
+        """
+        Return True if path is a Python hook using the hooking module, that
+        can be run by the persistent runner.
+        """
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached = self._python_hooks.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER_SIZE)
+        except EnvironmentError:
+            return False
+        first_line = header.split(b"\n", 1)[0]
+        result = (first_line.startswith(b"#!") and
+                  b"python" in first_line and
+                  b"hooking" in header and
+                  b"_hook_domxml" not in header and
+                  b"_hook_json" not in header)
+        self._python_hooks[path] = (key, result)
+        return result
+
+    def run(self, script, env, data):
+        """
+        Run script in a worker, returning the hook return code, error output
+        and the data modified by the hook.
+
+        Returns None if all workers are busy; the caller should run the
+        script in a new process.
+
+        Raises WorkerError if the worker failed.
+        """
+        worker = self._acquire()
+        if worker is None:
+            return None
+        try:
+            reply = worker.run(script, env, data)
+        except BaseException:
+            worker.close()
+            self._discard()
+            raise
+        self._release(worker)
+        return reply["rc"], reply["err"], reply["data"]
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._workers -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._workers == self._max_workers:
+                return None
+            self._workers += 1
+        try:
+            return _Worker()
+        except BaseException:
+            self._discard()
+            raise
+
+    def _release(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def _discard(self):
+        with self._lock:
+            self._workers -= 1
+
+
+class _Worker(object):
+
+    def __init__(self):
+        self._proc = commands.start(
+            [sys.executable, "-m", "vdsm.common.hookrunner"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        log.debug("Started hook worker pid=%s", self._proc.pid)
+
+    def run(self, script, env, data):
+        request = {"script": script, "env": env, "data": data}
+        try:
+            self._proc.stdin.write(json.dumps(request).encode("utf-8"))
+            self._proc.stdin.write(b"\n")
+            self._proc.stdin.flush()
+            line = self._proc.stdout.readline()
+        except EnvironmentError as e:
+            raise WorkerError("Error communicating with worker: %s" % e)
+        if not line:
+            raise WorkerError(
+                "Worker pid=%s terminated unexpectedly" % self._proc.pid)
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise WorkerError("Invalid reply %r: %s" % (line, e))
+
+    def close(self):
+        log.debug("Stopping hook worker pid=%s", self._proc.pid)
+        with commands.terminating(self._proc):
+            pass
+
+
+# Worker side.
+
+
+def main():
+    # Keep stdin and stdout for the protocol, and redirect the hooks and the
+    # commands they run to /dev/null and stderr.
+    proto_in = io.open(os.dup(0), "rb")
+    proto_out = io.open(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    os.close(devnull)
+
+    # Hooks import hooking from the hook directory, or vdsm.hook.hooking;
+    # both must use the same module, since the hook data is kept there.
+    from vdsm.hook import hooking
+    sys.path.append(os.path.dirname(hooking.__file__))
+    sys.modules["hooking"] = hooking
+
+    code_cache = {}
+
+    for line in proto_in:
+        request = json.loads(line)
+        reply = _run_hook(hooking, code_cache, request)
+        proto_out.write(json.dumps(reply).encode("utf-8"))
+        proto_out.write(b"\n")
+        proto_out.flush()
+
+
+def _run_hook(hooking, code_cache, request):
+    script = request["script"]
+    err = io.StringIO()
+    rc = 0
+
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.argv = [script]
+    hooking._data = request["data"]
+    try:
+        with contextlib.redirect_stderr(err), \
+                contextlib.redirect_stdout(io.StringIO()):
+            try:
+                code = _compile(code_cache, script)
+                exec(code, {"__name__": "__main__", "__file__": script})
+            except SystemExit as e:
+                rc = _exit_code(e, err)
+            except BaseException:
+                traceback.print_exc()
+                rc = 1
+        return {"rc": rc, "err": err.getvalue(), "data": hooking._data}
+    finally:
+        hooking._data = None
+
+
+def _compile(code_cache, script):
+    st = os.stat(script)
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = code_cache.get(script)
+    if cached is None or cached[0] != key:
+        with open(script, "rb") as f:
+            code = compile(f.read(), script, "exec")
+        cached = (key, code)
+        code_cache[script] = cached
+    return cached[1]
+
+
+def _exit_code(e, err):
+    # Mimic the interpreter handling of SystemExit.
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    err.write("%s\n" % e.code)
+    return 1
+
+
+if __name__ == "__main__":
+    main()
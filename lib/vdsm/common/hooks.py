@@ -22,7 +22,6 @@ from __future__ import print_function
 from __future__ import absolute_import
 from __future__ import division
 
-import glob
 import hashlib
 import itertools
 import json
@@ -33,11 +32,16 @@ import pkgutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 import six
 
 from vdsm.common import commands
+from vdsm.common import concurrent
 from vdsm.common import exception
+from vdsm.common import hookrunner
+from vdsm.common.config import config
 from vdsm.common.constants import P_VDSM_HOOKS, P_VDSM_RUN
 
 _LAUNCH_FLAGS_FILE = 'launchflags'
@@ -56,14 +60,158 @@ def _scriptsPerDir(dir_name):
         head, tail = os.path.split(head)
         if tail == "..":
             raise ValueError("Hook directory paths cannot contain '..'")
-    path = os.path.join(P_VDSM_HOOKS, dir_name, '*')
-    return [s for s in glob.glob(path)
-            if os.path.isfile(s) and os.access(s, os.X_OK)]
+    path = os.path.join(P_VDSM_HOOKS, dir_name)
+    return [s for s in _listHooksDir(path) if os.access(s, os.X_OK)]
+
+
+# Modifying a directory more recently than this may not change the
+# directory modification time, so we don't cache recently modified
+# directories.
+_MTIME_RESOLUTION = 1.0
+
+_dirCache = {}
+
+
+def _listHooksDir(path):
+    """
+    Return a sorted list of files in hook directory path.
+
+    The list is cached until the directory is modified, so listing a hook
+    directory does not require reading the directory for every event. Adding,
+    removing or renaming a file modifies the directory, so the cache is
+    invalidated. The executable bit can be modified without modifying the
+    directory, so callers must check it.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return []
+    key = (st.st_ino, st.st_mtime_ns)
+    cached = _dirCache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    files = sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if not name.startswith('.'))
+    files = [f for f in files if os.path.isfile(f)]
+
+    if time.time() - st.st_mtime > _MTIME_RESOLUTION:
+        _dirCache[path] = (key, files)
+    return files
 
 
 _DOMXML_HOOK = 1
 _JSON_HOOK = 2
 
+_runner = None
+_runnerLock = threading.Lock()
+
+
+def _persistentRunner():
+    global _runner
+    if not config.getboolean('hooks', 'persistent_runner'):
+        return None
+    with _runnerLock:
+        if _runner is None:
+            _runner = hookrunner.Runner(
+                config.getint('hooks', 'persistent_runner_workers'))
+        return _runner
+
+
+# Hooks declaring this header in the first _HEADER_SIZE bytes do not modify
+# the hook data, and do not depend on other hooks in the same directory.
+_READONLY_HEADER = b"# vdsm-hook: readonly"
+_HEADER_SIZE = 4096
+
+_readonlyCache = {}
+
+
+def _isReadonly(path):
+    """
+    Return True if hook script path declares itself read-only.
+
+    Read-only hooks may run concurrently with other read-only hooks when
+    parallel_readonly is enabled. The result is cached until the script is
+    modified.
+    """
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return False
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _readonlyCache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+    except EnvironmentError:
+        return False
+    result = any(line.strip() == _READONLY_HEADER
+                 for line in header.splitlines())
+    _readonlyCache[path] = (key, result)
+    return result
+
+
+def _parallelReadonly():
+    return config.getboolean('hooks', 'parallel_readonly')
+
+
+def _pipeline(scripts):
+    """
+    Split scripts to stages, keeping scripts order. When parallel_readonly
+    is enabled, consecutive read-only scripts are grouped in one read-only
+    stage. Other scripts run in their own stage.
+
+    Returns list of (readonly, scripts) tuples.
+    """
+    if not _parallelReadonly():
+        return [(False, [s]) for s in scripts]
+
+    stages = []
+    group = []
+    for s in scripts:
+        if _isReadonly(s):
+            group.append(s)
+            continue
+        if group:
+            stages.append((True, group))
+            group = []
+        stages.append((False, [s]))
+    if group:
+        stages.append((True, group))
+    return stages
+
+
+_statsLock = threading.Lock()
+_stats = {}
+
+
+def _recordElapsed(script, elapsed):
+    with _statsLock:
+        stats = _stats.get(script)
+        if stats is None:
+            stats = _stats[script] = {
+                "count": 0, "total": 0.0, "max": 0.0, "last": 0.0}
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["last"] = elapsed
+
+
+def script_stats():
+    """
+    Return wall time statistics for hook scripts run since vdsm started.
+
+    Returns:
+        dict {path: stats}, where stats is dict with "count", "total", "max"
+        and "last" keys. Times are in seconds.
+    """
+    with _statsLock:
+        return {path: dict(stats) for path, stats in _stats.items()}
+
 
 def _runHooksDir(data, dir, vmconf={}, raiseError=True, errors=None, params={},
                  hookType=_DOMXML_HOOK):
@@ -71,19 +219,24 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, errors=None, params={},
         errors = []
 
     scripts = _scriptsPerDir(dir)
-    scripts.sort()
 
     if not scripts:
         return data
 
-    data_fd, data_filename = tempfile.mkstemp()
-    try:
-        if hookType == _DOMXML_HOOK:
-            os.write(data_fd, data.encode('utf-8') if data else b'')
-        elif hookType == _JSON_HOOK:
-            os.write(data_fd, json.dumps(data).encode('utf-8'))
-        os.close(data_fd)
+    # The current data is kept in memory for hooks run by the persistent
+    # runner, and in a temporary file for other hooks. The file is created
+    # only when needed.
+    if hookType == _DOMXML_HOOK:
+        hook_data = data or ''
+    elif hookType == _JSON_HOOK:
+        hook_data = json.dumps(data)
+    data_filename = None
+    file_current = False
+    memory_current = True
 
+    runner = _persistentRunner()
+
+    try:
         scriptenv = os.environ.copy()
 
         # Update the environment using params and custom configuration
@@ -107,39 +260,146 @@ def _runHooksDir(data, dir, vmconf={}, raiseError=True, errors=None, params={},
         ppath = scriptenv.get('PYTHONPATH', '')
         hook = os.path.dirname(pkgutil.get_loader('vdsm.hook').get_filename())
         scriptenv['PYTHONPATH'] = ':'.join(ppath.split(':') + [hook])
-        if hookType == _DOMXML_HOOK:
-            scriptenv['_hook_domxml'] = data_filename
-        elif hookType == _JSON_HOOK:
-            scriptenv['_hook_json'] = data_filename
-
-        for s in scripts:
-            p = commands.start([s], stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, env=scriptenv)
-
-            with commands.terminating(p):
-                (out, err) = p.communicate()
 
-            rc = p.returncode
-            logging.info('%s: rc=%s err=%s', s, rc, err)
-            if rc != 0:
-                errors.append(err)
-
-            if rc == 2:
+        for readonly, stage in _pipeline(scripts):
+            if readonly:
+                if not memory_current:
+                    hook_data = _readHookData(data_filename)
+                    memory_current = True
+                results = _runReadonlyStage(
+                    stage, scriptenv, hook_data, hookType, runner)
+            else:
+                s = stage[0]
+                start = time.monotonic()
+                result = None
+
+                if runner is not None and runner.is_python_hook(s):
+                    if not memory_current:
+                        hook_data = _readHookData(data_filename)
+                        memory_current = True
+                    try:
+                        result = runner.run(s, scriptenv, hook_data)
+                    except hookrunner.WorkerError as e:
+                        logging.warning(
+                            "Persistent hook runner failed to run %s, "
+                            "running in a new process: %s", s, e)
+
+                if result is not None:
+                    rc, err, hook_data = result
+                    err = err.encode('utf-8')
+                    file_current = False
+                else:
+                    if data_filename is None:
+                        data_filename = _createHookDataFile(
+                            scriptenv, hookType)
+                    if not file_current:
+                        _writeHookData(data_filename, hook_data)
+                        file_current = True
+
+                    rc, err = _runScript(s, scriptenv)
+                    memory_current = False
+
+                results = [(s, rc, err, time.monotonic() - start)]
+
+            stop = False
+            for s, rc, err, elapsed in results:
+                _recordElapsed(s, elapsed)
+                logging.info('%s: rc=%s err=%s elapsed=%.3f',
+                             s, rc, err, elapsed)
+                if rc != 0:
+                    errors.append(err)
+
+                if rc == 2:
+                    stop = True
+                elif rc > 2:
+                    logging.warning('hook returned unexpected return code %s',
+                                    rc)
+            if stop:
                 break
-            elif rc > 2:
-                logging.warning('hook returned unexpected return code %s', rc)
 
         if errors and raiseError:
             raise exception.HookError(err)
 
-        with open(data_filename, encoding='utf-8') as f:
-            final_data = f.read()
+        if not memory_current:
+            hook_data = _readHookData(data_filename)
     finally:
-        os.unlink(data_filename)
+        if data_filename is not None:
+            os.unlink(data_filename)
     if hookType == _DOMXML_HOOK:
-        return final_data
+        return hook_data
     elif hookType == _JSON_HOOK:
-        return json.loads(final_data)
+        return json.loads(hook_data)
+
+
+def _runScript(script, scriptenv):
+    p = commands.start([script], stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, env=scriptenv)
+
+    with commands.terminating(p):
+        (out, err) = p.communicate()
+
+    return p.returncode, err
+
+
+def _runReadonlyStage(stage, scriptenv, hook_data, hookType, runner):
+    """
+    Run read-only scripts in stage concurrently, each with its own copy of
+    the hook data. Data modified by the scripts is dropped.
+
+    Returns list of (script, rc, err, elapsed) tuples, in stage order.
+    """
+    def run(s):
+        start = time.monotonic()
+        result = None
+
+        if runner is not None and runner.is_python_hook(s):
+            try:
+                result = runner.run(s, scriptenv, hook_data)
+            except hookrunner.WorkerError as e:
+                logging.warning("Persistent hook runner failed to run "
+                                "%s, running in a new process: %s", s, e)
+
+        if result is not None:
+            rc, err, _ = result
+            err = err.encode('utf-8')
+        else:
+            env = scriptenv.copy()
+            data_filename = _createHookDataFile(env, hookType)
+            try:
+                _writeHookData(data_filename, hook_data)
+                rc, err = _runScript(s, env)
+            finally:
+                os.unlink(data_filename)
+
+        return s, rc, err, time.monotonic() - start
+
+    results = {}
+    for res in concurrent.tmap(run, stage, max_workers=len(stage),
+                               name="hooks"):
+        if not res.succeeded:
+            raise res.value
+        results[res.value[0]] = res.value
+    return [results[s] for s in stage]
+
+
+def _createHookDataFile(scriptenv, hookType):
+    data_fd, data_filename = tempfile.mkstemp()
+    os.close(data_fd)
+    if hookType == _DOMXML_HOOK:
+        scriptenv['_hook_domxml'] = data_filename
+    elif hookType == _JSON_HOOK:
+        scriptenv['_hook_json'] = data_filename
+    return data_filename
+
+
+def _writeHookData(data_filename, hook_data):
+    with open(data_filename, 'w', encoding='utf-8') as f:
+        f.write(hook_data)
+
+
+def _readHookData(data_filename):
+    with open(data_filename, encoding='utf-8') as f:
+        return f.read()
 
 
 def before_device_create(devicexml, vmconf={}, customProperties={}):
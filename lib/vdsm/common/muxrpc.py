@@ -0,0 +1,351 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Multiplexed RPC over a unix socket.
+
+multiprocessing manager proxies use a connection per calling thread, and
+every call waits for the reply before the next call can be sent. The mux
+transport sends calls from all threads over one connection. Every request
+has an id, and replies are matched to the waiting callers by id, so
+concurrent calls do not wait for each other.
+
+A request may contain several calls, run by the server one after another in
+a single round trip.
+
+Messages are pickled by multiprocessing.connection, like multiprocessing
+manager messages:
+
+    request: (request_id, [(name, args, kwargs), ...])
+    reply:   (request_id, kind, value)
+
+If all calls succeeded, kind is RESULT and value is a list of results.
+Otherwise kind is ERROR and value is the exception raised by the failing
+call; the next calls in the request are not run.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import functools
+import itertools
+import logging
+import pickle
+import socket
+import threading
+import traceback
+
+from multiprocessing import connection
+
+from vdsm.common import concurrent
+
+RESULT = "result"
+ERROR = "error"
+
+log = logging.getLogger("common.muxrpc")
+
+
+class Closed(Exception):
+    """
+    Raised when the connection was closed before receiving the reply.
+    """
+
+
+class RemoteError(Exception):
+    """
+    Raised when the error raised on the server cannot be sent to the client.
+    """
+
+
+class _Call(object):
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._kind = None
+        self._value = None
+
+    def set(self, kind, value):
+        self._kind = kind
+        self._value = value
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._kind == ERROR:
+            raise self._value
+        return self._value
+
+
+class Client(object):
+    """
+    Send calls from multiple threads over one connection.
+    """
+
+    def __init__(self, address):
+        self._conn = connection.Client(address, family="AF_UNIX")
+        # Sending is serialized by _send_lock; _lock protects the pending
+        # calls and must not be held while sending, since the reader must
+        # be able to process replies while a sender is blocked.
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count()
+        self._error = None
+        self._reader = concurrent.thread(
+            self._read, name="muxrpc/reader", log=log)
+        self._reader.start()
+
+    def call(self, name, args=(), kwargs=None):
+        """
+        Call function name on the server, returning the result or raising
+        the error raised on the server.
+
+        Raises Closed if the connection was closed.
+        """
+        return self.batch([(name, args, kwargs or {})])[0]
+
+    def batch(self, calls):
+        """
+        Run calls on the server in one round trip.
+
+        Arguments:
+            calls (list): list of (name, args, kwargs) tuples.
+
+        Returns:
+            List of results, one per call.
+
+        Raises the error raised by the first failing call; the next calls
+        are not run. Raises Closed if the connection was closed.
+        """
+        call = _Call()
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            request_id = next(self._ids)
+            self._pending[request_id] = call
+
+        try:
+            with self._send_lock:
+                self._conn.send((request_id, list(calls)))
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            if isinstance(e, (EOFError, OSError)):
+                raise Closed("Error sending request: %s" % e)
+            raise
+
+        return call.wait()
+
+    def close(self):
+        if self._conn.closed:
+            return
+        # Closing the connection does not wake up the reader blocked in
+        # recv(), so we shut down the socket.
+        with socket.fromfd(self._conn.fileno(), socket.AF_UNIX,
+                           socket.SOCK_STREAM) as sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._reader.join()
+        self._conn.close()
+
+    def _read(self):
+        try:
+            while True:
+                request_id, kind, value = self._conn.recv()
+                with self._lock:
+                    call = self._pending.pop(request_id, None)
+                if call is None:
+                    log.warning("Unexpected reply %s", request_id)
+                    continue
+                call.set(kind, value)
+        except (EOFError, OSError) as e:
+            error = Closed("Connection closed: %s" % (e or "EOF"))
+        except Exception as e:
+            log.exception("Error reading replies")
+            error = Closed("Error reading replies: %s" % e)
+
+        with self._lock:
+            self._error = error
+            pending = self._pending
+            self._pending = {}
+
+        for call in pending.values():
+            call.set(ERROR, error)
+
+
+class Server(object):
+    """
+    Serve calls to the public methods of instance. Every request runs in
+    its own worker thread; up to idle_workers idle threads are kept for
+    running the next requests.
+    """
+
+    def __init__(self, address, instance, idle_workers=8):
+        self._address = address
+        self._instance = instance
+        self._listener = connection.Listener(address, family="AF_UNIX")
+        self._pool = _Pool(idle_workers)
+        self._running = True
+
+    def serve_forever(self):
+        try:
+            while True:
+                conn = self._listener.accept()
+                if not self._running:
+                    conn.close()
+                    break
+                t = concurrent.thread(
+                    self._serve_connection, args=(conn,),
+                    name="muxrpc/conn", log=log)
+                t.start()
+        finally:
+            self._listener.close()
+
+    def shutdown(self):
+        self._running = False
+        # Wake up serve_forever() blocked in accept().
+        connection.Client(self._address, family="AF_UNIX").close()
+        self._pool.stop()
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(msg):
+            with send_lock:
+                conn.send(msg)
+
+        try:
+            while True:
+                try:
+                    request_id, calls = conn.recv()
+                except EOFError:
+                    break
+                self._pool.dispatch(
+                    functools.partial(self._run, request_id, calls, reply))
+        finally:
+            conn.close()
+
+    def _run(self, request_id, calls, reply):
+        results = []
+        try:
+            for name, args, kwargs in calls:
+                results.append(self._lookup(name)(*args, **kwargs))
+        except Exception as e:
+            msg = (request_id, ERROR, _portable(e))
+        else:
+            msg = (request_id, RESULT, results)
+
+        try:
+            try:
+                reply(msg)
+            except (EOFError, OSError):
+                raise
+            except Exception:
+                # Pickling the reply failed; nothing was sent.
+                log.exception("Cannot send reply %s", request_id)
+                reply((request_id, ERROR,
+                       RemoteError(traceback.format_exc())))
+        except (EOFError, OSError) as e:
+            log.debug("Cannot send reply %s: %s", request_id, e)
+
+    def _lookup(self, name):
+        if name.startswith("_"):
+            raise AttributeError("Cannot call private method %r" % name)
+        return getattr(self._instance, name)
+
+
+def _portable(error):
+    """
+    Return error if it can be unpickled by the client, or RemoteError.
+    Some exceptions can be pickled, but fail when unpickled, breaking the
+    connection.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RemoteError("".join(
+            traceback.format_exception(type(error), error,
+                                       error.__traceback__)))
+    return error
+
+
+class _Pool(object):
+    """
+    Run every task in a worker thread, starting a new worker when all
+    workers are busy, so a slow task never delays other tasks. Up to
+    idle_workers idle workers are kept for running the next tasks.
+    """
+
+    def __init__(self, idle_workers):
+        self._idle_workers = idle_workers
+        self._cond = threading.Condition(threading.Lock())
+        self._tasks = collections.deque()
+        self._workers = set()
+        self._idle = 0
+        self._running = True
+        self._count = itertools.count()
+
+    def dispatch(self, task):
+        with self._cond:
+            self._tasks.append(task)
+            if self._idle >= len(self._tasks):
+                self._cond.notify()
+            else:
+                t = concurrent.thread(
+                    self._work, name="muxrpc/%d" % next(self._count),
+                    log=log)
+                self._workers.add(t)
+                t.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            workers = list(self._workers)
+        for t in workers:
+            t.join()
+
+    def _work(self):
+        try:
+            while True:
+                with self._cond:
+                    # Take a pending task before checking the idle limit;
+                    # dispatch() counts notified workers which did not wake
+                    # up yet as idle, so the task may be waiting for us.
+                    if not self._tasks:
+                        if self._idle >= self._idle_workers:
+                            break
+                        self._idle += 1
+                        while self._running and not self._tasks:
+                            self._cond.wait()
+                        self._idle -= 1
+                        if not self._tasks:
+                            break
+                    task = self._tasks.popleft()
+                try:
+                    task()
+                except Exception:
+                    log.exception("Unhandled error in task")
+        finally:
+            with self._cond:
+                self._workers.discard(threading.current_thread())
@@ -26,9 +26,12 @@ import os
 from multiprocessing.managers import BaseManager, RemoteError
 import logging
 import threading
+import time
 
 from vdsm.common import constants
 from vdsm.common import function
+from vdsm.common import muxrpc
+from vdsm.common.config import config
 from vdsm.common.panic import panic
 
 _g_singletonSupervdsmInstance = None
@@ -37,6 +40,18 @@ _g_singletonSupervdsmInstance_lock = threading.Lock()
 
 ADDRESS = os.path.join(constants.P_VDSM_RUN, "svdsm.sock")
 
+TRANSPORT_MUX = "mux"
+TRANSPORT_MANAGER = "manager"
+
+
+def mux_address(address):
+    """
+    Return the address of the mux transport socket for supervdsm manager
+    socket address.
+    """
+    base, ext = os.path.splitext(address)
+    return base + "-mux" + ext
+
 
 class _SuperVdsmManager(BaseManager):
     pass
@@ -49,16 +64,7 @@ class ProxyCaller(object):
         self._supervdsmProxy = supervdsmProxy
 
     def __call__(self, *args, **kwargs):
-        callMethod = lambda: \
-            getattr(self._supervdsmProxy._svdsm, self._funcName)(*args,
-                                                                 **kwargs)
-        try:
-            return callMethod()
-        except RemoteError:
-            self._supervdsmProxy._connect()
-            raise RuntimeError(
-                "Broken communication with supervdsm. Failed call to %s"
-                % self._funcName)
+        return self._supervdsmProxy._call(self._funcName, args, kwargs)
 
 
 class SuperVdsmProxy(object):
@@ -70,12 +76,94 @@ class SuperVdsmProxy(object):
     def __init__(self):
         self._manager = None
         self._svdsm = None
+        self._client = None
+        self._statsLock = threading.Lock()
+        self._stats = {}
         self._connect()
 
     def open(self, *args, **kwargs):
         # pylint: disable=no-member
         return self._manager.open(*args, **kwargs)
 
+    def batch(self, calls):
+        """
+        Run calls in supervdsm one after another, in a single round trip
+        when using the mux transport.
+
+        Arguments:
+            calls (list): list of (name, args, kwargs) tuples.
+
+        Returns:
+            List of results, one per call.
+
+        Raises the error raised by the first failing call; the next calls
+        are not run.
+        """
+        calls = [(name, tuple(args), dict(kwargs))
+                 for name, args, kwargs in calls]
+        start = time.monotonic()
+        try:
+            client = self._client
+            if client is not None:
+                names = ", ".join(name for name, _, _ in calls)
+                return self._muxCall(names, client.batch, calls)
+            return [self._managerCall(name, args, kwargs)
+                    for name, args, kwargs in calls]
+        finally:
+            elapsed = time.monotonic() - start
+            for name, _, _ in calls:
+                self._record(name, elapsed)
+
+    def stats(self):
+        """
+        Return latency statistics for supervdsm calls.
+
+        Returns:
+            dict {name: stats}, where stats is dict with "count", "total"
+            and "max" keys. Times are in seconds. Calls sent in a batch are
+            recorded with the latency of the batch.
+        """
+        with self._statsLock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def _call(self, name, args, kwargs):
+        start = time.monotonic()
+        try:
+            client = self._client
+            if client is not None:
+                return self._muxCall(name, client.call, name, args, kwargs)
+            return self._managerCall(name, args, kwargs)
+        finally:
+            self._record(name, time.monotonic() - start)
+
+    def _muxCall(self, name, func, *args):
+        try:
+            return func(*args)
+        except muxrpc.Closed:
+            self._connect()
+            raise RuntimeError(
+                "Broken communication with supervdsm. Failed call to %s"
+                % name)
+
+    def _managerCall(self, name, args, kwargs):
+        try:
+            return getattr(self._svdsm, name)(*args, **kwargs)
+        except RemoteError:
+            self._connect()
+            raise RuntimeError(
+                "Broken communication with supervdsm. Failed call to %s"
+                % name)
+
+    def _record(self, name, elapsed):
+        with self._statsLock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {
+                    "count": 0, "total": 0.0, "max": 0.0}
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
     def _connect(self):
         self._manager = _SuperVdsmManager(address=ADDRESS, authkey=b'')
         self._manager.register('instance')
@@ -91,6 +179,20 @@ class SuperVdsmProxy(object):
         # pylint: disable=no-member
         self._svdsm = self._manager.instance()
 
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+        if config.get('supervdsm', 'transport') == TRANSPORT_MUX:
+            # supervdsm started before upgrading vdsm may not serve the mux
+            # transport.
+            try:
+                self._client = muxrpc.Client(mux_address(ADDRESS))
+            except OSError as e:
+                self._log.warning(
+                    "Cannot connect to supervdsm mux transport, using "
+                    "manager transport: %s", e)
+
     def __getattr__(self, name):
         return ProxyCaller(self, name)
 
@@ -23,15 +23,19 @@ from __future__ import division
 
 import calendar
 import errno
+import functools
+import io
 import logging
 import os
 import socket
 import time
 import xml.etree.ElementTree as etree
 
+from vdsm.common import cache
 from vdsm.common import cmdutils
 from vdsm.common import commands
 from vdsm.common.compat import subprocess
+from vdsm.config import config
 from vdsm.network.netinfo import addresses
 
 from . import exception as ge
@@ -45,6 +49,19 @@ _TIME_ZONE = time.tzname[0]
 
 _DEFAULT_TIMEOUT = 120  # secs
 
+_RESULT_TAGS = frozenset(['opRet', 'opErrno', 'opErrstr'])
+
+_VOLUME_STATUS_NAME = 'volStatus/volumes/volume/volName'
+_VOLUME_STATUS_PATHS = (_VOLUME_STATUS_NAME,
+                        'volStatus/volumes/volume/node')
+_VOLUME_INFO_PATHS = ('volInfo/volumes/volume',)
+_VOLUME_PROFILE_NAME = 'volProfile/volname'
+_VOLUME_PROFILE_PATHS = (_VOLUME_PROFILE_NAME, 'volProfile/brick')
+
+# Cache for volume queries polled by engine. Commands modifying gluster
+# state invalidate the cache.
+_queryCache = cache.TTLCache(config.getfloat('gluster', 'cli_cache_ttl'))
+
 if hasattr(etree, 'ParseError'):
     _etreeExceptions = (etree.ParseError, AttributeError, ValueError)
 else:
@@ -106,6 +123,21 @@ class SnapshotStatus:
     DEACTIVATED = 'DEACTIVATED'
 
 
+def _invalidatesQueries(func):
+    """
+    Decorate a function modifying gluster state, invalidating cached
+    queries when it returns or fails, including queries running
+    concurrently with it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _queryCache.invalidate()
+    return wrapper
+
+
 def _execGluster(cmd):
     try:
         return commands.run(cmd)
@@ -116,17 +148,82 @@ def _execGluster(cmd):
 def _getTree(out):
     try:
         tree = etree.fromstring(out)
-        rv = int(tree.find('opRet').text)
-        msg = tree.find('opErrstr').text
-        errNo = int(tree.find('opErrno').text)
     except _etreeExceptions:  # pylint: disable=catching-non-exception
         raise ge.GlusterXmlErrorException(err=out)
-    if rv == 0:
-        return tree
-    else:
+    _checkResult(out,
+                 tree.findtext('opRet'),
+                 tree.findtext('opErrno'),
+                 tree.findtext('opErrstr'))
+    return tree
+
+
+def _checkResult(out, opRet, opErrno, opErrstr):
+    try:
+        rv = int(opRet)
+        errNo = int(opErrno)
+    except (TypeError, ValueError):
+        raise ge.GlusterXmlErrorException(err=out)
+    if rv != 0:
         if errNo != 0:
             rv = errNo
-        raise ge.GlusterCmdFailedException(rc=rv, err=[msg])
+        raise ge.GlusterCmdFailedException(rc=rv, err=[opErrstr or None])
+
+
+def _iterparse(out, paths):
+    """
+    Parse gluster XML output incrementally, yielding (path, element) for
+    elements matching one of paths, in document order. Paths are relative
+    to the root element, e.g. "volInfo/volumes/volume".
+
+    Elements are removed from the tree after they were yielded, so memory
+    usage does not depend on the number of volumes or bricks in the
+    output.
+
+    Raises GlusterCmdFailedException if the command failed, and
+    GlusterXmlErrorException if out is not valid gluster XML.
+    """
+    paths = {tuple(path.split('/')): path for path in paths}
+    depths = {len(key) for key in paths}
+    source = io.BytesIO(out) if isinstance(out, bytes) else io.StringIO(out)
+    # Tags of the open elements below the root, and the open elements.
+    tags = []
+    parents = []
+    result = {}
+    checked = False
+    try:
+        for event, el in etree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if parents:
+                    if (not checked and not tags and
+                            el.tag not in _RESULT_TAGS):
+                        # The command result is reported before the data.
+                        _checkResult(out, result.get('opRet'),
+                                     result.get('opErrno'),
+                                     result.get('opErrstr'))
+                        checked = True
+                    tags.append(el.tag)
+                parents.append(el)
+                continue
+
+            parents.pop()
+            if not parents:
+                break
+
+            if len(tags) in depths:
+                path = paths.get(tuple(tags))
+                if path is not None:
+                    yield path, el
+                    parents[-1].remove(el)
+            elif len(tags) == 1 and el.tag in _RESULT_TAGS:
+                result[el.tag] = el.text
+
+            tags.pop()
+    except _etreeExceptions:  # pylint: disable=catching-non-exception
+        raise ge.GlusterXmlErrorException(err=out)
+
+    if not checked:
+        _checkResult(out, result.get('opRet'), result.get('opErrno'),
+                     result.get('opErrstr'))
 
 
 def _execGlusterXml(cmd):
@@ -134,6 +231,37 @@ def _execGlusterXml(cmd):
     return _getTree(_execGluster(cmd))
 
 
+def _queryGlusterXml(cmd, paths, parse):
+    """
+    Run a gluster query command, and return the value returned by
+    parse(elements), where elements is an iterator of (path, element) for
+    the elements matching paths in the command XML output.
+
+    Results are cached for a short time, and concurrent identical queries
+    run the command once.
+    """
+    cmd.append('--xml')
+
+    def query():
+        out = _execGluster(cmd)
+        try:
+            return parse(_iterparse(out, paths))
+        except _etreeExceptions:  # pylint: disable=catching-non-exception
+            raise ge.GlusterXmlErrorException(err=[out])
+
+    return _queryCache.get(tuple(cmd), query)
+
+
+def _findall(tree, paths):
+    """
+    Return an iterator of (path, element) for the elements matching paths
+    in a parsed tree, like _iterparse().
+    """
+    for path in paths:
+        for el in tree.findall(path):
+            yield path, el
+
+
 def _execGlusterXmlWithTimeout(cmd, timeout=_DEFAULT_TIMEOUT):
     cmd.append('--xml')
     cmd = cmdutils.wrap_command(cmd)
@@ -187,13 +315,30 @@ def hostUUIDGet():
     return out[6:].rstrip('\n')
 
 
+def _volumeStatusNodes(elements, status):
+    """
+    Set the volume name in status, and yield the volume status node
+    elements.
+    """
+    for path, el in elements:
+        if path == _VOLUME_STATUS_NAME:
+            status.setdefault('name', el.text)
+        else:
+            yield el
+    if 'name' not in status:
+        raise ValueError("No volume name in volume status")
+
+
 def _parseVolumeStatus(tree):
-    status = {'name': tree.find('volStatus/volumes/volume/volName').text,
-              'bricks': [],
+    return _volumeStatus(_findall(tree, _VOLUME_STATUS_PATHS))
+
+
+def _volumeStatus(elements):
+    status = {'bricks': [],
               'nfs': [],
               'shd': []}
     hostname = _getLocalIpAddress() or _getGlusterHostName()
-    for el in tree.findall('volStatus/volumes/volume/node'):
+    for el in _volumeStatusNodes(elements, status):
         value = {}
 
         for ch in el:
@@ -235,9 +380,12 @@ def _parseVolumeStatus(tree):
 
 
 def _parseVolumeStatusDetail(tree):
-    status = {'name': tree.find('volStatus/volumes/volume/volName').text,
-              'bricks': []}
-    for el in tree.findall('volStatus/volumes/volume/node'):
+    return _volumeStatusDetail(_findall(tree, _VOLUME_STATUS_PATHS))
+
+
+def _volumeStatusDetail(elements):
+    status = {'bricks': []}
+    for el in _volumeStatusNodes(elements, status):
         value = {}
 
         for ch in el:
@@ -260,9 +408,12 @@ def _parseVolumeStatusDetail(tree):
 
 
 def _parseVolumeStatusClients(tree):
-    status = {'name': tree.find('volStatus/volumes/volume/volName').text,
-              'bricks': []}
-    for el in tree.findall('volStatus/volumes/volume/node'):
+    return _volumeStatusClients(_findall(tree, _VOLUME_STATUS_PATHS))
+
+
+def _volumeStatusClients(elements):
+    status = {'bricks': []}
+    for el in _volumeStatusNodes(elements, status):
         hostname = el.find('hostname').text
         path = el.find('path').text
         hostuuid = el.find('peerid').text
@@ -283,9 +434,12 @@ def _parseVolumeStatusClients(tree):
 
 
 def _parseVolumeStatusMem(tree):
-    status = {'name': tree.find('volStatus/volumes/volume/volName').text,
-              'bricks': []}
-    for el in tree.findall('volStatus/volumes/volume/node'):
+    return _volumeStatusMem(_findall(tree, _VOLUME_STATUS_PATHS))
+
+
+def _volumeStatusMem(elements):
+    status = {'bricks': []}
+    for el in _volumeStatusNodes(elements, status):
         brick = {'brick': '%s:%s' % (el.find('hostname').text,
                                      el.find('path').text),
                  'hostuuid': el.find('peerid').text,
@@ -382,21 +536,18 @@ def volumeStatus(volumeName, brick=None, option=None):
         command.append(brick)
     if option:
         command.append(option)
+    if option == 'detail':
+        parse = _volumeStatusDetail
+    elif option == 'clients':
+        parse = _volumeStatusClients
+    elif option == 'mem':
+        parse = _volumeStatusMem
+    else:
+        parse = _volumeStatus
     try:
-        xmltree = _execGlusterXml(command)
+        return _queryGlusterXml(command, _VOLUME_STATUS_PATHS, parse)
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterVolumeStatusFailedException(rc=e.rc, err=e.err)
-    try:
-        if option == 'detail':
-            return _parseVolumeStatusDetail(xmltree)
-        elif option == 'clients':
-            return _parseVolumeStatusClients(xmltree)
-        elif option == 'mem':
-            return _parseVolumeStatusMem(xmltree)
-        else:
-            return _parseVolumeStatus(xmltree)
-    except _etreeExceptions:  # pylint: disable=catching-non-exception
-        raise ge.GlusterXmlErrorException(err=[etree.tostring(xmltree)])
 
 
 def _parseVolumeInfo(tree):
@@ -413,8 +564,12 @@ def _parseVolumeInfo(tree):
                       'redundancyCount': REDUNDANCY_COUNT,
                       'isArbiter': [True/False]}, ...}
     """
+    return _volumeInfo(_findall(tree, _VOLUME_INFO_PATHS))
+
+
+def _volumeInfo(elements):
     volumes = {}
-    for el in tree.findall('volInfo/volumes/volume'):
+    for _, el in elements:
         value = {}
         value['volumeName'] = el.find('name').text
         value['uuid'] = el.find('id').text
@@ -461,6 +616,11 @@ def _parseVolumeInfo(tree):
 
 
 def _parseVolumeProfileInfo(tree, nfs):
+    return _volumeProfileInfo(_findall(tree, _VOLUME_PROFILE_PATHS), nfs)
+
+
+def _volumeProfileInfo(elements, nfs):
+    volumeName = None
     bricks = []
     if nfs:
         brickKey = 'nfs'
@@ -468,7 +628,10 @@ def _parseVolumeProfileInfo(tree, nfs):
     else:
         brickKey = 'brick'
         bricksKey = 'bricks'
-    for brick in tree.findall('volProfile/brick'):
+    for path, brick in elements:
+        if path == _VOLUME_PROFILE_NAME:
+            volumeName = brick.text
+            continue
         fopCumulative = []
         blkCumulative = []
         fopInterval = []
@@ -510,7 +673,9 @@ def _parseVolumeProfileInfo(tree, nfs):
                  'duration': brick.find('intervalStats/duration').text,
                  'totalRead': brick.find('intervalStats/totalRead').text,
                  'totalWrite': brick.find('intervalStats/totalWrite').text}})
-    status = {'volumeName': tree.find("volProfile/volname").text,
+    if volumeName is None:
+        raise ValueError("No volume name in volume profile")
+    status = {'volumeName': volumeName,
               bricksKey: bricks}
     return status
 
@@ -537,13 +702,9 @@ def volumeInfo(volumeName=None, remoteServer=None):
     if volumeName:
         command.append(volumeName)
     try:
-        xmltree = _execGlusterXml(command)
+        return _queryGlusterXml(command, _VOLUME_INFO_PATHS, _volumeInfo)
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterVolumesListFailedException(rc=e.rc, err=e.err)
-    try:
-        return _parseVolumeInfo(xmltree)
-    except _etreeExceptions:  # pylint: disable=catching-non-exception
-        raise ge.GlusterXmlErrorException(err=[etree.tostring(xmltree)])
 
 
 def is_ipv4_fqdn(address):
@@ -555,6 +716,7 @@ def is_ipv4_fqdn(address):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeCreate(volumeName, brickList, replicaCount=0, stripeCount=0,
                  transportList=[], force=False, arbiter=False):
     command = _getGlusterVolCmd() + ["create", volumeName]
@@ -582,6 +744,7 @@ def volumeCreate(volumeName, brickList, replicaCount=0, stripeCount=0,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeStart(volumeName, force=False):
     command = _getGlusterVolCmd() + ["start", volumeName]
     if force:
@@ -594,6 +757,7 @@ def volumeStart(volumeName, force=False):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeStop(volumeName, force=False):
     command = _getGlusterVolCmd() + ["stop", volumeName]
     if force:
@@ -606,6 +770,7 @@ def volumeStop(volumeName, force=False):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeDelete(volumeName):
     command = _getGlusterVolCmd() + ["delete", volumeName]
     try:
@@ -616,6 +781,7 @@ def volumeDelete(volumeName):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeSet(volumeName, option, value):
     heal_is_set = option in ('cluster.granular-entry-heal',
                              'granular-entry-heal')
@@ -664,6 +830,7 @@ def volumeSetHelpXml():
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeReset(volumeName, option='', force=False):
     command = _getGlusterVolCmd() + ['reset', volumeName]
     if option:
@@ -678,6 +845,7 @@ def volumeReset(volumeName, option='', force=False):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeAddBrick(volumeName, brickList,
                    replicaCount=0, stripeCount=0, force=False):
     command = _getGlusterVolCmd() + ["add-brick", volumeName]
@@ -696,6 +864,7 @@ def volumeAddBrick(volumeName, brickList,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRebalanceStart(volumeName, rebalanceType="", force=False):
     command = _getGlusterVolCmd() + ["rebalance", volumeName]
     if rebalanceType:
@@ -715,6 +884,7 @@ def volumeRebalanceStart(volumeName, rebalanceType="", force=False):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRebalanceStop(volumeName, force=False):
     command = _getGlusterVolCmd() + ["rebalance", volumeName, "stop"]
     if force:
@@ -802,6 +972,7 @@ def volumeRebalanceStatus(volumeName):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeReplaceBrickCommitForce(volumeName, existingBrick, newBrick):
     command = _getGlusterVolCmd() + ["replace-brick", volumeName,
                                      existingBrick, newBrick, "commit",
@@ -815,6 +986,7 @@ def volumeReplaceBrickCommitForce(volumeName, existingBrick, newBrick):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRemoveBrickStart(volumeName, brickList, replicaCount=0):
     command = _getGlusterVolCmd() + ["remove-brick", volumeName]
     if replicaCount:
@@ -832,6 +1004,7 @@ def volumeRemoveBrickStart(volumeName, brickList, replicaCount=0):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRemoveBrickStop(volumeName, brickList, replicaCount=0):
     command = _getGlusterVolCmd() + ["remove-brick", volumeName]
     if replicaCount:
@@ -867,6 +1040,7 @@ def volumeRemoveBrickStatus(volumeName, brickList, replicaCount=0):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRemoveBrickCommit(volumeName, brickList, replicaCount=0):
     command = _getGlusterVolCmd() + ["remove-brick", volumeName]
     if replicaCount:
@@ -881,6 +1055,7 @@ def volumeRemoveBrickCommit(volumeName, brickList, replicaCount=0):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeRemoveBrickForce(volumeName, brickList, replicaCount=0):
     command = _getGlusterVolCmd() + ["remove-brick", volumeName]
     if replicaCount:
@@ -895,6 +1070,7 @@ def volumeRemoveBrickForce(volumeName, brickList, replicaCount=0):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def peerProbe(hostName):
     command = _getGlusterPeerCmd() + ["probe", hostName]
     try:
@@ -905,6 +1081,7 @@ def peerProbe(hostName):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def peerDetach(hostName, force=False):
     command = _getGlusterPeerCmd() + ["detach", hostName]
     if force:
@@ -958,6 +1135,7 @@ def peerStatus():
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeProfileStart(volumeName):
     command = _getGlusterVolCmd() + ["profile", volumeName, "start"]
     try:
@@ -968,6 +1146,7 @@ def volumeProfileStart(volumeName):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeProfileStop(volumeName):
     command = _getGlusterVolCmd() + ["profile", volumeName, "stop"]
     try:
@@ -1039,13 +1218,12 @@ def volumeProfileInfo(volumeName, nfs=False):
     if nfs:
         command += ["nfs"]
     try:
-        xmltree = _execGlusterXml(command)
+        return _queryGlusterXml(
+            command,
+            _VOLUME_PROFILE_PATHS,
+            lambda elements: _volumeProfileInfo(elements, nfs))
     except ge.GlusterCmdFailedException as e:
         raise ge.GlusterVolumeProfileInfoFailedException(rc=e.rc, err=e.err)
-    try:
-        return _parseVolumeProfileInfo(xmltree, nfs)
-    except _etreeExceptions:  # pylint: disable=catching-non-exception
-        raise ge.GlusterXmlErrorException(err=[etree.tostring(xmltree)])
 
 
 def _parseVolumeTasks(tree):
@@ -1097,6 +1275,7 @@ def volumeTasks(volumeName="all"):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionStart(volumeName, remoteHost, remoteVolumeName,
                              remoteUserName=None, force=False):
     if remoteUserName:
@@ -1116,6 +1295,7 @@ def volumeGeoRepSessionStart(volumeName, remoteHost, remoteVolumeName,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionStop(volumeName, remoteHost, remoteVolumeName,
                             remoteUserName=None, force=False):
     if remoteUserName:
@@ -1239,6 +1419,7 @@ def volumeGeoRepStatus(volumeName=None, remoteHost=None,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionPause(volumeName, remoteHost, remoteVolumeName,
                              remoteUserName=None, force=False):
     if remoteUserName:
@@ -1258,6 +1439,7 @@ def volumeGeoRepSessionPause(volumeName, remoteHost, remoteVolumeName,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionResume(volumeName, remoteHost, remoteVolumeName,
                               remoteUserName=None, force=False):
     if remoteUserName:
@@ -1290,6 +1472,7 @@ def _parseVolumeGeoRepConfig(tree):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepConfig(volumeName, remoteHost,
                        remoteVolumeName, optionName=None,
                        optionValue=None,
@@ -1318,6 +1501,7 @@ def volumeGeoRepConfig(volumeName, remoteHost,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotCreate(volumeName, snapName,
                    snapDescription=None,
                    force=False):
@@ -1340,6 +1524,7 @@ def snapshotCreate(volumeName, snapName,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotDelete(volumeName=None, snapName=None):
     command = _getGlusterSnapshotCmd() + ["delete"]
     if snapName:
@@ -1356,6 +1541,7 @@ def snapshotDelete(volumeName=None, snapName=None):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotActivate(snapName, force=False):
     command = _getGlusterSnapshotCmd() + ["activate", snapName]
 
@@ -1370,6 +1556,7 @@ def snapshotActivate(snapName, force=False):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotDeactivate(snapName):
     command = _getGlusterSnapshotCmd() + ["deactivate", snapName]
 
@@ -1400,6 +1587,7 @@ def _parseRestoredSnapshot(tree):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotRestore(snapName):
     command = _getGlusterSnapshotCmd() + ["restore", snapName]
 
@@ -1445,6 +1633,7 @@ def _parseSnapshotConfigList(tree):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def snapshotConfig(volumeName=None, optionName=None, optionValue=None):
     command = _getGlusterSnapshotCmd() + ["config"]
     if volumeName:
@@ -1583,6 +1772,7 @@ def snapshotInfo(volumeName=None):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def executeGsecCreate():
     command = _getGlusterSystemCmd() + ["execute", "gsec_create"]
     try:
@@ -1594,6 +1784,7 @@ def executeGsecCreate():
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def executeMountBrokerUserAdd(remoteUserName, remoteVolumeName):
     command = _getGlusterSystemCmd() + ["execute", "mountbroker",
                                         "user", remoteUserName,
@@ -1607,6 +1798,7 @@ def executeMountBrokerUserAdd(remoteUserName, remoteVolumeName):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def executeMountBrokerOpt(optionName, optionValue):
     command = _getGlusterSystemCmd() + ["execute", "mountbroker",
                                         "opt", optionName,
@@ -1620,6 +1812,7 @@ def executeMountBrokerOpt(optionName, optionValue):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionCreate(volumeName, remoteHost,
                               remoteVolumeName,
                               remoteUserName=None, force=False):
@@ -1640,6 +1833,7 @@ def volumeGeoRepSessionCreate(volumeName, remoteHost,
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeGeoRepSessionDelete(volumeName, remoteHost, remoteVolumeName,
                               remoteUserName=None):
     if remoteUserName:
@@ -1690,6 +1884,7 @@ def _parseVolumeHealInfo(tree):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeResetBrickStart(volumeName, existingBrick):
     command = _getGlusterVolCmd() + ["reset-brick", volumeName,
                                      existingBrick, "start"]
@@ -1702,6 +1897,7 @@ def volumeResetBrickStart(volumeName, existingBrick):
 
 
 @gluster_mgmt_api
+@_invalidatesQueries
 def volumeResetBrickCommitForce(volumeName, existingBrick):
     command = _getGlusterVolCmd() + ["reset-brick", volumeName,
                                      existingBrick, existingBrick, "commit",
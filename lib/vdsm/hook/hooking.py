@@ -53,22 +53,39 @@ execCmd
 tobool
 
 
+# When running in the persistent hook runner, the hook data is passed in
+# memory instead of a file. See vdsm.common.hookrunner.
+_data = None
+
+
 def read_domxml():
+    if _data is not None:
+        return minidom.parseString(_data)
     with io.open(os.environ['_hook_domxml'], 'rb') as f:
         return minidom.parseString(f.read().decode('utf-8'))
 
 
 def write_domxml(domxml):
+    global _data
+    if _data is not None:
+        _data = domxml.toxml(encoding='utf-8').decode('utf-8')
+        return
     with io.open(os.environ['_hook_domxml'], 'wb') as f:
         f.write(domxml.toxml(encoding='utf-8'))
 
 
 def read_json():
+    if _data is not None:
+        return json.loads(_data)
     with open(os.environ['_hook_json']) as f:
         return json.loads(f.read())
 
 
 def write_json(data):
+    global _data
+    if _data is not None:
+        _data = json.dumps(data)
+        return
     with open(os.environ['_hook_json'], 'w') as f:
         f.write(json.dumps(data))
 
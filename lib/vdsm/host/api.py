@@ -23,6 +23,7 @@ from __future__ import division
 
 import errno
 import logging
+import os
 import time
 from . import stats
 from vdsm import utils
@@ -92,11 +93,29 @@ def send_metrics(hoststats):
             data[storage_prefix + '.delay'] = dom_info['delay']
             data[storage_prefix + '.last_check'] = dom_info['lastCheck']
 
+        data.update(_hooks_metrics(prefix))
+
         metrics.send(data)
     except KeyError:
         logging.exception('Host metrics collection failed')
 
 
+def _hooks_metrics(prefix):
+    """
+    Return wall time statistics of hook scripts run since vdsm started, so
+    slow hooks can be found without parsing the logs.
+    """
+    data = {}
+    for path, script_stats in hooks.script_stats().items():
+        hook_dir, script = os.path.split(path)
+        # Metric names are separated by dots.
+        script_prefix = '{}.hooks.{}.{}'.format(
+            prefix, os.path.basename(hook_dir), script.replace('.', '_'))
+        for name, value in script_stats.items():
+            data[script_prefix + '.' + name] = value
+    return data
+
+
 def _readSwapTotalFree():
     meminfo = utils.readMemInfo()
     return meminfo['SwapTotal'] // 1024, meminfo['SwapFree'] // 1024
@@ -111,31 +111,27 @@ def produce(first_sample, last_sample):
 
 def _get_cpu_core_stats(first_sample, last_sample):
     interval = last_sample.timestamp - first_sample.timestamp
+    first_cores = first_sample.cpuCores
+    last_cores = last_sample.cpuCores
 
-    def compute_cpu_usage(cpu_core, mode):
-        first_core_sample = first_sample.cpuCores.getCoreSample(cpu_core)
-        last_core_sample = last_sample.cpuCores.getCoreSample(cpu_core)
-        if not first_core_sample or not last_core_sample:
-            raise MissingSample()
-        jiffies = (
-            last_core_sample[mode] - first_core_sample[mode]
-        ) % JIFFIES_BOUND
-        return ("%.2f" % (jiffies / interval))
+    # Compute the usage of all cores at once from the jiffies arrays.
+    cpu_user = _cpu_usage(first_cores.jiffies('user'),
+                          last_cores.jiffies('user'), interval)
+    cpu_sys = _cpu_usage(first_cores.jiffies('sys'),
+                         last_cores.jiffies('sys'), interval)
 
     cpu_core_stats = {}
     for node_index, numa_node in six.iteritems(numa.topology()):
         cpu_cores = numa_node['cpus']
         for cpu_core in cpu_cores:
-            try:
-                user_cpu_usage = compute_cpu_usage(cpu_core, 'user')
-                system_cpu_usage = compute_cpu_usage(cpu_core, 'sys')
-            except MissingSample:
-                # Only collect data when all required samples already present
+            # Only collect data when all required samples already present
+            if not (first_cores.hasCore(cpu_core) and
+                    last_cores.hasCore(cpu_core)):
                 continue
             core_stat = {
                 'nodeIndex': int(node_index),
-                'cpuUser': user_cpu_usage,
-                'cpuSys': system_cpu_usage,
+                'cpuUser': cpu_user[cpu_core],
+                'cpuSys': cpu_sys[cpu_core],
             }
             core_stat['cpuIdle'] = (
                 "%.2f" % max(0.0,
@@ -146,8 +142,9 @@ def _get_cpu_core_stats(first_sample, last_sample):
     return cpu_core_stats
 
 
-class MissingSample(Exception):
-    pass
+def _cpu_usage(first, last, interval):
+    return ["%.2f" % ((b - a) % JIFFIES_BOUND / interval)
+            for a, b in zip(first, last)]
 
 
 def get_interfaces_stats():
@@ -28,6 +28,7 @@ from vdsm.network import bond_monitor
 from vdsm.network import dhcp_monitor
 from vdsm.network import lldp
 from vdsm.network.ipwrapper import getLinks
+from vdsm.network.link import stats as link_stats
 
 Lldp = lldp.driver()
 
@@ -39,11 +40,13 @@ def init_privileged_network_components():
 def init_unprivileged_network_components(cif, net_api):
     dhcp_monitor.initialize_monitor(cif, net_api)
     bond_monitor.initialize_monitor(cif)
+    link_stats.start()
 
 
 def stop_unprivileged_network_components():
     dhcp_monitor.Monitor.instance().stop()
     bond_monitor.stop()
+    link_stats.stop()
 
 
 @contextmanager
@@ -17,40 +17,189 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+"""
+Link statistics reporting.
+
+The statistics of all links are taken from a single netlink link dump,
+including the 64 bit link statistics, instead of reading sysfs files for
+every link.
+
+Reading link type, speed and duplex may require several sysfs reads and
+ethtool ioctls per link. When the link monitor is running, these are cached
+by link index, and invalidated by netlink link events.
+"""
+
 from __future__ import absolute_import
 from __future__ import division
 
 import errno
+import logging
+import threading
 
+from vdsm.common import concurrent
 from vdsm.network.link import bond
 from vdsm.network.link import iface
 from vdsm.network.link import nic
 from vdsm.network.link import vlan
+from vdsm.network.netlink import link
+from vdsm.network.netlink import monitor
 
 
 def report():
     stats = {}
-    for iface_properties in iface.list():
+    for properties in link.iter_links(stats=True):
         try:
-            interface = iface.iface(iface_properties['name'])
-            stats[interface.device] = _generate_iface_stats(interface)
+            stats[properties['name']] = _generate_link_stats(properties)
         except IOError as e:
             if e.errno != errno.ENODEV:
                 raise
     return stats
 
 
-def _generate_iface_stats(interface):
-    stats = interface.statistics()
-    speed = 0
-    if interface.type() == iface.Type.NIC:
-        speed = nic.speed(interface.device)
-    elif interface.type() == iface.Type.BOND:
-        speed = bond.speed(interface.device)
-    elif interface.type() == iface.Type.VLAN:
-        speed = vlan.speed(interface.device)
+def start():
+    """
+    Start caching link type, speed and duplex.
+    """
+    _cache.start()
+
+
+def stop():
+    _cache.stop()
+
+
+def _generate_link_stats(properties):
+    counters = properties['stats']
+    is_up = link.is_link_up(properties['flags'], check_oper_status=True)
+    stats = {
+        'name': properties['name'],
+        'rx': counters['rx_bytes'],
+        'tx': counters['tx_bytes'],
+        'state': 'up' if is_up else 'down',
+        'rxDropped': counters['rx_dropped'],
+        'txDropped': counters['tx_dropped'],
+        'rxErrors': counters['rx_errors'],
+        'txErrors': counters['tx_errors'],
+    }
 
-    stats['speed'] = speed
-    stats['duplex'] = nic.duplex(interface.device)
+    index = properties['index']
+    info = _cache.get(index)
+    if info is None:
+        generation = _cache.generation
+        info = _link_info(properties)
+        _cache.put(index, info, generation)
+
+    stats['speed'] = info.speed
+    stats['duplex'] = info.duplex
 
     return stats
+
+
+class _LinkInfo(object):
+
+    __slots__ = ('type', 'speed', 'duplex')
+
+    def __init__(self, type, speed, duplex):
+        self.type = type
+        self.speed = speed
+        self.duplex = duplex
+
+
+def _link_info(properties):
+    device = properties['name']
+    link_type = properties.get('type') or iface.get_alternative_type(device)
+    speed = 0
+    if link_type == iface.Type.NIC:
+        speed = nic.speed(device)
+    elif link_type == iface.Type.BOND:
+        speed = bond.speed(device)
+    elif link_type == iface.Type.VLAN:
+        speed = vlan.speed(device)
+    return _LinkInfo(link_type, speed, nic.duplex(device))
+
+
+class _LinkCache(object):
+    """
+    Cache link info by link index.
+
+    A link event invalidates the link and its master. Bond and vlan speed
+    depend on other links, so they are invalidated by any link event.
+
+    The cache is used only while the monitor is running; if the monitor
+    fails we cannot tell when links change, so caching is disabled.
+    """
+
+    # Types reporting the speed of other links.
+    DERIVED_TYPES = frozenset([iface.Type.BOND, iface.Type.VLAN])
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._links = {}
+        self._monitor = None
+        self._thread = None
+        self.generation = 0
+
+    def start(self):
+        with self._lock:
+            if self._monitor is not None:
+                return
+            logging.info('Starting link stats monitor.')
+            self._monitor = monitor.object_monitor(groups=('link',))
+            self._monitor.start()
+            self._thread = concurrent.thread(
+                self._serve, args=(self._monitor,), name='link-stats'
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            mon = self._monitor
+            thread = self._thread
+            if mon is None:
+                return
+            logging.info('Stopping link stats monitor.')
+            self._monitor = None
+            self._thread = None
+            self._clear()
+        if not mon.is_stopped():
+            mon.stop()
+        mon.wait()
+        thread.join()
+
+    def get(self, index):
+        with self._lock:
+            return self._links.get(index)
+
+    def put(self, index, info, generation):
+        """
+        Cache info computed when the cache was at generation. If a link
+        changed since then, info may be stale and is not cached.
+        """
+        with self._lock:
+            if self._monitor is not None and generation == self.generation:
+                self._links[index] = info
+
+    def invalidate(self, event):
+        changed = {event.get('index'), event.get('master_index')}
+        with self._lock:
+            self.generation += 1
+            for index, info in list(self._links.items()):
+                if index in changed or info.type in self.DERIVED_TYPES:
+                    del self._links[index]
+
+    def _serve(self, mon):
+        try:
+            for event in mon:
+                self.invalidate(event)
+        except monitor.MonitorError:
+            logging.exception('Link stats monitor failed, caching disabled')
+            with self._lock:
+                if self._monitor is mon:
+                    self._monitor = None
+                    self._clear()
+
+    def _clear(self):
+        self.generation += 1
+        self._links.clear()
+
+
+_cache = _LinkCache()
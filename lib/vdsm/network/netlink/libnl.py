@@ -43,6 +43,7 @@ from ctypes import c_char_p
 from ctypes import c_int
 from ctypes import c_size_t
 from ctypes import c_uint32
+from ctypes import c_uint64
 from ctypes import c_ushort
 from ctypes import c_void_p
 from ctypes import get_errno
@@ -186,6 +187,18 @@ class NlCbKind(object):
     NL_CB_CUSTOM = 3  # Customized handler specified by user
 
 
+# include/netlink/route/link.h
+class RtnlLinkStat(object):
+    RX_PACKETS = 0
+    TX_PACKETS = 1
+    RX_BYTES = 2
+    TX_BYTES = 3
+    RX_ERRORS = 4
+    TX_ERRORS = 5
+    RX_DROPPED = 6
+    TX_DROPPED = 7
+
+
 class RtnlObjectType(object):
     BASE = 'route'
     ADDR = BASE + '/addr'  # libnl/lib/route/addr.c
@@ -847,6 +860,23 @@ def rtnl_link_get_mtu(link):
     return mtu
 
 
+def rtnl_link_get_stat(link, stat_id):
+    """Return statistic counter of link object.
+
+    @arg link            Link object
+    @arg stat_id         Identifier of statistical counter (RtnlLinkStat)
+
+    Counters are parsed from the 64 bit statistics (IFLA_STATS64) when
+    reported by the kernel.
+
+    @return Value of counter or 0 if not specified.
+    """
+    _rtnl_link_get_stat = _libnl_route(
+        'rtnl_link_get_stat', c_uint64, c_void_p, c_int
+    )
+    return _rtnl_link_get_stat(link, stat_id)
+
+
 def rtnl_link_get_name(link):
     """Return name of link object.
 
@@ -41,14 +41,18 @@ def get_link(name):
         return link_info
 
 
-def iter_links():
+def iter_links(stats=False):
     """Generator that yields an information dictionary for each link of the
-    system."""
+    system. If stats is True, the dictionary includes the link statistics,
+    taken from the same link dump."""
     with _pool.socket() as sock:
         with _nl_link_cache(sock) as cache:
             link = libnl.nl_cache_get_first(cache)
             while link:
-                yield _link_info(link, cache=cache)
+                info = _link_info(link, cache=cache)
+                if stats:
+                    info['stats'] = _link_stats(link)
+                yield info
                 link = libnl.nl_cache_get_next(link)
 
 
@@ -108,6 +112,24 @@ def _link_info(link, cache=None):
     return info
 
 
+def _link_stats(link):
+    """Returns a dictionary with the statistics of the link object."""
+    return {
+        name: libnl.rtnl_link_get_stat(link, stat_id)
+        for name, stat_id in _LINK_STATS
+    }
+
+
+_LINK_STATS = (
+    ('rx_bytes', libnl.RtnlLinkStat.RX_BYTES),
+    ('tx_bytes', libnl.RtnlLinkStat.TX_BYTES),
+    ('rx_dropped', libnl.RtnlLinkStat.RX_DROPPED),
+    ('tx_dropped', libnl.RtnlLinkStat.TX_DROPPED),
+    ('rx_errors', libnl.RtnlLinkStat.RX_ERRORS),
+    ('tx_errors', libnl.RtnlLinkStat.TX_ERRORS),
+)
+
+
 def _link_index_to_name(link_index, cache=None):
     """Returns the textual name of the link with index equal to link_index."""
     if cache is None:
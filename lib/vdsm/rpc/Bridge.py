@@ -26,6 +26,7 @@ from yajsonrpc import exception
 
 from vdsm import API
 from vdsm.api import vdsmapi
+from vdsm.common import logutils
 from vdsm.config import config
 from vdsm.network.netinfo.addresses import getDeviceByIP
 
@@ -251,6 +252,15 @@ def Host_getStorageRepoStats_Ret(ret):
     return ret
 
 
+def Host_getAllVmStatsDelta_Ret(ret):
+    return logutils.Suppressed({
+        'generation': ret['generation'],
+        'full': ret['full'],
+        'statsList': ret['statsList'].value,
+        'removedVms': ret['removedVms'],
+    })
+
+
 def Host_getVMList_Call(api, args):
     """
     This call is only interested in returning the VM UUIDs so pass False for
@@ -350,6 +360,7 @@ command_info = {
     'Host_getVMList': {'call': Host_getVMList_Call, 'ret': 'vmList'},
     'Host_getVMFullList': {'call': Host_getVMFullList_Call, 'ret': 'vmList'},
     'Host_getAllVmStats': {'ret': 'statsList'},
+    'Host_getAllVmStatsDelta': {'ret': Host_getAllVmStatsDelta_Ret},
     'Host_getAllVmIoTunePolicies': {'ret': 'io_tune_policies_dict'},
     'Host_setupNetworks': {'ret': 'status'},
     'Host_setKsmTune': {'ret': 'status'},
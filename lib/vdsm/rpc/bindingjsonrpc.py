@@ -32,6 +32,7 @@ _TIMEOUT = config.getint('rpc', 'worker_timeout')
 _THREADS = config.getint('rpc', 'worker_threads')
 _TASK_PER_WORKER = config.getint('rpc', 'tasks_per_worker')
 _TASKS = _THREADS * _TASK_PER_WORKER
+_PARSE_WORKERS = config.getint('rpc', 'parse_workers')
 
 
 class BindingJsonRpc(object):
@@ -46,7 +47,8 @@ class BindingJsonRpc(object):
         self._server = JsonRpcServer(
             bridge, timeout, cif,
             functools.partial(self._executor.dispatch,
-                              timeout=_TIMEOUT, discard=False))
+                              timeout=_TIMEOUT, discard=False),
+            parse_workers=_PARSE_WORKERS)
         self._reactor = StompReactor(subs)
         self.startReactor()
 
@@ -179,6 +179,13 @@ UUID_GLOB_PATTERN = '*-*-*-*-*'
 REMOVED_IMAGE_PREFIX = "_remove_me_"
 ZEROED_IMAGE_PREFIX = REMOVED_IMAGE_PREFIX + "ZERO_"
 
+# Extend request priorities, most urgent first.
+EXTEND_ENOSPC = "enospc"  # VM paused because the volume is full
+EXTEND_EXCEEDED = "exceeded"  # Block threshold event
+EXTEND_THRESHOLD = "threshold"  # Periodic volume monitoring
+
+EXTEND_PRIORITIES = (EXTEND_ENOSPC, EXTEND_EXCEEDED, EXTEND_THRESHOLD)
+
 
 def fmt2str(fmt):
     return _FMT2STR[fmt]
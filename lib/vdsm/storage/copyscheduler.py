@@ -0,0 +1,272 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Run volume copies under a host wide concurrency budget.
+
+A scheduler runs a group of copies one after another, for example the
+volumes of an image chain; qemu-img opens the destination parent volume as
+the backing file of the child volume, so a child can be copied only after
+its parent copy has finished. Copies run by different operations, for
+example moving several images in different tasks, run concurrently and
+share a budget; the number of copies running on this host is limited by
+[irs] copy_max_per_host, and the number of copies reading from or writing
+to a storage domain is limited by [irs] copy_max_per_domain. A copy waits
+until both budgets are available.
+
+Copy progress is weighted by the copy size, and reported by
+Scheduler.progress. When a copy fails, the next copies are not started,
+and the scheduler raises the error of the failed copy.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import logging
+import threading
+import time
+
+from vdsm.common.exception import ActionStopped
+from vdsm.common.units import MiB
+from vdsm.config import config
+
+log = logging.getLogger("storage.copyscheduler")
+
+
+class Budget(object):
+    """
+    Limit the number of concurrent copies on this host, and per storage
+    domain.
+    """
+
+    def __init__(self, max_per_host, max_per_domain):
+        if max_per_host < 1:
+            raise ValueError("max_per_host {} < 1".format(max_per_host))
+        if max_per_domain < 1:
+            raise ValueError("max_per_domain {} < 1".format(max_per_domain))
+        self._max_per_host = max_per_host
+        self._max_per_domain = max_per_domain
+        self._cond = threading.Condition(threading.Lock())
+        self._running = 0
+        self._domains = collections.Counter()
+
+    def acquire(self, domains, aborted):
+        """
+        Wait until a copy accessing domains can run. Acquiring all the
+        domains at once avoids deadlocks between copies waiting for each
+        other's domains.
+
+        Raises ActionStopped if aborted() returns True while waiting.
+        """
+        with self._cond:
+            while not self._available(domains):
+                if aborted():
+                    raise ActionStopped
+                self._cond.wait()
+            self._running += 1
+            for sd_id in domains:
+                self._domains[sd_id] += 1
+
+    def release(self, domains):
+        with self._cond:
+            self._running -= 1
+            for sd_id in domains:
+                self._domains[sd_id] -= 1
+                if self._domains[sd_id] == 0:
+                    del self._domains[sd_id]
+            self._cond.notify_all()
+
+    def wakeup(self):
+        """
+        Wake up waiting copies so they can check if they were aborted.
+        """
+        with self._cond:
+            self._cond.notify_all()
+
+    def _available(self, domains):
+        if self._running >= self._max_per_host:
+            return False
+        return all(self._domains[sd_id] < self._max_per_domain
+                   for sd_id in domains)
+
+
+_budget = Budget(
+    config.getint("irs", "copy_max_per_host"),
+    config.getint("irs", "copy_max_per_domain"))
+
+
+class Copy(object):
+    """
+    A copy run by a scheduler.
+
+    Arguments:
+        name (str): name used in logs, e.g. volume UUID.
+        domains (iterable): UUIDs of the storage domains accessed by the
+            copy.
+        size (int): number of bytes to copy, used to weight the copy
+            progress.
+        func (callable): called with this copy as the only argument to do
+            the copy. func must run the copy operation using run().
+    """
+
+    def __init__(self, name, domains, size, func):
+        self.name = name
+        self.domains = frozenset(domains)
+        self.size = size
+        self._func = func
+        self._lock = threading.Lock()
+        self._operation = None
+        self._aborted = False
+        self._done = False
+        self.elapsed = None
+
+    def run(self, operation):
+        """
+        Run operation, supporting progress and abort.
+
+        Raises ActionStopped if the copy was aborted.
+        """
+        with self._lock:
+            self._operation = operation
+            aborted = self._aborted
+        if aborted:
+            operation.abort()
+        operation.run()
+
+    def abort(self):
+        with self._lock:
+            self._aborted = True
+            operation = self._operation
+        if operation is not None:
+            operation.abort()
+
+    @property
+    def progress(self):
+        """
+        Return copy progress as float between 0 and 100.
+        """
+        if self._done:
+            return 100.0
+        operation = self._operation
+        if operation is None:
+            return 0.0
+        return getattr(operation, "progress", 0.0)
+
+    @property
+    def throughput(self):
+        """
+        Return copy throughput in bytes per second, or None if the copy
+        has not finished.
+        """
+        if not self._done:
+            return None
+        return self.size / max(self.elapsed, 0.001)
+
+    def _execute(self):
+        start = time.monotonic()
+        self._func(self)
+        self.elapsed = time.monotonic() - start
+        self._done = True
+        log.info("Copied %s (%d bytes) in %.2f seconds (%.2f MiB/s)",
+                 self.name, self.size, self.elapsed,
+                 self.throughput / MiB)
+
+    def __repr__(self):
+        return "<Copy {} size={} progress={:.2f}% at {:#x}>".format(
+            self.name, self.size, self.progress, id(self))
+
+
+class Scheduler(object):
+    """
+    Run copies in order, each copy waiting for the copy budget.
+
+    A scheduler supports the operation interface (run, abort, progress), so
+    it can be run and reported like a qemu-img operation.
+    """
+
+    def __init__(self, copies, budget=None):
+        self._copies = list(copies)
+        self._budget = budget or _budget
+        self._lock = threading.Lock()
+        self._aborted = False
+
+    @property
+    def copies(self):
+        return list(self._copies)
+
+    @property
+    def progress(self):
+        """
+        Return the progress of all copies as float between 0 and 100,
+        weighted by copy size.
+
+        This method is threadsafe and may be called from any thread.
+        """
+        if not self._copies:
+            return 100.0
+        total = sum(c.size for c in self._copies)
+        if total == 0:
+            return sum(c.progress for c in self._copies) / len(self._copies)
+        return sum(c.size * c.progress for c in self._copies) / total
+
+    def run(self):
+        """
+        Run all copies, returning when all copies finished.
+
+        Raises the error raised by the failing copy, or ActionStopped if the
+        scheduler was aborted.
+        """
+        log.info("Running %d copies", len(self._copies))
+        start = time.monotonic()
+
+        for copy in self._copies:
+            self._run_copy(copy)
+
+        elapsed = time.monotonic() - start
+        total = sum(c.size for c in self._copies)
+        log.info("Finished %d copies (%d bytes) in %.2f seconds "
+                 "(%.2f MiB/s)", len(self._copies), total, elapsed,
+                 total / max(elapsed, 0.001) / MiB)
+
+    def abort(self):
+        """
+        Abort the running copy, and do not start pending copies.
+
+        This method is threadsafe and may be called from any thread.
+        """
+        with self._lock:
+            self._aborted = True
+        for copy in self._copies:
+            copy.abort()
+        self._budget.wakeup()
+
+    def _run_copy(self, copy):
+        self._budget.acquire(copy.domains, self._is_aborted)
+        try:
+            if self._is_aborted():
+                raise ActionStopped
+            copy._execute()
+        finally:
+            self._budget.release(copy.domains)
+
+    def _is_aborted(self):
+        with self._lock:
+            return self._aborted
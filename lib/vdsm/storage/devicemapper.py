@@ -35,6 +35,8 @@ from vdsm.storage import dmsetup
 
 
 DMPATH_PREFIX = "/dev/mapper/"
+SYS_BLOCK = "/sys/block"
+UDEV_DATA = "/run/udev/data"
 
 
 PathStatus = namedtuple("PathStatus", "name, status")
@@ -186,3 +188,44 @@ def multipath_status():
         res[guid] = statuses
 
     return res
+
+
+def multipath_events():
+    """
+    Return dict {name: event} for all multipath maps, where event is an
+    opaque value which changes when the kernel reports an event for the map,
+    such as failed or reinstated path. event is None if the map has no udev
+    database.
+
+    Returns None if udev database is not available.
+
+    Device mapper reports multipath events (e.g. DM_ACTION=PATH_FAILED) using
+    udev change events. udev replaces the device database file when handling
+    an event, so we can detect events by checking the database file, without
+    running dmsetup or requiring root.
+    """
+    if not os.path.isdir(UDEV_DATA):
+        return None
+
+    res = {}
+    for dm_dir in glob(os.path.join(SYS_BLOCK, "dm-*", "dm")):
+        try:
+            with open(os.path.join(dm_dir, "uuid")) as f:
+                if not f.read().startswith("mpath-"):
+                    continue
+            with open(os.path.join(dm_dir, "name")) as f:
+                name = f.read().rstrip("\n")
+            with open(os.path.join(dm_dir, "..", "dev")) as f:
+                devt = f.read().strip()
+        except EnvironmentError:
+            # Map removed while reading.
+            continue
+
+        try:
+            st = os.stat(os.path.join(UDEV_DATA, "b" + devt))
+        except EnvironmentError:
+            res[name] = None
+        else:
+            res[name] = (st.st_ino, st.st_mtime_ns)
+
+    return res
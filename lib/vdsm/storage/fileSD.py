@@ -47,6 +47,7 @@ from vdsm.storage import outOfProcess as oop
 from vdsm.storage import sanlock_direct
 from vdsm.storage import sd
 from vdsm.storage import volumemetadata
+from vdsm.storage import volumewalk
 from vdsm.storage import xlease
 from vdsm.storage.persistent import PersistentDict, DictValidator
 
@@ -72,6 +73,50 @@ FILE_SPECIAL_VOLUME_SIZES_MIB.update({
 
 _MOUNTLIST_IGNORE = ('/' + sd.BLOCKSD_DIR, '/' + sd.GLUSTERSD_DIR)
 
+# Volume in an image directory. nlink is the number of links to the volume
+# metadata; template volumes have a link in every image using them.
+ImageVolume = collections.namedtuple("ImageVolume", "nlink,metadata")
+
+
+def _volumes_images(images):
+    """
+    Create dict {volUUID: ImgsPar} from iterable of (imgUUID, [volUUID])
+    pairs. See FileStorageDomainManifest.getAllVolumes().
+    """
+    # Using images to volumes mapping, we can create volumes to images
+    # mapping, detecting template volumes and template images, based on
+    # these rules:
+    #
+    # Template volumes are hard linked in every image directory
+    # which is derived from that template, therefore:
+    #
+    # 1. A template volume which is in use will appear at least twice
+    #    (in the template image dir and in the derived image dir)
+    #
+    # 2. Any volume which appears more than once in the dir tree is
+    #    by definition a template volume.
+    #
+    # 3. Any image which has more than 1 volume is not a template
+    #    image.
+
+    volumes = {}
+    for imgUUID, volUUIDs in images:
+        for volUUID in volUUIDs:
+            if volUUID in volumes:
+                # This must be a template volume (rule 2)
+                volumes[volUUID]['parent'] = sd.BLANK_UUID
+                if len(volUUIDs) > 1:
+                    # This image is not a template (rule 3)
+                    volumes[volUUID]['imgs'].append(imgUUID)
+                else:
+                    # This image is a template (rule 3)
+                    volumes[volUUID]['imgs'].insert(0, imgUUID)
+            else:
+                volumes[volUUID] = {'imgs': [imgUUID], 'parent': None}
+
+    return dict((k, sd.ImgsPar(tuple(v['imgs']), v['parent']))
+                for k, v in six.iteritems(volumes))
+
 
 def getProcPool():
     return oop.getProcessPool(sc.GLOBAL_OOP)
@@ -161,6 +206,14 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
             metadata = FileSDMetadata(self.metafile)
         sd.StorageDomainManifest.__init__(self, sdUUID, domaindir, metadata)
 
+        # Cached image directories, used to avoid reading unmodified image
+        # directories: {imgUUID: (mtime, [volUUID, ...])}.
+        self._images_cache = {}
+        self._images_walker = volumewalk.Walker(
+            sdUUID,
+            timeout=oop.DEFAULT_TIMEOUT,
+            idle_time=oop.IOPROC_IDLE_TIME)
+
         if not self.oop.fileUtils.pathExists(self.metafile):
             raise se.StorageDomainMetadataNotFound(self.sdUUID, self.metafile)
 
@@ -285,52 +338,63 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         Template volumes have no parent, and thus we report BLANK_UUID as their
         parentUUID.
         """
-        volMetaPattern = os.path.join(glob_escape(self.mountpoint),
-                                      self.sdUUID,
-                                      sd.DOMAIN_IMAGES, "*", "*.meta")
-        volMetaPaths = self.oop.glob.glob(volMetaPattern)
-
-        # First create mapping from images to volumes
-        images = collections.defaultdict(list)
-        for metaPath in volMetaPaths:
-            head, tail = os.path.split(metaPath)
-            volUUID, volExt = os.path.splitext(tail)
-            imgUUID = os.path.basename(head)
-            images[imgUUID].append(volUUID)
-
-        # Using images to volumes mapping, we can create volumes to images
-        # mapping, detecting template volumes and template images, based on
-        # these rules:
-        #
-        # Template volumes are hard linked in every image directory
-        # which is derived from that template, therefore:
-        #
-        # 1. A template volume which is in use will appear at least twice
-        #    (in the template image dir and in the derived image dir)
-        #
-        # 2. Any volume which appears more than once in the dir tree is
-        #    by definition a template volume.
-        #
-        # 3. Any image which has more than 1 volume is not a template
-        #    image.
-
-        volumes = {}
-        for imgUUID, volUUIDs in six.iteritems(images):
-            for volUUID in volUUIDs:
-                if volUUID in volumes:
-                    # This must be a template volume (rule 2)
-                    volumes[volUUID]['parent'] = sd.BLANK_UUID
-                    if len(volUUIDs) > 1:
-                        # This image is not a template (rule 3)
-                        volumes[volUUID]['imgs'].append(imgUUID)
-                    else:
-                        # This image is a template (rule 3)
-                        volumes[volUUID]['imgs'].insert(0, imgUUID)
-                else:
-                    volumes[volUUID] = {'imgs': [imgUUID], 'parent': None}
+        images = self.getImagesVolumes()
+        return _volumes_images(
+            (imgUUID, list(volumes)) for imgUUID, volumes in images.items())
 
-        return dict((k, sd.ImgsPar(tuple(v['imgs']), v['parent']))
-                    for k, v in six.iteritems(volumes))
+    def getImagesVolumes(self, metadata=False):
+        """
+        Return dict {imgUUID: {volUUID: ImageVolume}} of the domain.
+
+        The domain images directory is walked in a helper process in a single
+        round-trip. Image directories are cached, and read again only if they
+        were modified. The link count of the volumes is always read, since
+        linking a template volume to another image does not modify the
+        template image directory.
+
+        If metadata is True, read and parse the metadata of all the volumes.
+        ImageVolume.metadata is None if metadata was not read or is invalid.
+        """
+        images_dir = os.path.join(
+            self.mountpoint, self.sdUUID, sd.DOMAIN_IMAGES)
+
+        known = {imgUUID: [mtime, volUUIDs]
+                 for imgUUID, (mtime, volUUIDs) in self._images_cache.items()
+                 if mtime is not None}
+        walked = self._images_walker.walk(
+            images_dir, known=known, metadata=metadata)
+
+        self._images_cache = {
+            imgUUID: (image["mtime"], list(image["volumes"]))
+            for imgUUID, image in walked.items()}
+
+        return {
+            imgUUID: {
+                volUUID: ImageVolume(
+                    volume["nlink"],
+                    self._parseVolumeMetadata(
+                        imgUUID, volUUID, volume.get("metadata")))
+                for volUUID, volume in image["volumes"].items()}
+            for imgUUID, image in walked.items()}
+
+    def clearImagesCache(self):
+        """
+        Drop cached image directories and stop the volume walker. Called
+        when the domain is not used any more.
+        """
+        self._images_cache = {}
+        self._images_walker.close()
+
+    def _parseVolumeMetadata(self, imgUUID, volUUID, data):
+        if data is None:
+            return None
+        try:
+            return volumemetadata.VolumeMetadata.from_lines(
+                data.encode("utf-8").splitlines())
+        except se.InvalidMetadata as e:
+            self.log.warning("Invalid metadata for volume %s/%s: %s",
+                             imgUUID, volUUID, e)
+            return None
 
     def getAllImages(self):
         """
@@ -649,6 +713,12 @@ class FileStorageDomain(sd.StorageDomain):
     def getRemotePath(self):
         return self._manifest.remotePath
 
+    def getImagesVolumes(self, metadata=False):
+        return self._manifest.getImagesVolumes(metadata=metadata)
+
+    def teardown(self):
+        self._manifest.clearImagesCache()
+
     def getRealPath(self):
         """
         Return the actual path to the underlying storage.
@@ -246,7 +246,10 @@ class HSM(object):
             self.log.warn("Failed to clean Storage Repository.", exc_info=True)
 
         monitorInterval = config.getint('irs', 'sd_health_check_delay')
-        self.mpathhealth_monitor = mpathhealth.Monitor(monitorInterval)
+        self.mpathhealth_monitor = mpathhealth.Monitor(
+            monitorInterval,
+            event_interval=config.getfloat(
+                'multipath', 'health_event_interval'))
         self.mpathhealth_monitor.start()
 
         def storageRefresh():
@@ -711,7 +714,8 @@ class HSM(object):
         pool.detachSD(sdUUID)
 
     @public
-    def sendExtendMsg(self, spUUID, volDict, newSize, callbackFunc):
+    def sendExtendMsg(self, spUUID, volDict, newSize, callbackFunc,
+                      priority=sc.EXTEND_THRESHOLD):
         """
         Send an extended message?
 
@@ -721,6 +725,9 @@ class HSM(object):
         :param volDict: ?
         :param newSize: ?
         :param callbackFun: A function to run once the operation is done. ?
+        :param priority: Extend priority, one of sc.EXTEND_PRIORITIES.
+                         Urgent extends are sent to the SPM before
+                         pending extends with lower priority.
 
         .. note::
             If the pool doesn't exist the function will fail silently and the
@@ -735,7 +742,8 @@ class HSM(object):
             pass
         else:
             if pool.hsmMailer:
-                pool.hsmMailer.sendExtendMsg(volDict, newSize_mb, callbackFunc)
+                pool.hsmMailer.sendExtendMsg(
+                    volDict, newSize_mb, callbackFunc, priority=priority)
 
     def _spmSchedule(self, spUUID, name, func, *args):
         pool = self.getPool(spUUID)
@@ -2883,15 +2891,13 @@ class HSM(object):
         """
         if deviceType == 'mpath':
             devPath = os.path.join(devicemapper.DMPATH_PREFIX, guid)
-            supervdsm.getProxy().appropriateDevice(guid, thiefId, deviceType)
-            supervdsm.getProxy().udevTrigger(guid, deviceType)
+            self._appropriateDevice(guid, thiefId, deviceType, guid)
             size = str(multipath.getDeviceSize(devicemapper.getDmId(guid)))
             device = dict(truesize=size, apparentsize=size, path=devPath)
         elif deviceType == 'rbd':
             # In case the device is rbd, the entire path will be passed
             devPath = guid
-            supervdsm.getProxy().appropriateDevice(guid, thiefId, deviceType)
-            supervdsm.getProxy().udevTrigger(devPath, deviceType)
+            self._appropriateDevice(guid, thiefId, deviceType, devPath)
             device = dict(path=devPath)
         else:
             raise RuntimeError("Unsupported device type %r" % deviceType)
@@ -2906,6 +2912,13 @@ class HSM(object):
 
         return device
 
+    def _appropriateDevice(self, guid, thiefId, deviceType, udevPath):
+        # Both calls are sent to supervdsm in a single round trip.
+        supervdsm.getProxy().batch([
+            ("appropriateDevice", (guid, thiefId, deviceType), {}),
+            ("udevTrigger", (udevPath, deviceType), {}),
+        ])
+
     @public
     def inappropriateDevices(self, thiefId):
         """
@@ -20,6 +20,7 @@
 
 from __future__ import absolute_import
 
+import functools
 import os
 import logging
 import threading
@@ -33,6 +34,7 @@ from vdsm.common.marks import deprecated
 from vdsm.common.threadlocal import vars
 from vdsm.common.units import MiB
 from vdsm.storage import constants as sc
+from vdsm.storage import copyscheduler
 from vdsm.storage import exception as se
 from vdsm.storage import glance
 from vdsm.storage import imageSharing
@@ -424,57 +426,69 @@ class Image:
             self.__cleanupMove(srcLeafVol, dstLeafVol)
             raise
 
-        try:
-            for srcVol in chains['srcChain']:
-                # Do the actual copy
-                try:
-                    dstVol = destDom.produceVolume(imgUUID=imgUUID,
-                                                   volUUID=srcVol.volUUID)
+        def copyVolume(copy, srcVol):
+            try:
+                dstVol = destDom.produceVolume(imgUUID=imgUUID,
+                                               volUUID=srcVol.volUUID)
 
-                    if workarounds.invalid_vm_conf_disk(srcVol):
-                        srcFormat = dstFormat = qemuimg.FORMAT.RAW
-                    else:
-                        srcFormat = sc.fmt2str(srcVol.getFormat())
-                        dstFormat = sc.fmt2str(dstVol.getFormat())
+                if workarounds.invalid_vm_conf_disk(srcVol):
+                    srcFormat = dstFormat = qemuimg.FORMAT.RAW
+                else:
+                    srcFormat = sc.fmt2str(srcVol.getFormat())
+                    dstFormat = sc.fmt2str(dstVol.getFormat())
 
-                    parentVol = dstVol.getParentVolume()
+                parentVol = dstVol.getParentVolume()
 
-                    if parentVol is not None:
-                        backing = volume.getBackingVolumePath(
-                            imgUUID, parentVol.volUUID)
-                        backingFormat = sc.fmt2str(parentVol.getFormat())
-                    else:
-                        backing = None
-                        backingFormat = None
+                if parentVol is not None:
+                    backing = volume.getBackingVolumePath(
+                        imgUUID, parentVol.volUUID)
+                    backingFormat = sc.fmt2str(parentVol.getFormat())
+                else:
+                    backing = None
+                    backingFormat = None
+
+                operation = qemuimg.convert(
+                    srcVol.getVolumePath(),
+                    dstVol.getVolumePath(),
+                    srcFormat=srcFormat,
+                    dstFormat=dstFormat,
+                    dstQcow2Compat=destDom.qcow2_compat(),
+                    backing=backing,
+                    backingFormat=backingFormat,
+                    unordered_writes=destDom.recommends_unordered_writes(
+                        dstVol.getFormat()),
+                    create=dstVol.requires_create(),
+                    target_is_zero=dstVol.zero_initialized(),
+                )
+                with utils.stopwatch(
+                        "Copy volume {}".format(srcVol.volUUID),
+                        level=logging.INFO,
+                        log=self.log):
+                    copy.run(operation)
+            except ActionStopped:
+                raise
+            except se.StorageException:
+                self.log.error("Unexpected error", exc_info=True)
+                raise
+            except Exception:
+                self.log.error("Copy image error: image=%s, src domain=%s,"
+                               " dst domain=%s", imgUUID, srcSdUUID,
+                               destDom.sdUUID, exc_info=True)
+                raise se.CopyImageError()
 
-                    operation = qemuimg.convert(
-                        srcVol.getVolumePath(),
-                        dstVol.getVolumePath(),
-                        srcFormat=srcFormat,
-                        dstFormat=dstFormat,
-                        dstQcow2Compat=destDom.qcow2_compat(),
-                        backing=backing,
-                        backingFormat=backingFormat,
-                        unordered_writes=destDom.recommends_unordered_writes(
-                            dstVol.getFormat()),
-                        create=dstVol.requires_create(),
-                        target_is_zero=dstVol.zero_initialized(),
-                    )
-                    with utils.stopwatch(
-                            "Copy volume {}".format(srcVol.volUUID),
-                            level=logging.INFO,
-                            log=self.log):
-                        self._run_qemuimg_operation(operation)
-                except ActionStopped:
-                    raise
-                except se.StorageException:
-                    self.log.error("Unexpected error", exc_info=True)
-                    raise
-                except Exception:
-                    self.log.error("Copy image error: image=%s, src domain=%s,"
-                                   " dst domain=%s", imgUUID, srcSdUUID,
-                                   destDom.sdUUID, exc_info=True)
-                    raise se.CopyImageError()
+        try:
+            # qemu-img convert opens the destination parent volume as the
+            # backing file of the destination volume, so the volumes of the
+            # chain must be copied in order, starting with the base volume.
+            copies = [
+                copyscheduler.Copy(
+                    srcVol.volUUID,
+                    (srcSdUUID, destDom.sdUUID),
+                    srcVol.getVolumeSize(),
+                    functools.partial(copyVolume, srcVol=srcVol))
+                for srcVol in chains['srcChain']
+            ]
+            self._run_qemuimg_operation(copyscheduler.Scheduler(copies))
         finally:
             # teardown volumes
             self.__cleanupMove(srcLeafVol, dstLeafVol)
@@ -747,11 +761,19 @@ class Image:
                         create=dstVol.requires_create(),
                         target_is_zero=dstVol.zero_initialized(),
                     )
+                    # The collapsed chain is copied to a single volume, but
+                    # the copy must be accounted in the copy budget.
+                    copy = copyscheduler.Copy(
+                        srcVol.volUUID,
+                        (sdUUID, dstSdUUID),
+                        volParams['capacity'],
+                        lambda copy: copy.run(operation))
                     with utils.stopwatch(
                             "Copy volume {}".format(srcVol.volUUID),
                             level=logging.INFO,
                             log=self.log):
-                        self._run_qemuimg_operation(operation)
+                        self._run_qemuimg_operation(
+                            copyscheduler.Scheduler([copy]))
                 except ActionStopped:
                     raise
                 except cmdutils.Error as e:
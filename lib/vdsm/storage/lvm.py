@@ -35,6 +35,7 @@ import logging
 from collections import namedtuple
 import pprint as pp
 import threading
+import time
 
 from itertools import chain
 
@@ -204,7 +205,19 @@ re_pvName = re.compile(PV_PREFIX + r'[^\s\"]+', re.MULTILINE)
 
 PVS_CMD = ("pvs",) + LVM_FLAGS + ("-o", PV_FIELDS)
 VGS_CMD = ("vgs",) + LVM_FLAGS + ("-o", VG_FIELDS)
-LVS_CMD = ("lvs",) + LVM_FLAGS + ("-o", LV_FIELDS)
+VG_SEQNO_CMD = ("vgs",) + LVM_FLAGS + ("-o", "vg_seqno")
+
+# The VG metadata sequence number is reported with the LVs so we can tell if
+# the LVs changed since they were loaded.
+LVS_CMD = ("lvs",) + LVM_FLAGS + ("-o", LV_FIELDS + ",vg_seqno")
+
+# Activating or deactivating LVs adds or removes device mapper devices, but
+# does not change the VG metadata.
+DM_DIR = "/dev/mapper"
+
+# Changing a directory more recently than this may not change the directory
+# modification time, so we cannot trust recent modification times.
+MTIME_RESOLUTION = 1.0
 
 # FIXME we must use different METADATA_USER ownership for qemu-unreadable
 # metadata volumes
@@ -400,6 +413,8 @@ class LVMCache(object):
         self._stalepv = True
         self._stalevg = True
         self._freshlv = set()
+        # VG name -> (vg_seqno, dm_version) when the VG LVs were loaded.
+        self._lvs_version = {}
         self._pvs = {}
         self._vgs = {}
         self._lvs = {}
@@ -677,6 +692,7 @@ class LVMCache(object):
                 del self._vgs[name]
                 # Remove fresh lvs indication of the vg removed from cache.
                 self._freshlv.discard(name)
+                self._lvs_version.pop(name, None)
 
         return updatedVGs
 
@@ -760,6 +776,10 @@ class LVMCache(object):
         cmd = list(LVS_CMD)
         cmd.append(vgName)
 
+        # Must be checked before reading the LVs, so changes during the
+        # reload are detected in the next check.
+        dm_version = _dm_version()
+
         out, error = self.run_command_error(
             cmd, devices=self._getVGDevs((vgName,)))
 
@@ -786,16 +806,11 @@ class LVMCache(object):
 
                 return updatedLVs
 
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                if len(fields) != LV_FIELDS_LEN:
-                    raise InvalidOutputLine("lvs", line)
-
-                lv = LV.fromlvm(*fields)
-                # For LV we are only interested in its first extent
-                if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
-                    updatedLVs[(lv.vg_name, lv.name)] = lv
+            seqnos = {}
+            for lv, seqno in _parse_lvs(out):
+                self._lvs[(lv.vg_name, lv.name)] = lv
+                updatedLVs[(lv.vg_name, lv.name)] = lv
+                seqnos[lv.vg_name] = seqno
 
             # Determine if there are stale LVs
             # All the LVs in the VG
@@ -809,6 +824,7 @@ class LVMCache(object):
                     del self._lvs[(vgName, lvName)]
 
             self._freshlv.add(vgName)
+            self._update_lvs_version_locked(vgName, seqnos, dm_version)
 
             log.debug("lvs reloaded")
 
@@ -820,28 +836,53 @@ class LVMCache(object):
         """
         cmd = list(LVS_CMD)
 
+        dm_version = _dm_version()
+
         out, error = self.run_command_error(cmd)
 
         if error:
             return self._lvs.copy()
 
         new_lvs = {}
-        for line in out:
-            fields = [field.strip() for field in line.split(SEPARATOR)]
-            if len(fields) != LV_FIELDS_LEN:
-                raise InvalidOutputLine("lvs", line)
-
-            lv = LV.fromlvm(*fields)
-            # For LV we are only interested in its first extent
-            if lv.seg_start_pe == "0":
-                new_lvs[(lv.vg_name, lv.name)] = lv
+        seqnos = {}
+        for lv, seqno in _parse_lvs(out):
+            new_lvs[(lv.vg_name, lv.name)] = lv
+            seqnos[lv.vg_name] = seqno
 
         with self._lock:
             self._lvs = new_lvs
             self._freshlv = {vg_name for vg_name, _ in self._lvs}
+            self._lvs_version = {}
+            for vg_name in self._freshlv:
+                self._update_lvs_version_locked(vg_name, seqnos, dm_version)
 
         return self._lvs.copy()
 
+    def _update_lvs_version_locked(self, vg_name, seqnos, dm_version):
+        """
+        Remember the version of the VG LVs loaded from LVM. If the version is
+        not known, the LVs will be reloaded on the next access.
+        Must be called while holding the lock.
+        """
+        seqno = seqnos.get(vg_name)
+        if seqno is None or dm_version is None:
+            self._lvs_version.pop(vg_name, None)
+        else:
+            self._lvs_version[vg_name] = (seqno, dm_version)
+
+    def _vg_seqno(self, vg_name):
+        """
+        Return the current VG metadata sequence number, or None if the VG
+        could not be read.
+        """
+        cmd = list(VG_SEQNO_CMD)
+        cmd.append(vg_name)
+        out, error = self.run_command_error(
+            cmd, devices=self._getVGDevs([vg_name]))
+        if error or len(out) != 1:
+            return None
+        return out[0].strip()
+
     def _invalidatepvs(self, pvNames):
         pvNames = normalize_args(pvNames)
         with self._lock:
@@ -870,6 +911,7 @@ class LVMCache(object):
             self._stalevg = True
             self._vgs.clear()
             self._freshlv = set()
+            self._lvs_version.clear()
 
     def _invalidatelvs(self, vgName, lvNames=None):
         lvNames = normalize_args(lvNames)
@@ -888,6 +930,7 @@ class LVMCache(object):
     def _invalidateAllLvs(self):
         with self._lock:
             self._freshlv = set()
+            self._lvs_version.clear()
             self._lvs.clear()
 
     def _removelvs(self, vgName, lvNames=None):
@@ -957,11 +1000,11 @@ class LVMCache(object):
                 pvs.append(pv)
 
         if stalepvs:
-            self.stats.miss()
+            self.stats.miss(vgName)
             reloadedpvs = self._reloadpvs(pv_name=stalepvs)
             pvs.extend(reloadedpvs.values())
         else:
-            self.stats.hit()
+            self.stats.hit(vgName)
         return pvs
 
     def getVg(self, vgName):
@@ -971,10 +1014,10 @@ class LVMCache(object):
         """
         vg = self._vgs.get(vgName)
         if not vg or vg.is_stale():
-            self.stats.miss()
+            self.stats.miss(vgName)
             vg = self._reload_single_vg(vgName)
         else:
-            self.stats.hit()
+            self.stats.hit(vgName)
         return vg
 
     def getVgs(self, vgNames):
@@ -1031,20 +1074,20 @@ class LVMCache(object):
             # vgName, lvName
             lv = self._lvs.get((vgName, lvName))
             if not lv or lv.is_stale():
-                self.stats.miss()
+                self.stats.miss(vgName)
                 # while we here reload all the LVs in the VG
                 lvs = self._reloadlvs(vgName)
                 lv = lvs.get((vgName, lvName))
             else:
-                self.stats.hit()
+                self.stats.hit(vgName)
 
             return lv
 
         if self._lvs_needs_reload(vgName):
-            self.stats.miss()
+            self.stats.miss(vgName)
             lvs = self._reloadlvs(vgName)
         else:
-            self.stats.hit()
+            self.stats.hit(vgName)
             lvs = self._lvs.copy()
 
         lvs = [lv for lv in lvs.values()
@@ -1052,16 +1095,61 @@ class LVMCache(object):
         return lvs
 
     def _lvs_needs_reload(self, vg_name):
-        # TODO: Return True only if VG has changed.
-        if not self._cache_lvs:
+        if vg_name not in self._freshlv:
             return True
 
-        if vg_name not in self._freshlv:
+        if any(lv.is_stale()
+               for (vgn, _), lv in self._lvs.items()
+               if vgn == vg_name):
             return True
 
-        return any(lv.is_stale()
-                   for (vgn, _), lv in self._lvs.items()
-                   if vgn == vg_name)
+        if self._cache_lvs:
+            return False
+
+        # The VG may be modified by another host. Reload only if the VG
+        # metadata or the local device mapper devices changed since the LVs
+        # were loaded.
+        return self._lvs_changed(vg_name)
+
+    def _lvs_changed(self, vg_name):
+        version = self._lvs_version.get(vg_name)
+        if version is None:
+            return True
+
+        seqno, dm_version = version
+        if _dm_version() != dm_version:
+            return True
+
+        return self._vg_seqno(vg_name) != seqno
+
+
+def _parse_lvs(out):
+    """
+    Parse lvs command output, yielding LV and VG metadata sequence number.
+    """
+    for line in out:
+        fields = [field.strip() for field in line.split(SEPARATOR)]
+        if len(fields) != LV_FIELDS_LEN + 1:
+            raise InvalidOutputLine("lvs", line)
+
+        lv = LV.fromlvm(*fields[:LV_FIELDS_LEN])
+        # For LV we are only interested in its first extent
+        if lv.seg_start_pe == "0":
+            yield lv, fields[LV_FIELDS_LEN]
+
+
+def _dm_version():
+    """
+    Return the version of the local device mapper devices, changed when
+    devices are added or removed, or None if the version cannot be trusted.
+    """
+    try:
+        st = os.stat(DM_DIR)
+    except FileNotFoundError:
+        return None
+    if time.time() - st.st_mtime < MTIME_RESOLUTION:
+        return None
+    return st.st_mtime_ns
 
 
 class CacheStats(object):
@@ -1070,29 +1158,43 @@ class CacheStats(object):
         self._lock = threading.Lock()
         self._hits = 0
         self._misses = 0
+        # VG name -> [hits, misses]
+        self._vgs = {}
 
     def info(self):
         with self._lock:
-            calls = self._hits + self._misses
-            hit_ratio = (100 * self._hits / calls) if calls > 0 else 0
-            return {
-                "hits": self._hits,
-                "misses": self._misses,
-                "hit_ratio": hit_ratio
-            }
+            info = _hit_info(self._hits, self._misses)
+            info["vgs"] = {vg_name: _hit_info(hits, misses)
+                           for vg_name, (hits, misses) in self._vgs.items()}
+            return info
 
     def clear(self):
         with self._lock:
             self._hits = 0
             self._misses = 0
+            self._vgs.clear()
 
-    def miss(self):
+    def miss(self, vg_name=None):
         with self._lock:
             self._misses += 1
+            if vg_name is not None:
+                self._vgs.setdefault(vg_name, [0, 0])[1] += 1
 
-    def hit(self):
+    def hit(self, vg_name=None):
         with self._lock:
             self._hits += 1
+            if vg_name is not None:
+                self._vgs.setdefault(vg_name, [0, 0])[0] += 1
+
+
+def _hit_info(hits, misses):
+    calls = hits + misses
+    hit_ratio = (100 * hits / calls) if calls > 0 else 0
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hit_ratio
+    }
 
 
 _lvminfo = LVMCache()
@@ -21,8 +21,11 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import bisect
+import heapq
+import itertools
 import os
-import errno
+import mmap
 import time
 import threading
 import struct
@@ -34,8 +37,10 @@ from functools import partial
 from six.moves import queue
 
 from vdsm.common import commands
+from vdsm.common.osutils import uninterruptible
 from vdsm.common.units import KiB
 from vdsm.config import config
+from vdsm.storage import constants as sc
 from vdsm.storage import misc
 from vdsm.storage import task
 from vdsm.storage.exception import InvalidParameterException
@@ -64,6 +69,34 @@ SLOTS_PER_MAILBOX = int(MAILBOX_SIZE // MESSAGE_SIZE)
 # Last message slot is reserved for metadata (checksum, extendable mailbox,
 # etc)
 MESSAGES_PER_MAILBOX = SLOTS_PER_MAILBOX - 1
+# Number of mailboxes compared at once when looking for changed mailboxes.
+_MAILBOXES_PER_RANGE = 64
+
+# Protocol version 2.
+#
+# A version 2 extend message extends several volumes in the same storage
+# domain. The message structure is: Version (1 byte), OpCode (4 bytes), Count
+# (1 byte), Domain UUID (16 bytes), and Count extends, each with Volume UUID
+# (16 bytes) and size (4 bytes, big endian), padded with zeros to 64 bytes.
+# The reply has the same structure, with size 0 for failed extends.
+#
+# Hosts supporting version 2 write a version record in the reserved slot of
+# their outbox mailbox. The SPM replies with the version it will handle in
+# the reserved slot of the host inbox mailbox. A host uses version 2 only
+# when the SPM advertised it; otherwise, for example after the SPM moved to
+# an older host, it falls back to version 1.
+MESSAGE_VERSION_2 = b"2"
+PROTOCOL_VERSION = 2
+VERSION_CODE = b"\0ver"
+VERSION_OFFSET = MESSAGES_PER_MAILBOX * MESSAGE_SIZE
+_V2_HEADER = struct.Struct("!c4sB16s")
+_V2_EXTEND = struct.Struct("!16sI")
+EXTENDS_PER_MESSAGE = (MESSAGE_SIZE - _V2_HEADER.size) // _V2_EXTEND.size
+
+# Upper bounds in seconds of extend latency histogram buckets.
+LATENCY_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+_PRIORITY_RANK = {p: i for i, p in enumerate(sc.EXTEND_PRIORITIES)}
 
 log = logging.getLogger('storage.mailbox')
 
@@ -103,7 +136,8 @@ class SPM_Extend_Message:
 
     log = logging.getLogger('storage.mailbox')
 
-    def __init__(self, volumeData, newSize, callbackFunction=None):
+    def __init__(self, volumeData, newSize, callbackFunction=None,
+                 priority=sc.EXTEND_THRESHOLD):
         if ('poolID' not in volumeData or
                 'domainID' not in volumeData or
                 'volumeID' not in volumeData):
@@ -115,12 +149,22 @@ class SPM_Extend_Message:
         if (newSize < 0) or (newSize > VOLUME_MAX_SIZE):
             raise InvalidParameterException('volumeSize', newSize)
 
+        if priority not in _PRIORITY_RANK:
+            raise InvalidParameterException('priority', priority)
+
         misc.validateUUID(volumeData['domainID'], 'domainID')
         misc.validateUUID(volumeData['volumeID'], 'volumeID')
 
         self.pool = volumeData['poolID']
         self.volumeData = volumeData
         self.callback = callbackFunction
+        self.newSize = newSize
+        self.priority = priority
+        # Scheduling rank, may be raised by merging a more urgent request.
+        self.rank = _PRIORITY_RANK[priority]
+        self.created = time.monotonic()
+        # Requests for the same volume merged into this message.
+        self.merged = []
 
         # Message structure is rigid (order must be kept and is relied upon):
         # Version (1 byte), OpCode (4 bytes), Domain UUID (16 bytes), Volume
@@ -139,6 +183,31 @@ class SPM_Extend_Message:
     def __getitem__(self, index):
         return self.payload[index]
 
+    @property
+    def key(self):
+        return (self.volumeData['domainID'], self.volumeData['volumeID'])
+
+    def merge(self, other):
+        """
+        Merge other request for the same volume into this message. The
+        message requests the largest size and is scheduled using the highest
+        priority of both requests. Both requests are completed when the SPM
+        replies.
+        """
+        if other.newSize > self.newSize:
+            self.newSize = other.newSize
+            self.payload = other.payload
+        self.rank = min(self.rank, other.rank)
+        self.merged.append(other)
+        self.merged.extend(other.merged)
+        other.merged = []
+
+    def requests(self):
+        """
+        Return this message and the requests merged into it.
+        """
+        return [self] + self.merged
+
     def checkReply(self, reply):
         # Sanity check - Make sure reply is for current message
         sizeOffset = 5 + 2 * PACKED_UUID_SIZE
@@ -157,6 +226,9 @@ class SPM_Extend_Message:
 
     @classmethod
     def processRequest(cls, pool, msgID, payload):
+        if payload[0:1] == MESSAGE_VERSION_2:
+            return SPM_Extend_Batch.processRequest(pool, msgID, payload)
+
         cls.log.debug("processRequest, payload:" + repr(payload))
         sdOffset = 5
         volumeOffset = sdOffset + PACKED_UUID_SIZE
@@ -190,6 +262,221 @@ class SPM_Extend_Message:
             return {'status': {'code': 0, 'message': 'Done'}}
 
 
+class SPM_Extend_Batch(object):
+    """
+    Protocol version 2 extend message, extending up to EXTENDS_PER_MESSAGE
+    volumes in the same storage domain.
+    """
+
+    log = logging.getLogger('storage.mailbox')
+
+    def __init__(self, extends):
+        """
+        Arguments:
+            extends (list): SPM_Extend_Message for volumes in the same
+                storage domain.
+        """
+        if not 0 < len(extends) <= EXTENDS_PER_MESSAGE:
+            raise InvalidParameterException('extends', len(extends))
+        self.extends = extends
+        self.payload = pack_extends(
+            extends[0].volumeData['domainID'],
+            [(e.volumeData['volumeID'], e.newSize) for e in extends])
+
+    def __getitem__(self, index):
+        return self.payload[index]
+
+    def requests(self):
+        return [r for e in self.extends for r in e.requests()]
+
+    def checkReply(self, reply):
+        domain, extends = unpack_extends(reply)
+        expected_domain, expected = unpack_extends(self.payload)
+        if (domain != expected_domain or
+                [v for v, _ in extends] != [v for v, _ in expected]):
+            self.log.error("SPM_Extend_Batch: Reply message volume data "
+                           "differs from request message, reply : %s, "
+                           "orig: %s", reply, self.payload)
+            raise RuntimeError('Incorrect reply')
+        for vol_id, size in extends:
+            if size == 0:
+                self.log.warning("SPM_Extend_Batch: Extending volume %s "
+                                 "failed", vol_id)
+        return REPLY_OK
+
+    @classmethod
+    def processRequest(cls, pool, msgID, payload):
+        cls.log.debug("processRequest, payload: %r", payload)
+        domain, extends = unpack_extends(payload)
+
+        # Reply once for all the extends in the message.
+        results = []
+        for vol_id, size in extends:
+            cls.log.info("processRequest: extending volume %s in domain %s "
+                         "(pool %s) to size %d", vol_id, domain, pool.spUUID,
+                         size)
+            try:
+                pool.extendVolume(domain, vol_id, size)
+            except:
+                cls.log.error("processRequest: Exception caught while trying "
+                              "to extend volume: %s in domain: %s",
+                              vol_id, domain, exc_info=True)
+                size = 0
+            results.append((vol_id, size))
+
+        pool.spmMailer.sendReply(msgID, _Reply(pack_extends(domain, results)))
+        return {'status': {'code': 0, 'message': 'Done'}}
+
+
+class _Reply(object):
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def pack_extends(domain, extends):
+    """
+    Pack protocol version 2 extend message for volumes in domain.
+
+    Arguments:
+        domain (str): Storage domain UUID.
+        extends (list): (volume UUID, size) tuples.
+    """
+    header = _V2_HEADER.pack(
+        MESSAGE_VERSION_2, EXTEND_CODE, len(extends), pack_uuid(domain))
+    body = b"".join(_V2_EXTEND.pack(pack_uuid(vol_id), size)
+                    for vol_id, size in extends)
+    return (header + body).ljust(MESSAGE_SIZE, b"\0")
+
+
+def unpack_extends(payload):
+    """
+    Unpack protocol version 2 extend message, returning domain UUID and list
+    of (volume UUID, size) tuples.
+    """
+    _, _, count, domain = _V2_HEADER.unpack_from(payload)
+    if not 0 < count <= EXTENDS_PER_MESSAGE:
+        raise ValueError("Invalid extend count: %d" % count)
+    extends = []
+    for i in range(count):
+        volume, size = _V2_EXTEND.unpack_from(
+            payload, _V2_HEADER.size + i * _V2_EXTEND.size)
+        extends.append((unpack_uuid(volume), size))
+    return unpack_uuid(domain), extends
+
+
+class ExtendQueue(object):
+    """
+    Extend messages waiting for a free slot in the mailbox.
+
+    Messages are returned by priority, and in FIFO order for messages with
+    the same priority, so a VM paused because of ENOSPC does not wait behind
+    routine extends when many volumes are extended at the same time.
+
+    A message for a volume with a pending message is merged into the pending
+    message, so the volume is extended once to the largest requested size.
+
+    Provides the get() interface of queue.Queue used by HSM_MailMonitor.
+    """
+
+    log = logging.getLogger('storage.mailbox')
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        # Entries: (rank, seq, msg). Entries for merged messages, or with an
+        # old rank, are stale and skipped.
+        self._heap = []
+        self._pending = {}
+        self._seq = itertools.count()
+
+    def put(self, msg):
+        with self._cond:
+            pending = self._pending.get(msg.key)
+            if pending is None:
+                self._pending[msg.key] = msg
+                self._push(msg)
+            else:
+                rank = pending.rank
+                pending.merge(msg)
+                self.log.debug("Merged extend request for volume %s "
+                               "priority=%s size=%s",
+                               msg.volumeData['volumeID'], msg.priority,
+                               msg.newSize)
+                if pending.rank < rank:
+                    self._push(pending)
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    if self._valid(entry):
+                        msg = entry[2]
+                        del self._pending[msg.key]
+                        return msg
+                if not block:
+                    raise queue.Empty
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._cond.wait(remaining)
+
+    def get_domain(self, domain_id, count):
+        """
+        Remove and return up to count pending messages for volumes in
+        domain_id, most urgent first, without blocking.
+        """
+        with self._cond:
+            entries = heapq.nsmallest(
+                count,
+                (entry for entry in self._heap
+                 if entry[2].key[0] == domain_id and self._valid(entry)))
+            for _, _, msg in entries:
+                del self._pending[msg.key]
+            return [msg for _, _, msg in entries]
+
+    def qsize(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _valid(self, entry):
+        rank, _, msg = entry
+        return rank == msg.rank and self._pending.get(msg.key) is msg
+
+    def _push(self, msg):
+        heapq.heappush(self._heap, (msg.rank, next(self._seq), msg))
+
+
+class Histogram(object):
+    """
+    Latency histogram. Values larger than the last bucket are counted in
+    the "inf" bucket.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def add(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def info(self):
+        names = [str(b) for b in self._buckets] + ["inf"]
+        return {
+            "count": sum(self._counts),
+            "sum": self._sum,
+            "buckets": dict(zip(names, self._counts)),
+        }
+
+
 class HSM_Mailbox:
 
     log = logging.getLogger('storage.mailbox')
@@ -200,7 +487,7 @@ class HSM_Mailbox:
         self._poolID = str(poolID)
         self._monitorInterval = monitorInterval
         self._eventInterval = min(eventInterval, monitorInterval)
-        self._queue = queue.Queue(-1)
+        self._queue = ExtendQueue()
         self._inbox = inbox
         if not os.path.exists(self._inbox):
             self.log.error("HSM_Mailbox create failed - inbox %s does not "
@@ -218,12 +505,21 @@ class HSM_Mailbox:
             eventInterval)
         self.log.debug('HSM_MailboxMonitor created for pool %s' % self._poolID)
 
-    def sendExtendMsg(self, volumeData, newSize, callbackFunction=None):
-        msg = SPM_Extend_Message(volumeData, newSize, callbackFunction)
+    def sendExtendMsg(self, volumeData, newSize, callbackFunction=None,
+                      priority=sc.EXTEND_THRESHOLD):
+        msg = SPM_Extend_Message(
+            volumeData, newSize, callbackFunction, priority=priority)
         if str(msg.pool) != self._poolID:
             raise ValueError('PoolID does not correspond to Mailbox pool')
         self._queue.put(msg)
 
+    def extend_stats(self):
+        """
+        Return extend latency histogram for every priority. The latency is
+        the time from sending an extend request until the SPM replied.
+        """
+        return self._mailman.extend_stats()
+
     def stop(self):
         if self._mailman:
             self._mailman.immStop()
@@ -250,12 +546,19 @@ class HSM_MailMonitor(object):
         self._stop = False
         self._queue = queue
         self._activeMessages = {}
+        self._stats_lock = threading.Lock()
+        self._latency = {p: Histogram() for p in sc.EXTEND_PRIORITIES}
         self._monitorInterval = monitorInterval
         self._eventInterval = eventInterval
         self._hostID = int(hostID)
         self._used_slots_array = [0] * MESSAGES_PER_MAILBOX
         self._outgoingMail = EMPTYMAILBOX
         self._incomingMail = EMPTYMAILBOX
+        # Protocol version supported by this host, and the version
+        # negotiated with the SPM.
+        self._maxVersion = min(
+            config.getint('mailbox', 'protocol_version'), PROTOCOL_VERSION)
+        self._version = 1
         # TODO: add support for multiple paths (multiple mailboxes)
         self._inCmd = [constants.EXT_DD,
                        'if=' + str(inbox),
@@ -286,6 +589,7 @@ class HSM_MailMonitor(object):
         (rc, out, err) = _mboxExecCmd(self._inCmd, raw=True)
         if rc == 0:
             self._incomingMail = out
+            self._checkVersion(out)
             self._init = True
         else:
             self.log.warning("HSM_MailboxMonitor - Could not initialize "
@@ -300,7 +604,7 @@ class HSM_MailMonitor(object):
         return not self._thread.is_alive()
 
     def _handleResponses(self, newMsgs):
-        rc = False
+        rc = self._checkVersion(newMsgs)
 
         for i in range(0, MESSAGES_PER_MAILBOX):
             # Skip checking non used slots
@@ -333,12 +637,7 @@ class HSM_MailMonitor(object):
             newMsg = newMsgs[start:start + MESSAGE_SIZE]
 
             if newMsg == CLEAN_MESSAGE:
-                del self._activeMessages[i]
-                self._used_slots_array[i] = 0
-                self._msgCounter -= 1
-                self._outgoingMail = self._outgoingMail[0:start] + \
-                    MESSAGE_SIZE * b"\0" + self._outgoingMail[start +
-                                                              MESSAGE_SIZE:]
+                self._clearSlot(i)
                 continue
 
             msg = self._activeMessages[i]
@@ -351,18 +650,10 @@ class HSM_MailMonitor(object):
                                "%s", self._msgCounter, MESSAGES_PER_MAILBOX,
                                repr(newMsg))
                 msg.checkReply(newMsg)
-                if msg.callback:
-                    try:
-                        id = str(uuid.uuid4())
-                        if not self.tp.queueTask(id, runTask, (msg.callback,
-                                                 msg.volumeData)):
-                            raise Exception()
-                    except:
-                        self.log.error("HSM_MailMonitor: exception caught "
-                                       "while running msg callback, for "
-                                       "message: %s, callback function: %s",
-                                       repr(msg.payload), msg.callback,
-                                       exc_info=True)
+                self._record_latency(msg)
+                for request in msg.requests():
+                    if request.callback:
+                        self._run_callback(msg, request)
             except RuntimeError as e:
                 self.log.error("HSM_MailMonitor: exception: %s caught while "
                                "checking reply for message: %s, reply: %s",
@@ -377,6 +668,85 @@ class HSM_MailMonitor(object):
         self._incomingMail = newMsgs
         return rc
 
+    def _clearSlot(self, i):
+        del self._activeMessages[i]
+        self._used_slots_array[i] = 0
+        self._msgCounter -= 1
+        start = i * MESSAGE_SIZE
+        self._outgoingMail = self._outgoingMail[0:start] + \
+            MESSAGE_SIZE * b"\0" + self._outgoingMail[start + MESSAGE_SIZE:]
+
+    # Protocol version.
+
+    def _checkVersion(self, mailbox):
+        """
+        Update the protocol version from the version advertised by the SPM in
+        our inbox mailbox. If the SPM does not support version 2 messages,
+        send the active version 2 messages again as version 1 messages.
+
+        Return True if the outgoing mail was modified.
+        """
+        version = min(self._maxVersion, read_version(mailbox))
+        if version == self._version:
+            return False
+
+        self.log.info("HSM_MailMonitor - using protocol version %d",
+                      version)
+        self._version = version
+        if version >= 2:
+            return False
+
+        rc = False
+        for i, msg in list(self._activeMessages.items()):
+            if isinstance(msg, SPM_Extend_Batch):
+                self.log.info("HSM_MailMonitor - sending message %r again "
+                              "using protocol version 1", msg.payload)
+                self._clearSlot(i)
+                for extend in msg.extends:
+                    self._queue.put(extend)
+                rc = True
+        return rc
+
+    def _nextMessage(self, block=True, timeout=None):
+        """
+        Return the next message from the queue. When using protocol version
+        2, add more pending extends for volumes in the same domain.
+        """
+        msg = self._queue.get(block=block, timeout=timeout)
+        if self._version < 2:
+            return msg
+        extends = [msg] + self._queue.get_domain(
+            msg.volumeData['domainID'], EXTENDS_PER_MESSAGE - 1)
+        return SPM_Extend_Batch(extends)
+
+    def _run_callback(self, msg, request):
+        try:
+            id = str(uuid.uuid4())
+            if not self.tp.queueTask(id, runTask, (request.callback,
+                                     request.volumeData)):
+                raise Exception()
+        except:
+            self.log.error("HSM_MailMonitor: exception caught "
+                           "while running msg callback, for "
+                           "message: %s, callback function: %s",
+                           repr(msg.payload), request.callback,
+                           exc_info=True)
+
+    def _record_latency(self, msg):
+        now = time.monotonic()
+        with self._stats_lock:
+            for request in msg.requests():
+                latency = now - request.created
+                self._latency[request.priority].add(latency)
+                self.log.debug("Extend request for volume %s completed "
+                               "priority=%s latency=%.3f",
+                               request.volumeData['volumeID'],
+                               request.priority, latency)
+
+    def extend_stats(self):
+        with self._stats_lock:
+            return {p: h.info() for p, h in self._latency.items()}
+
     def _checkForMail(self):
         # self.log.debug("HSM_MailMonitor - checking for mail")
         # self.log.debug("Running command: " + str(self._inCmd))
@@ -426,6 +796,11 @@ class HSM_MailMonitor(object):
         end = start + MESSAGE_SIZE
         self._outgoingMail = self._outgoingMail[0:start] + message.payload + \
             self._outgoingMail[end:]
+        if self._maxVersion >= 2:
+            # Tell the SPM that we support protocol version 2.
+            record = version_record(self._maxVersion)
+            self._outgoingMail = self._outgoingMail[0:VERSION_OFFSET] + \
+                record + self._outgoingMail[VERSION_OFFSET + len(record):]
         self.log.debug("HSM_MailMonitor - start: %s, end: %s, len: %s, "
                        "message(%s/%s): %s" %
                        (start, end, len(self._outgoingMail), self._msgCounter,
@@ -457,7 +832,7 @@ class HSM_MailMonitor(object):
                             # self.log.debug("No requests in queue, going to "
                             #               "sleep until new requests arrive")
                             # Check if a new message is waiting to be sent
-                            message = self._queue.get(
+                            message = self._nextMessage(
                                 block=True, timeout=self._monitorInterval)
                             self._handleMessage(message)
                             message = None
@@ -475,7 +850,7 @@ class HSM_MailMonitor(object):
                             (len(self._activeMessages) < MESSAGES_PER_MAILBOX):
                         # TODO: Remove single mailbox limitation
                         try:
-                            message = self._queue.get(block=False)
+                            message = self._nextMessage(block=False)
                             self._handleMessage(message)
                             message = None
                             sendMail = True
@@ -600,34 +975,50 @@ class SPM_MailMonitor:
         self._monitorInterval = monitorInterval
         self._eventInterval = min(eventInterval, monitorInterval)
         # TODO: add support for multiple paths (multiple mailboxes)
-        self._outgoingMail = self._outMailLen * b"\0"
-        self._incomingMail = self._outgoingMail
-        self._inCmd = ['dd',
-                       'if=' + str(self._inbox),
-                       'iflag=direct,fullblock',
-                       'count=1'
-                       ]
-        self._outCmd = ['dd',
-                        'of=' + str(self._outbox),
-                        'oflag=direct',
-                        'iflag=fullblock',
-                        'conv=notrunc',
-                        'count=1'
-                        ]
+        # Mail is kept in mutable buffers, so replies and cleared messages
+        # are patched in place instead of copying the entire mail.
+        self._outgoingMail = bytearray(self._outMailLen)
+        self._incomingMail = bytearray(self._outMailLen)
         self._outLock = threading.Lock()
         self._inLock = threading.Lock()
 
+        # Replies are written to the outbox in batches. Mailboxes modified
+        # since the last write are kept in _dirty, and written by the first
+        # thread taking _flushLock.
+        self._flushLock = threading.Lock()
+        self._dirty = set()
+
+        self._stats = MailboxStats()
+
+        # Protocol version supported by the SPM, and the version written by
+        # every host in its mailbox.
+        self._maxVersion = min(
+            config.getint('mailbox', 'protocol_version'), PROTOCOL_VERSION)
+        self._hostVersions = {}
+
         # The event detected in an empty mailbox.
         self._last_event = uuid.UUID(int=0)
 
+        # Keep the mailboxes open and read or write them using aligned
+        # buffers, instead of running dd for every I/O.
+        self._inFile = MailboxFile(self._inbox)
+        try:
+            self._outFile = MailboxFile(self._outbox, "r+")
+        except:
+            self._inFile.close()
+            raise
+        self._inBuf = mmap.mmap(-1, self._outMailLen, mmap.MAP_SHARED)
+        self._outBuf = mmap.mmap(-1, self._outMailLen, mmap.MAP_SHARED)
+        self._eventBuf = mmap.mmap(-1, MAILBOX_SIZE, mmap.MAP_SHARED)
+
         # Clear outgoing mail
-        self.log.debug("SPM_MailMonitor - clearing outgoing mail, command is: "
-                       "%s", self._outCmd)
-        cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-        (rc, out, err) = _mboxExecCmd(cmd, data=self._outgoingMail)
-        if rc:
-            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail, "
-                             "dd failed")
+        self.log.debug("SPM_MailMonitor - clearing outgoing mail")
+        self._dirty.update(range(self._numHosts))
+        try:
+            self._flushOutgoingMail()
+        except EnvironmentError as e:
+            self.log.warning("SPM_MailMonitor couldn't clear outgoing mail: "
+                             "%s", e)
 
         self._thread = concurrent.thread(
             self._run, name="mailbox-spm", log=self.log)
@@ -646,6 +1037,9 @@ class SPM_MailMonitor:
     def isStopped(self):
         return self._stopped
 
+    def stats(self):
+        return self._stats
+
     @classmethod
     def validateMailbox(self, mailbox, mailboxIndex):
         """
@@ -670,79 +1064,62 @@ class SPM_MailMonitor:
 
         send = False
 
-        # run through all messages and check if new messages have arrived
-        # (since last read)
-        for host in range(0, self._numHosts):
-            # Check mailbox checksum
+        # Check only mailboxes that have changed since last read. Most
+        # mailboxes are empty or unchanged, so it costs less to compare
+        # entire mailboxes than to check every message.
+        for host in self._changedMailboxes(newMail):
             mailboxStart = host * MAILBOX_SIZE
+            mailboxEnd = mailboxStart + MAILBOX_SIZE
+            newMailbox = bytes(newMail[mailboxStart:mailboxEnd])
+
+            slots = changed_slots(
+                newMailbox, self._incomingMail[mailboxStart:mailboxEnd])
+
+            version = read_version(newMailbox)
+            negotiate = version != self._hostVersions.get(host, 1)
+
+            # Validating the mailbox is done only after we find a new message
+            # or a new version record in the mailbox.
+            if slots or (negotiate and version > 1):
+                if not self.validateMailbox(newMailbox, host):
+                    # Cleaning invalid mbx in incoming mail, so its messages
+                    # are checked again on the next read.
+                    self._incomingMail[mailboxStart:mailboxEnd] = \
+                        EMPTYMAILBOX
+                    continue
+                self.log.debug("SPM_MailMonitor: Mailbox %s validated, "
+                               "checking mail", host)
 
-            isMailboxValidated = False
-
-            for i in range(0, MESSAGES_PER_MAILBOX):
+            if negotiate:
+                self._negotiate(host, version)
 
+            for i in slots:
                 msgId = host * SLOTS_PER_MAILBOX + i
-                msgStart = msgId * MESSAGE_SIZE
-
-                # First byte of message is message version.
-                # A null byte indicates an empty message to be skipped.
-                if newMail[msgStart:msgStart + 1] == b"\0":
-                    continue
-
-                # Most mailboxes are probably empty so it costs less to check
-                # that all messages start with 0 than to validate the mailbox,
-                # therefor this is done after we find a non empty message in
-                # mailbox
-                if not isMailboxValidated:
-                    if not self.validateMailbox(
-                            newMail[mailboxStart:mailboxStart + MAILBOX_SIZE],
-                            host):
-                        # Cleaning invalid mbx in newMail
-                        newMail = newMail[:mailboxStart] + EMPTYMAILBOX + \
-                            newMail[mailboxStart + MAILBOX_SIZE:]
-                        break
-                    self.log.debug("SPM_MailMonitor: Mailbox %s validated, "
-                                   "checking mail", host)
-                    isMailboxValidated = True
+                msgStart = i * MESSAGE_SIZE
+                newMsg = newMailbox[msgStart:msgStart + MESSAGE_SIZE]
 
-                newMsg = newMail[msgStart:msgStart + MESSAGE_SIZE]
-                msgOffset = msgId * MESSAGE_SIZE
                 if newMsg == CLEAN_MESSAGE:
+                    msgOffset = msgId * MESSAGE_SIZE
                     # Should probably put a setter on outgoingMail which would
                     # take the lock
                     with self._outLock:
-                        self._outgoingMail = \
-                            self._outgoingMail[0:msgOffset] + CLEAN_MESSAGE + \
-                            self._outgoingMail[msgOffset + MESSAGE_SIZE:
-                                               self._outMailLen]
+                        self._outgoingMail[
+                            msgOffset:msgOffset + MESSAGE_SIZE] = CLEAN_MESSAGE
                     send = True
                     continue
 
-                # Message isn't empty, check if its new
-                isMessageNew = False
-                for j in range(msgStart, msgStart + MESSAGE_SIZE):
-                    if newMail[j] != self._incomingMail[j]:
-                        isMessageNew = True
-                        break
-
-                # If search exhausted, i.e. message hasn't changed since last
-                # read, it can be skipped
-                if not isMessageNew:
-                    continue
-
                 # We only get here if there is a novel request
                 try:
-                    msgType = newMail[msgStart + 1:msgStart + 5]
+                    msgType = newMsg[1:5]
                     if msgType in self._messageTypes:
                         # Use message class to process request according to
                         # message specific logic
                         id = str(uuid.uuid4())
                         self.log.debug("SPM_MailMonitor: processing request: "
-                                       "%s" % repr(newMail[
-                                           msgStart:msgStart + MESSAGE_SIZE]))
+                                       "%s" % repr(newMsg))
                         res = self.tp.queueTask(
                             id, runTask, (self._messageTypes[msgType], msgId,
-                                          newMail[msgStart:
-                                                  msgStart + MESSAGE_SIZE])
+                                          newMsg)
                         )
                         if not res:
                             raise Exception()
@@ -752,65 +1129,132 @@ class SPM_MailMonitor:
                 except RuntimeError as e:
                     self.log.error("SPM_MailMonitor: exception: %s caught "
                                    "while handling message: %s", str(e),
-                                   newMail[msgStart:msgStart + MESSAGE_SIZE])
+                                   newMsg)
                 except:
                     self.log.error("SPM_MailMonitor: exception caught while "
-                                   "handling message: %s",
-                                   newMail[msgStart:msgStart + MESSAGE_SIZE],
+                                   "handling message: %s", newMsg,
                                    exc_info=True)
 
-        self._incomingMail = newMail
+            self._incomingMail[mailboxStart:mailboxEnd] = newMailbox
+
         return send
 
+    def _negotiate(self, host, version):
+        """
+        Reply with the protocol version we will handle to a host that wrote a
+        new version record.
+        """
+        self._hostVersions[host] = version
+        version = min(version, self._maxVersion)
+        self.log.info("SPM_MailMonitor: host %s uses protocol version %d",
+                      host, version)
+        if version >= 2:
+            record = version_record(version)
+        else:
+            record = b"\0" * len(version_record(1))
+        offset = host * MAILBOX_SIZE + VERSION_OFFSET
+        with self._outLock:
+            self._outgoingMail[offset:offset + len(record)] = record
+            self._dirty.add(host)
+
+    def _changedMailboxes(self, newMail):
+        """
+        Return the indexes of the mailboxes in newMail that differ from the
+        incoming mail read in the last check.
+
+        Comparing bytes is done by memcmp, so we compare large ranges first,
+        and compare single mailboxes only in the ranges that changed.
+        """
+        changed = []
+        for first in range(0, self._numHosts, _MAILBOXES_PER_RANGE):
+            last = min(first + _MAILBOXES_PER_RANGE, self._numHosts)
+            start = first * MAILBOX_SIZE
+            end = last * MAILBOX_SIZE
+            if newMail[start:end] == self._incomingMail[start:end]:
+                continue
+            for host in range(first, last):
+                start = host * MAILBOX_SIZE
+                end = start + MAILBOX_SIZE
+                if newMail[start:end] != self._incomingMail[start:end]:
+                    changed.append(host)
+        return changed
+
     def _checkForMail(self):
         # Lock is acquired in order to make sure that
         # incomingMail is not changed during checkForMail
         with self._inLock:
-            # self.log.debug("SPM_MailMonitor -_checking for mail")
-            cmd = self._inCmd + ['bs=' + str(self._outMailLen)]
-            # self.log.debug("SPM_MailMonitor - reading incoming mail, "
-            #               "command: " + str(cmd))
-            (rc, in_mail, err) = _mboxExecCmd(cmd, raw=True)
-            if rc:
-                raise IOError(errno.EIO, "_handleRequests._checkForMail - "
-                              "Could not read mailbox: %s" % self._inbox)
-
-            if (len(in_mail) != (self._outMailLen)):
-                self.log.error('SPM_MailMonitor: _checkForMail - dd succeeded '
-                               'but read %d bytes instead of %d, cannot check '
-                               'mail.  Read mail contains: %s', len(in_mail),
-                               self._outMailLen, repr(in_mail[:80]))
+            start = time.monotonic()
+
+            nread = self._inFile.preadv(0, [self._inBuf])
+            self._stats.record("read", time.monotonic() - start)
+            if nread != self._outMailLen:
+                self.log.error('SPM_MailMonitor: _checkForMail - read %d '
+                               'bytes instead of %d, cannot check mail.',
+                               nread, self._outMailLen)
                 raise RuntimeError("_handleRequests._checkForMail - Could not "
                                    "read mailbox")
-            # self.log.debug("Parsing inbox content: %s", in_mail)
-            if self._handleRequests(in_mail):
+
+            # self.log.debug("Parsing inbox content: %s", self._inBuf)
+            if self._handleRequests(self._inBuf):
                 with self._outLock:
-                    cmd = self._outCmd + ['bs=' + str(self._outMailLen)]
-                    (rc, out, err) = _mboxExecCmd(cmd,
-                                                  data=self._outgoingMail)
-                    if rc:
-                        self.log.warning("SPM_MailMonitor couldn't write "
-                                         "outgoing mail, dd failed")
+                    self._dirty.update(range(self._numHosts))
+
+            # Write cleared messages, and retry replies that failed to write
+            # during the last cycle.
+            if self._dirty:
+                try:
+                    self._flushOutgoingMail()
+                except EnvironmentError as e:
+                    self.log.warning("SPM_MailMonitor couldn't write "
+                                     "outgoing mail: %s", e)
+
+            self._stats.record("cycle", time.monotonic() - start)
 
     def sendReply(self, msgID, msg):
         # Lock is acquired in order to make sure that
         # outgoingMail is not changed while used
         with self._outLock:
             msgOffset = msgID * MESSAGE_SIZE
-            self._outgoingMail = \
-                self._outgoingMail[0:msgOffset] + msg.payload + \
-                self._outgoingMail[msgOffset + MESSAGE_SIZE:self._outMailLen]
-            mailboxOffset = (msgID // SLOTS_PER_MAILBOX) * MAILBOX_SIZE
-            mailbox = self._outgoingMail[mailboxOffset:
-                                         mailboxOffset + MAILBOX_SIZE]
-            cmd = self._outCmd + ['bs=' + str(MAILBOX_SIZE),
-                                  'seek=' + str(mailboxOffset // MAILBOX_SIZE)]
-            # self.log.debug("Running command: %s, for message id: %s",
-            #               str(cmd), str(msgID))
-            (rc, out, err) = _mboxExecCmd(cmd, data=mailbox)
-            if rc:
-                self.log.error("SPM_MailMonitor: sendReply - couldn't send "
-                               "reply, dd failed")
+            self._outgoingMail[msgOffset:msgOffset + MESSAGE_SIZE] = \
+                msg.payload
+            self._dirty.add(msgID // SLOTS_PER_MAILBOX)
+        try:
+            self._flushOutgoingMail()
+        except EnvironmentError as e:
+            self.log.error("SPM_MailMonitor: sendReply - couldn't send "
+                           "reply: %s", e)
+
+    def _flushOutgoingMail(self):
+        """
+        Write all mailboxes modified since the last flush in one vectored
+        write.
+
+        Replies sent concurrently by several threads are written together:
+        while one thread is writing, the others update the outgoing mail and
+        wait for the flush lock. The first of them writes all pending
+        replies, and the rest find nothing left to write.
+        """
+        with self._flushLock:
+            with self._outLock:
+                if not self._dirty:
+                    return
+                hosts = sorted(self._dirty)
+                self._dirty.clear()
+                start = hosts[0] * MAILBOX_SIZE
+                end = (hosts[-1] + 1) * MAILBOX_SIZE
+                self._outBuf[start:end] = self._outgoingMail[start:end]
+
+            started = time.monotonic()
+            try:
+                with memoryview(self._outBuf) as view:
+                    self._outFile.pwritev(start, [view[start:end]])
+            except:
+                # Write these mailboxes again on the next flush.
+                with self._outLock:
+                    self._dirty.update(hosts)
+                raise
+            self._stats.record("write", time.monotonic() - started)
+            self._stats.count("mailboxes", len(hosts))
 
     def _run(self):
         try:
@@ -823,8 +1267,16 @@ class SPM_MailMonitor:
         finally:
             self._stopped = True
             self.tp.joinAll()
+            self._close()
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
-                          "stopped")
+                          "stopped (stats: %s)", self._stats.info())
+
+    def _close(self):
+        self._inFile.close()
+        self._outFile.close()
+        self._inBuf.close()
+        self._outBuf.close()
+        self._eventBuf.close()
 
     # Events.
 
@@ -874,28 +1326,155 @@ class SPM_MailMonitor:
         """
         Read event from host 0 mailbox.
         """
-        # Even if we got a short read, it will be at least 512 bytes, so
-        # we don't need iflag=fullblock.
-        cmd = [
-            constants.EXT_DD,
-            'if=' + str(self._inbox),
-            'iflag=direct',
-            'count=1',
-            'bs=' + str(MAILBOX_SIZE),
-        ]
-
         # If read fails, we will retry on the next check. In the worst
         # case we will check the entire mailbox after one monitor
         # interval.
-        rc, out, err = _mboxExecCmd(cmd, raw=True)
-        if rc != 0:
-            raise ReadEventError(err.decode())
+        start = time.monotonic()
+        try:
+            nread = self._inFile.preadv(0, [self._eventBuf])
+        except EnvironmentError as e:
+            raise ReadEventError(str(e))
+        self._stats.record("event", time.monotonic() - start)
 
         # Should never happen, we will retry on the next check.
-        if len(out) < 24:
-            raise ReadEventError(f"Short read: {len(out)} < 24")
+        if nread < 24:
+            raise ReadEventError(f"Short read: {nread} < 24")
+
+        return uuid.UUID(bytes=self._eventBuf[4:20])
+
+
+class MailboxFile(object):
+    """
+    Mailbox file performing vectored direct I/O to/from mmap objects,
+    keeping the file open between calls.
+    """
+
+    def __init__(self, path, mode="r"):
+        flags = os.O_DIRECT
+        flags |= os.O_RDWR if "+" in mode else os.O_RDONLY
+        self._path = path
+        self._fd = os.open(path, flags)
+
+    @property
+    def name(self):
+        return self._path
+
+    def preadv(self, offset, bufs):
+        """
+        Read from storage at offset into mmap bufs.
+
+        Returns:
+            The number bytes read (int).
+        """
+        views = [memoryview(buf) for buf in bufs]
+        size = sum(len(view) for view in views)
+        pos = 0
+        while pos < size:
+            nread = uninterruptible(
+                os.preadv, self._fd, _skip(views, pos), offset + pos)
+            if nread == 0:
+                break  # EOF
+            pos += nread
+        return pos
+
+    def pwritev(self, offset, bufs):
+        """
+        Write mmap bufs to storage at offset.
+        """
+        views = [memoryview(buf) for buf in bufs]
+        size = sum(len(view) for view in views)
+        pos = 0
+        while pos < size:
+            pos += uninterruptible(
+                os.pwritev, self._fd, _skip(views, pos), offset + pos)
+
+    def close(self):
+        if self._fd != -1:
+            fd, self._fd = self._fd, -1
+            os.close(fd)
+
+
+def _skip(views, n):
+    """
+    Return the part of views after the first n bytes.
+    """
+    for i, view in enumerate(views):
+        if n < len(view):
+            return [view[n:]] + views[i + 1:]
+        n -= len(view)
+    return []
+
+
+class MailboxStats(object):
+    """
+    Latency counters for mailbox I/O and monitor cycles.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+
+    def info(self):
+        with self._lock:
+            info = {}
+            for name, (count, total, worst, last) in self._timers.items():
+                info[name] = {
+                    "count": count,
+                    "average": total / count,
+                    "worst": worst,
+                    "last": last,
+                }
+            info.update(self._counters)
+            return info
+
+    def clear(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def record(self, name, elapsed):
+        with self._lock:
+            count, total, worst, _ = self._timers.get(name, (0, 0.0, 0.0, 0))
+            self._timers[name] = (
+                count + 1, total + elapsed, max(worst, elapsed), elapsed)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+
+def changed_slots(new, old):
+    """
+    Return the indexes of the message slots in mailbox new that are not
+    empty and differ from the same slot in mailbox old.
+    """
+    slots = []
+    for i in range(MESSAGES_PER_MAILBOX):
+        start = i * MESSAGE_SIZE
+        end = start + MESSAGE_SIZE
+        # First byte of message is message version.
+        # A null byte indicates an empty message to be skipped.
+        if new[start] == 0:
+            continue
+        if new[start:end] != old[start:end]:
+            slots.append(i)
+    return slots
+
+
+def read_version(mailbox):
+    """
+    Return the protocol version in the reserved slot of mailbox, or 1 if the
+    mailbox has no version record.
+    """
+    end = VERSION_OFFSET + len(VERSION_CODE)
+    if mailbox[VERSION_OFFSET:end] != VERSION_CODE:
+        return 1
+    return max(mailbox[end], 1)
+
 
-        return uuid.UUID(bytes=bytes(out[4:20]))
+def version_record(version):
+    return VERSION_CODE + bytes([version])
 
 
 def wait_timeout(monitor_interval):
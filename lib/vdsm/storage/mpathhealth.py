@@ -21,6 +21,7 @@ from __future__ import absolute_import
 
 import logging
 import threading
+import time
 
 import six
 
@@ -29,6 +30,10 @@ from vdsm.storage import devicemapper
 
 log = logging.getLogger("storage.mpathhealth")
 
+# Query all maps at least every REFRESH_INTERVAL seconds, in case an event
+# was missed.
+REFRESH_INTERVAL = 300
+
 
 class MultipathStatus(object):
 
@@ -44,13 +49,28 @@ class MultipathStatus(object):
 
 
 class Monitor(object):
+    """
+    Monitor multipath maps health.
+
+    Every event_interval seconds, the monitor checks the multipath maps
+    events, and queries the maps status only if a map was added, removed, or
+    reported an event. Querying the status requires running dmsetup via
+    supervdsm, while checking the events is cheap, so we can detect failed
+    paths quickly without loading the host.
+
+    If events are not available, the maps status is queried every interval
+    seconds.
+    """
 
-    def __init__(self, interval=10):
+    def __init__(self, interval=10, event_interval=1.0):
         self._lock = threading.Lock()
         self._status = {}
         self._thread = None
         self._done = threading.Event()
         self._interval = interval
+        self._event_interval = min(interval, event_interval)
+        self._events = None
+        self._last_update = None
         self._thread = concurrent.thread(self._run,
                                          name="mpathhealth",
                                          log=log)
@@ -98,7 +118,7 @@ class Monitor(object):
                 log.exception("multipath health update failed")
             finally:
                 self.callback()
-            if self._done.wait(self._interval):
+            if self._done.wait(self._event_interval):
                 break
         log.debug("multipath health monitoring has stopped")
 
@@ -107,6 +127,13 @@ class Monitor(object):
         Implementation of the multipath health monitor thread.
         The status of the mpath devices is queried here.
         """
+        # Must check the events before querying the status, so an event
+        # reported during the query is handled in the next cycle.
+        events = devicemapper.multipath_events()
+        now = time.monotonic()
+        if not self._needs_update(events, now):
+            return
+
         status = {}
         for guid, paths in devicemapper.multipath_status().items():
             failed_paths = [p.name for p in paths if p.status == "F"]
@@ -127,6 +154,27 @@ class Monitor(object):
         # so we update the report status dictionary only when we are done.
         with self._lock:
             self._status = status
+        self._events = events
+        self._last_update = now
+
+    def _needs_update(self, events, now):
+        if self._last_update is None:
+            return True
+
+        elapsed = now - self._last_update
+        if elapsed >= REFRESH_INTERVAL:
+            return True
+
+        if events is None:
+            # Events not available, poll every interval.
+            return elapsed >= self._interval
+
+        if events != self._events:
+            # Map added, removed, or reported an event.
+            return True
+
+        # Maps without events are polled every interval.
+        return None in events.values() and elapsed >= self._interval
 
 
 def _NULL_CALLBACK():
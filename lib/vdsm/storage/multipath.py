@@ -28,6 +28,7 @@ import errno
 from glob import glob
 import logging
 import re
+import threading
 import time
 
 from collections import namedtuple
@@ -36,6 +37,7 @@ from contextlib import closing
 from vdsm import utils
 from vdsm.common import cmdutils
 from vdsm.common import commands
+from vdsm.common import concurrent
 from vdsm.common import supervdsm
 from vdsm.common import udevadm
 from vdsm.common.compat import subprocess
@@ -50,6 +52,10 @@ DEV_FCP = "FCP"
 DEV_MIXED = "MIXED"
 SYS_BLOCK = "/sys/block"
 QUEUE = "queue"
+UDEV_DATA = "/run/udev/data"
+
+# Number of threads reading paths attributes in pathListIter().
+DISCOVERY_WORKERS = 8
 
 TOXIC_CHARS = '()*+?|^$.\\'
 
@@ -346,49 +352,260 @@ def get_scsi_serial(physdev):
 HBTL = namedtuple("HBTL", "host bus target lun")
 
 
-def getVendor(physDev):
-    with open(SYS_BLOCK + "/%s/device/vendor" % physDev, "r") as f:
-        return f.read().strip()
+def getHBTL(physdev):
+    hbtl = os.listdir(SYS_BLOCK + "/%s/device/scsi_disk/" % physdev)
+    if len(hbtl) > 1:
+        log.warn("Found more the 1 HBTL, this shouldn't happen")
 
+    return HBTL(*hbtl[0].split(":"))
 
-def getModel(physDev):
-    with open(SYS_BLOCK + "/%s/device/model" % physDev, "r") as f:
-        return f.read().strip()
 
+# Characters allowed in SCSI serial, based on udev util_replace_chars().
+_SERIAL_INVALID_CHARS = re.compile(
+    "[^0-9A-Za-z#+\\-.:=@_\u0080-\ud7ff\ue000-\U0010ffff]")
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Static attributes of a SCSI device, never modified while the device
+# exists.
+DeviceInfo = namedtuple(
+    "DeviceInfo",
+    "vendor, model, fwrev, logical_block_size, physical_block_size, lun, "
+    "serial, iscsi_session")
+
+PathInfo = namedtuple("PathInfo", "device, capacity")
+
+
+class DeviceCache(object):
+    """
+    Cache static attributes of SCSI devices.
+
+    Devices are keyed by their device number (dev_t). An entry is valid as
+    long as the device udev database file was not modified; udev replaces
+    the file on every add or change event, so a removed and re-added device
+    with the same device number, or a changed device, is read again.
+
+    Devices without udev database are not cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def get(self, physdev):
+        """
+        Return DeviceInfo for physdev, reading the device attributes only if
+        the device is not cached, or the device was changed.
+        """
+        devt, udev_key = _device_key(physdev)
+        if udev_key is None:
+            return _read_device_info(physdev)
+
+        with self._lock:
+            cached = self._devices.get(devt)
+        if cached is not None and cached[0] == udev_key:
+            return cached[1]
+
+        info = _read_device_info(physdev)
+        with self._lock:
+            self._devices[devt] = (udev_key, info)
+        return info
+
+    def prune(self, physdevs):
+        """
+        Drop cached devices not in physdevs.
+        """
+        keep = set()
+        for physdev in physdevs:
+            try:
+                keep.add(_read_devt(physdev))
+            except EnvironmentError:
+                continue
+        with self._lock:
+            for devt in list(self._devices):
+                if devt not in keep:
+                    del self._devices[devt]
 
-def getFwRev(physDev):
-    with open(SYS_BLOCK + "/%s/device/rev" % physDev, "r") as f:
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+
+_device_cache = DeviceCache()
+
+
+def _read_devt(physdev):
+    with open(os.path.join(SYS_BLOCK, physdev, "dev"), "r") as f:
         return f.read().strip()
 
 
-def getHBTL(physdev):
-    hbtl = os.listdir(SYS_BLOCK + "/%s/device/scsi_disk/" % physdev)
-    if len(hbtl) > 1:
-        log.warn("Found more the 1 HBTL, this shouldn't happen")
+def _device_key(physdev):
+    """
+    Return device number and udev database key for physdev. The udev key is
+    None if the device has no udev database.
+    """
+    try:
+        devt = _read_devt(physdev)
+    except EnvironmentError:
+        return None, None
+    try:
+        st = os.stat(os.path.join(UDEV_DATA, "b" + devt))
+    except EnvironmentError:
+        return devt, None
+    return devt, (st.st_ino, st.st_mtime_ns)
 
-    return HBTL(*hbtl[0].split(":"))
+
+def _read_device_info(physdev):
+    """
+    Read static attributes of physdev from sysfs.
+
+    Errors reading optional attributes are logged, and the attribute is set
+    to None.
+    """
+    device = os.path.join(SYS_BLOCK, physdev, "device")
+
+    vendor = _read_attr(os.path.join(device, "vendor"), physdev, "vendor")
+    model = _read_attr(os.path.join(device, "model"), physdev, "model name")
+    fwrev = _read_attr(os.path.join(device, "rev"), physdev, "fwrev")
+
+    try:
+        logical, physical = getDeviceBlockSizes(physdev)
+    except Exception:
+        log.warn("Problem getting blocksize from device `%s`",
+                 physdev, exc_info=True)
+        logical = physical = None
+
+    try:
+        lun = getHBTL(physdev).lun
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            log.error("Error: %s while trying to get hbtl of device: "
+                      "%s", e, physdev)
+            raise
+        log.warn("Device has no hbtl: %s", physdev)
+        lun = 0
+
+    serial = None
+    if vendor is not None and model is not None:
+        try:
+            with open(os.path.join(device, "vpd_pg80"), "rb") as f:
+                page = f.read()
+        except EnvironmentError as e:
+            # Older kernels, or device not supporting page 0x80.
+            if e.errno != errno.ENOENT:
+                log.warning("Error reading vpd_pg80 of device %s: %s",
+                            physdev, e)
+        else:
+            serial = format_scsi_serial(vendor, model, page)
+
+    if iscsi.devIsiSCSI(physdev):
+        iscsi_session = iscsi.getiScsiSession(physdev)
+    else:
+        iscsi_session = None
+
+    return DeviceInfo(
+        vendor=vendor.strip() if vendor is not None else None,
+        model=model.strip() if model is not None else None,
+        fwrev=fwrev.strip() if fwrev is not None else None,
+        logical_block_size=logical,
+        physical_block_size=physical,
+        lun=lun,
+        serial=serial,
+        iscsi_session=iscsi_session)
+
+
+def _read_attr(path, physdev, what):
+    try:
+        with open(path, "r") as f:
+            return f.read().rstrip("\n")
+    except Exception:
+        log.warn("Problem getting %s from device `%s`",
+                 what, physdev, exc_info=True)
+        return None
+
+
+def format_scsi_serial(vendor, model, page):
+    """
+    Format SCSI serial from the raw vendor and model sysfs attributes, and
+    VPD page 0x80, like "scsi_id --page=0x80 --whitelisted --export
+    --replace-whitespace" reports ID_SERIAL.
+
+    Returns empty string if page is not a valid VPD page 0x80.
+    """
+    if len(page) < 4 or page[1] != 0x80:
+        return ""
+    length = page[3]
+    unit_serial = page[4:4 + length].split(b"\0", 1)[0]
+    unit_serial = unit_serial.decode("utf-8", errors="surrogateescape")
+
+    # scsi_id prepends "S" and the padded vendor and model.
+    serial = "S" + vendor[:8].ljust(8) + model[:16].ljust(16) + unit_serial
+    serial = _WHITESPACE.sub("_", serial.strip())
+    return _SERIAL_INVALID_CHARS.sub("_", serial)
+
+
+def _read_path(physdev):
+    info = _device_cache.get(physdev)
+    if info.logical_block_size is None:
+        capacity = getDeviceSize(physdev)
+    else:
+        capacity = info.logical_block_size * read_int(
+            os.path.join(SYS_BLOCK, physdev, "size"))
+    return physdev, PathInfo(info, capacity)
+
+
+def _read_paths(physdevs):
+    """
+    Read all paths attributes using a small thread pool, returning dict
+    {physdev: PathInfo}.
+    """
+    paths = {}
+    for res in concurrent.tmap(
+            _read_path, physdevs, max_workers=DISCOVERY_WORKERS,
+            name="mpath/discovery"):
+        if not res.succeeded:
+            raise res.value
+        physdev, path = res.value
+        paths[physdev] = path
+    return paths
 
 
 def pathListIter(filterGuids=()):
     filterLen = len(filterGuids) if filterGuids else -1
-    devsFound = 0
     knownSessions = {}
     pathStatuses = devicemapper.getPathsStatus()
 
+    # Collect all devices and their slaves, so we can read all paths in
+    # one sweep.
+    devices = []
     for dmId, guid in getMPDevsIter():
-        if devsFound == filterLen:
+        if len(devices) == filterLen:
             break
 
         if filterGuids and guid not in filterGuids:
             continue
 
-        devsFound += 1
+        slaves = []
+        for slave in devicemapper.getSlaves(dmId):
+            if not devicemapper.isBlockDevice(slave):
+                log.warning("No such physdev '%s' is ignored" % slave)
+                continue
+            slaves.append(slave)
+
+        devices.append((dmId, guid, slaves))
 
+    allSlaves = [slave for _, _, slaves in devices for slave in slaves]
+    paths = _read_paths(allSlaves)
+
+    if not filterGuids:
+        _device_cache.prune(allSlaves)
+
+    for dmId, guid, slaves in devices:
         devInfo = {
             "guid": guid,
             "dm": dmId,
             "capacity": str(getDeviceSize(dmId)),
-            "serial": get_scsi_serial(dmId),
+            "serial": "",
             "paths": [],
             "connections": [],
             "devtypes": [],
@@ -401,63 +618,41 @@ def pathListIter(filterGuids=()):
             "discard_max_bytes": getDeviceDiscardMaxBytes(dmId),
         }
 
-        for slave in devicemapper.getSlaves(dmId):
-            if not devicemapper.isBlockDevice(slave):
-                log.warning("No such physdev '%s' is ignored" % slave)
-                continue
+        serial = None
+
+        for slave in slaves:
+            path = paths[slave]
+            dev = path.device
+
+            if not devInfo["vendor"] and dev.vendor:
+                devInfo["vendor"] = dev.vendor
+
+            if not devInfo["product"] and dev.model:
+                devInfo["product"] = dev.model
+
+            if not devInfo["fwrev"] and dev.fwrev:
+                devInfo["fwrev"] = dev.fwrev
 
-            if not devInfo["vendor"]:
-                try:
-                    devInfo["vendor"] = getVendor(slave)
-                except Exception:
-                    log.warn("Problem getting vendor from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["product"]:
-                try:
-                    devInfo["product"] = getModel(slave)
-                except Exception:
-                    log.warn("Problem getting model name from device `%s`",
-                             slave, exc_info=True)
-
-            if not devInfo["fwrev"]:
-                try:
-                    devInfo["fwrev"] = getFwRev(slave)
-                except Exception:
-                    log.warn("Problem getting fwrev from device `%s`",
-                             slave, exc_info=True)
-
-            if (not devInfo["logicalblocksize"] or
-                    not devInfo["physicalblocksize"]):
-                try:
-                    logBlkSize, phyBlkSize = getDeviceBlockSizes(slave)
-                    devInfo["logicalblocksize"] = str(logBlkSize)
-                    devInfo["physicalblocksize"] = str(phyBlkSize)
-                except Exception:
-                    log.warn("Problem getting blocksize from device `%s`",
-                             slave, exc_info=True)
+            if (not devInfo["logicalblocksize"] and
+                    dev.logical_block_size is not None):
+                devInfo["logicalblocksize"] = str(dev.logical_block_size)
+                devInfo["physicalblocksize"] = str(dev.physical_block_size)
+
+            # All paths report the same serial; scsi_id would read it from
+            # the active path.
+            if serial is None:
+                serial = dev.serial
 
             pathInfo = {}
             pathInfo["physdev"] = slave
             pathInfo["state"] = pathStatuses.get(slave, "failed")
-            pathInfo["capacity"] = str(getDeviceSize(slave))
-            try:
-                hbtl = getHBTL(slave)
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    log.warn("Device has no hbtl: %s", slave)
-                    pathInfo["lun"] = 0
-                else:
-                    log.error("Error: %s while trying to get hbtl of device: "
-                              "%s", e, slave)
-                    raise
-            else:
-                pathInfo["lun"] = hbtl.lun
+            pathInfo["capacity"] = str(path.capacity)
+            pathInfo["lun"] = dev.lun
 
-            if iscsi.devIsiSCSI(slave):
+            if dev.iscsi_session is not None:
                 devInfo["devtypes"].append(DEV_ISCSI)
                 pathInfo["type"] = DEV_ISCSI
-                sessionID = iscsi.getiScsiSession(slave)
+                sessionID = dev.iscsi_session
                 if sessionID not in knownSessions:
                     # FIXME: This entire part is for BC. It should be moved to
                     # hsm and not preserved for new APIs. New APIs should keep
@@ -492,6 +687,11 @@ def pathListIter(filterGuids=()):
 
             devInfo["paths"].append(pathInfo)
 
+        # If the kernel does not expose VPD page 0x80, fall back to scsi_id.
+        if serial is None:
+            serial = get_scsi_serial(dmId)
+        devInfo["serial"] = serial
+
         yield devInfo
 
 
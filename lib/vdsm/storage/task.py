@@ -66,6 +66,7 @@ from vdsm.storage import exception as se
 from vdsm.storage import constants as sc
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import resourceManager as rm
+from vdsm.storage import taskjournal
 
 
 KEY_SEPARATOR = "="
@@ -83,6 +84,9 @@ TASK_METADATA_VERSION = 1
 
 ROLLBACK_SENTINEL = "rollback sentinel"
 
+# If True, persist tasks in the tasks journal instead of a task directory.
+USE_JOURNAL = config.getboolean('irs', 'task_journal')
+
 
 def getProcPool():
     return oop.getProcessPool(sc.GLOBAL_OOP)
@@ -520,26 +524,36 @@ class Task:
         self.nrecoveries = 0    # just utility count - used by save/load
         self.njobs = 0          # just utility count - used by save/load
 
+        # Where the task is persisted.
+        self._inDir = False
+        self._inJournal = False
+
         # Used by tests to wait for a task from another thread.
         self._is_done = threading.Event()
 
         self.log = SimpleLogAdapter(self.log, {"Task": self.id})
 
     def __del__(self):
-        def finalize(log, owner, taskDir):
+        def finalize(log, owner, taskDir, journal, taskID):
             log.warn("Task was autocleaned")
             owner.releaseAll()
             if taskDir is not None:
                 getProcPool().fileUtils.cleanupdir(taskDir)
+            if journal is not None:
+                journal.clean(taskID)
 
         if not self.state.isDone():
             taskDir = None
+            journal = None
             if (self.cleanPolicy == TaskCleanType.auto and
                     self.store is not None):
-                taskDir = os.path.join(self.store, self.id)
+                if self._inDir:
+                    taskDir = os.path.join(self.store, self.id)
+                if self._inJournal:
+                    journal = taskjournal.get(self.store)
             t = concurrent.thread(
                 finalize,
-                args=(self.log, self.resOwner, taskDir),
+                args=(self.log, self.resOwner, taskDir, journal, self.id),
                 name="task/" + self.id[:8])
             t.start()
 
@@ -650,30 +664,35 @@ class Task:
     @classmethod
     def _loadMetaFile(cls, filename, obj, fields):
         try:
-            for line in getProcPool().readLines(filename):
-                # process current line
-                line = line.decode('utf-8')
-                if line.find(KEY_SEPARATOR) < 0:
-                    continue
-                parts = line.split(KEY_SEPARATOR)
-                if len(parts) != 2:
-                    cls.log.warning("Task._loadMetaFile: %s - ignoring line"
-                                    " '%s'", filename, line)
-                    continue
-
-                field = _eq_decode(parts[0].strip())
-                value = _eq_decode(parts[1].strip())
-                if field not in fields:
-                    cls.log.warning("Task._loadMetaFile: %s - ignoring field"
-                                    " %s in line '%s'", filename, field, line)
-                    continue
-
-                ftype = fields[field]
-                setattr(obj, field, ftype(value))
+            lines = [line.decode('utf-8')
+                     for line in getProcPool().readLines(filename)]
+            cls._loadLines(filename, lines, obj, fields)
         except Exception:
             cls.log.error("Unexpected error", exc_info=True)
             raise se.TaskMetaDataLoadError(filename)
 
+    @classmethod
+    def _loadLines(cls, filename, lines, obj, fields):
+        for line in lines:
+            # process current line
+            if line.find(KEY_SEPARATOR) < 0:
+                continue
+            parts = line.split(KEY_SEPARATOR)
+            if len(parts) != 2:
+                cls.log.warning("Task._loadMetaFile: %s - ignoring line"
+                                " '%s'", filename, line)
+                continue
+
+            field = _eq_decode(parts[0].strip())
+            value = _eq_decode(parts[1].strip())
+            if field not in fields:
+                cls.log.warning("Task._loadMetaFile: %s - ignoring field"
+                                " %s in line '%s'", filename, field, line)
+                continue
+
+            ftype = fields[field]
+            setattr(obj, field, ftype(value))
+
     @classmethod
     def _dump(cls, obj, fields):
         lines = []
@@ -772,8 +791,74 @@ class Task:
                                             "load", "load", ""))
             self._loadRecoveryMetaFile(taskDir, rn)
             self.recoveries[rn].setOwnerTask(self)
+        self._inDir = True
+
+    def _loadJournal(self, storPath, state):
+        """
+        Load the task from state saved in the tasks journal, in the same way
+        _load() loads the task from the task directory.
+        """
+        self.log.debug("%s: load from journal %s", self, storPath)
+        if self.state != State.init:
+            raise se.TaskMetaDataLoadError("task %s - can't load self: "
+                                           "not in init state" % self)
+        name = os.path.join(storPath, taskjournal.JOURNAL_DIR, self.id)
+        try:
+            oldid = self.id
+            self._loadLines(name, state["task"], self, Task.fields)
+            if self.id != oldid:
+                raise se.TaskMetaDataLoadError(
+                    "task %s: loaded file do not match id (%s != %s)" %
+                    (self, self.id, oldid))
+            if self.state == State.finished:
+                self._loadLines(name, state["result"], self.result,
+                                TaskResult.fields)
+            for jn in range(self.njobs):
+                self.jobs.append(Job("load", None))
+                self._loadLines(name, state["jobs"][jn], self.jobs[jn],
+                                Job.fields)
+                self.jobs[jn].setOwnerTask(self)
+            for rn in range(self.nrecoveries):
+                self.recoveries.append(Recovery("load", "load",
+                                                "load", "load", ""))
+                self._loadLines(name, state["recoveries"][rn],
+                                self.recoveries[rn], Recovery.fields)
+                self.recoveries[rn].setOwnerTask(self)
+        except se.TaskMetaDataLoadError:
+            raise
+        except Exception:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskMetaDataLoadError(name)
+        self._inJournal = True
+
+    def _saveJournal(self, storPath):
+        """
+        Save the task state as a single journal record. Records of
+        concurrent tasks are written together.
+        """
+        self.njobs = len(self.jobs)
+        self.nrecoveries = len(self.recoveries)
+        state = {
+            "task": self._dump(self, Task.fields),
+            "result": None,
+            "jobs": [self._dump(job, Job.fields) for job in self.jobs],
+            "recoveries": [self._dump(rec, Recovery.fields)
+                           for rec in self.recoveries],
+        }
+        if self.state == State.finished:
+            state["result"] = self._dump(self.result, TaskResult.fields)
+        try:
+            taskjournal.get(storPath).save(self.id, state)
+        except Exception as e:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskPersistError("%s persist failed: %s" % (self, e))
+        self._inJournal = True
 
     def _save(self, storPath):
+        if USE_JOURNAL:
+            self._saveJournal(storPath)
+            return
+
         origTaskDir = os.path.join(storPath, self.id)
         if not getProcPool().os.path.exists(origTaskDir):
             raise se.TaskDirError("_save: no such task dir '%s'" % origTaskDir)
@@ -805,10 +890,19 @@ class Task:
         getProcPool().os.rename(taskDir, origTaskDir)
         getProcPool().fileUtils.cleanupdir(origTaskDir + BACKUP_EXT)
         getProcPool().fileUtils.fsyncPath(origTaskDir)
+        self._inDir = True
+
+        # The task directory is more recent than the journal.
+        if self._inJournal:
+            taskjournal.get(storPath).clean(self.id)
+            self._inJournal = False
 
     def _clean(self, storPath):
-        taskDir = os.path.join(storPath, self.id)
-        getProcPool().fileUtils.cleanupdir(taskDir)
+        if self._inDir:
+            taskDir = os.path.join(storPath, self.id)
+            getProcPool().fileUtils.cleanupdir(taskDir)
+        if self._inJournal:
+            taskjournal.get(storPath).clean(self.id)
 
     def _recoverDone(self):
         # protect agains races with stop/abort
@@ -1111,13 +1205,22 @@ class Task:
         self.setCleanPolicy(cleanPolicy)
         if self.persistPolicy != TaskPersistType.none and not self.store:
             raise se.TaskPersistError("no store defined")
-        taskDir = os.path.join(self.store, self.id)
-        try:
-            getProcPool().fileUtils.createdir(taskDir)
-        except Exception as e:
-            self.log.error("Unexpected error", exc_info=True)
-            raise se.TaskPersistError("%s: cannot access/create taskdir"
-                                      " %s: %s" % (self, taskDir, e))
+        if USE_JOURNAL:
+            try:
+                taskjournal.get(self.store)
+            except Exception as e:
+                self.log.error("Unexpected error", exc_info=True)
+                raise se.TaskPersistError("%s: cannot access journal in"
+                                          " %s: %s" % (self, self.store, e))
+        else:
+            taskDir = os.path.join(self.store, self.id)
+            try:
+                getProcPool().fileUtils.createdir(taskDir)
+            except Exception as e:
+                self.log.error("Unexpected error", exc_info=True)
+                raise se.TaskPersistError("%s: cannot access/create taskdir"
+                                          " %s: %s" % (self, taskDir, e))
+            self._inDir = True
         if (self.persistPolicy == TaskPersistType.auto and
                 self.state != State.init):
             self.persist()
@@ -1147,6 +1250,12 @@ class Task:
     @classmethod
     def loadTask(cls, store, taskid):
         t = Task(taskid)
+        # A task in the journal is more recent than the task directory.
+        state = taskjournal.get(store).get(taskid)
+        if state is not None:
+            t._loadJournal(store, state)
+            return t
+
         if getProcPool().os.path.exists(os.path.join(store, taskid)):
             ext = ""
         # TBD: is this the correct order (temp < backup) + should temp
@@ -25,6 +25,7 @@ import threading
 
 from vdsm.config import config
 from vdsm.storage import exception as se
+from vdsm.storage import taskjournal
 from vdsm.storage.task import Task, Job, TaskCleanType
 from vdsm.storage.threadPool import ThreadPool
 
@@ -210,8 +211,12 @@ class TaskManager:
         if not os.path.exists(store):
             self.log.debug("task dump path %s does not exist.", store)
             return
+        # Another host may have modified the journal since we loaded it.
+        journal = taskjournal.load(store)
+        tasksIDs = set(journal.tasks())
         # taskID is the root part of each (root.ext) entry in the dump task dir
-        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store))
+        tasksIDs.update(os.path.splitext(tid)[0] for tid in os.listdir(store)
+                        if tid != taskjournal.JOURNAL_DIR)
         for taskID in tasksIDs:
             self.log.debug("Loading dumped task %s", taskID)
             try:
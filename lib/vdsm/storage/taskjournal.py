@@ -0,0 +1,330 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Journal for persisting SPM tasks.
+
+Persisting a task in a task directory requires many small synchronous writes
+on the master domain; creating a temporary directory, writing a file for the
+task, the result, every job and every recovery, and renaming directories.
+The journal persists the entire task state in a single record, and writes
+records from concurrent tasks together (group commit).
+
+The journal is kept in the JOURNAL_DIR directory in the tasks directory.
+ioprocess cannot append to a file, so every batch of records is appended to
+the journal as a new segment file. Records are checksummed, and a segment is
+applied only if it ends with a commit record, so a partly written segment is
+ignored.
+
+When the journal has MAX_SEGMENTS segments, it is compacted by writing all
+live tasks to a new snapshot segment, and removing the older segments.
+
+Record format:
+
+    <crc32 hex> <json>\\n
+
+Record types:
+
+    {"op": "save", "id": task_id, "state": state}
+    {"op": "clean", "id": task_id}
+    {"op": "snapshot"}
+    {"op": "commit", "records": count}
+
+The snapshot record drops all state from previous segments.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import os
+import threading
+import zlib
+
+from vdsm.storage import constants as sc
+from vdsm.storage import outOfProcess as oop
+
+JOURNAL_DIR = ".journal"
+SEGMENT_EXT = ".seg"
+
+# Compact the journal when it has this number of segments.
+MAX_SEGMENTS = 64
+
+log = logging.getLogger("storage.taskjournal")
+
+_lock = threading.Lock()
+_journals = {}
+
+
+class CorruptedRecord(Exception):
+    """
+    Raised when a record checksum does not match.
+    """
+
+
+def get(store):
+    """
+    Return the journal for store, loading it if needed.
+    """
+    with _lock:
+        journal = _journals.get(store)
+        if journal is None:
+            journal = Journal(store)
+            _journals[store] = journal
+        return journal
+
+
+def load(store):
+    """
+    Load the journal for store from storage, replacing the cached journal.
+    Must be called when starting the SPM, since another host may have
+    modified the journal.
+    """
+    journal = Journal(store)
+    with _lock:
+        _journals[store] = journal
+    return journal
+
+
+def _oop():
+    return oop.getProcessPool(sc.GLOBAL_OOP)
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.records = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class Journal(object):
+
+    def __init__(self, store, max_segments=MAX_SEGMENTS):
+        self._dir = os.path.join(store, JOURNAL_DIR)
+        self._max_segments = max_segments
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._segments = []
+        self._created = False
+        self._batch = _Batch()
+        self._writing = False
+        self._load()
+
+    @property
+    def path(self):
+        return self._dir
+
+    def tasks(self):
+        """
+        Return the ids of the tasks in the journal.
+        """
+        with self._lock:
+            return list(self._tasks)
+
+    def get(self, task_id):
+        """
+        Return task state, or None if the task is not in the journal.
+        """
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def save(self, task_id, state):
+        """
+        Save task state, returning when the state was written to storage.
+        """
+        self._append({"op": "save", "id": task_id, "state": state})
+
+    def clean(self, task_id):
+        """
+        Remove task from the journal, returning when the change was written
+        to storage.
+        """
+        self._append({"op": "clean", "id": task_id})
+
+    # Group commit
+
+    def _append(self, record):
+        """
+        Add record to the current batch. If no other thread is writing,
+        become the writer, writing batches until no records are pending.
+        Otherwise wait until the writer commits our batch.
+        """
+        with self._lock:
+            batch = self._batch
+            batch.records.append(record)
+            if self._writing:
+                writer = False
+            else:
+                self._writing = True
+                writer = True
+
+        if not writer:
+            batch.done.wait()
+            if batch.error:
+                raise batch.error
+            return
+
+        while True:
+            with self._lock:
+                pending = self._batch
+                if not pending.records:
+                    self._writing = False
+                    break
+                self._batch = _Batch()
+            self._commit(pending)
+
+        if batch.error:
+            raise batch.error
+
+    def _commit(self, batch):
+        log.debug("Writing %d records to %s", len(batch.records), self._dir)
+        try:
+            self._write_segment(batch.records)
+        except Exception as e:
+            log.exception("Error writing journal %s", self._dir)
+            batch.error = e
+        else:
+            with self._lock:
+                for record in batch.records:
+                    self._apply(record)
+            try:
+                if len(self._segments) >= self._max_segments:
+                    self._compact()
+            except Exception:
+                # The journal is valid, we will try again later.
+                log.exception("Error compacting journal %s", self._dir)
+        finally:
+            batch.done.set()
+
+    def _compact(self):
+        with self._lock:
+            records = [{"op": "snapshot"}]
+            for task_id, state in self._tasks.items():
+                records.append({"op": "save", "id": task_id, "state": state})
+
+        old_segments = self._segments[:]
+        self._write_segment(records)
+        log.info("Compacted journal %s (tasks=%d, segments=%d)",
+                 self._dir, len(records) - 1, len(old_segments))
+
+        proc = _oop()
+        for seq in old_segments:
+            proc.utils.rmFile(self._segment_path(seq))
+            self._segments.remove(seq)
+
+    # Storage
+
+    def _write_segment(self, records):
+        proc = _oop()
+        if not self._created:
+            proc.fileUtils.createdir(self._dir)
+            self._created = True
+
+        seq = self._segments[-1] + 1 if self._segments else 1
+        path = self._segment_path(seq)
+        records = records + [{"op": "commit", "records": len(records)}]
+        data = b"".join(_encode(r) for r in records)
+
+        proc.writeFile(path, data)
+        proc.fileUtils.fsyncPath(path)
+        proc.fileUtils.fsyncPath(self._dir)
+        self._segments.append(seq)
+
+    def _segment_path(self, seq):
+        return os.path.join(self._dir, "%016d%s" % (seq, SEGMENT_EXT))
+
+    def _load(self):
+        proc = _oop()
+        if not proc.os.path.isdir(self._dir):
+            return
+
+        self._created = True
+        paths = proc.glob.glob(os.path.join(self._dir, "*" + SEGMENT_EXT))
+        segments = []
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                segments.append(int(name[:-len(SEGMENT_EXT)]))
+            except ValueError:
+                log.warning("Ignoring invalid segment %s", path)
+        segments.sort()
+
+        for seq in segments:
+            path = self._segment_path(seq)
+            records = self._read_segment(path)
+            if records is None:
+                continue
+            for record in records:
+                self._apply(record)
+
+        self._segments = segments
+        log.info("Loaded journal %s (tasks=%d, segments=%d)",
+                 self._dir, len(self._tasks), len(segments))
+
+    def _read_segment(self, path):
+        """
+        Return the records in segment path, or None if the segment was not
+        committed.
+        """
+        data = _oop().readFile(path)
+        records = []
+        for line in data.splitlines():
+            try:
+                record = _decode(line)
+            except (CorruptedRecord, ValueError) as e:
+                log.warning("Ignoring uncommitted segment %s: %s", path, e)
+                return None
+            if record["op"] == "commit":
+                if record["records"] != len(records):
+                    log.warning("Ignoring uncommitted segment %s: expected "
+                                "%d records, found %d",
+                                path, record["records"], len(records))
+                    return None
+                return records
+            records.append(record)
+
+        log.warning("Ignoring uncommitted segment %s: no commit record",
+                    path)
+        return None
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "save":
+            self._tasks[record["id"]] = record["state"]
+        elif op == "clean":
+            self._tasks.pop(record["id"], None)
+        elif op == "snapshot":
+            self._tasks.clear()
+        else:
+            log.warning("Ignoring unknown record %s", record)
+
+
+def _encode(record):
+    data = json.dumps(record, sort_keys=True).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+
+def _decode(line):
+    checksum, data = line.split(b" ", 1)
+    if int(checksum, 16) != zlib.crc32(data):
+        raise CorruptedRecord("Checksum mismatch: %r" % line)
+    return json.loads(data.decode("utf-8"))
@@ -0,0 +1,320 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Walk file storage domain images directory in a helper process.
+
+Globbing the images directory with oop returns only the volume metadata
+paths; learning more about the volumes, such as the link count or the
+metadata, requires an ioprocess call per volume. ioprocess does not provide
+a bulk walk operation, so the walk runs in a long running helper process,
+like ioprocess, so it cannot block vdsm on non-responsive storage. The
+helper walks the images directory using os.scandir(), and returns
+everything in one round-trip.
+
+The helper is started when needed, and exits when it is idle. If a walk
+times out, the helper is killed and a new helper is started for the next
+walk.
+
+To avoid reading unmodified image directories, the caller can pass the
+modification time and volumes of the image directories it already knows.
+The helper reads only image directories that were modified, but stats all
+volumes, since adding a link to a volume does not modify the directory of
+the image owning the volume.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import errno
+import json
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+from vdsm.common import cmdutils
+from vdsm.common import commands
+from vdsm.common.compat import subprocess
+
+META_EXT = ".meta"
+
+# A directory modified again within this interval may not have a new
+# modification time, so we do not report modification time of recently
+# modified directories.
+MTIME_RESOLUTION = 1.0
+
+log = logging.getLogger("storage.volumewalk")
+
+
+class Walker(object):
+    """
+    Walk images directories using a helper process.
+
+    Arguments:
+        name (str): Name used in logs, e.g. the storage domain UUID.
+        timeout (int): Time to wait for a walk.
+        idle_time (int): The helper exits if no walk was requested in this
+            time.
+    """
+
+    def __init__(self, name, timeout=60, idle_time=60):
+        self._name = name
+        self._timeout = timeout
+        self._idle_time = idle_time
+        self._lock = threading.Lock()
+        self._proc = None
+
+    def walk(self, images_dir, known=None, metadata=False):
+        """
+        Walk images_dir.
+
+        Arguments:
+            images_dir (str): Storage domain images directory.
+            known (dict): Image directories known by the caller
+                {imgUUID: [mtime, [volUUID, ...]]}. Image directories with
+                the same modification time are not read again.
+            metadata (bool): If True, read all the volumes metadata. Ignores
+                known, since modifying the metadata does not modify the image
+                directory.
+
+        Returns:
+            dict {imgUUID: image} where image is dict with "mtime" and
+            "volumes" keys. "mtime" is the image directory modification
+            time, or None if the directory was modified recently. "volumes"
+            is dict {volUUID: volume}, where volume is dict with "nlink" key,
+            and "metadata" key if metadata was read.
+
+        Raises:
+            OSError with ETIMEDOUT if the walk did not finish in timeout.
+            OSError if walking images_dir failed.
+            cmdutils.Error if the helper failed.
+        """
+        request = {
+            "images_dir": images_dir,
+            "known": {} if metadata else (known or {}),
+            "metadata": metadata,
+        }
+        line = json.dumps(request).encode("utf-8") + b"\n"
+
+        with self._lock:
+            # The helper may exit because it was idle just when we send the
+            # request; in this case we retry once with a new helper.
+            for attempt in (1, 2):
+                if self._proc is None:
+                    self._start()
+                try:
+                    response = self._communicate(line)
+                except _Exited:
+                    if attempt == 2:
+                        raise
+                    continue
+                break
+
+        if "error" in response:
+            code, message = response["error"]
+            raise OSError(code, message)
+
+        return response["images"]
+
+    def close(self):
+        """
+        Terminate the helper process.
+        """
+        with self._lock:
+            if self._proc is not None:
+                self._kill()
+
+    def _start(self):
+        self._cmd = [sys.executable, "-m", __name__, str(self._idle_time)]
+        log.debug("Starting volume walker %s", self._name)
+        self._proc = commands.start(
+            self._cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+
+    def _communicate(self, line):
+        try:
+            self._proc.stdin.write(line)
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            self._exited()
+
+        deadline = time.monotonic() + self._timeout
+        fd = self._proc.stdout.fileno()
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        chunks = []
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not poller.poll(remaining * 1000):
+                # The helper may be blocked on storage and may not
+                # terminate; don't block the caller waiting for it.
+                self._kill()
+                raise OSError(
+                    errno.ETIMEDOUT,
+                    "Timeout walking images of {}".format(self._name))
+            data = os.read(fd, 1024 * 1024)
+            if not data:
+                self._exited()
+            chunks.append(data)
+            if data.endswith(b"\n"):
+                return json.loads(b"".join(chunks))
+
+    def _exited(self):
+        proc = self._proc
+        self._proc = None
+        rc = proc.wait()
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            # The request was not sent.
+            pass
+        proc.stdout.close()
+        if rc == 0:
+            log.debug("Volume walker %s exited", self._name)
+            raise _Exited
+        raise cmdutils.Error(self._cmd, rc, b"", b"")
+
+    def _kill(self):
+        proc = self._proc
+        self._proc = None
+        proc.kill()
+        commands.wait_async(proc)
+
+
+class _Exited(Exception):
+    """
+    Raised when the helper process exited after it was idle.
+    """
+
+
+# Helper process.
+
+
+def main():
+    idle_time = float(sys.argv[1])
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    poller = select.poll()
+    poller.register(stdin.fileno(), select.POLLIN)
+
+    # The caller sends the next request only after reading the response, so
+    # stdin buffer never hides a pending request from poll().
+    while poller.poll(idle_time * 1000):
+        line = stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        try:
+            images = _walk_images(
+                request["images_dir"], request["known"], request["metadata"])
+        except OSError as e:
+            response = {"error": [e.errno, e.strerror]}
+        else:
+            response = {"images": images}
+        stdout.write(json.dumps(response).encode("utf-8") + b"\n")
+        stdout.flush()
+
+
+def _walk_images(images_dir, known, metadata):
+    images = {}
+    now = time.time()
+
+    try:
+        with os.scandir(images_dir) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return images
+
+    for entry in entries:
+        # Like glob, skip hidden files.
+        if entry.name.startswith("."):
+            continue
+        try:
+            if not entry.is_dir():
+                continue
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+
+        if now - st.st_mtime < MTIME_RESOLUTION:
+            mtime = None
+        else:
+            mtime = st.st_mtime_ns
+
+        # The directory may be removed after it was listed.
+        try:
+            volumes = None
+            if mtime is not None and entry.name in known:
+                known_mtime, known_volumes = known[entry.name]
+                if known_mtime == mtime:
+                    volumes = _stat_volumes(entry.path, known_volumes)
+            if volumes is None:
+                volumes = _walk_image(entry.path, metadata)
+        except FileNotFoundError:
+            continue
+
+        images[entry.name] = {"mtime": mtime, "volumes": volumes}
+
+    return images
+
+
+def _stat_volumes(image_dir, vol_ids):
+    """
+    Return the volumes of an unmodified image directory, or None if a volume
+    was removed and the directory must be read again.
+    """
+    volumes = {}
+    for vol_id in vol_ids:
+        path = os.path.join(image_dir, vol_id + META_EXT)
+        try:
+            volumes[vol_id] = {"nlink": os.stat(path).st_nlink}
+        except FileNotFoundError:
+            return None
+    return volumes
+
+
+def _walk_image(image_dir, metadata):
+    volumes = {}
+    with os.scandir(image_dir) as it:
+        for entry in it:
+            if entry.name.startswith(".") or \
+                    not entry.name.endswith(META_EXT):
+                continue
+            vol_id = entry.name[:-len(META_EXT)]
+            try:
+                # Template volumes are hard linked with their metadata in all
+                # images using them.
+                volume = {"nlink": entry.stat().st_nlink}
+                if metadata:
+                    with open(entry.path, "rb") as f:
+                        volume["metadata"] = f.read().decode("utf-8")
+            except FileNotFoundError:
+                continue
+            volumes[vol_id] = volume
+    return volumes
+
+
+if __name__ == "__main__":
+    main()
@@ -134,6 +134,7 @@ This is where user leases are created.
 
 from __future__ import absolute_import
 
+import bisect
 import io
 import logging
 import mmap
@@ -501,6 +502,11 @@ class Record(object):
 # Record with empty values, mark a free record in the index.
 EMPTY_RECORD = Record("", 0)
 
+# Storage format of a free record, and the lookup prefix of a record without a
+# resource, for indexing records.
+EMPTY_RECORD_BYTES = EMPTY_RECORD.bytes()
+EMPTY_LOOKUP = LOOKUP_STRUCT.pack(b"")
+
 
 class LeasesVolume(object):
     """
@@ -670,7 +676,7 @@ class LeasesVolume(object):
         """
         log.debug("Getting all leases for lockspace %r", self.lockspace)
         leases = {}
-        for recnum in range(MAX_RECORDS):
+        for recnum in self._index.used_records():
             # Bad records will raise InvalidRecord and fail the request.
             # For dump API usage we would want to keep going over the next
             # readable records and log the exception.
@@ -993,6 +999,11 @@ class VolumeIndex(object):
     Index maintaining volume metadata and the mapping from lease id to lease
     offset.
 
+    To avoid searching the entire index buffer for every lookup, the index
+    keeps a mapping from record lookup prefix to record numbers, and a map of
+    free records. Both are built when loading the index, and updated when
+    writing a record.
+
     Arguments:
         offset (int): offset of the index in the underlying volume
         block_size (int): storage logical block size
@@ -1002,6 +1013,12 @@ class VolumeIndex(object):
         self._offset = offset
         self._block_size = block_size
         self._buf = mmap.mmap(-1, INDEX_SIZE, mmap.MAP_SHARED)
+        # Lookup prefix -> sorted list of record numbers. A corrupted index
+        # may have more than one record with the same lease id; like
+        # searching the index, we use the first record.
+        self._records = {}
+        # Byte per record, 1 if the record is free.
+        self._free = bytearray(MAX_RECORDS)
 
     def find_record(self, lease_id):
         """
@@ -1009,25 +1026,24 @@ class VolumeIndex(object):
         otherwise.
         """
         prefix = LOOKUP_STRUCT.pack(lease_id.encode("ascii"))
-
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(prefix, RECORD_BASE)
-        if offset == -1:
+        recnums = self._records.get(prefix)
+        if not recnums:
             return -1
 
-        return self._record_number(offset)
+        return recnums[0]
 
     def find_free_record(self):
         """
         Find the first free record. Returns record number if found, -1
         otherwise.
         """
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(EMPTY_RECORD.bytes(), RECORD_BASE)
-        if offset == -1:
-            return -1
+        return self._free.find(1)
 
-        return self._record_number(offset)
+    def used_records(self):
+        """
+        Return the numbers of the records which are not free.
+        """
+        return [recnum for recnum, free in enumerate(self._free) if not free]
 
     def read_record(self, recnum):
         """
@@ -1047,8 +1063,10 @@ class VolumeIndex(object):
         storage.
         """
         offset = self._record_offset(recnum)
+        self._remove_record(recnum, offset)
         self._buf.seek(offset)
         self._buf.write(record.bytes())
+        self._add_record(recnum, offset)
 
     def read_metadata(self):
         """
@@ -1081,6 +1099,10 @@ class VolumeIndex(object):
         if nread < len(self._buf):
             raise TruncatedIndex(len(self._buf), nread)
 
+        self._records.clear()
+        for recnum in range(MAX_RECORDS):
+            self._add_record(recnum, self._record_offset(recnum))
+
     def dump(self, file):
         """
         Write the entire buffer to storage and wait until the data reach
@@ -1128,8 +1150,25 @@ class VolumeIndex(object):
     def _record_offset(self, recnum):
         return RECORD_BASE + recnum * RECORD_SIZE
 
-    def _record_number(self, offset):
-        return (offset - RECORD_BASE) // RECORD_SIZE
+    def _add_record(self, recnum, offset):
+        data = self._buf[offset:offset + RECORD_SIZE]
+        if data == EMPTY_RECORD_BYTES:
+            self._free[recnum] = 1
+            return
+
+        self._free[recnum] = 0
+        prefix = data[:LOOKUP_STRUCT.size]
+        if prefix != EMPTY_LOOKUP:
+            recnums = self._records.setdefault(prefix, [])
+            bisect.insort(recnums, recnum)
+
+    def _remove_record(self, recnum, offset):
+        prefix = self._buf[offset:offset + LOOKUP_STRUCT.size]
+        recnums = self._records.get(prefix)
+        if recnums and recnum in recnums:
+            recnums.remove(recnum)
+            if not recnums:
+                del self._records[prefix]
 
 
 class ChangeBlock(object):
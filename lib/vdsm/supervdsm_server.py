@@ -44,7 +44,9 @@ from vdsm.common import commands
 from vdsm.common import concurrent
 from vdsm.common import constants
 from vdsm.common import lockfile
+from vdsm.common import muxrpc
 from vdsm.common import sigutils
+from vdsm.common import supervdsm
 
 try:
     from vdsm.gluster import listPublicFunctions
@@ -276,13 +278,16 @@ def main(args):
 
         log.debug("Parsing cmd args")
         address = sockfile
+        mux_address = supervdsm.mux_address(address)
 
-        log.debug("Cleaning old socket %s", address)
-        if os.path.exists(address):
-            os.unlink(address)
+        for path in (address, mux_address):
+            log.debug("Cleaning old socket %s", path)
+            if os.path.exists(path):
+                os.unlink(path)
 
         log.debug("Setting up keep alive thread")
 
+        mux_server = None
         try:
             signal.signal(signal.SIGTERM, terminate)
             signal.signal(signal.SIGINT, terminate)
@@ -297,6 +302,17 @@ def main(args):
 
             chown(address, args.user, args.group)
 
+            log.debug("Creating mux server")
+            mux_server = muxrpc.Server(
+                mux_address,
+                _SuperVdsm(),
+                idle_workers=config.getint('supervdsm', 'idle_workers'))
+            mux_thread = concurrent.thread(
+                mux_server.serve_forever, name="svdsm/mux")
+            mux_thread.start()
+
+            chown(mux_address, args.user, args.group)
+
             if args.enable_network:
                 init_privileged_network_components()
 
@@ -314,6 +330,9 @@ def main(args):
                 with connection.Client(address, authkey=_AUTHKEY) as conn:
                     server.shutdown(conn)
                 server_thread.join()
+                if mux_server:
+                    mux_server.shutdown()
+                    mux_thread.join()
             except Exception:
                 # We ignore any errors here to avoid a situation where systemd
                 # restarts supervdsmd just at the end of shutdown stage. We're
@@ -41,6 +41,7 @@ from vdsm.config import config
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import sampling
+from vdsm.virt import thinp
 from vdsm.virt import virdomain
 from vdsm.virt import vmstatus
 from vdsm.virt.externaldata import ExternalDataKind
@@ -388,12 +389,69 @@ class BlockjobMonitor(_RunnableOnVm):
         self._vm.updateVmJobs()
 
 
-class VolumeWatermarkMonitor(_RunnableOnVm):
+class VolumeWatermarkMonitor(object):
+    """
+    Check and extend thin provisioned volumes of all VMs, querying libvirt
+    block stats of all VMs needing monitoring in one call.
 
-    @property
-    def required(self):
-        return (super(VolumeWatermarkMonitor, self).required and
-                self._vm.volume_monitor.monitoring_needed())
+    VMs which could not be monitored in the bulk query, for example because
+    the domain is busy with another job, are monitored separately using
+    DriveWatermarkMonitor, so a blocked domain does not block the monitoring
+    of other VMs.
+    """
+
+    _log = logging.getLogger("virt.periodic.VolumeWatermarkMonitor")
+
+    def __init__(self, get_vms, conn, executor, timeout):
+        self._get_vms = get_vms
+        self._conn = conn
+        self._executor = executor
+        self._timeout = timeout
+        self._running = threading.Lock()
+
+    def __call__(self):
+        # If the previous cycle is blocked, we don't want to pile up more
+        # calls.
+        if not self._running.acquire(blocking=False):
+            self._log.warning(
+                "Previous monitoring cycle is still running, skipping")
+            return
+        try:
+            vms = [vm for vm in self._get_vms().values()
+                   if self._monitoring_needed(vm)]
+            if vms:
+                for vm in thinp.monitor_vms(self._conn, vms):
+                    self._dispatch(vm)
+        finally:
+            self._running.release()
+
+    def _monitoring_needed(self, vm):
+        # Same checks done by VmDispatcher for per-vm operations; skipping
+        # blocked domains avoids blocking the monitoring of other VMs.
+        try:
+            return (vm.monitorable and
+                    vm.volume_monitor.monitoring_needed() and
+                    vm.isDomainReadyForCommands())
+        except Exception:
+            self._log.exception(
+                "Unable to check if vm %s needs volume monitoring", vm.id)
+            return False
+
+    def _dispatch(self, vm):
+        try:
+            self._executor.dispatch(DriveWatermarkMonitor(vm), self._timeout)
+        except exception.ResourceExhausted:
+            self._log.warning(
+                "Could not monitor volumes of vm %s separately", vm.id)
+
+    def __repr__(self):
+        return '<%s at 0x%x>' % (self.__class__.__name__, id(self))
+
+
+class DriveWatermarkMonitor(_RunnableOnVm):
+    """
+    Check and extend thin provisioned volumes of one VM.
+    """
 
     def _execute(self):
         self._vm.volume_monitor.monitor_volumes()
@@ -463,10 +521,16 @@ def _create(cif, scheduler):
 
         # We do this only until we get high water mark notifications
         # from QEMU. It accesses storage and/or QEMU monitor, so can block,
-        # thus we need dispatching.
-        per_vm_operation(
-            VolumeWatermarkMonitor,
-            config.getint('vars', 'vm_watermark_interval')),
+        # thus we need dispatching. Monitors all VMs using one libvirt
+        # call.
+        Operation(
+            VolumeWatermarkMonitor(
+                cif.getVMs,
+                libvirtconnection.get(cif),
+                _executor,
+                _timeout_from(config.getint('vars', 'vm_watermark_interval'))),
+            config.getint('vars', 'vm_watermark_interval'),
+            scheduler),
 
         per_vm_operation(
             NvramDataMonitor,
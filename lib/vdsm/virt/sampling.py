@@ -29,10 +29,10 @@ from six.moves import map
 Support for VM and host statistics sampling.
 """
 
-from collections import defaultdict, deque, namedtuple
+from collections import deque, namedtuple
+import array
 import logging
 import os
-import re
 import threading
 import time
 
@@ -44,26 +44,36 @@ from vdsm.common.units import KiB, MiB
 from vdsm.config import config
 from vdsm.constants import P_VDSM_RUN
 from vdsm.host import api as hostapi
+from vdsm.virt import vmstats
 from vdsm.virt.utils import ExpiringCache
 
 
 _THP_STATE_PATH = '/sys/kernel/mm/transparent_hugepage/enabled'
 if not os.path.exists(_THP_STATE_PATH):
     _THP_STATE_PATH = '/sys/kernel/mm/redhat_transparent_hugepage/enabled'
+_PROC_STAT_PATH = '/proc/stat'
+_SYSFS_NODE_PATH = '/sys/devices/system/node'
+_PAGE_SIZE_KIB = os.sysconf('SC_PAGE_SIZE') // KiB
 _METRICS_ENABLED = config.getboolean('metrics', 'enabled')
 _NOWAIT_ENABLED = config.getboolean('vars', 'nowait_domain_stats')
 
 
+def _readProcStat():
+    with open(_PROC_STAT_PATH) as f:
+        return f.read()
+
+
 class TotalCpuSample(object):
     """
     A sample of total CPU consumption.
 
     The sample is taken at initialization time and can't be updated.
     """
-    def __init__(self):
-        with open('/proc/stat') as f:
-            self.user, userNice, self.sys, self.idle = \
-                map(int, f.readline().split()[1:5])
+    def __init__(self, stat=None):
+        if stat is None:
+            stat = _readProcStat()
+        self.user, userNice, self.sys, self.idle = \
+            map(int, stat.split('\n', 1)[0].split()[1:5])
         self.user += userNice
 
 
@@ -71,60 +81,159 @@ class CpuCoreSample(object):
     """
     A sample of the CPU consumption of each core
 
+    /proc/stat is parsed into a single array of jiffies indexed by core id,
+    FIELDS values per core, so keeping a window of samples on hosts with
+    many cores does not keep a dict for every core in every sample.
+
     The sample is taken at initialization time and can't be updated.
     """
-    CPU_CORE_STATS_PATTERN = re.compile(r'cpu(\d+)\s+(.*)')
-
-    def __init__(self):
-        self.coresSample = {}
-        with open('/proc/stat') as src:
-            for line in src:
-                match = self.CPU_CORE_STATS_PATTERN.match(line)
-                if match:
-                    coreSample = {}
-                    user, userNice, sys, idle = \
-                        map(int, match.group(2).split()[0:4])
-                    coreSample['user'] = user
-                    coreSample['userNice'] = userNice
-                    coreSample['sys'] = sys
-                    coreSample['idle'] = idle
-                    self.coresSample[match.group(1)] = coreSample
+    FIELDS = ('user', 'userNice', 'sys', 'idle')
+    STRIDE = len(FIELDS)
+
+    def __init__(self, stat=None):
+        if stat is None:
+            stat = _readProcStat()
+        coreIds = []
+        values = []
+        for line in stat.splitlines():
+            # The cpu lines are always first.
+            if not line.startswith('cpu'):
+                break
+            fields = line.split(None, 5)
+            if fields[0] == 'cpu':
+                continue
+            coreIds.append(int(fields[0][3:]))
+            values.extend(fields[1:self.STRIDE + 1])
+
+        jiffies = array.array('q', map(int, values))
+        size = max(coreIds) + 1 if coreIds else 0
+        if len(coreIds) == size:
+            # All cores are online, listed in order.
+            self._jiffies = jiffies
+            self._online = bytearray(b'\x01') * size
+        else:
+            self._jiffies = array.array('q', [0]) * (size * self.STRIDE)
+            self._online = bytearray(size)
+            for n, coreId in enumerate(coreIds):
+                self._set(coreId, jiffies[n * self.STRIDE:
+                                          (n + 1) * self.STRIDE])
+
+    @classmethod
+    def from_cores(cls, cores):
+        """
+        Create a sample from dict {coreId: {field: jiffies}}.
+        """
+        sample = cls.__new__(cls)
+        sample._jiffies = array.array('q')
+        sample._online = bytearray()
+        for coreId, core in six.iteritems(cores):
+            sample._set(int(coreId),
+                        (int(core.get(field, 0)) for field in cls.FIELDS))
+        return sample
+
+    def _set(self, coreId, values):
+        if coreId >= len(self._online):
+            grow = coreId + 1 - len(self._online)
+            self._jiffies.extend(array.array('q', [0]) * (grow * self.STRIDE))
+            self._online.extend(bytearray(grow))
+        i = coreId * self.STRIDE
+        self._jiffies[i:i + self.STRIDE] = array.array('q', values)
+        self._online[coreId] = 1
+
+    def hasCore(self, coreId):
+        return coreId < len(self._online) and self._online[coreId] == 1
+
+    def jiffies(self, field):
+        """
+        Return array of field jiffies of all cores, indexed by core id.
+        Offline cores have zero jiffies.
+        """
+        return self._jiffies[self.FIELDS.index(field)::self.STRIDE]
 
     def getCoreSample(self, coreId):
-        strCoreId = str(coreId)
-        return self.coresSample.get(strCoreId)
+        coreId = int(coreId)
+        if not self.hasCore(coreId):
+            return None
+        i = coreId * self.STRIDE
+        return dict(zip(self.FIELDS, self._jiffies[i:i + self.STRIDE]))
 
 
 class NumaNodeMemorySample(object):
     """
     A sample of the memory stats of each numa node
 
+    The memory stats are read from sysfs, falling back to libvirt if the
+    node is not available in sysfs.
+
     The sample is taken at initialization time and can't be updated.
     """
     def __init__(self):
         self.nodesMemSample = {}
         numaTopology = numa.topology()
         for nodeIndex in numaTopology:
+            page_sizes = list(numaTopology[nodeIndex]['hugepages'].keys())
+            try:
+                memTotal, memFree, hugepages = _readNodeMemory(
+                    int(nodeIndex), page_sizes)
+            except FileNotFoundError:
+                memTotal, memFree, hugepages = _libvirtNodeMemory(
+                    nodeIndex, page_sizes, len(numaTopology))
+
             nodeMemSample = {}
-            # work around libvirt bug (if not built with numactl)
-            if len(numaTopology) == 1:
-                idx = -1
-            else:
-                idx = int(nodeIndex)
-            memInfo = numa.memory_by_cell(idx)
-            nodeMemSample['memFree'] = memInfo['free']
+            nodeMemSample['memFree'] = memFree
             # in case the numa node has zero memory assigned, report the whole
             # memory as used
             nodeMemSample['memPercent'] = 100
-            if int(memInfo['total']) != 0:
+            if int(memTotal) != 0:
                 nodeMemSample['memPercent'] = 100 - \
-                    int(100.0 * int(memInfo['free']) // int(memInfo['total']))
-            page_sizes = list(numaTopology[nodeIndex]['hugepages'].keys())
-            nodeMemSample['hugepages'] = \
-                numa.free_pages_by_cell(page_sizes, idx)
+                    int(100.0 * int(memFree) // int(memTotal))
+            nodeMemSample['hugepages'] = hugepages
             self.nodesMemSample[nodeIndex] = nodeMemSample
 
 
+def _readNodeMemory(index, page_sizes):
+    """
+    Read node memory from sysfs, returning total and free memory in MiB
+    and free pages for page_sizes, like libvirt reports them.
+    """
+    nodeDir = os.path.join(_SYSFS_NODE_PATH, 'node%d' % index)
+    meminfo = {}
+    with open(os.path.join(nodeDir, 'meminfo')) as f:
+        for line in f:
+            # Node 0 MemFree:        3331104 kB
+            fields = line.split()
+            if len(fields) > 3:
+                meminfo[fields[2].rstrip(':')] = fields[3]
+    memFree = int(meminfo['MemFree'])
+
+    hugepages = {}
+    for page_size in page_sizes:
+        page_size = int(page_size)
+        if page_size == _PAGE_SIZE_KIB:
+            freePages = memFree // page_size
+        else:
+            path = os.path.join(
+                nodeDir, 'hugepages', 'hugepages-%dkB' % page_size,
+                'free_hugepages')
+            with open(path) as f:
+                freePages = int(f.read())
+        hugepages[page_size] = {'freePages': freePages}
+
+    return (str(int(meminfo['MemTotal']) // KiB), str(memFree // KiB),
+            hugepages)
+
+
+def _libvirtNodeMemory(nodeIndex, page_sizes, nodes):
+    # work around libvirt bug (if not built with numactl)
+    if nodes == 1:
+        idx = -1
+    else:
+        idx = int(nodeIndex)
+    memInfo = numa.memory_by_cell(idx)
+    hugepages = numa.free_pages_by_cell(page_sizes, idx)
+    return memInfo['total'], memInfo['free'], hugepages
+
+
 class PidCpuSample(object):
     """
     A sample of the CPU consumption of a process.
@@ -167,7 +276,9 @@ class HostSample(object):
         self.timestamp = time.time()
         self.pidcpu = PidCpuSample(pid)
         self.ncpus = os.sysconf('SC_NPROCESSORS_ONLN')
-        self.totcpu = TotalCpuSample()
+        # /proc/stat is read once for both total and per core samples.
+        stat = _readProcStat()
+        self.totcpu = TotalCpuSample(stat)
         meminfo = utils.readMemInfo()
         freeOrCached = (meminfo['MemFree'] +
                         meminfo['Cached'] +
@@ -188,7 +299,7 @@ class HostSample(object):
         except:
             self.thpState = 'never'
         self.hugepages = hugepages.state()
-        self.cpuCores = CpuCoreSample()
+        self.cpuCores = CpuCoreSample(stat)
         self.numaNodeMem = NumaNodeMemorySample()
 
 
@@ -284,10 +395,31 @@ class StatsCache(object):
 
     def __init__(self, clock=vdsm.common.time.monotonic_time):
         self._clock = clock
+        # Serializes writers; readers use the current snapshot and never take
+        # the lock.
         self._lock = threading.Lock()
         self._samples = SampleWindow(size=2, timefn=self._clock)
-        self._last_sample_time = 0
-        self._vm_last_timestamp = defaultdict(int)
+        self._snapshot = Snapshot(None, None, None, 0, 0, frozenset())
+        # Time the VM was added, or the time of the last sample including
+        # the VM if it is missing in the last sample. VMs in the last sample
+        # use the time of the last sample, so adding a sample does not need
+        # to touch every VM.
+        self._vm_last_timestamp = {}
+
+    @property
+    def generation(self):
+        """
+        Return the number of bulk samples added to the cache. Can be used to
+        invalidate values computed from the samples.
+        """
+        return self._snapshot.generation
+
+    def snapshot(self):
+        """
+        Return the current immutable Snapshot of the cache. The snapshot is
+        shared by all readers and must not be modified.
+        """
+        return self._snapshot
 
     def add(self, vmid):
         """
@@ -297,53 +429,74 @@ class StatsCache(object):
         """
         with self._lock:
             self._vm_last_timestamp[vmid] = self._clock()
+            snapshot = self._snapshot
+            if vmid in snapshot.removed:
+                self._snapshot = snapshot._replace(
+                    removed=snapshot.removed - {vmid})
 
     def remove(self, vmid):
         """
         Remove any data from the cache related to the given VM.
         """
         with self._lock:
-            del self._vm_last_timestamp[vmid]
+            snapshot = self._snapshot
+            in_sample = (snapshot.last_batch is not None and
+                         vmid in snapshot.last_batch and
+                         vmid not in snapshot.removed)
+            if self._vm_last_timestamp.pop(vmid, None) is None and \
+                    not in_sample:
+                raise KeyError(vmid)
+            # The VM is reported as removed until the next sample.
+            self._snapshot = snapshot._replace(
+                removed=snapshot.removed | {vmid})
 
     def get(self, vmid):
         """
         Return the available StatSample for the given VM.
         """
-        with self._lock:
-            first_batch, last_batch, interval = self._samples.stats()
-            stats_age = self._clock() - self._vm_last_timestamp[vmid]
+        snapshot = self._snapshot
+        stats_age = self._clock() - self._last_timestamp(snapshot, vmid)
 
-            if first_batch is None:
-                return StatsSample(None, None, None, stats_age)
+        if snapshot.first_batch is None:
+            return StatsSample(None, None, None, stats_age)
 
-            first_sample = first_batch.get(vmid)
-            last_sample = last_batch.get(vmid)
+        first_sample = snapshot.first_batch.get(vmid)
+        last_sample = snapshot.last_batch.get(vmid)
 
-            if first_sample is None or last_sample is None:
-                return StatsSample(None, None, None, stats_age)
+        if first_sample is None or last_sample is None:
+            return StatsSample(None, None, None, stats_age)
 
-            return StatsSample(first_sample, last_sample,
-                               interval, stats_age)
+        return StatsSample(first_sample, last_sample,
+                           snapshot.interval, stats_age)
 
     def get_batch(self):
         """
         Return the available StatSample for the all VMs.
         """
-        with self._lock:
-            first_batch, last_batch, interval = self._samples.stats()
-
-            if first_batch is None:
-                return None
-
-            ts = self._clock()
-            return {
-                vm_id: StatsSample(
-                    first_batch[vm_id], last_batch[vm_id], interval,
-                    ts - self._vm_last_timestamp[vm_id]
-                )
-                for vm_id in last_batch if (vm_id in first_batch and
-                                            vm_id in self._vm_last_timestamp)
-            }
+        snapshot = self._snapshot
+        first_batch = snapshot.first_batch
+
+        if first_batch is None:
+            return None
+
+        # All VMs in the last sample were seen at the time of the last
+        # sample, unless they were added later.
+        ts = self._clock()
+        interval = snapshot.interval
+        removed = snapshot.removed
+        default_age = ts - snapshot.timestamp
+        vm_last_timestamp = self._vm_last_timestamp
+        batch = {}
+        for vm_id, last_sample in snapshot.last_batch.items():
+            if vm_id in first_batch and vm_id not in removed:
+                added = vm_last_timestamp.get(vm_id, 0)
+                if added > snapshot.timestamp:
+                    stats_age = ts - added
+                else:
+                    stats_age = default_age
+                batch[vm_id] = StatsSample(
+                    first_batch[vm_id], last_sample, interval, stats_age)
+        return batch
 
     def clock(self):
         """
@@ -361,21 +514,60 @@ class StatsCache(object):
         with stale one.
         """
         with self._lock:
-            last_sample_time = self._last_sample_time
-            if monotonic_ts >= last_sample_time:
+            snapshot = self._snapshot
+            if monotonic_ts >= snapshot.timestamp:
                 self._samples.append(bulk_stats)
-                self._last_sample_time = monotonic_ts
-
-                self._update_ts(bulk_stats, monotonic_ts)
+                self._update_ts(snapshot, bulk_stats)
+                first_batch, _, interval = self._samples.stats()
+                self._snapshot = Snapshot(
+                    first_batch, bulk_stats, interval, monotonic_ts,
+                    snapshot.generation + 1, frozenset())
             else:
                 self._log.warning(
                     'dropped stale old sample: sampled %f stored %f',
-                    monotonic_ts, last_sample_time)
+                    monotonic_ts, snapshot.timestamp)
+
+    def _update_ts(self, snapshot, bulk_stats):
+        """
+        Record the time VMs were last seen for VMs missing in the new sample.
+        """
+        last_batch = snapshot.last_batch
+        if last_batch is None:
+            return
+        for vmid in last_batch.keys() - bulk_stats.keys():
+            if vmid not in snapshot.removed:
+                ts = self._vm_last_timestamp.get(vmid, 0)
+                self._vm_last_timestamp[vmid] = max(ts, snapshot.timestamp)
+
+    def _last_timestamp(self, snapshot, vmid):
+        ts = self._vm_last_timestamp.get(vmid, 0)
+        if (snapshot.last_batch is not None and
+                vmid in snapshot.last_batch and
+                vmid not in snapshot.removed):
+            ts = max(ts, snapshot.timestamp)
+        return ts
+
+
+class Snapshot(namedtuple('Snapshot', [
+        'first_batch', 'last_batch', 'interval', 'timestamp', 'generation',
+        'removed'])):
+    """
+    Immutable state of StatsCache, replaced when a sample is added.
+
+    timestamp is the time the last sample was taken, using the cache clock,
+    and generation the number of samples added to the cache.
+    """
+
+    __slots__ = ()
 
-    def _update_ts(self, bulk_stats, monotonic_ts):
-        # FIXME: this is expected to be costly performance-wise.
-        for vmid in bulk_stats:
-            self._vm_last_timestamp[vmid] = monotonic_ts
+    def sample(self, vmid):
+        """
+        Return the raw bulk stats of the given VM in the last sample, or None
+        if the VM is not in the last sample.
+        """
+        if self.last_batch is None or vmid in self.removed:
+            return None
+        return self.last_batch.get(vmid)
 
 
 stats_cache = StatsCache()
@@ -400,6 +592,14 @@ BULK_STATS_TYPES = (
     libvirt.VIR_DOMAIN_STATS_BLOCK
 )
 
+# Include block stats for the backing chain nodes, so volume monitoring can
+# use the sample instead of querying libvirt again. The backing chain nodes
+# are reported after the top node of every drive, using the same name.
+BULK_STATS_FLAGS = (
+    libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING |
+    libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_BACKING
+)
+
 
 class VMBulkstatsMonitor(object):
     def __init__(self, conn, get_vms, stats_cache,
@@ -420,7 +620,7 @@ class VMBulkstatsMonitor(object):
         # *is* costly so we should avoid it if we can.
         fast_path = acquired and not self._skip_doms
         responsive_doms = []
-        flags = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING
+        flags = BULK_STATS_FLAGS
         if _NOWAIT_ENABLED:
             flags |= libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT
         try:
@@ -492,5 +692,5 @@ class HostMonitor(object):
 
 
 def _translate(bulk_stats):
-    return dict((dom.UUIDString(), stats)
+    return dict((dom.UUIDString(), vmstats.BulkSample(stats))
                 for dom, stats in bulk_stats)
@@ -0,0 +1,166 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+Support for reporting only the VM stats changed since a previous report.
+
+Clients poll Host.getAllVmStats frequently, but most of the reported fields
+(vmName, vmType, acpiEnable, hashes, ...) do not change between polls.
+StatsTracker keeps the last reported stats of every VM, and the generation
+in which every field was changed. A client sending back the generation of
+the previous report gets only the VMs and fields changed since then.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from collections import namedtuple
+import threading
+import time
+
+# Maximum number of removed VMs to remember. When more VMs are removed, the
+# oldest are forgotten, and clients using an older generation get a full
+# report.
+MAX_REMOVED = 1024
+
+
+Delta = namedtuple("Delta", [
+    # Generation of this report, to be used as "since" in the next call.
+    "generation",
+    # True if stats_list contains the complete stats of all VMs.
+    "full",
+    # List of stats, either complete or including only the changed fields
+    # and "vmId".
+    "stats_list",
+    # List of ids of VMs removed since the requested generation.
+    "removed",
+])
+
+
+class StatsTracker(object):
+
+    def __init__(self, max_removed=MAX_REMOVED, clock=time.time):
+        self._lock = threading.Lock()
+        self._max_removed = max_removed
+        # Start from the current time in milliseconds, so a generation from
+        # a previous run of vdsm is older than any generation of this run
+        # and results in a full report.
+        self._generation = int(clock() * 1000)
+        # Clients using a generation older than this get a full report.
+        self._horizon = self._generation
+        self._vms = {}
+        self._removed = {}
+
+    def delta(self, stats_list, since=0):
+        """
+        Record stats_list as the current stats of all VMs, and return a Delta
+        with the changes since generation since.
+
+        Arguments:
+            stats_list (list): current stats of all VMs, as returned by
+                getAllVmStats.
+            since (int): generation returned in the previous report, or 0 to
+                get a full report.
+
+        Returns:
+            Delta
+        """
+        with self._lock:
+            self._generation += 1
+            self._update(stats_list)
+            full = not (self._horizon <= since < self._generation)
+            if full:
+                return Delta(self._generation, True, stats_list, [])
+            return Delta(
+                self._generation,
+                False,
+                self._changed(since),
+                [vm_id for vm_id, generation in self._removed.items()
+                 if generation > since])
+
+    def _update(self, stats_list):
+        current = set()
+        for stats in stats_list:
+            vm_id = stats["vmId"]
+            current.add(vm_id)
+            entry = self._vms.get(vm_id)
+            if entry is None:
+                self._vms[vm_id] = _Entry(stats, self._generation)
+                self._removed.pop(vm_id, None)
+            else:
+                entry.update(stats, self._generation)
+
+        for vm_id in [vm_id for vm_id in self._vms if vm_id not in current]:
+            del self._vms[vm_id]
+            self._removed[vm_id] = self._generation
+
+        if len(self._removed) > self._max_removed:
+            self._forget_removed()
+
+    def _forget_removed(self):
+        # Forget the oldest half; clients that may have missed them must get
+        # a full report.
+        by_age = sorted(self._removed.items(), key=lambda item: item[1])
+        forget = by_age[:len(by_age) // 2 + 1]
+        for vm_id, _ in forget:
+            del self._removed[vm_id]
+        self._horizon = forget[-1][1]
+
+    def _changed(self, since):
+        changed = []
+        for vm_id, entry in self._vms.items():
+            if entry.reset > since:
+                changed.append(entry.stats)
+                continue
+            stats = {key: entry.stats[key]
+                     for key, generation in entry.fields.items()
+                     if generation > since}
+            if stats:
+                stats["vmId"] = vm_id
+                changed.append(stats)
+        return changed
+
+
+class _Entry(object):
+    """
+    Last reported stats of a VM, and the generation in which each field was
+    last changed.
+    """
+
+    __slots__ = ("stats", "fields", "reset")
+
+    def __init__(self, stats, generation):
+        self.stats = stats
+        self.fields = dict.fromkeys(stats, generation)
+        # Generation when the VM was added or a field was removed. Since
+        # clients cannot learn about removed fields from a delta, they must
+        # get the complete stats of this VM.
+        self.reset = generation
+
+    def update(self, stats, generation):
+        old = self.stats
+        for key, value in stats.items():
+            if key not in old or old[key] != value:
+                self.fields[key] = generation
+        if len(self.fields) != len(stats):
+            for key in [key for key in self.fields if key not in stats]:
+                del self.fields[key]
+            self.reset = generation
+        self.stats = stats
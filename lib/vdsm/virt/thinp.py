@@ -18,6 +18,7 @@
 # Refer to the README and COPYING files for full details of the license
 #
 
+import logging
 import re
 import sys
 import time
@@ -30,10 +31,13 @@ import libvirt
 from vdsm.common import exception
 from vdsm.common.config import config
 from vdsm.common.time import Clock
+from vdsm.storage import constants as sc
 from vdsm.virt import virdomain
 from vdsm.virt.vmdevices import lookup
 from vdsm.virt.vmdevices import storage
 
+log = logging.getLogger("virt.thinp")
+
 # Block device Information from libvirt block stats API.
 BlockInfo = namedtuple("BlockInfo", [
     "index",
@@ -268,7 +272,8 @@ class VolumeMonitor(object):
         timeout = config.getfloat("thinp", "extend_timeout")
         try:
             with drive.monitor_lock(timeout):
-                self._handle_exceeded(drive, urgent=True)
+                self._handle_exceeded(
+                    drive, urgent=True, priority=sc.EXTEND_EXCEEDED)
         except storage.MonitorBusy:
             self._log.warning(
                 "Timeout acquiring monitor lock for drive %s, retrying "
@@ -285,30 +290,64 @@ class VolumeMonitor(object):
         if not drives:
             return
 
-        if not self._update_block_info(drives):
+        # Block stats from the last bulk stats sample are good enough if the
+        # sample was taken since the last monitoring cycle.
+        max_age = config.getint("vars", "vm_watermark_interval")
+        if not self._update_block_info(drives, max_age=max_age):
             return
 
-        timeout = config.getfloat("thinp", "monitor_timeout")
         for drive in drives:
-            try:
-                with drive.monitor_lock(timeout):
-                    self._extend_drive_if_needed(drive)
-            except storage.MonitorBusy:
-                self._log.debug(
-                    "Timeout acquiring monitor lock for drive %s, retrying "
-                    "in next monitoring cycle",
-                    drive.name)
+            self.check_drive(drive)
 
-    def _update_block_info(self, drives):
+    def monitored_volumes(self):
+        """
+        Return the drives that need to be checked for extension in this
+        monitoring cycle.
+        """
+        if not self._enabled:
+            return []
+        return self._monitored_volumes()
+
+    def update_block_info(self, drives, raw_stats):
+        """
+        Update drives block info using libvirt block stats queried by the
+        caller, in the format returned by Vm.query_block_stats().
+        """
+        block_stats = self._parse_block_stats(raw_stats)
+        for drive in drives:
+            self._query_block_info(drive, drive.volumeID, block_stats)
+
+    def check_drive(self, drive):
+        """
+        Check if drive should be extended, and start extension flow if
+        needed. The drive block info must be updated in this monitoring
+        cycle.
+        """
+        timeout = config.getfloat("thinp", "monitor_timeout")
+        try:
+            with drive.monitor_lock(timeout):
+                self._extend_drive_if_needed(drive)
+        except storage.MonitorBusy:
+            self._log.debug(
+                "Timeout acquiring monitor lock for drive %s, retrying "
+                "in next monitoring cycle",
+                drive.name)
+
+    def _update_block_info(self, drives, max_age=None):
         """
         Query libvirt block stats and update drives block info. This must be
         done on every monitoring cycle, before we decide if a drive should be
         extended.
 
+        If max_age is specified, use block stats from the last bulk stats
+        sample if the sample is not older than max_age seconds, and was
+        taken after the drives were resized.
+
         Return True if the update was successful.
         """
         try:
-            block_stats = self._query_block_stats()
+            block_stats = self._query_block_stats(
+                max_age=max_age, since=_last_resize(drives))
         except libvirt.libvirtError as e:
             self._log.error("Unable to get block stats: %s", e)
             return False
@@ -329,7 +368,7 @@ class VolumeMonitor(object):
             # Extend completed during monitoring, nothing to do.
             pass
         elif drive.threshold_state == storage.BLOCK_THRESHOLD.EXCEEDED:
-            self._handle_exceeded(drive)
+            self._handle_exceeded(drive, priority=sc.EXTEND_EXCEEDED)
         else:
             self._log.warning(
                 "Unexpected threshold state %s for drive %s",
@@ -352,9 +391,16 @@ class VolumeMonitor(object):
             self._set_threshold(
                 drive, drive.block_info.physical, drive.block_info.index)
 
-    def _handle_exceeded(self, drive, urgent=False):
+    def _handle_exceeded(self, drive, urgent=False,
+                         priority=sc.EXTEND_THRESHOLD):
         """
         Handle drive with EXCEEDED threshold state.
+
+        priority is EXTEND_EXCEEDED if we got a block threshold event for the
+        drive, or EXTEND_THRESHOLD if the monitor found that the drive
+        exceeded the threshold. If the VM was paused because of ENOSPC, the
+        VM cannot run until the volume is extended, so the extend is sent
+        with the highest priority.
         """
         if not self._can_extend_drive(drive):
             # Can happen with the default chunk size and utilization if drive
@@ -391,7 +437,11 @@ class VolumeMonitor(object):
         new_size = drive.getNextVolumeSize(
             drive.block_info.physical, drive.block_info.capacity)
 
-        self.extend_volume(drive, drive.volumeID, new_size)
+        if self._vm.pause_code == "ENOSPC":
+            priority = sc.EXTEND_ENOSPC
+
+        self.extend_volume(
+            drive, drive.volumeID, new_size, priority=priority)
 
     def _can_extend_drive(self, drive):
         # NOTE: Physical may be larger than maximum volume size since it is
@@ -464,13 +514,21 @@ class VolumeMonitor(object):
         drive.block_info = self._amend_block_info(drive, block_stats[index])
         return drive.block_info
 
-    def _query_block_stats(self):
+    def _query_block_stats(self, max_age=None, since=0.0):
         """
         Extract monitoring related info from libvirt block stats.
 
         Return mapping from volume backing index to its BlockInfo.
         """
-        block_stats = self._vm.query_block_stats()
+        block_stats = None
+        if max_age is not None:
+            block_stats = self._vm.sampled_block_stats(max_age, since=since)
+        if block_stats is None:
+            block_stats = self._vm.query_block_stats()
+
+        return self._parse_block_stats(block_stats)
+
+    def _parse_block_stats(self, block_stats):
         result = {}
 
         for i in range(block_stats["block.count"]):
@@ -521,7 +579,8 @@ class VolumeMonitor(object):
 
     # Extending volumes.
 
-    def extend_volume(self, vmDrive, volumeID, newSize, callback=None):
+    def extend_volume(self, vmDrive, volumeID, newSize, callback=None,
+                      priority=sc.EXTEND_THRESHOLD):
         """
         Extend drive volume and its replica volume during replication to
         newSize.
@@ -534,6 +593,8 @@ class VolumeMonitor(object):
 
             def callback(error=None):
 
+        priority is one of sc.EXTEND_PRIORITIES, used to order extend
+        requests from all VMs.
         """
         # If drive is replicated to a block device, we extend first the
         # replica, and handle drive later in _extend_replica_completed.
@@ -555,12 +616,14 @@ class VolumeMonitor(object):
 
         if vmDrive.replicaChunked:
             self._extend_replica(
-                vmDrive, newSize, clock, callback=callback)
+                vmDrive, newSize, clock, callback=callback, priority=priority)
         else:
             self._extend_volume(
-                vmDrive, volumeID, newSize, clock, callback=callback)
+                vmDrive, volumeID, newSize, clock, callback=callback,
+                priority=priority)
 
-    def _extend_replica(self, drive, newSize, clock, callback=None):
+    def _extend_replica(self, drive, newSize, clock, callback=None,
+                        priority=sc.EXTEND_THRESHOLD):
         clock.start("extend-replica")
         volInfo = {
             'domainID': drive.diskReplicate['domainID'],
@@ -571,12 +634,14 @@ class VolumeMonitor(object):
             'volumeID': drive.diskReplicate['volumeID'],
             'clock': clock,
             'callback': callback,
+            'priority': priority,
         }
         self._log.debug(
             "Requesting an extension for the volume replication: %s",
             volInfo)
         self._vm.cif.irs.sendExtendMsg(
-            drive.poolID, volInfo, newSize, self._extend_replica_completed)
+            drive.poolID, volInfo, newSize, self._extend_replica_completed,
+            priority=priority)
 
     def _extend_replica_completed(self, volInfo):
         clock = volInfo["clock"]
@@ -601,10 +666,10 @@ class VolumeMonitor(object):
             vmDrive.name, vmDrive.domainID, vmDrive.volumeID)
         self._extend_volume(
             vmDrive, vmDrive.volumeID, volInfo['newSize'], clock,
-            callback=volInfo["callback"])
+            callback=volInfo["callback"], priority=volInfo["priority"])
 
     def _extend_volume(self, vmDrive, volumeID, newSize, clock,
-                       callback=None):
+                       callback=None, priority=sc.EXTEND_THRESHOLD):
         clock.start("extend-volume")
         volInfo = {
             'domainID': vmDrive.domainID,
@@ -616,10 +681,12 @@ class VolumeMonitor(object):
             'volumeID': volumeID,
             'clock': clock,
             'callback': callback,
+            'priority': priority,
         }
         self._log.debug("Requesting an extension for the volume: %s", volInfo)
         self._vm.cif.irs.sendExtendMsg(
-            vmDrive.poolID, volInfo, newSize, self._extend_volume_completed)
+            vmDrive.poolID, volInfo, newSize, self._extend_volume_completed,
+            priority=priority)
 
     def _extend_volume_completed(self, volInfo):
         callback = None
@@ -702,6 +769,7 @@ class VolumeMonitor(object):
                 resized volume.
             volsize (virt.vm.VolumeSize): new volume size tuple
         """
+        drive.resize_time = time.monotonic()
         drive.apparentsize = volsize.apparentsize
         drive.truesize = volsize.truesize
 
@@ -709,6 +777,151 @@ class VolumeMonitor(object):
         self._set_threshold(drive, volsize.apparentsize, index)
 
 
+def monitor_vms(conn, vms):
+    """
+    Check and extend drives of all vms, querying libvirt block stats of all
+    vms in one call.
+
+    Block stats of vms in the last bulk stats sample are used if the sample
+    was taken since the last monitoring cycle. Other vms are queried using
+    one domainListGetStats() call. When all drives were updated, the drives
+    are checked in order of their free space, so drives which are about to
+    run out of space are extended first.
+
+    Like bulk stats sampling, the query does not wait for domains busy with
+    another job. Such domains may be blocked, so they are not queried again
+    here; they are returned to the caller, which should monitor them
+    separately, without blocking the monitoring of other vms.
+
+    Arguments:
+        conn (libvirt.virConnect): libvirt connection
+        vms (list of vdsm.virt.vm.Vm): vms to monitor
+
+    Returns:
+        list of vms which could not be monitored.
+    """
+    max_age = config.getint("vars", "vm_watermark_interval")
+    updates = []
+    query = {}
+
+    for vm in vms:
+        drives = vm.volume_monitor.monitored_volumes()
+        if not drives:
+            continue
+        raw_stats = vm.sampled_block_stats(
+            max_age, since=_last_resize(drives))
+        if raw_stats is None:
+            query[vm.id] = (vm, drives)
+        else:
+            updates.append((vm, drives, raw_stats))
+
+    skipped = []
+    if query:
+        queried, skipped = _query_vms(conn, query)
+        updates.extend(queried)
+
+    checks = []
+    for vm, drives, raw_stats in updates:
+        try:
+            vm.volume_monitor.update_block_info(drives, raw_stats)
+        except Exception:
+            vm.log.exception("Unable to update block info")
+            continue
+        for drive in drives:
+            checks.append((_headroom(drive), vm, drive))
+
+    checks.sort(key=lambda check: check[0])
+
+    for _, vm, drive in checks:
+        try:
+            vm.volume_monitor.check_drive(drive)
+        except Exception:
+            vm.log.exception("Unable to check drive %s", drive.name)
+
+    return skipped
+
+
+def block_stats_complete(raw_stats):
+    """
+    Return True if raw_stats include the block stats reported by qemu.
+
+    When querying stats with VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT, stats
+    of a domain busy with another job include only the stats libvirt can get
+    without qemu, and the allocation of the block nodes is missing.
+    """
+    count = raw_stats.get("block.count")
+    if count is None:
+        return False
+    return all(f"block.{i}.allocation" in raw_stats
+               for i in range(count)
+               if f"block.{i}.backingIndex" in raw_stats)
+
+
+def _query_vms(conn, query):
+    """
+    Query block stats of all vms in query.
+
+    Returns:
+        tuple (queried, skipped). queried is list of (vm, drives, raw_stats)
+        tuples, and skipped is list of vms with missing or incomplete block
+        stats.
+    """
+    doms = []
+    for vm, drives in query.values():
+        try:
+            doms.append(vm._dom.dom)
+        except virdomain.NotConnectedError:
+            vm.log.debug("Domain not connected, skipping volume monitoring")
+
+    if not doms:
+        return [], []
+
+    flags = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_BACKING
+    if config.getboolean("vars", "nowait_domain_stats"):
+        flags |= libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT
+
+    try:
+        bulk_stats = conn.domainListGetStats(
+            doms, stats=libvirt.VIR_DOMAIN_STATS_BLOCK, flags=flags)
+    except libvirt.libvirtError as e:
+        log.warning(
+            "Unable to get block stats for %d vms, monitoring vms "
+            "separately: %s", len(doms), e)
+        return [], [vm for vm, _ in query.values()]
+
+    queried = []
+    for dom, raw_stats in bulk_stats:
+        vm, drives = query.pop(dom.UUIDString())
+        if block_stats_complete(raw_stats):
+            queried.append((vm, drives, raw_stats))
+        else:
+            vm.log.debug("Incomplete block stats, domain may be busy")
+            query[vm.id] = (vm, drives)
+
+    # Domains which were stopped, or with incomplete stats.
+    skipped = [vm for vm, _ in query.values()]
+
+    return queried, skipped
+
+
+def _last_resize(drives):
+    """
+    Return the time the last of drives was resized. Block stats sampled
+    before this time report the old size of the resized drive.
+    """
+    return max(drive.resize_time for drive in drives)
+
+
+def _headroom(drive):
+    """
+    Return the free space of drive above the watermark limit. Negative
+    value means the drive needs extension.
+    """
+    block_info = drive.block_info
+    free_space = block_info.physical - block_info.allocation
+    return free_space - drive.watermarkLimit
+
+
 _TARGET_RE = re.compile(r"([hvs]d[a-z]+)\[(\d+)\]")
 
 
@@ -485,6 +485,7 @@ class Vm(object):
         self._migration_downtime = None
         self._pause_code = None
         self._last_disk_mapping_hash = None
+        self._sample_stats_cache = (None, None)
         self._external_data = {}
         self._init_external_data(
             ExternalDataKind.TPM,
@@ -1326,6 +1327,28 @@ class Vm(object):
         _, raw_stats = res[0]
         return raw_stats
 
+    def sampled_block_stats(self, max_age, since=0.0):
+        """
+        Return stats for all block nodes from the last bulk stats sample, in
+        the same format as query_block_stats(), avoiding another libvirt
+        call.
+
+        Return None if the sample was taken more than max_age seconds ago,
+        or before since (monotonic time), or the sample does not include
+        complete block stats for this VM.
+        """
+        snapshot = sampling.stats_cache.snapshot()
+        if snapshot.timestamp < since:
+            return None
+        if sampling.stats_cache.clock() - snapshot.timestamp > max_age:
+            return None
+
+        raw_stats = snapshot.sample(self.id)
+        if raw_stats is None or not thinp.block_stats_complete(raw_stats):
+            return None
+
+        return raw_stats
+
     def extend_volume(self, vmDrive, volumeID, new_size, callback=None):
         """
         Extend drive volume and its replica volume during replication to
@@ -1878,17 +1901,17 @@ class Vm(object):
             # Here we need to do the reverse: check first if a VM is
             # monitorable, and only if it is, consider the stats_age.
             monitorable = self._monitorable
+            # Read the generation before getting the sample, so a sample
+            # added meanwhile invalidates the cached stats.
+            generation = sampling.stats_cache.generation
             vm_sample = sampling.stats_cache.get(self.id)
-            decStats = vmstats.produce(self,
-                                       vm_sample.first_value,
-                                       vm_sample.last_value,
-                                       vm_sample.interval)
+            sample_stats = self._getSampleStats(vm_sample, generation)
             if monitorable:
                 self._setUnresponsiveIfTimeout(stats, vm_sample.stats_age)
         except Exception:
             self.log.exception("Error fetching vm stats")
         else:
-            stats.update(vmstats.translate(decStats))
+            stats.update(sample_stats)
 
         stats.update(self._getGraphicsStats())
         devices_hash = self._domain.devices_hash
@@ -1913,6 +1936,29 @@ class Vm(object):
         stats.update(self._getVmTuneStats())
         return stats
 
+    def _getSampleStats(self, vm_sample, generation):
+        """
+        Return the stats computed from vm_sample.
+
+        Computing the stats is relatively expensive, and the rates computed
+        from the sample change only when a new bulk sample is added to the
+        stats cache, or when the VM devices change. Reuse the stats computed
+        in the previous call if both did not change, and update only the
+        stats that may change without a new sample, like disk sizes, ioTune
+        and balloon info.
+        """
+        key = (generation, self._domain.devices_hash)
+        cached_key, sample_stats = self._sample_stats_cache
+        if cached_key != key:
+            decStats = vmstats.produce(self,
+                                       vm_sample.first_value,
+                                       vm_sample.last_value,
+                                       vm_sample.interval)
+            sample_stats = vmstats.translate(decStats)
+            self._sample_stats_cache = (key, sample_stats)
+
+        return vmstats.live_stats(self, sample_stats, vm_sample.last_value)
+
     def _getVmTuneStats(self):
         stats = {}
 
@@ -4194,15 +4240,50 @@ class Vm(object):
         if not vmDrive.device == 'disk' or not isVdsmImage(vmDrive):
             return
 
+        # The size of a block volume is the size of the block device, which
+        # is reported in the bulk stats sample, so we don't need to access
+        # storage.
+        if vmDrive.diskType == DISK_TYPE.BLOCK:
+            physical = self._sampled_drive_physical(vmDrive)
+            if physical is not None:
+                vmDrive.truesize = physical
+                vmDrive.apparentsize = physical
+                return
+
         volSize = self.getVolumeSize(
             vmDrive.domainID,
             vmDrive.poolID,
             vmDrive.imageID,
             vmDrive.volumeID)
 
+        vmDrive.resize_time = time.monotonic()
         vmDrive.truesize = volSize.truesize
         vmDrive.apparentsize = volSize.apparentsize
 
+    def _sampled_drive_physical(self, vmDrive):
+        """
+        Return the physical size of the drive top volume from the last bulk
+        stats sample, or None if not available.
+        """
+        # A sample taken before the last size update, for example before an
+        # extend completed, reports the old size.
+        raw_stats = self.sampled_block_stats(
+            config.getint('irs', 'vol_size_sample_interval'),
+            since=vmDrive.resize_time)
+        if raw_stats is None:
+            return None
+
+        for i in range(raw_stats["block.count"]):
+            if raw_stats.get("block.%d.name" % i) == vmDrive.name:
+                # The top node is reported first. If the top volume was
+                # changed after the sample was taken, the path does not
+                # match.
+                if raw_stats.get("block.%d.path" % i) != vmDrive.path:
+                    return None
+                return raw_stats.get("block.%d.physical" % i)
+
+        return None
+
     def updateDriveParameters(self, driveParams):
         """Update the drive with the new volume information"""
 
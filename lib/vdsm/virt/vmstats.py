@@ -21,6 +21,7 @@
 from __future__ import absolute_import
 from __future__ import division
 
+from collections import namedtuple
 import contextlib
 import logging
 
@@ -53,6 +54,39 @@ def produce(vm, first_sample, last_sample, interval):
     return stats
 
 
+def live_stats(vm, sample_stats, last_sample):
+    """
+    Return a copy of sample_stats, the translated stats produced from a
+    sample, with the stats that may change without a new sample updated
+    from the vm: disk sizes, ioTune and balloon info.
+    """
+    live = {}
+    balloon(vm, live, last_sample)
+    tune_io(vm, live)
+
+    stats = dict(sample_stats)
+    stats.pop('balloonInfo', None)
+    stats.pop('ioTune', None)
+    stats.update(translate(live))
+
+    disk_stats = sample_stats.get('disks')
+    if disk_stats:
+        disk_stats = {name: dict(value) for name, value in disk_stats.items()}
+        for vm_drive in vm.getDiskDevices():
+            drive_stats = disk_stats.get(vm_drive.name)
+            if drive_stats is None:
+                continue
+            try:
+                drive_stats['truesize'] = str(vm_drive.truesize)
+                drive_stats['apparentsize'] = str(vm_drive.apparentsize)
+            except AttributeError:
+                _log.exception("Disk %s stats not available",
+                               vm_drive.name)
+        stats['disks'] = disk_stats
+
+    return stats
+
+
 def translate(vm_stats):
     stats = {}
 
@@ -246,8 +280,8 @@ def networks(vm, stats, first_sample, last_sample, interval):
             interval, vm.id)
         return None
 
-    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'net')
-    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'net')
+    first_indexes = _nic_indexes(first_sample)
+    last_indexes = _nic_indexes(last_sample)
 
     for nic in vm.getNicDevices():
         if nic.is_hostdevice:
@@ -289,9 +323,9 @@ def disks(vm, stats, first_sample, last_sample, interval):
     # libvirt does not guarantee that disk will returned in the same
     # order across calls. It is usually like this, but not always,
     # for example if hotplug/hotunplug comes into play.
-    # To be safe, we need to find the mapping after each call.
-    first_indexes = _find_bulk_stats_reverse_map(first_sample, 'block')
-    last_indexes = _find_bulk_stats_reverse_map(last_sample, 'block')
+    # To be safe, we need to find the mapping for each sample.
+    first_counters = _disk_counters(first_sample)
+    last_counters = _disk_counters(last_sample)
     disk_stats = {}
 
     for vm_drive in vm.getDiskDevices():
@@ -299,8 +333,10 @@ def disks(vm, stats, first_sample, last_sample, interval):
         try:
             drive_stats = disk_info(vm_drive)
 
-            if (vm_drive.name in first_indexes and
-               vm_drive.name in last_indexes):
+            if (vm_drive.name in first_counters and
+               vm_drive.name in last_counters):
+                first = first_counters[vm_drive.name]
+                last = last_counters[vm_drive.name]
                 # will be None if sampled during recovery
                 if interval <= 0:
                     _log.warning(
@@ -308,19 +344,9 @@ def disks(vm, stats, first_sample, last_sample, interval):
                         'stats for vm %s disk %s',
                         interval, vm.id, vm_drive.name)
                 else:
-                    drive_stats.update(
-                        _disk_rate(
-                            first_sample, first_indexes[vm_drive.name],
-                            last_sample, last_indexes[vm_drive.name],
-                            interval))
-                drive_stats.update(
-                    _disk_latency(
-                        first_sample, first_indexes[vm_drive.name],
-                        last_sample, last_indexes[vm_drive.name]))
-                drive_stats.update(
-                    _disk_iops_bytes(
-                        first_sample, first_indexes[vm_drive.name],
-                        last_sample, last_indexes[vm_drive.name]))
+                    drive_stats.update(_disk_rate(first, last, interval))
+                drive_stats.update(_disk_latency(first, last))
+                drive_stats.update(_disk_iops_bytes(last))
 
         except AttributeError:
             _log.exception("Disk %s stats not available",
@@ -355,37 +381,33 @@ def disk_info(vm_drive):
     return drive_stats
 
 
-def _disk_rate(first_sample, first_index, last_sample, last_index, interval):
+def _disk_rate(first, last, interval):
     stats = {}
 
-    for name, mode in (("readRate", "rd"), ("writeRate", "wr")):
-        first_key = 'block.%d.%s.bytes' % (first_index, mode)
-        last_key = 'block.%d.%s.bytes' % (last_index, mode)
-        try:
-            first_value = first_sample[first_key]
-            last_value = last_sample[last_key]
-        except KeyError:
+    for name, first_value, last_value in (
+            ("readRate", first.rd_bytes, last.rd_bytes),
+            ("writeRate", first.wr_bytes, last.wr_bytes)):
+        if first_value is None or last_value is None:
             continue
         stats[name] = str((last_value - first_value) / interval)
 
     return stats
 
 
-def _disk_latency(first_sample, first_index, last_sample, last_index):
+def _disk_latency(first, last):
     stats = {}
 
-    for name, mode in (('readLatency', 'rd'),
-                       ('writeLatency', 'wr'),
-                       ('flushLatency', 'fl')):
-        try:
-            last_key = "block.%d.%s" % (last_index, mode)
-            first_key = "block.%d.%s" % (first_index, mode)
-            operations = (last_sample[last_key + ".reqs"] -
-                          first_sample[first_key + ".reqs"])
-            elapsed_time = (last_sample[last_key + ".times"] -
-                            first_sample[first_key + ".times"])
-        except KeyError:
+    for name, first_reqs, last_reqs, first_times, last_times in (
+            ('readLatency', first.rd_reqs, last.rd_reqs,
+             first.rd_times, last.rd_times),
+            ('writeLatency', first.wr_reqs, last.wr_reqs,
+             first.wr_times, last.wr_times),
+            ('flushLatency', first.fl_reqs, last.fl_reqs,
+             first.fl_times, last.fl_times)):
+        if None in (first_reqs, last_reqs, first_times, last_times):
             continue
+        operations = last_reqs - first_reqs
+        elapsed_time = last_times - first_times
         if operations:
             stats[name] = str(elapsed_time / operations)
         else:
@@ -394,23 +416,68 @@ def _disk_latency(first_sample, first_index, last_sample, last_index):
     return stats
 
 
-def _disk_iops_bytes(first_sample, first_index, last_sample, last_index):
+def _disk_iops_bytes(last):
     stats = {}
 
-    for name, mode, field in (('readOps', 'rd', 'reqs'),
-                              ('writeOps', 'wr', 'reqs'),
-                              ('readBytes', 'rd', 'bytes'),
-                              ('writtenBytes', 'wr', 'bytes')):
-        key = 'block.%d.%s.%s' % (last_index, mode, field)
-        try:
-            value = last_sample[key]
-        except KeyError:
-            continue
-        stats[name] = str(value)
+    for name, value in (('readOps', last.rd_reqs),
+                        ('writeOps', last.wr_reqs),
+                        ('readBytes', last.rd_bytes),
+                        ('writtenBytes', last.wr_bytes)):
+        if value is not None:
+            stats[name] = str(value)
 
     return stats
 
 
+# Disk counters used to compute disk stats. A counter missing in the bulk
+# stats is None.
+_DiskCounters = namedtuple('_DiskCounters', [
+    'rd_bytes', 'wr_bytes',
+    'rd_reqs', 'wr_reqs', 'fl_reqs',
+    'rd_times', 'wr_times', 'fl_times',
+])
+
+_DISK_COUNTER_KEYS = tuple(
+    name.replace('_', '.') for name in _DiskCounters._fields)
+
+
+class BulkSample(dict):
+    """
+    Libvirt bulk stats of a single VM, with the devices indexed by name.
+
+    Created once for every VM when a bulk sample is taken, so computing the
+    stats of a VM does not need to look up the devices in the same sample
+    again and again.
+    """
+
+    def __init__(self, stats):
+        dict.__init__(self, stats)
+        self.nic_indexes = _find_bulk_stats_reverse_map(self, 'net')
+        self.disk_counters = _find_disk_counters(self)
+
+
+def _nic_indexes(sample):
+    if isinstance(sample, BulkSample):
+        return sample.nic_indexes
+    return _find_bulk_stats_reverse_map(sample, 'net')
+
+
+def _disk_counters(sample):
+    if isinstance(sample, BulkSample):
+        return sample.disk_counters
+    return _find_disk_counters(sample)
+
+
+def _find_disk_counters(stats):
+    counters = {}
+    for name, idx in six.iteritems(
+            _find_bulk_stats_reverse_map(stats, 'block')):
+        prefix = 'block.%d.' % idx
+        counters[name] = _DiskCounters._make(
+            stats.get(prefix + key) for key in _DISK_COUNTER_KEYS)
+    return counters
+
+
 def _usage_percentage(val, interval):
     return 100 * val / interval / 1000 ** 3
 
@@ -427,7 +494,9 @@ def _find_bulk_stats_reverse_map(stats, group):
             # an upper bound more like a precise indicator.
             pass
         else:
-            name_to_idx[name] = idx
+            # With backing chain stats, the backing chain nodes use the same
+            # name as the top node reported before them.
+            name_to_idx.setdefault(name, idx)
     return name_to_idx
 
 
@@ -16,15 +16,22 @@
 from __future__ import absolute_import
 from __future__ import division
 import logging
+import threading
 from six.moves import queue
 
+from vdsm.common import concurrent
 from vdsm.common import exception as vdsmexception
 
 from vdsm.common.compat import json
+from vdsm.common.compat import orjson
 from vdsm.common.logutils import Suppressed, traceback
 from vdsm.common.threadlocal import vars
 from vdsm.common.time import monotonic_time, event_time
-from vdsm.common.password import protect_passwords, unprotect_passwords
+from vdsm.common.password import (
+    ProtectedPassword,
+    protect_passwords,
+    unprotect_passwords,
+)
 
 from yajsonrpc import exception
 
@@ -39,6 +46,33 @@ _STATE_ONESHOT = 4
 _SLOW_CALL_THRESHOLD = 1.0
 
 
+def _encode_default(obj):
+    if isinstance(obj, ProtectedPassword):
+        return obj.value
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % type(obj).__name__)
+
+
+def encode_json(obj):
+    """
+    Encode obj to JSON bytes.
+
+    Use orjson if available, falling back to json for objects orjson cannot
+    encode, like integers larger than 64 bits. ProtectedPassword objects are
+    encoded as their values, so there is no need to copy obj to unprotect
+    them before encoding.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                obj,
+                default=_encode_default,
+                option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, default=_encode_default).encode("utf-8")
+
+
 class JsonRpcRequest(object):
     def __init__(self, method, params=(), reqId=None):
         self.method = method
@@ -102,11 +136,24 @@ class JsonRpcRequest(object):
 
 class JsonRpcResponse(object):
     def __init__(self, result=None, error=None, reqId=None):
-        self.result = unprotect_passwords(result)
+        # Unprotecting passwords copies the entire result, so we do it only
+        # if the result is accessed. encode_bytes() does not need a copy.
+        self._result = result
+        self._unprotected = result is None
         self.error = error
         self.id = reqId
 
+    @property
+    def result(self):
+        if not self._unprotected:
+            self._result = unprotect_passwords(self._result)
+            self._unprotected = True
+        return self._result
+
     def toDict(self):
+        return self._toDict(self.result)
+
+    def _toDict(self, result):
         res = {'jsonrpc': '2.0',
                'id': self.id}
 
@@ -114,7 +161,7 @@ class JsonRpcResponse(object):
             res['error'] = {'code': self.error.code,
                             'message': str(self.error)}
         else:
-            res['result'] = self.result
+            res['result'] = result
 
         return res
 
@@ -122,6 +169,15 @@ class JsonRpcResponse(object):
         res = self.toDict()
         return json.dumps(res)
 
+    def encode_bytes(self):
+        """
+        Encode the response to JSON bytes without copying the result.
+
+        The id is always encoded before the result, so the receiver can find
+        it without decoding the entire response.
+        """
+        return encode_json(self._toDict(self._result))
+
     @staticmethod
     def decode(msg):
         obj = json.loads(msg)
@@ -224,19 +280,19 @@ class _JsonRpcServeRequestContext(object):
         encodedObjects = []
         for response in self._responses:
             try:
-                encodedObjects.append(response.encode())
+                encodedObjects.append(response.encode_bytes())
             except:  # Error encoding data
                 response = JsonRpcResponse(None,
                                            exception.JsonRpcInternalError(),
                                            response.id)
-                encodedObjects.append(response.encode())
+                encodedObjects.append(response.encode_bytes())
 
         if len(encodedObjects) == 1:
             data = encodedObjects[0]
         else:
-            data = '[' + ','.join(encodedObjects) + ']'
+            data = b'[' + b','.join(encodedObjects) + b']'
 
-        self._client.send(data.encode('utf-8'))
+        self._client.send(data)
 
     def addResponse(self, response):
         self._responses.append(response)
@@ -274,17 +330,24 @@ class JsonRpcServer(object):
 
     """
     Creates new JsonrRpcServer by providing a bridge, timeout in seconds
-    which defining how often we should log connections stats and thread
-    factory.
+    which defining how often we should log connections stats, thread
+    factory and number of threads parsing incoming messages.
     """
-    def __init__(self, bridge, timeout, cif, threadFactory=None):
+    def __init__(self, bridge, timeout, cif, threadFactory=None,
+                 parse_workers=1):
         self._bridge = bridge
         self._cif = cif
         self._workQueue = queue.Queue()
         self._threadFactory = threadFactory
+        self._parse_workers = parse_workers
         self._timeout = timeout
         self._next_report = monotonic_time() + self._timeout
+        self._stats_lock = threading.Lock()
         self._counter = 0
+        self._parsed = 0
+        self._parse_time = 0.0
+        self._max_parse_time = 0.0
+        self._max_queue_depth = 0
 
     def queueRequest(self, req):
         self._workQueue.put_nowait(req)
@@ -292,15 +355,38 @@ class JsonRpcServer(object):
     """
     Aggregates number of requests received by vdsm. Each request from
     a batch is added separately. After time defined by timeout we log
-    number of requests.
+    number of requests, and the time spent parsing incoming messages.
     """
     def _attempt_log_stats(self):
-        self._counter += 1
-        if monotonic_time() > self._next_report:
-            self.log.info('%s requests processed during %s seconds',
-                          self._counter, self._timeout)
-            self._next_report += self._timeout
-            self._counter = 0
+        with self._stats_lock:
+            self._counter += 1
+            if monotonic_time() > self._next_report:
+                if self._parsed:
+                    parse_avg = self._parse_time / self._parsed * 1000
+                else:
+                    parse_avg = 0.0
+                self.log.info('%s requests processed during %s seconds, '
+                              '%s messages parsed (average %.2f ms, '
+                              'max %.2f ms), max queue depth %s',
+                              self._counter, self._timeout, self._parsed,
+                              parse_avg, self._max_parse_time * 1000,
+                              self._max_queue_depth)
+                self._next_report += self._timeout
+                self._counter = 0
+                self._parsed = 0
+                self._parse_time = 0.0
+                self._max_parse_time = 0.0
+                self._max_queue_depth = 0
+
+    def _record_parse(self, duration):
+        with self._stats_lock:
+            self._parsed += 1
+            self._parse_time += duration
+            self._max_parse_time = max(self._max_parse_time, duration)
+
+    def _record_queue_depth(self, depth):
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
 
     def _serveRequest(self, ctx, req):
         start_time = monotonic_time()
@@ -366,20 +452,68 @@ class JsonRpcServer(object):
 
     @traceback(log=log)
     def serve_requests(self):
+        if self._parse_workers > 1:
+            self._serve_with_workers()
+            return
+
         while True:
             obj = self._workQueue.get()
             if obj is None:
                 break
 
+            self._record_queue_depth(self._workQueue.qsize())
+            self._parseMessage(obj)
+
+    def _serve_with_workers(self):
+        """
+        Distribute incoming messages to parse workers.
+
+        Messages from the same connection are always parsed by the same
+        worker, so requests from one client are dispatched in the order they
+        were received.
+        """
+        queues = [queue.Queue() for i in range(self._parse_workers)]
+        workers = []
+        for i, q in enumerate(queues):
+            t = concurrent.thread(
+                self._parse_requests, args=(q,),
+                name="JsonRpcParser/%d" % i, log=self.log)
+            t.start()
+            workers.append(t)
+
+        try:
+            while True:
+                obj = self._workQueue.get()
+                if obj is None:
+                    break
+
+                client = obj[0]
+                self._record_queue_depth(
+                    self._workQueue.qsize() + sum(q.qsize() for q in queues))
+                queues[hash(client) % len(queues)].put_nowait(obj)
+        finally:
+            for q in queues:
+                q.put_nowait(None)
+            for t in workers:
+                t.join()
+
+    def _parse_requests(self, q):
+        while True:
+            obj = q.get()
+            if obj is None:
+                break
+
             self._parseMessage(obj)
 
     def _parseMessage(self, obj):
+        start_time = monotonic_time()
         client, server_address, context, msg = obj
         ctx = _JsonRpcServeRequestContext(client, server_address, context)
 
         try:
             rawRequests = json.loads(msg)
         except:
+            self._record_parse(monotonic_time() - start_time)
             ctx.addResponse(JsonRpcResponse(
                 None, exception.JsonRpcParseError(), None))
             ctx.sendReply()
@@ -388,6 +522,7 @@ class JsonRpcServer(object):
         if isinstance(rawRequests, list):
             # Empty batch request
             if len(rawRequests) == 0:
+                self._record_parse(monotonic_time() - start_time)
                 ctx.addResponse(
                     JsonRpcResponse(
                         None, exception.JsonRpcInvalidRequestError(
@@ -411,6 +546,8 @@ class JsonRpcServer(object):
                 ctx.addResponse(JsonRpcResponse(
                     None, exception.JsonRpcInternalError(), None))
 
+        self._record_parse(monotonic_time() - start_time)
+
         ctx.setRequests(requests)
 
         # No request was built successfully or is only notifications
@@ -500,7 +500,9 @@ class AsyncDispatcher(object):
                 except IndexError:
                     return
 
-                self._outbuf = frame.encode()
+                # Use a memoryview so partial sends of large frames do not
+                # copy the rest of the frame.
+                self._outbuf = memoryview(frame.encode())
 
             data = self._outbuf
             numSent = dispatcher.send(data)
@@ -16,6 +16,7 @@
 from __future__ import absolute_import
 from __future__ import division
 import logging
+import re
 from collections import deque
 import functools
 
@@ -26,6 +27,50 @@ from . import stomp, stompclient
 from .betterAsyncore import Dispatcher, Reactor
 
 
+# Responses encoded by JsonRpcResponse.encode_bytes() start with the protocol
+# version and the id.
+_RESPONSE_PREFIX = re.compile(
+    br'\{\s*"jsonrpc"\s*:\s*"2\.0"\s*,\s*"id"\s*:\s*')
+
+# Longest id value we try to decode from the start of a response.
+_MAX_ID_SIZE = 256
+
+_decoder = json.JSONDecoder()
+
+
+def response_id(message):
+    """
+    Return the id of a JSON-RPC response message.
+
+    Decoding a large response just to find the id is expensive, so we try
+    to decode only the id at the start of the message, falling back to
+    decoding the entire message.
+
+    Raises ValueError if message is not a JSON object.
+    """
+    if isinstance(message, bytes):
+        match = _RESPONSE_PREFIX.match(message)
+        if match:
+            start = match.end()
+            head = message[start:start + _MAX_ID_SIZE]
+            text = head.decode("utf-8", "ignore")
+            try:
+                value, end = _decoder.raw_decode(text)
+            except ValueError:
+                pass
+            else:
+                # Make sure the id was not truncated.
+                if text[end:].lstrip()[:1] in (",", "}"):
+                    return value
+
+    resp = json.loads(message)
+    if not isinstance(resp, dict):
+        raise ValueError(
+            'Provided message %s failed parsing to dictionary' % message)
+    # pylint: disable=no-member
+    return resp.get("id")
+
+
 def parseHeartBeatHeader(v):
     try:
         x, y = v.split(",", 1)
@@ -304,16 +349,11 @@ class StompServer(object):
     Sends message to all subscribes that subscribed to destination.
     """
     def send(self, message, destination=stomp.SUBSCRIPTION_ID_RESPONSE):
-        resp = json.loads(message)
-        if not isinstance(resp, dict):
-            raise ValueError(
-                'Provided message %s failed parsing to dictionary' % message)
-        # pylint: disable=no-member
-        response_id = resp.get("id")
+        resp_id = response_id(message)
 
         try:
-            destination = self._req_dest[response_id]
-            del self._req_dest[response_id]
+            destination = self._req_dest[resp_id]
+            del self._req_dest[resp_id]
         except KeyError:
             # we could have no reply-to or we could send events (no message id)
             pass
@@ -22,11 +22,15 @@ from __future__ import absolute_import
 from __future__ import division
 
 import collections
+import threading
+
+import pytest
 
 from testlib import VdsmTestCase as TestCaseBase
 from testlib import permutations, expandPermutations
 
 from vdsm.common import cache
+from vdsm.common import concurrent
 
 
 @expandPermutations
@@ -87,3 +91,191 @@ class TestMemoized(TestCaseBase):
 @cache.memoized
 def memoized_function(test, *args):
     return test.get(args)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class Counter(object):
+
+    def __init__(self, value="value"):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_ttl_cache_expire():
+    clock = FakeClock()
+    c = cache.TTLCache(2, clock=clock)
+    func = Counter()
+
+    assert c.get("key", func) == "value"
+    clock.now = 1
+    assert c.get("key", func) == "value"
+    assert func.calls == 1
+
+    clock.now = 2
+    assert c.get("key", func) == "value"
+    assert func.calls == 2
+
+
+def test_ttl_cache_keys():
+    c = cache.TTLCache(2, clock=FakeClock())
+    a = Counter("a")
+    b = Counter("b")
+    assert c.get("a", a) == "a"
+    assert c.get("b", b) == "b"
+    assert c.get("a", a) == "a"
+    assert (a.calls, b.calls) == (1, 1)
+
+
+def test_ttl_cache_disabled():
+    c = cache.TTLCache(0, clock=FakeClock())
+    func = Counter()
+    c.get("key", func)
+    c.get("key", func)
+    assert func.calls == 2
+
+
+def test_ttl_cache_invalidate():
+    c = cache.TTLCache(2, clock=FakeClock())
+    func = Counter()
+    c.get("key", func)
+    c.invalidate()
+    c.get("key", func)
+    assert func.calls == 2
+
+
+def test_ttl_cache_error_not_cached():
+    c = cache.TTLCache(2, clock=FakeClock())
+
+    def fail():
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        c.get("key", fail)
+    assert c.get("key", Counter()) == "value"
+
+
+class BlockingFunc(object):
+
+    def __init__(self, value="value"):
+        self.value = value
+        self.calls = 0
+        self.started = threading.Event()
+        self.resume = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.resume.wait(5)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+class Waiters(object):
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._count = 0
+
+    def added(self):
+        with self._cond:
+            self._count += 1
+            self._cond.notify_all()
+
+    def wait_for(self, count):
+        with self._cond:
+            assert self._cond.wait_for(lambda: self._count == count, 5)
+
+
+@pytest.fixture
+def waiters(monkeypatch):
+    waiters = Waiters()
+    wait = cache._Call.wait
+
+    def counting_wait(self):
+        waiters.added()
+        return wait(self)
+
+    monkeypatch.setattr(cache._Call, "wait", counting_wait)
+    return waiters
+
+
+def start_callers(c, key, func, count):
+    results = []
+
+    def run():
+        try:
+            results.append(c.get(key, func))
+        except Exception as e:
+            results.append(e)
+
+    threads = [concurrent.thread(run) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results
+
+
+def test_ttl_cache_coalesce(waiters):
+    c = cache.TTLCache(0, clock=FakeClock())
+    func = BlockingFunc()
+    first, results = start_callers(c, "key", func, 1)
+    assert func.started.wait(5)
+
+    others, others_results = start_callers(c, "key", func, 4)
+    waiters.wait_for(4)
+    func.resume.set()
+    for t in first + others:
+        t.join()
+
+    assert func.calls == 1
+    assert results == ["value"]
+    assert others_results == ["value"] * 4
+
+
+def test_ttl_cache_coalesce_error(waiters):
+    c = cache.TTLCache(2, clock=FakeClock())
+    error = RuntimeError("failed")
+    func = BlockingFunc(error)
+    first, _ = start_callers(c, "key", func, 1)
+    assert func.started.wait(5)
+
+    others, results = start_callers(c, "key", func, 4)
+    waiters.wait_for(4)
+    func.resume.set()
+    for t in first + others:
+        t.join()
+
+    assert func.calls == 1
+    assert results == [error] * 4
+
+
+def test_ttl_cache_invalidate_running():
+    c = cache.TTLCache(2, clock=FakeClock())
+    stale = BlockingFunc("stale")
+    threads, _ = start_callers(c, "key", stale, 1)
+    assert stale.started.wait(5)
+
+    # The running call may return a stale value; new callers do not wait
+    # for it, and its value is not cached.
+    c.invalidate()
+    fresh = Counter("fresh")
+    assert c.get("key", fresh) == "fresh"
+
+    stale.resume.set()
+    for t in threads:
+        t.join()
+
+    assert c.get("key", fresh) == "fresh"
+    assert fresh.calls == 1
@@ -0,0 +1,272 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+import time
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common import muxrpc
+
+
+class Unpicklable(Exception):
+
+    def __init__(self, a, b):
+        super(Unpicklable, self).__init__("%s %s" % (a, b))
+
+
+class Instance(object):
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.resume = threading.Event()
+
+    def echo(self, *args, **kwargs):
+        self.calls.append("echo")
+        return args, kwargs
+
+    def block(self):
+        self.calls.append("block")
+        self.started.set()
+        if not self.resume.wait(5):
+            raise RuntimeError("Timeout waiting for resume")
+        return "unblocked"
+
+    def fail(self, msg):
+        self.calls.append("fail")
+        raise ValueError(msg)
+
+    def fail_unpicklable(self):
+        raise Unpicklable("a", "b")
+
+    def _private(self):
+        self.calls.append("_private")
+
+
+@pytest.fixture
+def instance():
+    return Instance()
+
+
+@pytest.fixture
+def address(tmpdir):
+    return str(tmpdir.join("mux.sock"))
+
+
+def start_server(address, instance, idle_workers=4):
+    server = muxrpc.Server(address, instance, idle_workers=idle_workers)
+    t = concurrent.thread(server.serve_forever)
+    t.start()
+    return server, t
+
+
+@pytest.fixture
+def server(address, instance):
+    server, t = start_server(address, instance)
+    yield server
+    instance.resume.set()
+    server.shutdown()
+    t.join()
+
+
+@pytest.fixture
+def client(server, address):
+    client = muxrpc.Client(address)
+    yield client
+    client.close()
+
+
+def test_call(client):
+    assert client.call("echo", (1, "2"), {"k": "v"}) == ((1, "2"), {"k": "v"})
+
+
+def test_call_error(client):
+    with pytest.raises(ValueError) as e:
+        client.call("fail", ("message",))
+    assert str(e.value) == "message"
+
+
+def test_call_unpicklable_error(client):
+    with pytest.raises(muxrpc.RemoteError) as e:
+        client.call("fail_unpicklable")
+    assert "Unpicklable" in str(e.value)
+
+    # The connection is still usable.
+    assert client.call("echo") == ((), {})
+
+
+def test_call_private(client, instance):
+    with pytest.raises(AttributeError):
+        client.call("_private")
+    assert instance.calls == []
+
+
+def test_call_missing(client):
+    with pytest.raises(AttributeError):
+        client.call("missing")
+
+
+def test_concurrent_calls(client, instance):
+    # A blocked call does not block other calls on the same connection.
+    blocked = concurrent.thread(client.call, args=("block",))
+    blocked.start()
+    try:
+        assert instance.started.wait(5)
+        for i in range(10):
+            assert client.call("echo", (i,)) == ((i,), {})
+    finally:
+        instance.resume.set()
+        blocked.join()
+
+
+def test_batch(client, instance):
+    results = client.batch([
+        ("echo", (1,), {}),
+        ("echo", (2,), {}),
+    ])
+    assert results == [((1,), {}), ((2,), {})]
+
+
+def test_batch_error(client, instance):
+    with pytest.raises(ValueError):
+        client.batch([
+            ("echo", (1,), {}),
+            ("fail", ("message",), {}),
+            ("echo", (2,), {}),
+        ])
+    # Calls after the failing call are not run.
+    assert instance.calls == ["echo", "fail"]
+
+
+def test_shutdown(address, instance):
+    server, t = start_server(address, instance)
+    server.shutdown()
+    t.join()
+    assert not os.path.exists(address)
+
+
+def test_call_after_close(client):
+    client.close()
+    with pytest.raises(muxrpc.Closed):
+        client.call("echo")
+
+
+def test_pending_calls_fail_on_close(client, instance):
+    result = {}
+
+    def call():
+        try:
+            client.call("block")
+        except Exception as e:
+            result["error"] = e
+
+    t = concurrent.thread(call)
+    t.start()
+    assert instance.started.wait(5)
+    client.close()
+    t.join()
+    assert isinstance(result["error"], muxrpc.Closed)
+
+
+def test_blocked_calls_do_not_starve(address, instance):
+    server, t = start_server(address, instance, idle_workers=1)
+    client = muxrpc.Client(address)
+    blocked = []
+    try:
+        # Block more calls than idle workers.
+        for i in range(3):
+            instance.started.clear()
+            b = concurrent.thread(client.call, args=("block",))
+            b.start()
+            blocked.append(b)
+            assert instance.started.wait(5)
+
+        # Other calls are not delayed by the blocked calls.
+        for i in range(10):
+            assert client.call("echo", (i,)) == ((i,), {})
+    finally:
+        instance.resume.set()
+        for b in blocked:
+            b.join()
+        client.close()
+        server.shutdown()
+        t.join()
+
+
+def test_pool_burst():
+    pool = muxrpc._Pool(2)
+    started = []
+    lock = threading.Lock()
+    resume = threading.Event()
+
+    def task():
+        with lock:
+            started.append(None)
+        # Longer than wait_for() timeout, so a task waiting for a blocked
+        # task fails the test.
+        if not resume.wait(10):
+            raise RuntimeError("Timeout waiting for resume")
+
+    try:
+        for i in range(2):
+            pool.dispatch(task)
+
+        for i in range(20):
+            # Wait until the workers are idle.
+            resume.set()
+            wait_for(lambda: pool._idle == 2)
+            resume.clear()
+            del started[:]
+
+            # A burst larger than the idle workers runs all tasks, even if
+            # the idle workers did not wake up yet.
+            for i in range(5):
+                pool.dispatch(task)
+            wait_for(lambda: len(started) == 5)
+    finally:
+        resume.set()
+        pool.stop()
+
+
+def test_shutdown_stops_workers(address, instance):
+    server, t = start_server(address, instance, idle_workers=1)
+    client = muxrpc.Client(address)
+    try:
+        for i in range(10):
+            assert client.call("echo", (i,)) == ((i,), {})
+    finally:
+        client.close()
+        server.shutdown()
+        t.join()
+    assert not server._pool._workers
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("Timeout waiting for condition")
+        time.sleep(0.01)
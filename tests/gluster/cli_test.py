@@ -22,8 +22,12 @@ from __future__ import absolute_import
 from __future__ import division
 
 import os
+import xml.etree.ElementTree as etree
+
 import pytest
 
+from vdsm.common import cache
+from vdsm.common import cmdutils
 from vdsm.gluster import cli
 from vdsm.gluster import exception as ge
 
@@ -51,3 +55,259 @@ def test_getTree(relative_filepath, expected):
 def test_get_tree_empty_input():
     with pytest.raises(ge.GlusterXmlErrorException):
         cli._getTree("")
+
+
+VOLUME_INFO = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>0</opRet>
+  <opErrno>0</opErrno>
+  <opErrstr/>
+  <volInfo>
+    <volumes>
+%s
+      <count>%d</count>
+    </volumes>
+  </volInfo>
+</cliOutput>
+"""
+
+VOLUME = """\
+      <volume>
+        <name>vol%(index)d</name>
+        <id>00000000-0000-0000-0000-%(index)012d</id>
+        <status>1</status>
+        <statusStr>Started</statusStr>
+        <brickCount>%(count)d</brickCount>
+        <distCount>1</distCount>
+        <stripeCount>1</stripeCount>
+        <replicaCount>%(count)d</replicaCount>
+        <arbiterCount>0</arbiterCount>
+        <disperseCount>0</disperseCount>
+        <redundancyCount>0</redundancyCount>
+        <type>2</type>
+        <typeStr>Replicate</typeStr>
+        <transport>0</transport>
+        <bricks>
+%(bricks)s
+        </bricks>
+        <optCount>1</optCount>
+        <options>
+          <option>
+            <name>performance.readdir-ahead</name>
+            <value>on</value>
+          </option>
+        </options>
+      </volume>"""
+
+BRICK = """\
+          <brick uuid="%(uuid)s">host%(index)d:/bricks/b%(index)d\
+<name>host%(index)d:/bricks/b%(index)d</name><hostUuid>%(uuid)s</hostUuid>\
+<isArbiter>0</isArbiter></brick>"""
+
+VOLUME_STATUS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>0</opRet>
+  <opErrno>0</opErrno>
+  <opErrstr/>
+  <volStatus>
+    <volumes>
+      <volume>
+        <volName>vol0</volName>
+        <nodeCount>%d</nodeCount>
+%s
+      </volume>
+    </volumes>
+  </volStatus>
+</cliOutput>
+"""
+
+NODE = """\
+        <node>
+          <hostname>host%(index)d</hostname>
+          <path>/bricks/b%(index)d</path>
+          <peerid>00000000-0000-0000-0000-%(index)012d</peerid>
+          <status>1</status>
+          <port>%(port)d</port>
+          <ports>
+            <tcp>%(port)d</tcp>
+            <rdma>N/A</rdma>
+          </ports>
+          <pid>%(pid)d</pid>
+        </node>"""
+
+FAILED = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cliOutput>
+  <opRet>-1</opRet>
+  <opErrno>2</opErrno>
+  <opErrstr>Volume vol0 does not exist</opErrstr>
+</cliOutput>
+"""
+
+
+def volume_info_xml(volumes, bricks):
+    items = []
+    for i in range(volumes):
+        brick_items = [
+            BRICK % {"index": j, "uuid": "00000000-0000-0000-0000-%012d" % j}
+            for j in range(bricks)]
+        items.append(VOLUME % {"index": i,
+                               "count": bricks,
+                               "bricks": "\n".join(brick_items)})
+    return (VOLUME_INFO % ("\n".join(items), volumes)).encode("utf-8")
+
+
+def volume_status_xml(nodes):
+    items = [NODE % {"index": i, "port": 49152 + i, "pid": 1000 + i}
+             for i in range(nodes)]
+    return (VOLUME_STATUS % (nodes, "\n".join(items))).encode("utf-8")
+
+
+class FakeRun(object):
+
+    def __init__(self, out):
+        self.out = out
+        self.commands = []
+
+    def __call__(self, cmd):
+        self.commands.append(cmd)
+        return self.out
+
+
+@pytest.fixture
+def query_cache(monkeypatch):
+    monkeypatch.setattr(cli, "_queryCache", cache.TTLCache(60))
+    monkeypatch.setattr(cli, "_getLocalIpAddress", lambda: "10.0.0.1")
+    # The gluster command is never run, but must exist.
+    monkeypatch.setattr(
+        cli, "_glusterCommandPath", cmdutils.CommandPath("gluster", "/bin/sh"))
+
+
+def test_iterparse():
+    out = volume_info_xml(volumes=3, bricks=2)
+    names = [(path, el.findtext("name"))
+             for path, el in cli._iterparse(out, cli._VOLUME_INFO_PATHS)]
+    assert names == [
+        ("volInfo/volumes/volume", "vol0"),
+        ("volInfo/volumes/volume", "vol1"),
+        ("volInfo/volumes/volume", "vol2"),
+    ]
+
+
+def test_iterparse_failed():
+    with pytest.raises(ge.GlusterCmdFailedException) as e:
+        list(cli._iterparse(FAILED.encode("utf-8"), cli._VOLUME_INFO_PATHS))
+    assert e.value.rc == 2
+    assert e.value.err == ["Volume vol0 does not exist"]
+
+
+@pytest.mark.parametrize("out", [
+    b"",
+    b"<cliOutput><opRet>0</opRet>",
+    b"<cliOutput><volInfo/></cliOutput>",
+])
+def test_iterparse_invalid(out):
+    with pytest.raises(ge.GlusterXmlErrorException):
+        list(cli._iterparse(out, cli._VOLUME_INFO_PATHS))
+
+
+def test_volume_info_stream():
+    out = volume_info_xml(volumes=5, bricks=3)
+    stream = cli._volumeInfo(cli._iterparse(out, cli._VOLUME_INFO_PATHS))
+    assert stream == cli._parseVolumeInfo(etree.fromstring(out))
+    assert sorted(stream) == ["vol0", "vol1", "vol2", "vol3", "vol4"]
+    assert stream["vol1"]["bricksInfo"][2] == {
+        "name": "host2:/bricks/b2",
+        "hostUuid": "00000000-0000-0000-0000-000000000002",
+        "isArbiter": False,
+    }
+
+
+def test_volume_status_stream(query_cache):
+    out = volume_status_xml(nodes=4)
+    stream = cli._volumeStatus(cli._iterparse(out, cli._VOLUME_STATUS_PATHS))
+    assert stream == cli._parseVolumeStatus(etree.fromstring(out))
+    assert stream["name"] == "vol0"
+    assert len(stream["bricks"]) == 4
+
+
+def test_volume_info_cached(query_cache, monkeypatch):
+    run = FakeRun(volume_info_xml(volumes=2, bricks=1))
+    monkeypatch.setattr(cli.commands, "run", run)
+
+    first = cli.volumeInfo()
+    assert cli.volumeInfo() == first
+    assert len(run.commands) == 1
+
+    # Different query is not cached.
+    cli.volumeInfo("vol0")
+    assert len(run.commands) == 2
+
+
+def test_volume_info_invalidated(query_cache, monkeypatch):
+    run = FakeRun(volume_info_xml(volumes=1, bricks=1))
+    monkeypatch.setattr(cli.commands, "run", run)
+
+    cli.volumeInfo()
+    cli.volumeStart("vol0")
+    cli.volumeInfo()
+    assert len(run.commands) == 3
+
+
+def test_volume_info_invalidated_on_failure(query_cache, monkeypatch):
+    run = FakeRun(volume_info_xml(volumes=1, bricks=1))
+    monkeypatch.setattr(cli.commands, "run", run)
+    cli.volumeInfo()
+
+    def fail(cmd):
+        raise cmdutils.Error(cmd, 1, b"", b"error")
+
+    monkeypatch.setattr(cli.commands, "run", fail)
+    with pytest.raises(ge.GlusterVolumeStartFailedException):
+        cli.volumeStart("vol0")
+
+    monkeypatch.setattr(cli.commands, "run", run)
+    cli.volumeInfo()
+    assert len(run.commands) == 2
+
+
+def test_volume_info_not_invalidated_by_queries(query_cache, monkeypatch):
+    run = FakeRun(volume_info_xml(volumes=1, bricks=1))
+    monkeypatch.setattr(cli.commands, "run", run)
+    cli.volumeInfo()
+
+    monkeypatch.setattr(cli.commands, "run", FakeRun(b"UUID: uuid\n"))
+    cli.hostUUIDGet()
+
+    monkeypatch.setattr(cli.commands, "run", run)
+    cli.volumeInfo()
+    assert len(run.commands) == 1
+
+
+def test_volume_status_cached(query_cache, monkeypatch):
+    run = FakeRun(volume_status_xml(nodes=2))
+    monkeypatch.setattr(cli.commands, "run", run)
+
+    cli.volumeStatus("vol0")
+    cli.volumeStatus("vol0")
+    assert len(run.commands) == 1
+
+
+def test_volume_info_failed(query_cache, monkeypatch):
+    run = FakeRun(FAILED.encode("utf-8"))
+    monkeypatch.setattr(cli.commands, "run", run)
+
+    for _ in range(2):
+        with pytest.raises(ge.GlusterVolumesListFailedException):
+            cli.volumeInfo("vol0")
+
+    # Errors are not cached.
+    assert len(run.commands) == 2
+
+
+def test_volume_status_invalid(query_cache, monkeypatch):
+    run = FakeRun(b"<cliOutput><opRet>0</opRet><opErrno>0</opErrno>"
+                  b"<opErrstr/><volStatus/></cliOutput>")
+    monkeypatch.setattr(cli.commands, "run", run)
+
+    with pytest.raises(ge.GlusterXmlErrorException):
+        cli.volumeStatus("vol0")
@@ -21,11 +21,18 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import logging
 import os
 import tempfile
+import time
 import shutil
 
+import pytest
+
+from vdsm.common import hooks
+from vdsm.host import api as hostapi
 from vdsm.host import stats as hoststats
+from vdsm.virt import sampling
 from vdsm import numa
 
 from testlib import VdsmTestCase as TestCaseBase
@@ -33,6 +40,8 @@ from monkeypatch import MonkeyPatchScope
 
 from virt import vmfakelib as fake
 
+log = logging.getLogger("test")
+
 
 class BootTimeTests(TestCaseBase):
     proc_stat_template = """
@@ -209,6 +218,76 @@ class HostStatsThreadTests(TestCaseBase):
         )
 
 
+def proc_stat(cpus, jiffies):
+    lines = ["cpu  %d 0 %d %d 0 0 0 0 0 0" % (
+        jiffies * cpus, jiffies * cpus, jiffies * cpus)]
+    for cpu in range(cpus):
+        lines.append("cpu%d %d 0 %d %d 0 0 0 0 0 0" % (
+            cpu, jiffies, jiffies, jiffies))
+    lines.append("intr 238783451 19 0 0 0 0 0 0 0 1 0 0 0 0")
+    lines.append("btime 1395249141")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("cpus", [8, 64, 256])
+def test_cpu_core_stats_benchmark(monkeypatch, cpus):
+    """
+    Measure the time to parse /proc/stat and compute per core stats.
+
+    This test is best run like this:
+
+        $ tox -e virt tests/hoststats_test.py -- \\
+            -m slow -k test_cpu_core_stats_benchmark \\
+            --log-cli-level=info \\
+            | grep stats
+
+    Example output (trimmed):
+
+        stats: cpus=8 parse=0.000026 cpu_stats=0.000032
+        stats: cpus=64 parse=0.000149 cpu_stats=0.000197
+        stats: cpus=256 parse=0.000538 cpu_stats=0.000738
+    """
+    def topology():
+        # 2 numa nodes, half of the cpus in each node.
+        half = cpus // 2
+        return {
+            '0': {'cpus': list(range(half))},
+            '1': {'cpus': list(range(half, cpus))},
+        }
+
+    monkeypatch.setattr(numa, 'topology', topology)
+    first_stat = proc_stat(cpus, 1000)
+    last_stat = proc_stat(cpus, 1100)
+
+    parse_times = []
+    stats_times = []
+    for i in range(10):
+        start = time.monotonic()
+        first = fake.HostSample(1.0, {})
+        first.totcpu = sampling.TotalCpuSample(first_stat)
+        first.cpuCores = sampling.CpuCoreSample(first_stat)
+        parse_times.append(time.monotonic() - start)
+
+        last = fake.HostSample(2.0, {})
+        last.cpuCores = sampling.CpuCoreSample(last_stat)
+
+        start = time.monotonic()
+        result = hoststats._get_cpu_core_stats(first, last)
+        stats_times.append(time.monotonic() - start)
+
+    log.info("stats: cpus=%d parse=%.6f cpu_stats=%.6f",
+             cpus, min(parse_times), min(stats_times))
+
+    assert len(result) == cpus
+    assert result[str(cpus - 1)] == {
+        'nodeIndex': 1,
+        'cpuUser': '100.00',
+        'cpuSys': '100.00',
+        'cpuIdle': '0.00',
+    }
+
+
 class HostStatsNetworkTests(TestCaseBase):
 
     def test_report_format(self):
@@ -228,3 +307,21 @@ class HostStatsNetworkTests(TestCaseBase):
         self.assertIsInstance(iface_stats['rxErrors'], str)
         self.assertIsInstance(iface_stats['txErrors'], str)
         self.assertIsInstance(iface_stats['sampleTime'], float)
+
+
+def test_send_hooks_metrics(monkeypatch):
+    monkeypatch.setattr(hooks, '_stats', {})
+    hooks._recordElapsed('/hooks/before_vm_start/50_foo.py', 2.0)
+    hooks._recordElapsed('/hooks/before_vm_start/50_foo.py', 1.0)
+    sent = []
+    monkeypatch.setattr(hostapi.metrics, 'send', sent.append)
+
+    hostapi.send_metrics({'storageDomains': {}})
+
+    prefix = 'hosts.hooks.before_vm_start.50_foo_py'
+    assert sent == [{
+        prefix + '.count': 2,
+        prefix + '.total': 3.0,
+        prefix + '.max': 2.0,
+        prefix + '.last': 1.0,
+    }]
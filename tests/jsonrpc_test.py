@@ -20,8 +20,11 @@
 
 from __future__ import absolute_import
 from __future__ import division
+import threading
+
 from yajsonrpc import JsonRpcRequest, JsonRpcServer
 
+from vdsm.common import concurrent
 from vdsm.common import exception
 from vdsm.common.compat import json
 
@@ -38,6 +41,49 @@ class FakeContext(object):
         return self._res
 
 
+class FakeClient(object):
+
+    def __init__(self):
+        self.replies = []
+
+    def send(self, data):
+        self.replies.append(json.loads(data.decode('utf-8')))
+
+
+class FakeCif(object):
+    ready = True
+
+
+class EchoBridge(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def dispatch(self, method):
+        return self.echo
+
+    def echo(self, client, n):
+        with self.lock:
+            self.calls.append((client, n))
+        return n
+
+    def register_server_address(self, server_address):
+        pass
+
+    def unregister_server_address(self):
+        pass
+
+
+def echo_message(client, n):
+    return json.dumps({
+        "jsonrpc": "2.0",
+        "method": "echo",
+        "params": [client, n],
+        "id": "%s-%d" % (client, n),
+    })
+
+
 class ServerTests(VdsmTestCase):
 
     def test_full_pool(self):
@@ -63,3 +109,40 @@ class ServerTests(VdsmTestCase):
         self.assertEqual({"reason": "Too many tasks",
                           "resource": "test",
                           "current_tasks": 0}, reason)
+
+    def test_parse_workers_keep_order(self):
+        bridge = EchoBridge()
+        server = JsonRpcServer(bridge, 60, FakeCif(), parse_workers=4)
+        clients = [FakeClient() for i in range(8)]
+
+        t = concurrent.thread(server.serve_requests)
+        t.start()
+        try:
+            for n in range(50):
+                for i, client in enumerate(clients):
+                    server.queueRequest(
+                        (client, "127.0.0.1", None, echo_message(i, n)))
+        finally:
+            server.stop()
+            t.join()
+
+        # Requests from every client were served in order.
+        for i, client in enumerate(clients):
+            calls = [n for c, n in bridge.calls if c == i]
+            self.assertEqual(list(range(50)), calls)
+            results = [reply["result"] for reply in client.replies]
+            self.assertEqual(list(range(50)), results)
+
+    def test_parse_stats(self):
+        server = JsonRpcServer(EchoBridge(), 60, FakeCif())
+        client = FakeClient()
+
+        server.queueRequest((client, "127.0.0.1", None, echo_message(0, 0)))
+        server.queueRequest((client, "127.0.0.1", None, "invalid json"))
+        server.stop()
+        server.serve_requests()
+
+        self.assertEqual(2, server._parsed)
+        self.assertEqual(2, server._max_queue_depth)
+        self.assertEqual(1, server._counter)
+        self.assertEqual(-32700, client.replies[1]["error"]["code"])
@@ -31,10 +31,12 @@ import os.path
 import pickle
 import pytest
 import sys
+import time
 
 from collections import namedtuple
 
 from vdsm.common import exception
+from vdsm.common import hookrunner
 from vdsm.common import hooks
 
 
@@ -451,6 +453,312 @@ def test_rhd_should_pass_data_file_to_hooks(hooks_dir, env_dump, mkstemp_path,
     assert env[var_name] == mkstemp_path
 
 
+def test_scripts_per_dir_cache(hooks_dir):
+    FileEntry("1.sh", 0o700, "").apply(hooks_dir)
+    old = time.time() - 10
+    os.utime(str(hooks_dir), (old, old))
+    assert hooks._scriptsPerDir(hooks_dir.basename) == [
+        str(hooks_dir.join("1.sh"))]
+
+    # Adding a script modifies the directory and invalidates the cache.
+    FileEntry("2.sh", 0o700, "").apply(hooks_dir)
+    assert hooks._scriptsPerDir(hooks_dir.basename) == [
+        str(hooks_dir.join("1.sh")),
+        str(hooks_dir.join("2.sh")),
+    ]
+
+    # Changing the mode does not modify the directory, but must be detected.
+    old += 1
+    os.utime(str(hooks_dir), (old, old))
+    hooks._scriptsPerDir(hooks_dir.basename)
+    hooks_dir.join("1.sh").chmod(0o600)
+    assert hooks._scriptsPerDir(hooks_dir.basename) == [
+        str(hooks_dir.join("2.sh"))]
+
+
+def test_scripts_per_dir_missing(fake_hooks_root):
+    assert hooks._scriptsPerDir("missing") == []
+
+
+def python_hook(script_name, body, exit_code=0):
+    code = textwrap.dedent(
+        """\
+        #!{}
+        import sys
+        import hooking
+        {}
+        sys.exit({})
+        """).format(sys.executable, body, exit_code)
+    return FileEntry(script_name, 0o777, code)
+
+
+def domxml_appender(script_name, exit_code=0):
+    body = textwrap.dedent(
+        """
+        domxml = hooking.read_domxml()
+        root = domxml.documentElement
+        root.appendChild(domxml.createElement("{name}"))
+        hooking.write_domxml(domxml)
+        sys.stderr.write("{name}")
+        """).format(name=script_name.split(".")[0])
+    return python_hook(script_name, body, exit_code)
+
+
+def bash_domxml_appender(script_name):
+    code = textwrap.dedent(
+        """\
+        #!/bin/bash
+        sed -i 's|</vm>|<{}/></vm>|' "$_hook_domxml"
+        """).format(script_name.split(".")[0])
+    return FileEntry(script_name, 0o777, code)
+
+
+@pytest.fixture
+def persistent_runner(monkeypatch, request):
+    runner = hookrunner.Runner(getattr(request, 'param', 1))
+    monkeypatch.setattr(hooks, "_persistentRunner", lambda: runner)
+    yield runner
+    runner.close()
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            domxml_appender("a.py"),
+            bash_domxml_appender("b.sh"),
+            domxml_appender("c.py"),
+        ],
+        id="mixed hooks"
+    ),
+])
+def test_persistent_runner_domxml(hooks_dir, persistent_runner):
+    assert persistent_runner.is_python_hook(str(hooks_dir.join("a.py")))
+    assert not persistent_runner.is_python_hook(str(hooks_dir.join("b.sh")))
+
+    # Run twice to use the same worker twice.
+    for i in range(2):
+        result = hooks._runHooksDir(u"<vm/>", hooks_dir.basename)
+        assert result == (u'<?xml version="1.0" encoding="utf-8"?>'
+                          u'<vm><a/><b/><c/></vm>')
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            python_hook("a.py", textwrap.dedent(
+                """
+                data = hooking.read_json()
+                data["a"] = "\u0105"
+                hooking.write_json(data)
+                """)),
+        ],
+        id="json hook"
+    ),
+])
+def test_persistent_runner_json(hooks_dir, persistent_runner):
+    result = hooks._runHooksDir({"b": 1}, hooks_dir.basename,
+                                hookType=hooks._JSON_HOOK)
+    assert result == {"a": u"\u0105", "b": 1}
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            domxml_appender("a.py"),
+            domxml_appender("b.py", exit_code=2),
+            domxml_appender("c.py"),
+        ],
+        id="fatal hook error"
+    ),
+])
+def test_persistent_runner_errors(hooks_dir, persistent_runner):
+    with pytest.raises(exception.HookError) as e:
+        hooks._runHooksDir(u"<vm/>", hooks_dir.basename)
+    assert "b" in str(e.value)
+
+    result = hooks._runHooksDir(u"<vm/>", hooks_dir.basename,
+                                raiseError=False)
+    assert result == u'<?xml version="1.0" encoding="utf-8"?><vm><a/><b/></vm>'
+
+
+@pytest.mark.parametrize("hooks_dir, persistent_runner", indirect=True,
+                         argvalues=[
+    pytest.param(  # noqa: E122
+        [
+            domxml_appender("a.py"),
+        ],
+        0,
+        id="no workers"
+    ),
+])  # noqa: E122
+def test_persistent_runner_busy(hooks_dir, persistent_runner):
+    result = hooks._runHooksDir(u"<vm/>", hooks_dir.basename)
+    assert result == u'<?xml version="1.0" encoding="utf-8"?><vm><a/></vm>'
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            python_hook("a.py", "import os; os._exit(0)"),
+            domxml_appender("b.py"),
+        ],
+        id="worker killed"
+    ),
+])
+def test_persistent_runner_worker_error(hooks_dir, persistent_runner):
+    # The first hook kills the worker, so it must run again in a new process.
+    result = hooks._runHooksDir(u"<vm/>", hooks_dir.basename)
+    assert result == u'<?xml version="1.0" encoding="utf-8"?><vm><b/></vm>'
+
+
+def readonly_script(script_name, other):
+    # Wait until the other script is running, so the test fails if the
+    # scripts run one after another.
+    code = textwrap.dedent(
+        """\
+        #!/bin/bash
+        # vdsm-hook: readonly
+        echo "{name}" >> "$_hook_domxml"
+        touch "$markers/{name}"
+        for i in $(seq 100); do
+            [ -e "$markers/{other}" ] && exit 0
+            sleep 0.1
+        done
+        >&2 echo "{other} is not running"
+        exit 1
+        """).format(name=script_name, other=other)
+    return FileEntry(script_name, 0o777, code)
+
+
+@pytest.fixture
+def parallel_readonly(monkeypatch):
+    monkeypatch.setattr(hooks, "_parallelReadonly", lambda: True)
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            appender_script("1.sh"),
+            readonly_script("2.sh", "3.sh"),
+            readonly_script("3.sh", "2.sh"),
+            appender_script("4.sh"),
+            readonly_script("5.sh", "5.sh"),
+        ],
+        id="readonly hooks"
+    ),
+])
+def test_pipeline(hooks_dir, parallel_readonly):
+    stages = hooks._pipeline(hooks._scriptsPerDir(hooks_dir.basename))
+    names = [(readonly, [os.path.basename(s) for s in stage])
+             for readonly, stage in stages]
+    assert names == [
+        (False, ["1.sh"]),
+        (True, ["2.sh", "3.sh"]),
+        (False, ["4.sh"]),
+        (True, ["5.sh"]),
+    ]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            readonly_script("1.sh", "2.sh"),
+            readonly_script("2.sh", "1.sh"),
+        ],
+        id="readonly hooks"
+    ),
+])
+def test_pipeline_disabled(hooks_dir):
+    stages = hooks._pipeline(hooks._scriptsPerDir(hooks_dir.basename))
+    assert stages == [
+        (False, [str(hooks_dir.join("1.sh"))]),
+        (False, [str(hooks_dir.join("2.sh"))]),
+    ]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            appender_script("1.sh"),
+            readonly_script("2.sh", "3.sh"),
+            readonly_script("3.sh", "2.sh"),
+            appender_script("4.sh"),
+        ],
+        id="readonly hooks"
+    ),
+])
+def test_rhd_parallel_readonly(tmpdir, hooks_dir, parallel_readonly):
+    markers = tmpdir.mkdir("markers")
+    result = hooks._runHooksDir(u"", hooks_dir.basename,
+                                params={"markers": str(markers)})
+
+    # Data modified by read-only hooks is dropped.
+    assert result == u"1.sh\n4.sh\n"
+    assert sorted(markers.listdir()) == [
+        markers.join("2.sh"), markers.join("3.sh")]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            readonly_script("1.sh", "2.sh"),
+            appender_script("2.sh", exit_code=2),
+            appender_script("3.sh"),
+        ],
+        id="readonly hook error"
+    ),
+])
+def test_rhd_parallel_readonly_errors(tmpdir, hooks_dir, parallel_readonly):
+    markers = tmpdir.mkdir("markers")
+    markers.join("2.sh").write("")
+    errors = []
+    result = hooks._runHooksDir(u"", hooks_dir.basename, raiseError=False,
+                                errors=errors,
+                                params={"markers": str(markers)})
+    # 3.sh is skipped after the fatal error in 2.sh.
+    assert result == u"2.sh\n"
+    assert errors == [b"2.sh\n"]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            appender_script("1.sh"),
+            appender_script("2.sh", exit_code=1),
+        ],
+        id="two hooks"
+    ),
+])
+def test_rhd_script_stats(monkeypatch, hooks_dir):
+    monkeypatch.setattr(hooks, "_stats", {})
+    for i in range(2):
+        hooks._runHooksDir(u"", hooks_dir.basename, raiseError=False)
+
+    stats = hooks.script_stats()
+    assert sorted(stats) == [
+        str(hooks_dir.join("1.sh")), str(hooks_dir.join("2.sh"))]
+    for s in stats.values():
+        assert s["count"] == 2
+        assert 0 < s["last"] <= s["max"] <= s["total"]
+
+
+@pytest.mark.parametrize("hooks_dir", indirect=True, argvalues=[
+    pytest.param(
+        [
+            appender_script("1.sh"),
+        ],
+        id="single hook"
+    ),
+])
+def test_rhd_should_log_hook_elapsed_time(caplog, hooks_dir):
+    caplog.set_level(logging.INFO)
+    hooks._runHooksDir(u"", hooks_dir.basename)
+
+    assert "elapsed=" in "".join(msg
+                                 for _, lvl, msg in caplog.record_tuples
+                                 if lvl == logging.INFO)
+
+
 @pytest.fixture
 def hooking_client(hooks_dir):
     code = textwrap.dedent(
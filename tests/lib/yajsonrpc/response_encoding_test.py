@@ -0,0 +1,239 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import logging
+import time
+import tracemalloc
+import uuid
+
+import pytest
+
+import yajsonrpc
+
+from vdsm.common.compat import json
+from vdsm.common.password import ProtectedPassword
+
+from yajsonrpc import JsonRpcResponse
+from yajsonrpc import stomp
+from yajsonrpc import stompserver
+
+log = logging.getLogger("test")
+
+REQ_ID = "943-fd5b-4c2e"
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "orjson":
+        if yajsonrpc.orjson is None:
+            pytest.skip("orjson is not available")
+    else:
+        monkeypatch.setattr(yajsonrpc, "orjson", None)
+    return request.param
+
+
+class TestEncodeJson:
+
+    def test_encode(self, backend):
+        obj = {"a": [1, 2.5, None, True], "b": {"c": "ą"}}
+        data = yajsonrpc.encode_json(obj)
+        assert isinstance(data, bytes)
+        assert json.loads(data) == obj
+
+    def test_non_string_keys(self, backend):
+        data = yajsonrpc.encode_json({1: "a"})
+        assert json.loads(data) == {"1": "a"}
+
+    def test_big_int(self, backend):
+        data = yajsonrpc.encode_json({"size": 2**65})
+        assert json.loads(data) == {"size": 2**65}
+
+    def test_protected_password(self, backend):
+        obj = {"password": ProtectedPassword("secret")}
+        data = yajsonrpc.encode_json(obj)
+        assert json.loads(data) == {"password": "secret"}
+
+    def test_unsupported(self, backend):
+        with pytest.raises(TypeError):
+            yajsonrpc.encode_json({"value": object()})
+
+
+class TestResponse:
+
+    def test_encode_bytes(self, backend):
+        res = JsonRpcResponse({"vms": [1, 2]}, None, REQ_ID)
+        data = res.encode_bytes()
+        assert json.loads(data) == json.loads(res.encode())
+
+    def test_encode_bytes_error(self, backend):
+        error = yajsonrpc.exception.JsonRpcInternalError()
+        res = JsonRpcResponse(None, error, REQ_ID)
+        assert json.loads(res.encode_bytes()) == res.toDict()
+
+    def test_result_unprotected(self):
+        result = {"password": ProtectedPassword("secret")}
+        res = JsonRpcResponse(result, None, REQ_ID)
+        assert res.result == {"password": "secret"}
+        # The original result is not modified.
+        assert result["password"] == ProtectedPassword("secret")
+
+    def test_encode_bytes_unprotected(self, backend):
+        result = {"password": ProtectedPassword("secret")}
+        res = JsonRpcResponse(result, None, REQ_ID)
+        obj = json.loads(res.encode_bytes())
+        assert obj["result"] == {"password": "secret"}
+
+
+class TestResponseId:
+
+    @pytest.mark.parametrize("req_id", [REQ_ID, 42, None, "a,}b"])
+    def test_encoded_response(self, backend, req_id):
+        res = JsonRpcResponse({"big": "x" * 1000}, None, req_id)
+        assert stompserver.response_id(res.encode_bytes()) == req_id
+
+    def test_fallback(self):
+        message = json.dumps({"result": True, "id": REQ_ID})
+        assert stompserver.response_id(message) == REQ_ID
+
+    def test_long_id(self):
+        req_id = "x" * 1000
+        message = json.dumps({"jsonrpc": "2.0", "id": req_id}).encode()
+        assert stompserver.response_id(message) == req_id
+
+    def test_event(self):
+        message = json.dumps({"jsonrpc": "2.0", "method": "event"})
+        assert stompserver.response_id(message) is None
+
+    def test_not_dict(self):
+        with pytest.raises(ValueError):
+            stompserver.response_id(b"[]")
+
+
+def vm_stats(count):
+    """
+    Return result similar to Host.getAllVmStats with count vms.
+    """
+    stats = []
+    for i in range(count):
+        vm_id = str(uuid.uuid4())
+        stats.append({
+            "vmId": vm_id,
+            "vmName": "vm-%04d" % i,
+            "status": "Up",
+            "cpuUser": "1.25",
+            "cpuSys": "0.50",
+            "elapsedTime": "123456",
+            "memUsage": "42",
+            "network": {
+                "vnet%d" % j: {
+                    "name": "vnet%d" % j,
+                    "rxDropped": "0",
+                    "txDropped": "0",
+                    "rx": str(123456789 + j),
+                    "tx": str(987654321 + j),
+                    "sampleTime": 4319.87,
+                } for j in range(4)
+            },
+            "disks": {
+                "sd%s" % c: {
+                    "readLatency": "0.000123",
+                    "writeLatency": "0.000456",
+                    "flushLatency": "0.000012",
+                    "readRate": "1234.5",
+                    "writeRate": "6789.0",
+                    "apparentsize": "10737418240",
+                    "truesize": "2147483648",
+                    "imageID": str(uuid.uuid4()),
+                } for c in "abcd"
+            },
+            "guestIPs": "192.168.1.%d" % (i % 256),
+            "hash": "-1234567890",
+        })
+    return {"vmStats": stats}
+
+
+def encode_frame_old(res):
+    data = res.encode().encode("utf-8")
+    return stomp.Frame(stomp.Command.MESSAGE, {}, data).encode()
+
+
+def encode_frame_new(res):
+    data = res.encode_bytes()
+    return stomp.Frame(stomp.Command.MESSAGE, {}, data).encode()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("encode", [
+    pytest.param(encode_frame_old, id="old"),
+    pytest.param(encode_frame_new, id="new"),
+])
+@pytest.mark.parametrize("vms", [10, 300])
+def test_encode_benchmark(backend, encode, vms):
+    """
+    Compare time and peak memory allocations when encoding a large response
+    into a stomp frame.
+
+    This test is best run like this:
+
+        $ tox -e lib tests/lib/yajsonrpc/response_encoding_test.py -- \\
+            -m slow -k test_encode_benchmark \\
+            --log-cli-level=info \\
+            | grep stats
+
+    Example output (trimmed):
+
+        stats: vms=10 encode=old backend=json size=0.0 MiB time=0.001 peak=0.1 MiB
+        stats: vms=10 encode=new backend=json size=0.0 MiB time=0.000 peak=0.1 MiB
+        stats: vms=10 encode=new backend=orjson size=0.0 MiB time=0.000 peak=0.0 MiB
+        stats: vms=300 encode=old backend=json size=0.5 MiB time=0.043 peak=4.5 MiB
+        stats: vms=300 encode=new backend=json size=0.5 MiB time=0.007 peak=3.6 MiB
+        stats: vms=300 encode=new backend=orjson size=0.5 MiB time=0.001 peak=1.0 MiB
+
+    Peak memory is measured by tracemalloc, measuring temporary objects
+    created while encoding, including the encoded frame.
+    """  # NOQA: E501 (long line)
+    result = vm_stats(vms)
+
+    times = []
+    for i in range(5):
+        start = time.monotonic()
+        res = JsonRpcResponse(result, None, REQ_ID)
+        frame = encode(res)
+        times.append(time.monotonic() - start)
+
+    tracemalloc.start()
+    try:
+        res = JsonRpcResponse(result, None, REQ_ID)
+        frame = encode(res)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    log.info(
+        "stats: vms=%d encode=%s backend=%s size=%.1f MiB time=%.3f "
+        "peak=%.1f MiB",
+        vms, encode.__name__[13:], backend, len(frame) / 1024**2,
+        min(times), peak / 1024**2)
+
+    body = frame[frame.index(b"\n\n") + 2:-1]
+    assert json.loads(body)["result"] == result
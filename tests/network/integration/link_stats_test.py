@@ -20,6 +20,7 @@ from __future__ import absolute_import
 from __future__ import division
 
 from contextlib import contextmanager
+import time
 
 import pytest
 
@@ -28,6 +29,8 @@ from network.nettestlib import bridge_device
 from network.nettestlib import dummy_device
 from network.nettestlib import vlan_device
 
+from vdsm.network.ipwrapper import linkSet
+from vdsm.network.link import iface
 from vdsm.network.link import stats as link_stats
 
 
@@ -77,3 +80,70 @@ def test_report(device_ctx, device_ctx_args):
             'duplex',
         }
         assert expected_stat_names == set(stats[dev])
+
+
+@pytest.fixture
+def link_cache():
+    link_stats.start()
+    try:
+        yield link_stats._cache
+    finally:
+        link_stats.stop()
+
+
+def _sysfs_stat(device, name):
+    with open('/sys/class/net/{}/statistics/{}'.format(device, name)) as f:
+        return int(f.read())
+
+
+def test_report_counters():
+    with dummy_device() as dev:
+        stats = link_stats.report()[dev]
+        assert stats['rx'] == _sysfs_stat(dev, 'rx_bytes')
+        assert stats['tx'] == _sysfs_stat(dev, 'tx_bytes')
+        assert stats['rxDropped'] == _sysfs_stat(dev, 'rx_dropped')
+        assert stats['txDropped'] == _sysfs_stat(dev, 'tx_dropped')
+        assert stats['rxErrors'] == _sysfs_stat(dev, 'rx_errors')
+        assert stats['txErrors'] == _sysfs_stat(dev, 'tx_errors')
+
+
+def test_report_cached(link_cache):
+    with dummy_device() as dev:
+        index = iface.iface(dev).properties()['index']
+        first = link_stats.report()[dev]
+        assert link_cache.get(index) is not None
+
+        second = link_stats.report()[dev]
+        assert second['speed'] == first['speed']
+        assert second['duplex'] == first['duplex']
+
+
+def test_cache_invalidated_by_link_event(link_cache):
+    with dummy_device() as dev:
+        index = iface.iface(dev).properties()['index']
+
+        # Wait until the events for creating the device were handled.
+        deadline = time.monotonic() + 5
+        while True:
+            link_stats.report()
+            time.sleep(0.2)
+            if link_cache.get(index) is not None:
+                break
+            assert time.monotonic() < deadline
+
+        linkSet(dev, ['up'])
+
+        deadline = time.monotonic() + 5
+        while link_cache.get(index) is not None:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+
+        assert link_stats.report()[dev]['state'] == 'up'
+        assert link_cache.get(index) is not None
+
+
+def test_cache_disabled():
+    with dummy_device() as dev:
+        index = iface.iface(dev).properties()['index']
+        link_stats.report()
+        assert link_stats._cache.get(index) is None
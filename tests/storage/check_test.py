@@ -22,6 +22,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import errno
 import logging
 import os
 import pprint
@@ -383,10 +384,147 @@ class TestDirectioCheckerTimings:
                 res.delay()
 
 
+class TestThreadChecker:
+
+    def setup_method(self, m):
+        self.loop = asyncevent.EventLoop()
+        self.results = []
+        self.checks = 1
+
+    def teardown_method(self, m):
+        self.loop.close()
+
+    def complete(self, result):
+        self.results.append(result)
+        if len(self.results) == self.checks:
+            self.loop.stop()
+
+    def test_path_missing(self):
+        checker = check.ThreadChecker(self.loop, "/no/such/path",
+                                      self.complete)
+        checker.start()
+        self.loop.run_forever()
+        pprint.pprint(self.results)
+        result = self.results[0]
+        assert result.rc == errno.ENOENT
+        with pytest.raises(exception.MiscFileReadException):
+            result.delay()
+
+    def test_path_ok(self):
+        with temporaryPath(data=b"blah") as path:
+            checker = check.ThreadChecker(self.loop, path, self.complete)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+            delay = self.results[0].delay()
+            print("delay:", delay)
+            assert isinstance(delay, float)
+
+    def test_path_ok_leak(self):
+        fds_before = set(os.listdir("/proc/self/fd"))
+        self.checks = 10
+        with temporaryPath(data=b"blah") as path:
+            checker = check.ThreadChecker(
+                self.loop, path, self.complete, interval=0.1)
+            checker.start()
+            self.loop.run_forever()
+            pprint.pprint(self.results)
+        fds_after = set(os.listdir("/proc/self/fd"))
+        assert fds_before == fds_after
+
+    def test_no_process(self, monkeypatch):
+        def popen(*args, **kwargs):
+            raise AssertionError("Process started")
+
+        monkeypatch.setattr(check.subprocess, "Popen", popen)
+        self.checks = 3
+        with temporaryPath(data=b"blah") as path:
+            checker = check.ThreadChecker(
+                self.loop, path, self.complete, interval=0.1)
+            checker.start()
+            self.loop.run_forever()
+        for result in self.results:
+            result.delay()
+
+    def test_read_error(self, fake_read):
+        fake_read.error = RuntimeError("No read for you")
+        checker = check.ThreadChecker(self.loop, "/path", self.complete)
+        checker.start()
+        self.loop.run_forever()
+        result = self.results[0]
+        assert result.rc == check.EXEC_ERROR
+        with pytest.raises(exception.MiscFileReadException) as e:
+            result.delay()
+        assert "No read for you" in str(e.value)
+
+    def test_timeout(self, fake_read):
+        # Expected events:
+        # +0.0 start checker
+        # +0.3 fail with timeout
+        # +0.4 read completes, result ignored
+        # +0.5 loop stopped
+
+        def complete(result):
+            self.results.append(result)
+            self.loop.call_later(0.2, self.loop.stop)
+
+        fake_read.delay = 0.4
+        checker = check.ThreadChecker(
+            self.loop, "/path", complete, interval=0.3)
+        checker.start()
+        self.loop.run_forever()
+
+        assert len(self.results) == 1
+        with pytest.raises(exception.MiscFileReadException) as e:
+            self.results[0].delay()
+        assert "Read timeout" in str(e.value)
+
+    def test_block_warnings(self, monkeypatch, fake_read):
+        monkeypatch.setattr(check, "_log", FakeLogger(logging.WARNING))
+        # Expected events:
+        # +0.0 start checker
+        # +0.2 fail with timeout
+        # +0.4 log warning
+        # +0.5 checker stopped
+        # +0.6 read completes, result ignored
+        # +0.7 loop stopped
+
+        def complete(result):
+            self.results.append(result)
+            self.loop.call_later(0.3, checker.stop)
+            self.loop.call_later(0.4, self.loop.stop)
+
+        fake_read.delay = 0.6
+        checker = check.ThreadChecker(
+            self.loop, "/path", complete, interval=0.2)
+        checker.start()
+        self.loop.run_forever()
+
+        assert len(check._log.messages) == 1
+        r = re.compile(r"Checker '/path' is blocked for .+ seconds")
+        msg = check._log.messages[0][1]
+        assert re.match(r, msg)
+
+    def test_stop_during_check(self, fake_read):
+        fake_read.delay = 0.2
+        checker = check.ThreadChecker(self.loop, "/path", self.complete)
+        checker.start()
+        checker.stop()
+        assert checker.is_running()
+        start_thread(self.wait_for_checker, checker)
+        self.loop.run_forever()
+        assert not checker.is_running()
+        assert self.results == []
+
+    def wait_for_checker(self, checker):
+        checker.wait(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
 class TestCheckService:
 
     def setup_method(self, m):
-        self.service = check.CheckService()
+        self.service = check.CheckService(checker_class=check.DirectioChecker)
         self.service.start()
         self.result = None
         self.completed = threading.Event()
@@ -435,6 +573,37 @@ class TestCheckService:
         assert not self.service.is_checking("/path")
 
 
+@pytest.mark.parametrize('name, checker_class', [
+    ("dd", check.DirectioChecker),
+    ("thread", check.ThreadChecker),
+    ("unknown", check.ThreadChecker),
+])
+def test_check_service_configured_checker(monkeypatch, name, checker_class):
+    monkeypatch.setattr(check.config, "get", lambda section, key: name)
+    service = check.CheckService()
+    assert service._checker_class is checker_class
+
+
+def test_check_service_thread_checker():
+    service = check.CheckService(checker_class=check.ThreadChecker)
+    service.start()
+    try:
+        completed = threading.Event()
+        results = []
+
+        def complete(result):
+            results.append(result)
+            completed.set()
+
+        with temporaryPath(data=b"blah") as path:
+            service.start_checking(path, complete)
+            assert completed.wait(1.0)
+            assert service.stop_checking(path, timeout=1.0)
+        results[0].delay()
+    finally:
+        service.stop()
+
+
 @pytest.mark.parametrize('err, seconds', [
     (b"1\n2\n1 byte (1 B) copied, 1 s, 1 B/s\n",
      1.0),
@@ -463,6 +632,18 @@ def test_check_result_success(err, seconds):
     assert result.delay() == seconds
 
 
+def test_check_result_read_delay():
+    result = check.CheckResult("/path", 0, b"", 0, 0, read_delay=0.5)
+    assert result.delay() == 0.5
+
+
+def test_check_result_read_delay_error():
+    result = check.CheckResult(
+        "/path", errno.EIO, b"Input/output error", 0, 0, read_delay=None)
+    with pytest.raises(exception.MiscFileReadException):
+        result.delay()
+
+
 def test_check_result_non_zero_exit_code():
     path = "/path"
     reason = "REASON"
@@ -506,6 +687,26 @@ echo 100 bytes copied, {delay} s, {rate} B/s >&2
             f.write(data)
 
 
+class FakeRead(object):
+
+    def __init__(self):
+        self.delay = 0
+        self.error = None
+
+    def __call__(self, path):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.delay
+
+
+@pytest.fixture
+def fake_read(monkeypatch):
+    fake = FakeRead()
+    monkeypatch.setattr(check, "_read_block", fake)
+    return fake
+
+
 @pytest.fixture
 def fake_dd(tmpdir, monkeypatch):
     path = str(tmpdir.join("fake-dd"))
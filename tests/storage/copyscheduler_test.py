@@ -0,0 +1,301 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common.exception import ActionStopped
+from vdsm.storage import copyscheduler
+
+
+class FakeOperation(object):
+    """
+    Operation blocking until finished or aborted.
+    """
+
+    def __init__(self, tracker):
+        self._tracker = tracker
+        self._done = threading.Event()
+        self._aborted = False
+        self.progress = 0.0
+        self.error = None
+
+    def run(self):
+        self._tracker.started(self)
+        try:
+            if not self._done.wait(5):
+                raise RuntimeError("Timeout waiting for operation")
+            if self._aborted:
+                raise ActionStopped
+            if self.error:
+                raise self.error
+            self.progress = 100.0
+        finally:
+            self._tracker.finished(self)
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def abort(self):
+        self._aborted = True
+        self._done.set()
+
+
+class Tracker(object):
+    """
+    Track running operations.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.running = []
+        self.all = []
+        self.max_running = 0
+
+    def started(self, op):
+        with self._cond:
+            self.running.append(op)
+            self.all.append(op)
+            self.max_running = max(self.max_running, len(self.running))
+            self._cond.notify_all()
+
+    def finished(self, op):
+        with self._cond:
+            self.running.remove(op)
+            self._cond.notify_all()
+
+    def wait_for(self, count):
+        """
+        Wait until count operations are running.
+        """
+        with self._cond:
+            assert self._cond.wait_for(lambda: len(self.running) == count, 5)
+            return list(self.running)
+
+    def wait_for_started(self, count):
+        """
+        Wait until count operations were started, and return the operations
+        in start order.
+        """
+        with self._cond:
+            assert self._cond.wait_for(lambda: len(self.all) >= count, 5)
+            return self.all[:count]
+
+
+def make_copy(tracker, name, domains=("src", "dst"), size=1):
+    op = FakeOperation(tracker)
+    copy = copyscheduler.Copy(name, domains, size, lambda c: c.run(op))
+    copy.operation = op
+    return copy
+
+
+def start(scheduler):
+    result = {}
+
+    def run():
+        try:
+            scheduler.run()
+        except Exception as e:
+            result["error"] = e
+
+    t = concurrent.thread(run)
+    t.start()
+    return t, result
+
+
+@pytest.fixture
+def tracker():
+    return Tracker()
+
+
+@pytest.fixture
+def budget():
+    return copyscheduler.Budget(max_per_host=16, max_per_domain=16)
+
+
+def test_copied_in_order(tracker, budget):
+    copies = [make_copy(tracker, name) for name in ("base", "middle", "top")]
+    scheduler = copyscheduler.Scheduler(copies, budget=budget)
+    t, result = start(scheduler)
+
+    # A copy is started only after the previous copy finished.
+    for i, copy in enumerate(copies):
+        op = tracker.wait_for_started(i + 1)[i]
+        assert op is copy.operation
+        assert tracker.running == [op]
+        op.finish()
+    t.join()
+
+    assert result == {}
+    assert tracker.max_running == 1
+    assert scheduler.progress == 100.0
+    for copy in copies:
+        assert copy.throughput > 0
+
+
+def test_schedulers_run_concurrently(tracker, budget):
+    schedulers = [
+        copyscheduler.Scheduler(
+            [make_copy(tracker, name + "1"), make_copy(tracker, name + "2")],
+            budget=budget)
+        for name in ("a", "b")
+    ]
+    threads = [start(scheduler) for scheduler in schedulers]
+
+    for op in tracker.wait_for(2):
+        op.finish()
+    for op in tracker.wait_for_started(4)[2:]:
+        op.finish()
+    for t, result in threads:
+        t.join()
+        assert result == {}
+
+    assert tracker.max_running == 2
+
+
+def test_error_skips_next_copies(tracker, budget):
+    copies = [make_copy(tracker, "vol%d" % i) for i in range(3)]
+    scheduler = copyscheduler.Scheduler(copies, budget=budget)
+    t, result = start(scheduler)
+
+    error = RuntimeError("copy failed")
+    tracker.wait_for(1)[0].finish(error)
+    t.join()
+
+    assert result["error"] is error
+    assert tracker.all == [copies[0].operation]
+
+
+def test_domain_budget(tracker):
+    budget = copyscheduler.Budget(max_per_host=16, max_per_domain=1)
+    a = make_copy(tracker, "a", domains=("sd1", "sd2"))
+    b = make_copy(tracker, "b", domains=("sd2", "sd3"))
+    c = make_copy(tracker, "c", domains=("sd3", "sd4"))
+
+    threads = [start(copyscheduler.Scheduler([a], budget=budget))]
+    tracker.wait_for(1)
+    threads.append(start(copyscheduler.Scheduler([c], budget=budget)))
+    tracker.wait_for(2)
+    threads.append(start(copyscheduler.Scheduler([b], budget=budget)))
+
+    # "b" shares a domain with "a" and "c", so it must wait.
+    a.operation.finish()
+    tracker.wait_for(1)
+    assert b.operation not in tracker.all
+    c.operation.finish()
+
+    tracker.wait_for_started(3)[2].finish()
+    for t, result in threads:
+        t.join()
+        assert result == {}
+
+    assert tracker.all == [a.operation, c.operation, b.operation]
+    assert tracker.max_running == 2
+
+
+def test_host_budget_shared(tracker):
+    budget = copyscheduler.Budget(max_per_host=2, max_per_domain=16)
+    threads = [
+        start(copyscheduler.Scheduler([make_copy(tracker, name)],
+                                      budget=budget))
+        for name in ("a", "b")
+    ]
+    started = tracker.wait_for_started(2)
+    threads.append(
+        start(copyscheduler.Scheduler([make_copy(tracker, "c")],
+                                      budget=budget)))
+
+    # The third scheduler waits until the others release the budget.
+    for op in started:
+        op.finish()
+    tracker.wait_for_started(3)[2].finish()
+    for t, result in threads:
+        t.join()
+        assert result == {}
+
+    assert tracker.max_running == 2
+
+
+def test_progress(tracker, budget):
+    copies = [
+        make_copy(tracker, "small", size=1),
+        make_copy(tracker, "large", size=3),
+    ]
+    scheduler = copyscheduler.Scheduler(copies, budget=budget)
+    t, _ = start(scheduler)
+
+    tracker.wait_for(1)
+    copies[0].operation.progress = 50.0
+    assert scheduler.progress == 12.5
+    copies[0].operation.finish()
+
+    tracker.wait_for_started(2)
+    copies[1].operation.progress = 50.0
+    assert scheduler.progress == 62.5
+    copies[1].operation.finish()
+    t.join()
+
+    assert scheduler.progress == 100.0
+
+
+def test_abort(tracker, budget):
+    copies = [make_copy(tracker, "vol%d" % i) for i in range(3)]
+    scheduler = copyscheduler.Scheduler(copies, budget=budget)
+    t, result = start(scheduler)
+
+    tracker.wait_for(1)
+    scheduler.abort()
+    t.join()
+
+    # The running copy was aborted, and the pending copies were not started.
+    assert isinstance(result["error"], ActionStopped)
+    assert tracker.all == [copies[0].operation]
+
+
+def test_abort_waiting_for_budget(tracker):
+    budget = copyscheduler.Budget(max_per_host=1, max_per_domain=1)
+    blocker = copyscheduler.Scheduler(
+        [make_copy(tracker, "a")], budget=budget)
+    t1, _ = start(blocker)
+    running = tracker.wait_for(1)
+
+    waiting = copyscheduler.Scheduler(
+        [make_copy(tracker, "b")], budget=budget)
+    t2, result = start(waiting)
+
+    waiting.abort()
+    t2.join()
+    assert isinstance(result["error"], ActionStopped)
+
+    running[0].finish()
+    t1.join()
+    assert tracker.max_running == 1
+
+
+@pytest.mark.parametrize("host, domain", [(0, 1), (1, 0)])
+def test_invalid_budget(host, domain):
+    with pytest.raises(ValueError):
+        copyscheduler.Budget(max_per_host=host, max_per_domain=domain)
@@ -143,6 +143,48 @@ def test_get_paths_status_no_device(fake_dmsetup_status):
     assert devicemapper.getPathsStatus() == {}
 
 
+@pytest.fixture
+def fake_dm_sysfs(tmpdir, monkeypatch):
+    sys_block = tmpdir.mkdir("block")
+    udev_data = tmpdir.mkdir("udev")
+    monkeypatch.setattr(devicemapper, "SYS_BLOCK", str(sys_block))
+    monkeypatch.setattr(devicemapper, "UDEV_DATA", str(udev_data))
+
+    def add_map(dm, name, uuid, devt):
+        dev = sys_block.mkdir(dm)
+        dev.join("dev").write(devt + "\n")
+        info = dev.mkdir("dm")
+        info.join("name").write(name + "\n")
+        info.join("uuid").write(uuid + "\n")
+
+    add_map("dm-0", "mpath-a", "mpath-mpath-a", "253:0")
+    add_map("dm-1", "mpath-b", "mpath-mpath-b", "253:1")
+    add_map("dm-2", "vg-lv", "LVM-xxx", "253:2")
+    udev_data.join("b253:0").write("")
+    udev_data.join("b253:2").write("")
+    return udev_data
+
+
+def test_multipath_events(fake_dm_sysfs):
+    events = devicemapper.multipath_events()
+    assert set(events) == {"mpath-a", "mpath-b"}
+    assert events["mpath-b"] is None
+
+    # udev replaces the database file on every event.
+    before = events["mpath-a"]
+    tmp = fake_dm_sysfs.join("tmp")
+    tmp.write("E:DM_ACTION=PATH_FAILED\n")
+    os.rename(str(tmp), str(fake_dm_sysfs.join("b253:0")))
+
+    events = devicemapper.multipath_events()
+    assert events["mpath-a"] != before
+
+
+def test_multipath_events_no_udev(fake_dm_sysfs):
+    fake_dm_sysfs.remove()
+    assert devicemapper.multipath_events() is None
+
+
 @broken_on_ci
 @requires_root
 def test_remove_mapping(zero_dm_device):
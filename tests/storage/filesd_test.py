@@ -41,6 +41,8 @@ from vdsm.storage import fileSD
 from vdsm.storage import fileUtils
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import sd
+from vdsm.storage import volumemetadata
+from vdsm.storage import volumewalk
 
 
 class FileStorageDomainManifest(fileSD.FileStorageDomainManifest):
@@ -49,6 +51,8 @@ class FileStorageDomainManifest(fileSD.FileStorageDomainManifest):
         self.mountpoint = os.path.dirname(domainpath)
         self.sdUUID = os.path.basename(domainpath)
         self._oop = oop
+        self._images_cache = {}
+        self._images_walker = volumewalk.Walker(self.sdUUID)
 
     @property
     def oop(self):
@@ -81,27 +85,57 @@ class FakeOOP(object):
 
 class TestGetAllVolumes(VdsmTestCase):
 
-    MOUNTPOINT = "/rhev/data-center/%s" % uuid.uuid4()
     SD_UUID = str(uuid.uuid4())
-    IMAGES_DIR = os.path.join(MOUNTPOINT, SD_UUID, sd.DOMAIN_IMAGES)
+
+    def setUp(self):
+        self.domains = []
+
+    def tearDown(self):
+        for dom in self.domains:
+            dom.teardown()
+
+    def create_domain(self, mountpoint):
+        dom = FileStorageDomain(self.SD_UUID, mountpoint, None)
+        self.domains.append(dom)
+        return dom
+
+    def create_volumes(self, mountpoint, volumes):
+        """
+        Create volumes metadata from list of (imgUUID, volUUID) pairs. If a
+        volume exists in another image, link the existing volume like a
+        template volume.
+        """
+        images_dir = os.path.join(mountpoint, self.SD_UUID, sd.DOMAIN_IMAGES)
+        paths = {}
+        for imgUUID, volUUID in volumes:
+            image_dir = os.path.join(images_dir, imgUUID)
+            if not os.path.isdir(image_dir):
+                os.makedirs(image_dir)
+            path = os.path.join(image_dir, volUUID + ".meta")
+            if volUUID in paths:
+                os.link(paths[volUUID], path)
+            else:
+                open(path, "w").close()
+                paths[volUUID] = path
 
     def test_no_volumes(self):
-        oop = FakeOOP(FakeGlob([]))
-        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
-        res = dom.getAllVolumes()
-        self.assertEqual(res, {})
+        with namedTemporaryDir() as mountpoint:
+            dom = self.create_domain(mountpoint)
+            res = dom.getAllVolumes()
+            self.assertEqual(res, {})
 
     def test_no_templates(self):
-        oop = FakeOOP(FakeGlob([
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-2.meta"),
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-3.meta"),
-            os.path.join(self.IMAGES_DIR, "image-2", "volume-4.meta"),
-            os.path.join(self.IMAGES_DIR, "image-2", "volume-5.meta"),
-            os.path.join(self.IMAGES_DIR, "image-3", "volume-6.meta"),
-        ]))
-        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
-        res = dom.getAllVolumes()
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("image-1", "volume-1"),
+                ("image-1", "volume-2"),
+                ("image-1", "volume-3"),
+                ("image-2", "volume-4"),
+                ("image-2", "volume-5"),
+                ("image-3", "volume-6"),
+            ])
+            dom = self.create_domain(mountpoint)
+            res = dom.getAllVolumes()
 
         # These volumes should have parent uuid, but the implementation does
         # not read the meta data files, so this info is not available (None).
@@ -115,17 +149,18 @@ class TestGetAllVolumes(VdsmTestCase):
         })
 
     def test_with_template(self):
-        oop = FakeOOP(FakeGlob([
-            os.path.join(self.IMAGES_DIR, "template-1", "volume-1.meta"),
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-2.meta"),
-            os.path.join(self.IMAGES_DIR, "image-1", "volume-3.meta"),
-            os.path.join(self.IMAGES_DIR, "image-2", "volume-1.meta"),
-            os.path.join(self.IMAGES_DIR, "image-2", "volume-4.meta"),
-            os.path.join(self.IMAGES_DIR, "image-3", "volume-5.meta"),
-        ]))
-        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
-        res = dom.getAllVolumes()
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("template-1", "volume-1"),
+                ("image-1", "volume-1"),
+                ("image-1", "volume-2"),
+                ("image-1", "volume-3"),
+                ("image-2", "volume-1"),
+                ("image-2", "volume-4"),
+                ("image-3", "volume-5"),
+            ])
+            dom = self.create_domain(mountpoint)
+            res = dom.getAllVolumes()
 
         self.assertEqual(len(res), 5)
 
@@ -144,6 +179,157 @@ class TestGetAllVolumes(VdsmTestCase):
         self.assertEqual(res["volume-4"], (("image-2",), None))
         self.assertEqual(res["volume-5"], (("image-3",), None))
 
+    def test_no_images_dir(self):
+        with namedTemporaryDir() as mountpoint:
+            os.mkdir(os.path.join(mountpoint, self.SD_UUID))
+            dom = self.create_domain(mountpoint)
+            self.assertEqual(dom.getAllVolumes(), {})
+
+    def test_image_modified(self):
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("image-1", "volume-1"),
+                ("image-2", "volume-2"),
+            ])
+            images_dir = os.path.join(
+                mountpoint, self.SD_UUID, sd.DOMAIN_IMAGES)
+            image_1 = os.path.join(images_dir, "image-1")
+            old = time.time() - 10
+            for name in ("image-1", "image-2"):
+                os.utime(os.path.join(images_dir, name), (old, old))
+
+            dom = self.create_domain(mountpoint)
+            self.assertEqual(set(dom.getAllVolumes()),
+                             {"volume-1", "volume-2"})
+
+            # Adding a volume modifies the image directory.
+            open(os.path.join(image_1, "volume-3.meta"), "w").close()
+            self.assertEqual(set(dom.getAllVolumes()),
+                             {"volume-1", "volume-2", "volume-3"})
+
+            # Removing an image.
+            os.unlink(os.path.join(images_dir, "image-2", "volume-2.meta"))
+            os.rmdir(os.path.join(images_dir, "image-2"))
+            self.assertEqual(set(dom.getAllVolumes()),
+                             {"volume-1", "volume-3"})
+
+    def test_images_volumes(self):
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("template-1", "volume-1"),
+                ("image-1", "volume-1"),
+                ("image-1", "volume-2"),
+            ])
+            dom = self.create_domain(mountpoint)
+            res = dom.getImagesVolumes()
+
+        self.assertEqual(res, {
+            "template-1": {
+                "volume-1": fileSD.ImageVolume(2, None),
+            },
+            "image-1": {
+                "volume-1": fileSD.ImageVolume(2, None),
+                "volume-2": fileSD.ImageVolume(1, None),
+            },
+        })
+
+    def test_images_volumes_metadata(self):
+        md = volumemetadata.VolumeMetadata(
+            domain=self.SD_UUID,
+            image="image-1",
+            parent=sc.BLANK_UUID,
+            capacity=1024**3,
+            format=sc.type2name(sc.COW_FORMAT),
+            type=sc.type2name(sc.SPARSE_VOL),
+            voltype=sc.type2name(sc.LEAF_VOL),
+            disktype=sc.DATA_DISKTYPE,
+            description="description",
+            legality=sc.LEGAL_VOL,
+            ctime=1000,
+            generation=1,
+            sequence=1)
+
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("image-1", "volume-1"),
+                ("image-1", "volume-2"),
+            ])
+            image_dir = os.path.join(
+                mountpoint, self.SD_UUID, sd.DOMAIN_IMAGES, "image-1")
+            with open(os.path.join(image_dir, "volume-1.meta"), "wb") as f:
+                f.write(md.storage_format(sc.DOMAIN_VERSIONS[-1]))
+            with open(os.path.join(image_dir, "volume-2.meta"), "wb") as f:
+                f.write(b"invalid")
+
+            dom = self.create_domain(mountpoint)
+            res = dom.getImagesVolumes(metadata=True)
+
+        vol1 = res["image-1"]["volume-1"]
+        self.assertEqual(vol1.nlink, 1)
+        self.assertEqual(vol1.metadata.description, "description")
+        self.assertEqual(vol1.metadata.generation, 1)
+        self.assertEqual(res["image-1"]["volume-2"],
+                         fileSD.ImageVolume(1, None))
+
+    def test_template_linked(self):
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [
+                ("template-1", "volume-1"),
+            ])
+            images_dir = os.path.join(
+                mountpoint, self.SD_UUID, sd.DOMAIN_IMAGES)
+            template_dir = os.path.join(images_dir, "template-1")
+            old = time.time() - 10
+            os.utime(template_dir, (old, old))
+
+            dom = self.create_domain(mountpoint)
+            res = dom.getImagesVolumes()
+            self.assertEqual(res["template-1"]["volume-1"].nlink, 1)
+
+            # Linking the template volume to another image does not modify
+            # the template image directory, but the link count must be
+            # updated.
+            os.mkdir(os.path.join(images_dir, "image-1"))
+            os.link(os.path.join(template_dir, "volume-1.meta"),
+                    os.path.join(images_dir, "image-1", "volume-1.meta"))
+            self.assertEqual(os.stat(template_dir).st_mtime, old)
+
+            res = dom.getImagesVolumes()
+            self.assertEqual(res["template-1"]["volume-1"].nlink, 2)
+            self.assertEqual(res["image-1"]["volume-1"].nlink, 2)
+
+    def test_walker_reused(self):
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [("image-1", "volume-1")])
+            dom = self.create_domain(mountpoint)
+            walker = dom._manifest._images_walker
+
+            dom.getAllVolumes()
+            pid = walker._proc.pid
+            dom.getAllVolumes()
+            self.assertEqual(walker._proc.pid, pid)
+
+            # Tearing down the domain stops the walker, and the next call
+            # starts a new one.
+            dom.teardown()
+            self.assertIsNone(walker._proc)
+            self.assertEqual(set(dom.getAllVolumes()), {"volume-1"})
+
+    def test_walker_idle(self):
+        with namedTemporaryDir() as mountpoint:
+            self.create_volumes(mountpoint, [("image-1", "volume-1")])
+            dom = self.create_domain(mountpoint)
+            walker = dom._manifest._images_walker
+            walker._idle_time = 0.1
+
+            dom.getAllVolumes()
+            proc = walker._proc
+            proc.wait(5)
+
+            # The idle walker exited; a new walker is started.
+            self.assertEqual(set(dom.getAllVolumes()), {"volume-1"})
+            self.assertNotEqual(walker._proc.pid, proc.pid)
+
     @pytest.mark.skipif(
         "OVIRT_CI" in os.environ or "TRAVIS_CI" in os.environ,
         reason="performance test, unpredictable on CI")
@@ -153,30 +339,18 @@ class TestGetAllVolumes(VdsmTestCase):
         template_image_uuid = str(uuid.uuid4())
         template_volume_uuid = str(uuid.uuid4())
 
-        files = []
-        template_volume = os.path.join(self.IMAGES_DIR, template_image_uuid,
-                                       template_volume_uuid + ".meta")
-        files.append(template_volume)
+        images = [(template_image_uuid, [template_volume_uuid])]
 
         for i in range(images_count):
             image_uuid = str(uuid.uuid4())
             volume_uuid = str(uuid.uuid4())
-            template_volume = os.path.join(self.IMAGES_DIR, image_uuid,
-                                           template_volume_uuid + ".meta")
-            files.append(template_volume)
-            new_volume = os.path.join(self.IMAGES_DIR, image_uuid,
-                                      volume_uuid + ".meta")
-            files.append(new_volume)
-
-        oop = FakeOOP(FakeGlob(files))
-        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
+            images.append((image_uuid, [template_volume_uuid, volume_uuid]))
 
         start = time.time()
-        dom.getAllVolumes()
+        fileSD._volumes_images(images)
         elapsed = time.time() - start
         print("%f seconds" % elapsed)
 
-        # This takes about 0.11 seconds on T450s.
         self.assertTrue(elapsed < 0.5, "Elapsed time: %f seconds" % elapsed)
 
 
@@ -1992,8 +1992,7 @@ def test_lv_stale_cache_one(stale_lv):
 def test_lv_stale_cache_all(stale_lv):
     vg_name, good_lv_name, stale_lv_name = stale_lv
 
-    # LVs always skip the cache.
-    # TODO: Use cache if VG did not change.
+    # The VG was modified, so LVs are reloaded.
 
     lv_names = {lv.name for lv in lvm.getLV(vg_name)}
     assert good_lv_name in lv_names
@@ -2182,6 +2181,135 @@ def test_lv_reload_for_stale_vg(fake_devices):
     assert not lc._lvs_needs_reload("vg")
 
 
+class VGRunner(FakeRunner):
+    """
+    Simulate lvs and vgs commands for a single VG with 2 LVs.
+    """
+
+    def __init__(self, seqno=1):
+        super().__init__()
+        self.seqno = seqno
+
+    def _run_command(self, cmd):
+        self.calls.append(cmd)
+        if "lvs" in cmd:
+            lines = [
+                "uuid|{}|vg|-wi-------|128|0|/dev/mapper/a(0)|MD_1|{}".format(
+                    lv_name, self.seqno)
+                for lv_name in ("lv1", "lv2")
+            ]
+            return 0, "\n".join(lines).encode("utf-8"), b""
+        if "vgs" in cmd:
+            return 0, str(self.seqno).encode("utf-8"), b""
+        return 0, b"", b""
+
+    def lvs_calls(self):
+        return [cmd for cmd in self.calls if "lvs" in cmd]
+
+
+@pytest.fixture
+def fake_dm_dir(monkeypatch, tmpdir):
+    dm_dir = str(tmpdir.mkdir("mapper"))
+    set_mtime(dm_dir, time.time() - 10)
+    monkeypatch.setattr(lvm, "DM_DIR", dm_dir)
+    return dm_dir
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_lv_reload_vg_not_changed(fake_devices, fake_dm_dir):
+    fake_runner = VGRunner()
+    lc = lvm.LVMCache(fake_runner)
+
+    lvs = lc.getLv("vg")
+    assert len(lc.getLv("vg")) == 2
+    assert lc.getLv("vg") == lvs
+
+    # LVs were loaded once, and then checked using vgs.
+    assert len(fake_runner.lvs_calls()) == 1
+    assert lc.stats.info()["vgs"]["vg"] == {
+        "hits": 2,
+        "misses": 1,
+        "hit_ratio": 100 * 2 / 3,
+    }
+
+
+def test_lv_reload_vg_changed(fake_devices, fake_dm_dir):
+    fake_runner = VGRunner()
+    lc = lvm.LVMCache(fake_runner)
+    lc.getLv("vg")
+
+    # Another host modified the VG.
+    fake_runner.seqno = 2
+
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+
+def test_lv_reload_dm_changed(fake_devices, fake_dm_dir):
+    fake_runner = VGRunner()
+    lc = lvm.LVMCache(fake_runner)
+    lc.getLv("vg")
+
+    # LV activated or deactivated on this host.
+    set_mtime(fake_dm_dir, time.time() - 5)
+
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+
+def test_lv_reload_dm_recently_changed(fake_devices, fake_dm_dir):
+    fake_runner = VGRunner()
+    lc = lvm.LVMCache(fake_runner)
+
+    # The modification time may not change if the directory is modified
+    # again, so the LVs are not cached.
+    set_mtime(fake_dm_dir, time.time())
+    lc.getLv("vg")
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+
+def test_lv_reload_invalidated(fake_devices, fake_dm_dir):
+    fake_runner = VGRunner()
+    lc = lvm.LVMCache(fake_runner)
+    lc.getLv("vg")
+
+    lc.invalidateCache()
+    lc.getLv("vg")
+    assert len(fake_runner.lvs_calls()) == 2
+
+
+def test_cache_stats_per_vg():
+    stats = lvm.CacheStats()
+    stats.hit("vg1")
+    stats.miss("vg1")
+    stats.miss("vg2")
+    stats.hit()
+
+    assert stats.info() == {
+        "hits": 2,
+        "misses": 2,
+        "hit_ratio": 50,
+        "vgs": {
+            "vg1": {"hits": 1, "misses": 1, "hit_ratio": 50},
+            "vg2": {"hits": 0, "misses": 1, "hit_ratio": 0},
+        },
+    }
+
+    stats.clear()
+    assert stats.info() == {
+        "hits": 0, "misses": 0, "hit_ratio": 0, "vgs": {}}
+
+
 @requires_root
 @pytest.mark.root
 def test_retry_with_wider_filter(tmp_storage):
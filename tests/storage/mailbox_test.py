@@ -25,6 +25,7 @@ import collections
 import contextlib
 import io
 import logging
+import mmap
 import random
 import struct
 import threading
@@ -33,6 +34,8 @@ import uuid
 
 from functools import partial
 
+from six.moves import queue
+
 import pytest
 
 from testlib import make_uuid
@@ -40,6 +43,8 @@ from testlib import make_config
 
 import vdsm.storage.mailbox as sm
 
+from vdsm.storage import constants as sc
+
 from vdsm.common.units import MiB, GiB
 
 MAX_HOSTS = 10
@@ -132,6 +137,26 @@ def make_spm_mailbox(mboxfiles):
             raise RuntimeError('Timemout waiting for spm mailbox')
 
 
+@contextlib.contextmanager
+def make_stopped_spm_mailbox(mboxfiles, max_hosts=MAX_HOSTS):
+    """
+    Create SPM mailbox without starting the monitor thread, for testing
+    mail handling without racing with the monitor.
+    """
+    mailbox = sm.SPM_MailMonitor(
+        SPUUID,
+        max_hosts,
+        inbox=mboxfiles.inbox,
+        outbox=mboxfiles.outbox,
+        monitorInterval=MONITOR_INTERVAL,
+        eventInterval=EVENT_INTERVAL)
+    try:
+        yield mailbox
+    finally:
+        mailbox.tp.joinAll()
+        mailbox._close()
+
+
 class FakeSPMMailer(object):
     """
     Fake SPM mailer class for sending reply message when
@@ -156,8 +181,11 @@ class FakePool(object):
     def __init__(self, mailer):
         self.spmMailer = mailer
         self.volume_data = None
+        self.errors = {}
 
     def extendVolume(self, sdUUID, volUUID, newSize):
+        if volUUID in self.errors:
+            raise self.errors[volUUID]
         self.volume_data = {
             'domainID': sdUUID,
             'volumeID': volUUID,
@@ -195,6 +223,201 @@ class TestSPMMailMonitor:
         with make_spm_mailbox(mboxfiles) as spm_mm:
             assert not spm_mm._handleRequests(sm.EMPTYMAILBOX * MAX_HOSTS)
 
+    def test_no_dd(self, mboxfiles, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("Unexpected command: %s" % (args,))
+
+        monkeypatch.setattr(sm, "_mboxExecCmd", fail)
+
+        with make_spm_mailbox(mboxfiles) as spm_mm:
+            spm_mm._checkForMail()
+            msg = sm.SPM_Extend_Message(volume_data(), GiB)
+            spm_mm.sendReply(3 * sm.SLOTS_PER_MAILBOX, msg)
+
+        inbox, outbox = read_mbox(mboxfiles)
+        offset = 3 * sm.MAILBOX_SIZE
+        assert outbox[offset:offset + sm.MESSAGE_SIZE] == extend_message(GiB)
+
+    def test_stats(self, mboxfiles):
+        with make_spm_mailbox(mboxfiles) as spm_mm:
+            spm_mm._checkForMail()
+            msg = sm.SPM_Extend_Message(volume_data(), GiB)
+            spm_mm.sendReply(12, msg)
+            info = spm_mm.stats().info()
+
+        assert info["read"]["count"] >= 1
+        assert info["cycle"]["count"] >= 1
+        # Clearing the outbox and sending the reply.
+        assert info["write"]["count"] >= 2
+        assert info["mailboxes"] >= MAX_HOSTS + 1
+
+    def test_batch_replies(self, mboxfiles):
+        with make_spm_mailbox(mboxfiles) as spm_mm:
+            # Simulate replies added while another thread was writing.
+            with spm_mm._outLock:
+                for host_id in (2, 5):
+                    msg_id = host_id * sm.SLOTS_PER_MAILBOX
+                    offset = msg_id * sm.MESSAGE_SIZE
+                    spm_mm._outgoingMail[
+                        offset:offset + sm.MESSAGE_SIZE] = extend_message(GiB)
+                    spm_mm._dirty.add(host_id)
+
+            writes = spm_mm.stats().info()["write"]["count"]
+            spm_mm._flushOutgoingMail()
+            assert spm_mm.stats().info()["write"]["count"] == writes + 1
+
+        inbox, outbox = read_mbox(mboxfiles)
+        for host_id in (2, 5):
+            offset = host_id * sm.MAILBOX_SIZE
+            assert outbox[offset:offset + sm.MESSAGE_SIZE] == \
+                extend_message(GiB)
+
+    def test_handle_changed_requests(self, mboxfiles):
+        received = queue.Queue()
+
+        def spm_callback(msg_id, data):
+            received.put((msg_id, data))
+
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            spm_mm.registerMessageType(sm.EXTEND_CODE, spm_callback)
+
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_message(mail, 2, 5, extend_message(GiB))
+            write_message(mail, 7, 0, extend_message(2 * GiB))
+            spm_mm._handleRequests(mail)
+
+            # Unchanged messages are not handled again.
+            write_message(mail, 7, 1, extend_message(3 * GiB))
+            spm_mm._handleRequests(mail)
+
+            messages = [received.get(timeout=MAILER_TIMEOUT)
+                        for _ in range(3)]
+
+        assert received.empty()
+        assert sorted(messages) == [
+            (2 * sm.SLOTS_PER_MAILBOX + 5, extend_message(GiB)),
+            (7 * sm.SLOTS_PER_MAILBOX, extend_message(2 * GiB)),
+            (7 * sm.SLOTS_PER_MAILBOX + 1, extend_message(3 * GiB)),
+        ]
+
+    def test_clean_message(self, mboxfiles):
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_message(mail, 4, 3, sm.CLEAN_MESSAGE)
+            assert spm_mm._handleRequests(mail)
+
+            offset = (4 * sm.SLOTS_PER_MAILBOX + 3) * sm.MESSAGE_SIZE
+            out = spm_mm._outgoingMail
+            assert out[offset:offset + sm.MESSAGE_SIZE] == sm.CLEAN_MESSAGE
+            assert out[:offset] == b"\0" * offset
+
+    def test_invalid_mailbox(self, mboxfiles):
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_message(mail, 2, 0, sm.CLEAN_MESSAGE)
+            # Corrupt the checksum.
+            end = 3 * sm.MAILBOX_SIZE
+            mail[end - sm.CHECKSUM_BYTES:end] = b"bad!"
+            assert not spm_mm._handleRequests(mail)
+
+            # Invalid mailbox is checked again on the next read.
+            write_message(mail, 2, 0, sm.CLEAN_MESSAGE)
+            assert spm_mm._handleRequests(mail)
+
+    @pytest.mark.slow
+    @pytest.mark.parametrize("hosts", [250, 1000, 2000])
+    @pytest.mark.parametrize("changed", [0, 1, 10])
+    def test_scan_benchmark(self, tmpdir, hosts, changed):
+        """
+        Measure the time to scan the inbox for new requests.
+
+        This test is best run like this:
+
+            $ tox -e storage tests/storage/mailbox_test.py -- \
+                -m slow -k test_scan_benchmark \
+                --log-cli-level=info \
+                | grep stats
+
+        Example output (trimmed):
+
+            stats: hosts=250 changed=0 best=0.000 average=0.000 worst=0.000
+            stats: hosts=1000 changed=0 best=0.000 average=0.001 worst=0.002
+            stats: hosts=2000 changed=0 best=0.001 average=0.001 worst=0.002
+            stats: hosts=250 changed=1 best=0.000 average=0.000 worst=0.000
+            stats: hosts=1000 changed=1 best=0.001 average=0.001 worst=0.001
+            stats: hosts=2000 changed=1 best=0.001 average=0.002 worst=0.002
+            stats: hosts=250 changed=10 best=0.001 average=0.001 worst=0.007
+            stats: hosts=1000 changed=10 best=0.002 average=0.002 worst=0.003
+            stats: hosts=2000 changed=10 best=0.002 average=0.003 worst=0.009
+
+        """
+        data = sm.EMPTYMAILBOX * hosts
+        inbox = tmpdir.join('inbox')
+        outbox = tmpdir.join('outbox')
+        inbox.write(data)
+        outbox.write(data)
+        mboxfiles = MboxFiles(str(inbox), str(outbox))
+
+        with make_stopped_spm_mailbox(mboxfiles, hosts) as spm_mm:
+            times = []
+            for i in range(20):
+                # Use clean messages to measure only the scan, without
+                # queuing tasks.
+                mail = bytearray(data)
+                for n in range(changed):
+                    write_message(
+                        mail, n * hosts // changed, i % 2,
+                        sm.CLEAN_MESSAGE)
+                mail = bytes(mail)
+
+                start = time.monotonic()
+                spm_mm._handleRequests(mail)
+                times.append(time.monotonic() - start)
+
+        times.sort()
+        best = times[0]
+        worst = times[-1]
+        average = sum(times) / len(times)
+
+        log.info(
+            "stats: hosts=%d changed=%d best=%.3f average=%.3f worst=%.3f",
+            hosts, changed, best, average, worst)
+
+
+def write_message(mail, host_id, slot, msg):
+    """
+    Write message to slot in host mailbox, and update the mailbox checksum.
+    """
+    mailbox_start = host_id * sm.MAILBOX_SIZE
+    msg_start = mailbox_start + slot * sm.MESSAGE_SIZE
+    mail[msg_start:msg_start + sm.MESSAGE_SIZE] = msg
+    checksum_start = mailbox_start + sm.MAILBOX_SIZE - sm.CHECKSUM_BYTES
+    mail[checksum_start:checksum_start + sm.CHECKSUM_BYTES] = \
+        sm.packed_checksum(mail[mailbox_start:checksum_start])
+
+
+class TestChangedSlots:
+
+    def test_unchanged(self):
+        mailbox = bytearray(sm.EMPTYMAILBOX)
+        mailbox[0:sm.MESSAGE_SIZE] = extend_message()
+        assert sm.changed_slots(bytes(mailbox), mailbox) == []
+
+    def test_changed(self):
+        old = bytearray(sm.EMPTYMAILBOX)
+        old[0:sm.MESSAGE_SIZE] = extend_message()
+        new = bytearray(old)
+        new[sm.MESSAGE_SIZE:2 * sm.MESSAGE_SIZE] = extend_message()
+        offset = 62 * sm.MESSAGE_SIZE
+        new[offset:offset + sm.MESSAGE_SIZE] = sm.CLEAN_MESSAGE
+        assert sm.changed_slots(bytes(new), old) == [1, 62]
+
+    def test_skip_empty(self):
+        old = bytearray(sm.EMPTYMAILBOX)
+        old[0:sm.MESSAGE_SIZE] = extend_message()
+        new = sm.EMPTYMAILBOX
+        assert sm.changed_slots(new, old) == []
+
 
 class TestHSMMailbox:
 
@@ -465,6 +688,368 @@ class TestExtendMessage:
         assert spm_mailer.msg.callback is None
 
 
+class TestExtendQueue:
+
+    def test_priority(self):
+        q = sm.ExtendQueue()
+        for priority in (sc.EXTEND_THRESHOLD, sc.EXTEND_EXCEEDED,
+                         sc.EXTEND_ENOSPC, sc.EXTEND_THRESHOLD):
+            q.put(sm.SPM_Extend_Message(
+                volume_data(make_uuid()), GiB, priority=priority))
+
+        received = [q.get(block=False).priority for _ in range(4)]
+        assert received == [
+            sc.EXTEND_ENOSPC,
+            sc.EXTEND_EXCEEDED,
+            sc.EXTEND_THRESHOLD,
+            sc.EXTEND_THRESHOLD,
+        ]
+
+    def test_fifo(self):
+        q = sm.ExtendQueue()
+        volumes = [make_uuid() for _ in range(5)]
+        for vol_id in volumes:
+            q.put(sm.SPM_Extend_Message(volume_data(vol_id), GiB))
+
+        received = [q.get(block=False).volumeData["volumeID"]
+                    for _ in volumes]
+        assert received == volumes
+
+    def test_merge(self):
+        q = sm.ExtendQueue()
+        first = sm.SPM_Extend_Message(volume_data(), GiB)
+        second = sm.SPM_Extend_Message(volume_data(), 2 * GiB)
+        third = sm.SPM_Extend_Message(volume_data(), GiB)
+        for msg in (first, second, third):
+            q.put(msg)
+        assert q.qsize() == 1
+
+        # The volume is extended once to the largest size.
+        msg = q.get(block=False)
+        assert msg is first
+        assert msg.newSize == 2 * GiB
+        assert msg.payload == extend_message(2 * GiB)
+        assert msg.requests() == [first, second, third]
+
+        with pytest.raises(queue.Empty):
+            q.get(block=False)
+
+    def test_merge_raises_priority(self):
+        q = sm.ExtendQueue()
+        q.put(sm.SPM_Extend_Message(volume_data(make_uuid()), GiB))
+        routine = sm.SPM_Extend_Message(volume_data(), GiB)
+        q.put(routine)
+        q.put(sm.SPM_Extend_Message(
+            volume_data(), GiB, priority=sc.EXTEND_ENOSPC))
+
+        # The merged message is sent first, but requests keep their priority
+        # for reporting latency.
+        msg = q.get(block=False)
+        assert msg is routine
+        assert [r.priority for r in msg.requests()] == [
+            sc.EXTEND_THRESHOLD, sc.EXTEND_ENOSPC]
+
+        # The stale entry for the merged message is skipped.
+        msg = q.get(block=False)
+        assert msg is not routine
+        with pytest.raises(queue.Empty):
+            q.get(block=False)
+
+    def test_put_after_get(self):
+        q = sm.ExtendQueue()
+        q.put(sm.SPM_Extend_Message(volume_data(), GiB))
+        first = q.get(block=False)
+
+        # A message already taken from the queue is not merged.
+        q.put(sm.SPM_Extend_Message(volume_data(), 2 * GiB))
+        second = q.get(block=False)
+        assert second is not first
+        assert first.requests() == [first]
+
+    def test_get_timeout(self):
+        q = sm.ExtendQueue()
+        start = time.monotonic()
+        with pytest.raises(queue.Empty):
+            q.get(block=True, timeout=0.1)
+        assert time.monotonic() - start >= 0.1
+
+    def test_get_wakeup(self):
+        q = sm.ExtendQueue()
+        msg = sm.SPM_Extend_Message(volume_data(), GiB)
+        t = threading.Timer(0.1, q.put, args=(msg,))
+        t.start()
+        try:
+            assert q.get(block=True, timeout=MAILER_TIMEOUT) is msg
+        finally:
+            t.join()
+
+    def test_get_domain(self):
+        q = sm.ExtendQueue()
+        other = dict(volume_data(make_uuid()), domainID=make_uuid())
+        q.put(sm.SPM_Extend_Message(other, GiB))
+        routine = sm.SPM_Extend_Message(volume_data(make_uuid()), GiB)
+        q.put(routine)
+        urgent = sm.SPM_Extend_Message(
+            volume_data(make_uuid()), GiB, priority=sc.EXTEND_EXCEEDED)
+        q.put(urgent)
+
+        domain_id = volume_data()["domainID"]
+        assert q.get_domain(domain_id, 1) == [urgent]
+        assert q.get_domain(domain_id, 2) == [routine]
+        assert q.get_domain(domain_id, 2) == []
+
+        # Messages taken by get_domain() are not returned by get().
+        assert q.get(block=False).volumeData is other
+        with pytest.raises(queue.Empty):
+            q.get(block=False)
+
+
+class TestExtendLatency:
+
+    def test_histogram(self):
+        h = sm.Histogram(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            h.add(value)
+        assert h.info() == {
+            "count": 4,
+            "sum": 6.0,
+            "buckets": {"1": 2, "2": 1, "inf": 1},
+        }
+
+    def test_merged_requests(self, mboxfiles):
+        done = threading.Event()
+        replies = []
+
+        def reply_callback(vol_data):
+            replies.append(vol_data["size"])
+            if len(replies) == 2:
+                done.set()
+
+        # Merge the requests before the mail monitor can take the first
+        # request from the queue.
+        msg = sm.SPM_Extend_Message(
+            dict(volume_data(), size=GiB), GiB, reply_callback)
+        msg.merge(sm.SPM_Extend_Message(
+            dict(volume_data(), size=2 * GiB), 2 * GiB, reply_callback,
+            priority=sc.EXTEND_ENOSPC))
+
+        with make_hsm_mailbox(mboxfiles, 7) as hsm_mb:
+            hsm_mb._queue.put(msg)
+
+            with make_spm_mailbox(mboxfiles) as spm_mm:
+                pool = FakePool(spm_mm)
+                spm_callback = partial(
+                    sm.SPM_Extend_Message.processRequest, pool)
+                spm_mm.registerMessageType(sm.EXTEND_CODE, spm_callback)
+
+                assert done.wait(MAILER_TIMEOUT)
+
+            stats = hsm_mb.extend_stats()
+
+        # One extend to the largest size was sent to the SPM.
+        assert pool.volume_data["size"] == 2 * GiB
+        assert sorted(replies) == [GiB, 2 * GiB]
+
+        assert stats[sc.EXTEND_ENOSPC]["count"] == 1
+        assert stats[sc.EXTEND_THRESHOLD]["count"] == 1
+        assert stats[sc.EXTEND_EXCEEDED]["count"] == 0
+
+
+def write_version(mail, host_id, version):
+    """
+    Write version record to host mailbox, and update the mailbox checksum.
+    """
+    mailbox_start = host_id * sm.MAILBOX_SIZE
+    start = mailbox_start + sm.VERSION_OFFSET
+    record = sm.version_record(version)
+    mail[start:start + len(record)] = record
+    checksum_start = mailbox_start + sm.MAILBOX_SIZE - sm.CHECKSUM_BYTES
+    mail[checksum_start:checksum_start + sm.CHECKSUM_BYTES] = \
+        sm.packed_checksum(mail[mailbox_start:checksum_start])
+
+
+def read_version(mail, host_id):
+    start = host_id * sm.MAILBOX_SIZE
+    return sm.read_version(mail[start:start + sm.MAILBOX_SIZE])
+
+
+class TestProtocolV2:
+
+    def test_pack_unpack(self):
+        domain = volume_data()["domainID"]
+        extends = [(make_uuid(), GiB), (make_uuid(), 2 * GiB)]
+        payload = sm.pack_extends(domain, extends)
+        assert len(payload) == sm.MESSAGE_SIZE
+        assert payload[0:1] == sm.MESSAGE_VERSION_2
+        assert payload[1:5] == sm.EXTEND_CODE
+        assert sm.unpack_extends(payload) == (domain, extends)
+
+    def test_extends_per_message(self):
+        assert sm.EXTENDS_PER_MESSAGE == 2
+
+    def test_unpack_invalid_count(self):
+        payload = bytearray(sm.pack_extends(make_uuid(), [(make_uuid(), 1)]))
+        payload[5] = sm.EXTENDS_PER_MESSAGE + 1
+        with pytest.raises(ValueError):
+            sm.unpack_extends(payload)
+
+    def test_batch_payload(self):
+        extends = [sm.SPM_Extend_Message(volume_data(make_uuid()), size)
+                   for size in (GiB, 2 * GiB)]
+        batch = sm.SPM_Extend_Batch(extends)
+        domain, volumes = sm.unpack_extends(batch.payload)
+        assert domain == volume_data()["domainID"]
+        assert volumes == [(e.volumeData["volumeID"], e.newSize)
+                           for e in extends]
+        assert batch.requests() == extends
+
+    def test_batch_too_many_extends(self):
+        extends = [sm.SPM_Extend_Message(volume_data(make_uuid()), GiB)
+                   for _ in range(sm.EXTENDS_PER_MESSAGE + 1)]
+        with pytest.raises(sm.InvalidParameterException):
+            sm.SPM_Extend_Batch(extends)
+
+    def test_check_reply(self):
+        extends = [sm.SPM_Extend_Message(volume_data(make_uuid()), GiB)
+                   for _ in range(2)]
+        batch = sm.SPM_Extend_Batch(extends)
+        assert batch.checkReply(batch.payload) == sm.REPLY_OK
+
+        other = sm.SPM_Extend_Batch(extends[:1])
+        with pytest.raises(RuntimeError):
+            batch.checkReply(other.payload)
+
+    def test_process_request(self):
+        MSG_ID = 7
+        spm_mailer = FakeSPMMailer()
+        pool = FakePool(spm_mailer)
+        domain = volume_data()["domainID"]
+        ok_volume = make_uuid()
+        bad_volume = make_uuid()
+        pool.errors[bad_volume] = RuntimeError("No space left in VG")
+
+        payload = sm.pack_extends(
+            domain, [(bad_volume, GiB), (ok_volume, 2 * GiB)])
+        ret = sm.SPM_Extend_Message.processRequest(
+            pool=pool, msgID=MSG_ID, payload=payload)
+
+        assert ret == {'status': {'code': 0, 'message': 'Done'}}
+        assert pool.volume_data == {
+            'volumeID': ok_volume,
+            'domainID': domain,
+            'size': 2 * GiB
+        }
+
+        # One reply for both extends, with size 0 for the failed extend.
+        assert spm_mailer.msg_id == MSG_ID
+        assert sm.unpack_extends(spm_mailer.msg.payload) == (
+            domain, [(bad_volume, 0), (ok_volume, 2 * GiB)])
+
+    def test_negotiate(self, mboxfiles):
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_version(mail, 3, 2)
+            spm_mm._handleRequests(mail)
+
+            out = spm_mm._outgoingMail
+            assert read_version(out, 3) == 2
+            for host_id in range(MAX_HOSTS):
+                if host_id != 3:
+                    assert read_version(out, host_id) == 1
+
+            # The host mailbox was cleared, for example when the host was
+            # downgraded.
+            start = 3 * sm.MAILBOX_SIZE
+            mail[start:start + sm.MAILBOX_SIZE] = sm.EMPTYMAILBOX
+            spm_mm._handleRequests(mail)
+            assert out == bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+
+    def test_negotiate_invalid_mailbox(self, mboxfiles):
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_version(mail, 3, 2)
+            end = 4 * sm.MAILBOX_SIZE
+            mail[end - sm.CHECKSUM_BYTES:end] = b"bad!"
+            spm_mm._handleRequests(mail)
+            assert read_version(spm_mm._outgoingMail, 3) == 1
+
+    def test_negotiate_disabled(self, mboxfiles, monkeypatch):
+        config = make_config([("mailbox", "protocol_version", "1")])
+        monkeypatch.setattr(sm, "config", config)
+
+        with make_stopped_spm_mailbox(mboxfiles) as spm_mm:
+            mail = bytearray(sm.EMPTYMAILBOX * MAX_HOSTS)
+            write_version(mail, 3, 2)
+            spm_mm._handleRequests(mail)
+            assert read_version(spm_mm._outgoingMail, 3) == 1
+
+    def test_send_receive(self, mboxfiles):
+        received = []
+
+        with make_hsm_mailbox(mboxfiles, 7) as hsm_mb:
+            with make_spm_mailbox(mboxfiles) as spm_mm:
+                pool = FakePool(spm_mm)
+
+                def spm_callback(msg_id, payload):
+                    received.append(payload[0:1])
+                    sm.SPM_Extend_Message.processRequest(
+                        pool, msg_id, payload)
+
+                spm_mm.registerMessageType(sm.EXTEND_CODE, spm_callback)
+
+                # The first message is sent using version 1, since the SPM
+                # did not advertise version 2 yet.
+                self.extend(hsm_mb, [make_uuid()])
+                assert hsm_mb._mailman._version == 2
+
+                # Extends in the same domain are sent together if they are
+                # pending when the mail monitor takes the first extend.
+                self.extend(hsm_mb, [make_uuid() for _ in range(4)])
+
+        assert received[0] == sm.MESSAGE_VERSION
+        assert 2 <= len(received[1:]) <= 4
+        assert set(received[1:]) == {sm.MESSAGE_VERSION_2}
+
+    def test_fallback(self, mboxfiles):
+        received = []
+
+        with make_hsm_mailbox(mboxfiles, 7) as hsm_mb:
+            # Simulate SPM moved to a host that does not support version 2.
+            hsm_mb._mailman._version = 2
+
+            with make_spm_mailbox(mboxfiles) as spm_mm:
+                spm_mm._maxVersion = 1
+                pool = FakePool(spm_mm)
+
+                def spm_callback(msg_id, payload):
+                    received.append(payload[0:1])
+                    sm.SPM_Extend_Message.processRequest(
+                        pool, msg_id, payload)
+
+                spm_mm.registerMessageType(sm.EXTEND_CODE, spm_callback)
+
+                self.extend(hsm_mb, [make_uuid() for _ in range(2)])
+                assert hsm_mb._mailman._version == 1
+
+        assert received == [sm.MESSAGE_VERSION] * 2
+
+    def extend(self, hsm_mb, volumes):
+        done = threading.Event()
+        replies = []
+
+        def reply_callback(vol_data):
+            replies.append(vol_data["volumeID"])
+            if len(replies) == len(volumes):
+                done.set()
+
+        for vol_id in volumes:
+            hsm_mb.sendExtendMsg(
+                volume_data(vol_id), GiB, callbackFunction=reply_callback)
+
+        assert done.wait(MAILER_TIMEOUT)
+        assert sorted(replies) == sorted(volumes)
+
+
 class TestValidation:
 
     def test_empty_mailbox(self):
@@ -527,6 +1112,41 @@ class TestChecksum:
         assert sm.packed_checksum(data) == packed_result
 
 
+class TestMailboxFile:
+
+    def test_read_write(self, tmpdir):
+        path = str(tmpdir.join("mailbox"))
+        with io.open(path, "wb") as f:
+            f.write(b"\0" * 2 * sm.MAILBOX_SIZE)
+
+        f = sm.MailboxFile(path, "r+")
+        buf = mmap.mmap(-1, 2 * sm.MAILBOX_SIZE, mmap.MAP_SHARED)
+        try:
+            buf[:] = b"a" * sm.MAILBOX_SIZE + b"b" * sm.MAILBOX_SIZE
+            with memoryview(buf) as view:
+                f.pwritev(0, [view[:sm.MAILBOX_SIZE],
+                              view[sm.MAILBOX_SIZE:]])
+            buf[:] = b"\0" * len(buf)
+            assert f.preadv(0, [buf]) == len(buf)
+            assert buf[:] == b"a" * sm.MAILBOX_SIZE + b"b" * sm.MAILBOX_SIZE
+        finally:
+            f.close()
+            buf.close()
+
+    def test_read_eof(self, tmpdir):
+        path = str(tmpdir.join("mailbox"))
+        with io.open(path, "wb") as f:
+            f.write(b"x" * sm.MAILBOX_SIZE)
+
+        f = sm.MailboxFile(path)
+        buf = mmap.mmap(-1, 2 * sm.MAILBOX_SIZE, mmap.MAP_SHARED)
+        try:
+            assert f.preadv(0, [buf]) == sm.MAILBOX_SIZE
+        finally:
+            f.close()
+            buf.close()
+
+
 class TestWaitTimeout:
 
     @pytest.mark.parametrize("monitor_interval, expected_timeout", [
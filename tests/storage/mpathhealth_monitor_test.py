@@ -24,6 +24,7 @@ from __future__ import print_function
 
 import pytest
 import threading
+import time
 
 from vdsm.storage import devicemapper
 from vdsm.storage import mpathhealth
@@ -42,6 +43,27 @@ class FakeMultipathStatus(object):
         return self.out
 
 
+class FakeMultipathEvents(object):
+
+    def __init__(self, out=None):
+        # Events are not available by default.
+        self.out = out
+
+    def __call__(self):
+        return None if self.out is None else dict(self.out)
+
+
+class CountingMultipathStatus(FakeMultipathStatus):
+
+    def __init__(self):
+        super(CountingMultipathStatus, self).__init__()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.out
+
+
 class MonitorCallback(object):
     """
     Callable callback class used for synchronization of the health monitor
@@ -95,6 +117,8 @@ class MonitorCallback(object):
 def tmp_monitor(monkeypatch):
     monkeypatch.setattr(
         devicemapper, "multipath_status", FakeMultipathStatus())
+    monkeypatch.setattr(
+        devicemapper, "multipath_events", FakeMultipathEvents())
     monitor = mpathhealth.Monitor(MONITOR_INTERVAL)
     monitor.callback = MonitorCallback()
     yield monitor
@@ -339,3 +363,149 @@ def test_error(tmp_monitor):
             "valid_paths": 1
         }
     }
+
+
+@pytest.fixture
+def event_monitor(monkeypatch):
+    """
+    Monitor using events, polling the status only every 60 seconds.
+    """
+    monkeypatch.setattr(
+        devicemapper, "multipath_status", CountingMultipathStatus())
+    monkeypatch.setattr(
+        devicemapper, "multipath_events", FakeMultipathEvents({}))
+    monitor = mpathhealth.Monitor(60, event_interval=MONITOR_INTERVAL)
+    monitor.callback = MonitorCallback()
+    yield monitor
+    monitor.callback.resume()
+    monitor.stop()
+    monitor.wait()
+
+
+def run_cycles(monitor, count):
+    for i in range(count):
+        monitor.callback.resume()
+        monitor.callback.wait()
+
+
+def test_events_no_change(event_monitor):
+    devicemapper.multipath_events.out = {"uuid-1": 1}
+    devicemapper.multipath_status.out = {
+        "uuid-1": [PathStatus("8:11", "A"), PathStatus("6:66", "A")]
+    }
+    event_monitor.start()
+    event_monitor.callback.wait()
+    assert devicemapper.multipath_status.calls == 1
+
+    # Without events, the status is not queried again.
+    run_cycles(event_monitor, 3)
+    assert devicemapper.multipath_status.calls == 1
+
+
+def test_events_path_failed(event_monitor):
+    devicemapper.multipath_events.out = {"uuid-1": 1}
+    devicemapper.multipath_status.out = {
+        "uuid-1": [PathStatus("8:11", "A"), PathStatus("6:66", "A")]
+    }
+    event_monitor.start()
+    event_monitor.callback.wait()
+    assert event_monitor.status() == {}
+
+    devicemapper.multipath_events.out = {"uuid-1": 2}
+    devicemapper.multipath_status.out = {
+        "uuid-1": [PathStatus("8:11", "A"), PathStatus("6:66", "F")]
+    }
+    run_cycles(event_monitor, 1)
+
+    assert devicemapper.multipath_status.calls == 2
+    assert event_monitor.status() == {
+        "uuid-1": {
+            "failed_paths": ["6:66"],
+            "valid_paths": 1
+        }
+    }
+
+
+def test_events_map_removed(event_monitor):
+    devicemapper.multipath_events.out = {"uuid-1": 1, "uuid-2": 1}
+    devicemapper.multipath_status.out = {
+        "uuid-1": [PathStatus("8:11", "F")],
+        "uuid-2": [PathStatus("6:66", "A")],
+    }
+    event_monitor.start()
+    event_monitor.callback.wait()
+    assert "uuid-1" in event_monitor.status()
+
+    devicemapper.multipath_events.out = {"uuid-2": 1}
+    devicemapper.multipath_status.out = {
+        "uuid-2": [PathStatus("6:66", "A")],
+    }
+    run_cycles(event_monitor, 1)
+
+    assert event_monitor.status() == {}
+
+
+def test_events_map_without_events(event_monitor, monkeypatch):
+    monkeypatch.setattr(mpathhealth.time, "monotonic", lambda: 0)
+    devicemapper.multipath_events.out = {"uuid-1": None}
+    event_monitor.start()
+    event_monitor.callback.wait()
+    assert devicemapper.multipath_status.calls == 1
+
+    # Map without events is polled only every interval.
+    run_cycles(event_monitor, 3)
+    assert devicemapper.multipath_status.calls == 1
+
+    monkeypatch.setattr(mpathhealth.time, "monotonic", lambda: 60)
+    run_cycles(event_monitor, 1)
+    assert devicemapper.multipath_status.calls == 2
+
+
+def test_events_refresh(event_monitor, monkeypatch):
+    monkeypatch.setattr(mpathhealth.time, "monotonic", lambda: 0)
+    devicemapper.multipath_events.out = {"uuid-1": 1}
+    event_monitor.start()
+    event_monitor.callback.wait()
+
+    monkeypatch.setattr(
+        mpathhealth.time, "monotonic", lambda: mpathhealth.REFRESH_INTERVAL)
+    run_cycles(event_monitor, 1)
+    assert devicemapper.multipath_status.calls == 2
+
+
+def test_failed_path_latency(monkeypatch):
+    # Monitor polling the status every 10 seconds, checking events every
+    # 0.1 seconds.
+    monkeypatch.setattr(
+        devicemapper, "multipath_status", FakeMultipathStatus())
+    monkeypatch.setattr(
+        devicemapper, "multipath_events", FakeMultipathEvents({"uuid-1": 1}))
+    devicemapper.multipath_status.out = {
+        "uuid-1": [PathStatus("8:11", "A"), PathStatus("6:66", "A")]
+    }
+    updated = threading.Event()
+    monitor = mpathhealth.Monitor(10, event_interval=0.1)
+    monitor.callback = updated.set
+    monitor.start()
+    try:
+        assert updated.wait(CYCLE_TIMEOUT)
+
+        # Fail a path; the kernel reports an event for the map.
+        devicemapper.multipath_status.out = {
+            "uuid-1": [PathStatus("8:11", "A"), PathStatus("6:66", "F")]
+        }
+        devicemapper.multipath_events.out = {"uuid-1": 2}
+        start = time.monotonic()
+
+        deadline = start + CYCLE_TIMEOUT
+        while not monitor.status():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        latency = time.monotonic() - start
+    finally:
+        monitor.stop()
+        monitor.wait()
+
+    print("Failed path detected in %.3f seconds" % latency)
+    assert latency < 1.0
@@ -21,9 +21,13 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import os
+
 import pytest
 
 from vdsm.common import cmdutils
+from vdsm.storage import devicemapper
+from vdsm.storage import iscsi
 from vdsm.storage import multipath
 
 from . marks import requires_root
@@ -156,3 +160,220 @@ def test_scsi_id_fails(fake_scsi_id):
 
     scsi_serial = multipath.get_scsi_serial("fake_device")
     assert scsi_serial == ""
+
+
+# VPD page 0x80 of the device above.
+FAKE_VPD_PG80 = b"\x00\x80\x00\x14     WD-WMAT16865419"
+
+
+@pytest.mark.parametrize("vendor, model, page, serial", [
+    # Real device.
+    ("ATA     ", "WDC WD2502ABYS-1", FAKE_VPD_PG80,
+     "SATA_WDC_WD2502ABYS-1_WD-WMAT16865419"),
+    # Unpadded vendor and model.
+    ("ATA", "WDC WD2502ABYS-1", FAKE_VPD_PG80,
+     "SATA_WDC_WD2502ABYS-1_WD-WMAT16865419"),
+    # Serial padded with NUL bytes.
+    ("LIO-ORG ", "disk1           ", b"\x00\x80\x00\x08serial\x00\x00",
+     "SLIO-ORG_disk1_serial"),
+    # Invalid characters.
+    ("LIO-ORG ", "disk1           ", b"\x00\x80\x00\x05a/b\xffc",
+     "SLIO-ORG_disk1_a_b_c"),
+    # Empty serial.
+    ("LIO-ORG ", "disk1           ", b"\x00\x80\x00\x00",
+     "SLIO-ORG_disk1"),
+    # Wrong page.
+    ("LIO-ORG ", "disk1           ", b"\x00\x83\x00\x04abcd", ""),
+    # Truncated page.
+    ("LIO-ORG ", "disk1           ", b"\x00\x80", ""),
+])
+def test_format_scsi_serial(vendor, model, page, serial):
+    assert multipath.format_scsi_serial(vendor, model, page) == serial
+
+
+class FakeSysfs(object):
+
+    def __init__(self, root):
+        self.sys_block = root.mkdir("block")
+        self.udev_data = root.mkdir("udev")
+
+    def add_disk(self, name, devt, hbtl="0:0:0:1", size=2048,
+                 vpd_pg80=FAKE_VPD_PG80, udev=True):
+        dev = self.sys_block.mkdir(name)
+        dev.join("dev").write(devt + "\n")
+        dev.join("size").write("%d\n" % size)
+        queue = dev.mkdir("queue")
+        queue.join("logical_block_size").write("512\n")
+        queue.join("physical_block_size").write("4096\n")
+        queue.join("discard_max_bytes").write("0\n")
+        device = dev.mkdir("device")
+        device.join("vendor").write("ATA     \n")
+        device.join("model").write("WDC WD2502ABYS-1\n")
+        device.join("rev").write("3B05\n")
+        device.mkdir("scsi_disk").mkdir(hbtl)
+        if vpd_pg80 is not None:
+            device.join("vpd_pg80").write(vpd_pg80, mode="wb")
+        if udev:
+            self.udev_changed(devt)
+        return dev
+
+    def add_multipath(self, name, slaves):
+        dev = self.sys_block.mkdir(name)
+        dev.join("size").write("2048\n")
+        queue = dev.mkdir("queue")
+        queue.join("logical_block_size").write("512\n")
+        queue.join("physical_block_size").write("4096\n")
+        queue.join("discard_max_bytes").write("1024\n")
+        return dev
+
+    def udev_changed(self, devt):
+        # udev replaces the database file on every event.
+        path = self.udev_data.join("b" + devt)
+        tmp = self.udev_data.join(".tmp")
+        tmp.write("E:ID_TYPE=disk\n")
+        os.rename(str(tmp), str(path))
+
+
+@pytest.fixture
+def fake_sysfs(tmpdir, monkeypatch):
+    sysfs = FakeSysfs(tmpdir)
+    monkeypatch.setattr(multipath, "SYS_BLOCK", str(sysfs.sys_block))
+    monkeypatch.setattr(multipath, "UDEV_DATA", str(sysfs.udev_data))
+    monkeypatch.setattr(iscsi, "devIsiSCSI", lambda dev: False)
+    monkeypatch.setattr(multipath, "_device_cache", multipath.DeviceCache())
+    return sysfs
+
+
+def test_device_cache_read(fake_sysfs):
+    fake_sysfs.add_disk("sda", "8:0")
+    info = multipath.DeviceCache().get("sda")
+    assert info == multipath.DeviceInfo(
+        vendor="ATA",
+        model="WDC WD2502ABYS-1",
+        fwrev="3B05",
+        logical_block_size=512,
+        physical_block_size=4096,
+        lun="1",
+        serial="SATA_WDC_WD2502ABYS-1_WD-WMAT16865419",
+        iscsi_session=None)
+
+
+def test_device_cache_no_vpd_pg80(fake_sysfs):
+    fake_sysfs.add_disk("sda", "8:0", vpd_pg80=None)
+    info = multipath.DeviceCache().get("sda")
+    assert info.serial is None
+
+
+def test_device_cache_no_hbtl(fake_sysfs):
+    dev = fake_sysfs.add_disk("sda", "8:0")
+    dev.join("device", "scsi_disk").remove()
+    info = multipath.DeviceCache().get("sda")
+    assert info.lun == 0
+
+
+def test_device_cache_cached(fake_sysfs):
+    dev = fake_sysfs.add_disk("sda", "8:0")
+    cache = multipath.DeviceCache()
+    cache.get("sda")
+
+    # Without udev event, the device is not read again.
+    dev.join("device", "rev").write("4A01\n")
+    assert cache.get("sda").fwrev == "3B05"
+
+    # After udev event, the device is read again.
+    fake_sysfs.udev_changed("8:0")
+    assert cache.get("sda").fwrev == "4A01"
+
+
+def test_device_cache_no_udev(fake_sysfs):
+    dev = fake_sysfs.add_disk("sda", "8:0", udev=False)
+    cache = multipath.DeviceCache()
+    cache.get("sda")
+
+    dev.join("device", "rev").write("4A01\n")
+    assert cache.get("sda").fwrev == "4A01"
+
+
+def test_device_cache_prune(fake_sysfs):
+    fake_sysfs.add_disk("sda", "8:0")
+    dev = fake_sysfs.add_disk("sdb", "8:16")
+    cache = multipath.DeviceCache()
+    cache.get("sda")
+    cache.get("sdb")
+
+    cache.prune(["sda"])
+
+    # sdb was dropped from the cache and read again.
+    dev.join("device", "rev").write("4A01\n")
+    assert cache.get("sdb").fwrev == "4A01"
+
+
+@pytest.fixture
+def fake_multipath(fake_sysfs, monkeypatch):
+    fake_sysfs.add_disk("sda", "8:0", hbtl="1:0:0:3")
+    fake_sysfs.add_disk("sdb", "8:16", hbtl="2:0:0:3")
+    fake_sysfs.add_multipath("dm-0", ["sda", "sdb"])
+
+    monkeypatch.setattr(
+        multipath, "getMPDevsIter", lambda: iter([("dm-0", "guid")]))
+    monkeypatch.setattr(
+        devicemapper, "getSlaves", lambda dm: ["sda", "sdb"])
+    monkeypatch.setattr(devicemapper, "isBlockDevice", lambda dev: True)
+    monkeypatch.setattr(
+        devicemapper, "getPathsStatus", lambda: {"sda": "active"})
+
+    def get_scsi_serial(physdev):
+        raise AssertionError("scsi_id invoked")
+
+    monkeypatch.setattr(multipath, "get_scsi_serial", get_scsi_serial)
+
+    return fake_sysfs
+
+
+def test_path_list(fake_multipath):
+    devices = list(multipath.pathListIter())
+    assert devices == [{
+        "guid": "guid",
+        "dm": "dm-0",
+        "capacity": str(2048 * 512),
+        "serial": "SATA_WDC_WD2502ABYS-1_WD-WMAT16865419",
+        "paths": [
+            {
+                "physdev": "sda",
+                "state": "active",
+                "capacity": str(2048 * 512),
+                "lun": "3",
+                "type": multipath.DEV_FCP,
+            },
+            {
+                "physdev": "sdb",
+                "state": "failed",
+                "capacity": str(2048 * 512),
+                "lun": "3",
+                "type": multipath.DEV_FCP,
+            },
+        ],
+        "connections": [],
+        "devtypes": [multipath.DEV_FCP, multipath.DEV_FCP],
+        "devtype": multipath.DEV_FCP,
+        "vendor": "ATA",
+        "product": "WDC WD2502ABYS-1",
+        "fwrev": "3B05",
+        "logicalblocksize": "512",
+        "physicalblocksize": "4096",
+        "discard_max_bytes": 1024,
+    }]
+
+
+def test_path_list_filter(fake_multipath):
+    assert list(multipath.pathListIter(["other-guid"])) == []
+    assert len(list(multipath.pathListIter(["guid"]))) == 1
+
+
+def test_path_list_scsi_id_fallback(fake_multipath, monkeypatch):
+    for name in ("sda", "sdb"):
+        fake_multipath.sys_block.join(name, "device", "vpd_pg80").remove()
+    monkeypatch.setattr(
+        multipath, "get_scsi_serial", lambda physdev: "scsi-id-serial")
+    devices = list(multipath.pathListIter())
+    assert devices[0]["serial"] == "scsi-id-serial"
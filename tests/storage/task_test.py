@@ -21,10 +21,16 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import os
+
 from contextlib import contextmanager
 
+import pytest
+
 from vdsm.common import concurrent
 from vdsm.storage import outOfProcess as oop
+from vdsm.storage import task
+from vdsm.storage import taskjournal
 from vdsm.storage.task import Job, Recovery, Task, TaskCleanType,\
     TaskPersistType, TaskRecoveryType
 
@@ -195,7 +201,10 @@ def test_task_rollback(add_recovery):
         }
 
 
-def test_task_save_load(tmpdir, add_recovery):
+@pytest.mark.parametrize("use_journal", [False, True])
+def test_task_save_load(tmpdir, monkeypatch, add_recovery, use_journal):
+    monkeypatch.setattr(task, "USE_JOURNAL", use_journal)
+
     # Run async task
     c = Callable(hang_timeout=WAIT_TIMEOUT)
     with async_task(c, "task-id") as orig_task:
@@ -234,6 +243,36 @@ def test_task_save_load(tmpdir, add_recovery):
     }
 
 
+def test_task_journal(tmpdir, monkeypatch, add_recovery):
+    monkeypatch.setattr(task, "USE_JOURNAL", True)
+    store = str(tmpdir)
+
+    c = Callable(hang_timeout=WAIT_TIMEOUT)
+    with async_task(c, "task-id") as orig_task:
+        orig_task.setRecoveryPolicy("auto")
+        orig_task.setPersistence(store)
+        add_recovery(orig_task, "fakerecovery", ["arg1", "arg2"])
+
+        # The task is saved only in the journal.
+        assert not os.path.exists(os.path.join(store, "task-id"))
+        assert taskjournal.get(store).tasks() == ["task-id"]
+
+        journal_task = Task.loadTask(store, "task-id")
+
+        # Save the same task in a task directory.
+        monkeypatch.setattr(task, "USE_JOURNAL", False)
+        dir_store = str(tmpdir.mkdir("dir"))
+        orig_task.setPersistence(dir_store)
+        dir_task = Task.loadTask(dir_store, "task-id")
+
+        # Recovering from the journal must be identical.
+        dir_dump = dir_task.dumpTask().replace(dir_store, store)
+        assert journal_task.dumpTask() == dir_dump
+        assert journal_task.getStatus() == dir_task.getStatus()
+
+        orig_task.store = None
+
+
 def test_recovery_list():
     # Check push pop single recovery
     t = Task(id="task-id")
@@ -0,0 +1,213 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.storage import outOfProcess as oop
+from vdsm.storage import taskjournal
+
+
+@pytest.fixture
+def store(tmpdir):
+    yield str(tmpdir)
+    oop.stop()
+
+
+def segments(store):
+    path = os.path.join(store, taskjournal.JOURNAL_DIR)
+    return sorted(os.listdir(path))
+
+
+def test_empty(store):
+    journal = taskjournal.Journal(store)
+    assert journal.tasks() == []
+    assert journal.get("task-id") is None
+    # The journal is created on the first write.
+    assert not os.path.exists(os.path.join(store, taskjournal.JOURNAL_DIR))
+
+
+def test_save_load(store):
+    journal = taskjournal.Journal(store)
+    journal.save("task-1", {"task": ["id = task-1"]})
+    journal.save("task-2", {"task": ["id = task-2"]})
+    journal.save("task-1", {"task": ["id = task-1", "state = running"]})
+
+    loaded = taskjournal.Journal(store)
+    assert sorted(loaded.tasks()) == ["task-1", "task-2"]
+    assert loaded.get("task-1") == {"task": ["id = task-1", "state = running"]}
+    assert loaded.get("task-2") == {"task": ["id = task-2"]}
+
+
+def test_clean(store):
+    journal = taskjournal.Journal(store)
+    journal.save("task-1", {"task": []})
+    journal.save("task-2", {"task": []})
+    journal.clean("task-1")
+    assert journal.tasks() == ["task-2"]
+
+    loaded = taskjournal.Journal(store)
+    assert loaded.tasks() == ["task-2"]
+
+
+def test_uncommitted_segment(store):
+    journal = taskjournal.Journal(store)
+    journal.save("task-1", {"task": ["state = running"]})
+    journal.save("task-1", {"task": ["state = finished"]})
+
+    # Simulate crash while writing the last segment.
+    path = os.path.join(store, taskjournal.JOURNAL_DIR, segments(store)[-1])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:data.index(b"\n") + 1])
+
+    loaded = taskjournal.Journal(store)
+    assert loaded.get("task-1") == {"task": ["state = running"]}
+
+
+def test_corrupted_segment(store):
+    journal = taskjournal.Journal(store)
+    journal.save("task-1", {"task": ["state = running"]})
+    journal.save("task-1", {"task": ["state = finished"]})
+
+    path = os.path.join(store, taskjournal.JOURNAL_DIR, segments(store)[-1])
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data.replace(b"finished", b"finishes"))
+
+    loaded = taskjournal.Journal(store)
+    assert loaded.get("task-1") == {"task": ["state = running"]}
+
+
+def test_compact(store):
+    journal = taskjournal.Journal(store, max_segments=4)
+    for i in range(3):
+        journal.save("task-%d" % i, {"task": ["n = %d" % i]})
+    journal.clean("task-0")
+
+    # The 4th segment triggers compaction.
+    assert len(segments(store)) == 1
+
+    loaded = taskjournal.Journal(store)
+    assert sorted(loaded.tasks()) == ["task-1", "task-2"]
+    assert loaded.get("task-2") == {"task": ["n = 2"]}
+
+
+def test_compact_old_segments_left(store):
+    journal = taskjournal.Journal(store, max_segments=3)
+    journal.save("task-1", {"task": ["n = 1"]})
+    journal.save("task-2", {"task": ["n = 2"]})
+
+    first = os.path.join(store, taskjournal.JOURNAL_DIR, segments(store)[0])
+    with open(first, "rb") as f:
+        data = f.read()
+
+    journal.clean("task-1")
+    assert len(segments(store)) == 1
+
+    # Simulate crash after writing the snapshot, before removing old
+    # segments, by restoring an old segment with a stale record.
+    with open(first, "wb") as f:
+        f.write(data)
+
+    loaded = taskjournal.Journal(store)
+    assert loaded.tasks() == ["task-2"]
+
+    # Writing after loading must not overwrite the snapshot.
+    loaded.save("task-3", {"task": ["n = 3"]})
+    loaded = taskjournal.Journal(store)
+    assert sorted(loaded.tasks()) == ["task-2", "task-3"]
+
+
+def test_group_commit(store, monkeypatch):
+    journal = taskjournal.Journal(store)
+    writing = threading.Event()
+    resume = threading.Event()
+    write_segment = journal._write_segment
+    batches = []
+
+    def blocking_write_segment(records):
+        batches.append(len(records))
+        if len(batches) == 1:
+            writing.set()
+            resume.wait(5)
+        write_segment(records)
+
+    monkeypatch.setattr(journal, "_write_segment", blocking_write_segment)
+
+    # The first writer blocks in the write...
+    first = concurrent.thread(journal.save, args=("task-0", {}))
+    first.start()
+    assert writing.wait(5)
+
+    # ... while other tasks add records to the next batch.
+    threads = []
+    for i in range(1, 10):
+        t = concurrent.thread(journal.save, args=("task-%d" % i, {}))
+        t.start()
+        threads.append(t)
+
+    # Wait until all records are pending.
+    while len(journal._batch.records) < 9:
+        threading.Event().wait(0.01)
+
+    resume.set()
+    first.join()
+    for t in threads:
+        t.join()
+
+    assert batches == [1, 9]
+    assert len(segments(store)) == 2
+    assert len(taskjournal.Journal(store).tasks()) == 10
+
+
+def test_write_error(store, monkeypatch):
+    journal = taskjournal.Journal(store)
+
+    def fail(records):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(journal, "_write_segment", fail)
+
+    with pytest.raises(OSError):
+        journal.save("task-1", {})
+
+    assert journal.tasks() == []
+
+
+def test_get_load(store):
+    journal = taskjournal.get(store)
+    assert taskjournal.get(store) is journal
+
+    # Another host modified the journal.
+    taskjournal.Journal(store).save("task-1", {})
+    assert journal.tasks() == []
+
+    reloaded = taskjournal.load(store)
+    assert reloaded.tasks() == ["task-1"]
+    assert taskjournal.get(store) is reloaded
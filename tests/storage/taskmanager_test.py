@@ -23,6 +23,8 @@ from __future__ import division
 
 from contextlib import contextmanager
 
+import pytest
+
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import task
 from vdsm.storage import taskManager
@@ -49,7 +51,9 @@ def task_manager(workers=1):
         oop.stop()
 
 
-def test_persistent_job(tmpdir, add_recovery):
+@pytest.mark.parametrize("use_journal", [False, True])
+def test_persistent_job(tmpdir, monkeypatch, add_recovery, use_journal):
+    monkeypatch.setattr(task, "USE_JOURNAL", use_journal)
     store = str(tmpdir)
     # Simulate SPM starting a persistent job and fencing out
     with task_manager() as tm:
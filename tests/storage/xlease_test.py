@@ -26,6 +26,7 @@ import functools
 import io
 import mmap
 import os
+import time
 import timeit
 
 import pytest
@@ -991,6 +992,132 @@ def bench():
               % (count, elapsed, elapsed / count))
 
 
+@pytest.fixture
+def memory_index():
+    """
+    Provides a VolumeIndex loaded from a memory backend with a full index.
+    """
+    backend = xlease.MemoryBackend(size=sc.ALIGNMENT_1M + xlease.INDEX_SIZE)
+    with utils.closing(backend):
+        xlease.format_index(make_uuid(), backend)
+        index = xlease.VolumeIndex(sc.ALIGNMENT_1M, sc.BLOCK_SIZE_512)
+        with utils.closing(index):
+            index.load(backend)
+            yield index
+
+
+class TestVolumeIndex:
+
+    def test_empty(self, memory_index):
+        assert memory_index.find_record(make_uuid()) == -1
+        assert memory_index.find_free_record() == 0
+        assert memory_index.used_records() == []
+
+    def test_write_record(self, memory_index):
+        lease_id = make_uuid()
+        memory_index.write_record(0, xlease.Record(lease_id, 0))
+        assert memory_index.find_record(lease_id) == 0
+        assert memory_index.find_free_record() == 1
+        assert memory_index.used_records() == [0]
+
+    def test_clear_record(self, memory_index):
+        lease_ids = [make_uuid() for i in range(3)]
+        for recnum, lease_id in enumerate(lease_ids):
+            memory_index.write_record(recnum, xlease.Record(lease_id, 0))
+
+        memory_index.write_record(1, xlease.EMPTY_RECORD)
+        assert memory_index.find_record(lease_ids[1]) == -1
+        assert memory_index.find_free_record() == 1
+        assert memory_index.used_records() == [0, 2]
+
+    def test_replace_record(self, memory_index):
+        old_id = make_uuid()
+        new_id = make_uuid()
+        memory_index.write_record(0, xlease.Record(old_id, 0))
+        memory_index.write_record(0, xlease.Record(new_id, 0))
+        assert memory_index.find_record(old_id) == -1
+        assert memory_index.find_record(new_id) == 0
+
+    def test_full(self, memory_index):
+        for recnum in range(xlease.MAX_RECORDS):
+            memory_index.write_record(recnum, xlease.Record(make_uuid(), 0))
+        assert memory_index.find_free_record() == -1
+
+    def test_load(self, memory_index):
+        lease_id = make_uuid()
+        backend = xlease.MemoryBackend(
+            size=sc.ALIGNMENT_1M + xlease.INDEX_SIZE)
+        with utils.closing(backend):
+            xlease.format_index(make_uuid(), backend)
+            other = xlease.VolumeIndex(sc.ALIGNMENT_1M, sc.BLOCK_SIZE_512)
+            with utils.closing(other):
+                other.load(backend)
+                other.write_record(0, xlease.Record(make_uuid(), 0))
+                other.write_record(1, xlease.Record(lease_id, 0))
+                other.dump(backend)
+
+            # Loading replaces the current contents of the index.
+            memory_index.write_record(5, xlease.Record(make_uuid(), 0))
+            memory_index.load(backend)
+
+        assert memory_index.find_record(lease_id) == 1
+        assert memory_index.find_free_record() == 2
+        assert memory_index.used_records() == [0, 1]
+
+    def test_duplicate_records(self, memory_index):
+        lease_id = make_uuid()
+        memory_index.write_record(3, xlease.Record(lease_id, 0))
+        memory_index.write_record(1, xlease.Record(lease_id, 0))
+        assert memory_index.find_record(lease_id) == 1
+
+        memory_index.write_record(1, xlease.EMPTY_RECORD)
+        assert memory_index.find_record(lease_id) == 3
+
+    def test_misaligned_match(self):
+        lease_id = "lease-id"
+        backend = xlease.MemoryBackend(
+            size=sc.ALIGNMENT_1M + xlease.INDEX_SIZE)
+        with utils.closing(backend):
+            xlease.format_index(make_uuid(), backend, max_records=2)
+
+            # Write the lease id lookup prefix in the middle of the unused
+            # area after the formatted records.
+            offset = xlease.RECORD_BASE + 2 * xlease.RECORD_SIZE + 8
+            backend.pwrite(sc.ALIGNMENT_1M + offset, lease_id.encode("ascii"))
+
+            index = xlease.VolumeIndex(sc.ALIGNMENT_1M, sc.BLOCK_SIZE_512)
+            with utils.closing(index):
+                index.load(backend)
+                assert index.find_record(lease_id) == -1
+
+    @pytest.mark.slow
+    @pytest.mark.parametrize("count", [100, 1000, xlease.MAX_RECORDS])
+    def test_time(self, memory_index, count):
+        lease_ids = [make_uuid() for i in range(count)]
+
+        start = time.monotonic()
+        for lease_id in lease_ids:
+            recnum = memory_index.find_free_record()
+            memory_index.write_record(recnum, xlease.Record(lease_id, 0))
+        add = time.monotonic() - start
+
+        start = time.monotonic()
+        for lease_id in lease_ids:
+            memory_index.find_record(lease_id)
+        lookup = time.monotonic() - start
+
+        start = time.monotonic()
+        for lease_id in lease_ids:
+            recnum = memory_index.find_record(lease_id)
+            memory_index.write_record(recnum, xlease.EMPTY_RECORD)
+        remove = time.monotonic() - start
+
+        print("%d leases: add %.3f, lookup %.3f, remove %.3f "
+              "microseconds per lease"
+              % (count, add / count * 1e6, lookup / count * 1e6,
+                 remove / count * 1e6))
+
+
 @pytest.fixture(params=[
     xlease.DirectFile,
     xlease.InterruptibleDirectFile,
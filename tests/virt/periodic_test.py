@@ -26,6 +26,8 @@ import logging
 import threading
 import time
 
+import libvirt
+
 from vdsm import executor
 from vdsm import schedule
 from vdsm import throttledlog
@@ -556,9 +558,13 @@ class _FakeVM(object):
         self.post_copy = migration.PostCopyPhase.NONE
         self.disk_devices = []
         self.updated_drives = []
+        self.ready_for_commands = True
+        self.volume_monitor = _FakeVolumeMonitor()
 
     def isDomainReadyForCommands(self):
-        return True
+        if isinstance(self.ready_for_commands, Exception):
+            raise self.ready_for_commands
+        return self.ready_for_commands
 
     def isMigrating(self):
         return self.migrating
@@ -573,6 +579,19 @@ class _FakeVM(object):
         self.updated_drives.append(vmDrive)
 
 
+class _FakeVolumeMonitor(object):
+
+    def __init__(self):
+        self.needed = True
+        self.monitored = 0
+
+    def monitoring_needed(self):
+        return self.needed
+
+    def monitor_volumes(self):
+        self.monitored += 1
+
+
 class _FakeDrive(object):
 
     def __init__(self, name, readonly=False):
@@ -589,3 +608,92 @@ class PeriodicActionTests(TestCaseBase):
         vm.disk_devices = [ro_drive, rw_drive]
         periodic.UpdateVolumes(vm)._execute()
         assert [d.name for d in vm.updated_drives] == [rw_drive.name]
+
+    def test_volume_watermark_monitor(self):
+        vms = {}
+        for i in range(5):
+            vm_id = _fake_vm_id(i)
+            vms[vm_id] = _FakeVM(vm_id, vm_id)
+        vms[_fake_vm_id(1)].monitorable = False
+        vms[_fake_vm_id(2)].volume_monitor.needed = False
+        vms[_fake_vm_id(3)].ready_for_commands = False
+        # Unexpected error checking one vm skips only this vm.
+        vms[_fake_vm_id(4)].ready_for_commands = fake.Error(
+            libvirt.VIR_ERR_INTERNAL_ERROR, "unexpected error")
+
+        calls = []
+
+        def monitor_vms(conn, vms):
+            calls.append((conn, [vm.id for vm in vms]))
+            return []
+
+        conn = object()
+        executor = _FakeExecutor()
+        op = periodic.VolumeWatermarkMonitor(lambda: vms, conn, executor, 1)
+        with MonkeyPatchScope([(periodic.thinp, 'monitor_vms', monitor_vms)]):
+            op()
+
+        assert calls == [(conn, [_fake_vm_id(0)])]
+        assert executor.attempts == 0
+
+    def test_volume_watermark_monitor_skipped(self):
+        vms = {}
+        for i in range(3):
+            vm_id = _fake_vm_id(i)
+            vms[vm_id] = _FakeVM(vm_id, vm_id)
+
+        def monitor_vms(conn, vms):
+            # The second vm was busy, and could not be monitored.
+            return [vms[1]]
+
+        executor = _FakeExecutor()
+        op = periodic.VolumeWatermarkMonitor(lambda: vms, None, executor, 1)
+        with MonkeyPatchScope([(periodic.thinp, 'monitor_vms', monitor_vms)]):
+            op()
+
+        # The skipped vm is monitored separately.
+        assert executor.attempts == 1
+        monitored = [vm.volume_monitor.monitored for vm in vms.values()]
+        assert monitored == [0, 1, 0]
+
+    def test_volume_watermark_monitor_skipped_exhausted(self):
+        vm = _FakeVM('123', 'test')
+
+        def monitor_vms(conn, vms):
+            return vms
+
+        executor = _FakeExecutor(fail=True)
+        op = periodic.VolumeWatermarkMonitor(
+            lambda: {vm.id: vm}, None, executor, 1)
+        with MonkeyPatchScope([(periodic.thinp, 'monitor_vms', monitor_vms)]):
+            op()
+
+        assert executor.attempts == 1
+        assert vm.volume_monitor.monitored == 0
+
+    def test_volume_watermark_monitor_blocked(self):
+        vm = _FakeVM('123', 'test')
+        calls = []
+        entered = threading.Event()
+        resume = threading.Event()
+
+        def monitor_vms(conn, vms):
+            calls.append(vms)
+            entered.set()
+            resume.wait(5)
+            return []
+
+        op = periodic.VolumeWatermarkMonitor(
+            lambda: {vm.id: vm}, None, _FakeExecutor(), 1)
+        with MonkeyPatchScope([(periodic.thinp, 'monitor_vms', monitor_vms)]):
+            t = threading.Thread(target=op)
+            t.start()
+            try:
+                assert entered.wait(5)
+                # Blocked call, the next call must not pile up.
+                op()
+            finally:
+                resume.set()
+                t.join()
+
+        assert len(calls) == 1
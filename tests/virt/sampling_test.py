@@ -206,6 +206,132 @@ class StatsCacheTests(TestCaseBase):
         assert res.is_empty()
         assert res.stats_age == 100
 
+    def test_missing_in_last_sample(self):
+        self._feed_cache((
+            ({'a': 'foo', 'b': 'foo'}, 1),
+            ({'a': 'bar', 'b': 'bar'}, 2),
+            ({'a': 'baz'}, 3),
+            ({'a': 'qux'}, 4),
+        ))
+        self.fake_monotonic_time.freeze(value=10)
+        assert self.cache.get('a').stats_age == 6
+        res = self.cache.get('b')
+        assert res.is_empty()
+        assert res.stats_age == 8
+
+    def test_added_after_sample(self):
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+            ({'a': 'bar'}, 2),
+        ))
+        self.fake_monotonic_time.freeze(value=5)
+        self.cache.add('a')
+        self.fake_monotonic_time.freeze(value=7)
+        assert self.cache.get('a').stats_age == 2
+        assert self.cache.get_batch()['a'].stats_age == 2
+
+    def test_get_batch_stats_age(self):
+        self.cache.add('b')
+        self._feed_cache((
+            ({'a': 'foo', 'b': 'foo'}, 1),
+            ({'a': 'bar', 'b': 'bar'}, 2),
+        ))
+        self.fake_monotonic_time.freeze(value=5)
+        res = self.cache.get_batch()
+        assert res == {
+            'a': ('foo', 'bar', FakeClock.STEP, 3),
+            'b': ('foo', 'bar', FakeClock.STEP, 3),
+        }
+
+    def test_remove(self):
+        self._feed_cache((
+            ({'a': 'foo', 'b': 'foo'}, 1),
+            ({'a': 'bar', 'b': 'bar'}, 2),
+        ))
+        self.cache.remove('a')
+        self.fake_monotonic_time.freeze(value=5)
+        assert self.cache.get('a').stats_age == 5
+        assert list(self.cache.get_batch()) == ['b']
+
+        # Remove again fails, like removing unknown VM.
+        with pytest.raises(KeyError):
+            self.cache.remove('a')
+
+    def test_remove_missing_in_last_sample(self):
+        self._feed_cache((
+            ({'a': 'foo', 'b': 'foo'}, 1),
+            ({'b': 'bar'}, 2),
+        ))
+        self.cache.remove('a')
+        with pytest.raises(KeyError):
+            self.cache.remove('a')
+
+    def test_remove_unknown(self):
+        with pytest.raises(KeyError):
+            self.cache.remove('a')
+
+    def test_remove_sampled_again(self):
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+            ({'a': 'bar'}, 2),
+        ))
+        self.cache.remove('a')
+        # A sample taken before the VM was removed.
+        self._feed_cache((
+            ({'a': 'baz'}, 3),
+        ))
+        self.fake_monotonic_time.freeze(value=5)
+        assert self.cache.get('a').stats_age == 2
+        assert list(self.cache.get_batch()) == ['a']
+
+    def test_generation(self):
+        assert self.cache.generation == 0
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+            ({'a': 'bar'}, 2),
+        ))
+        assert self.cache.generation == 2
+
+    def test_generation_out_of_order(self):
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+            ({'a': 'bar'}, 0),
+        ))
+        assert self.cache.generation == 1
+
+    def test_snapshot(self):
+        snapshot = self.cache.snapshot()
+        assert snapshot.generation == 0
+        assert snapshot.sample('a') is None
+
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+            ({'a': 'bar', 'b': 'bar'}, 2),
+        ))
+        snapshot = self.cache.snapshot()
+        assert snapshot.generation == 2
+        assert snapshot.timestamp == 2
+        assert snapshot.sample('a') == 'bar'
+        assert snapshot.sample('b') == 'bar'
+        assert snapshot.sample('c') is None
+
+    def test_snapshot_immutable(self):
+        self._feed_cache((
+            ({'a': 'foo'}, 1),
+        ))
+        snapshot = self.cache.snapshot()
+        self._feed_cache((
+            ({'a': 'bar'}, 2),
+        ))
+        self.cache.remove('a')
+
+        # The old snapshot is not affected by later changes.
+        assert snapshot.generation == 1
+        assert snapshot.sample('a') == 'foo'
+
+        # The VM is not available in the new snapshot.
+        assert self.cache.snapshot().sample('a') is None
+
     def _feed_cache(self, samples):
         for sample in samples:
             self.cache.put(*sample)
@@ -238,7 +364,10 @@ class NumaNodeMemorySampleTests(TestCaseBase):
             '2048': '10'
         }
 
-        return MonkeyPatchScope([(numa, 'topology',
+        # Node memory is not available in sysfs, reported by libvirt.
+        return MonkeyPatchScope([(sampling, '_SYSFS_NODE_PATH',
+                                  '/no/such/path'),
+                                 (numa, 'topology',
                                   fakeNumaTopology),
                                  (numa, 'memory_by_cell',
                                   fakeMemoryStats),
@@ -287,6 +416,117 @@ class NumaNodeMemorySampleTests(TestCaseBase):
             assert memorySample.nodesMemSample == expected
 
 
+NODE_MEMINFO = """\
+Node {node} MemTotal:        1024000 kB
+Node {node} MemFree:          409600 kB
+Node {node} MemUsed:          614400 kB
+"""
+
+
+@pytest.fixture
+def sysfs_nodes(tmpdir, monkeypatch):
+    for node in (0, 1):
+        node_dir = tmpdir.join("node%d" % node)
+        node_dir.ensure_dir()
+        node_dir.join("meminfo").write(NODE_MEMINFO.format(node=node))
+        hugepages = node_dir.join("hugepages", "hugepages-2048kB")
+        hugepages.ensure_dir()
+        hugepages.join("free_hugepages").write("%d\n" % (10 + node))
+
+    def topology():
+        return {
+            '0': {'cpus': [0], 'hugepages': {4: {}, 2048: {}}},
+            '1': {'cpus': [1], 'hugepages': {4: {}, 2048: {}}},
+        }
+
+    def no_libvirt(*args):
+        raise AssertionError("libvirt should not be used")
+
+    monkeypatch.setattr(sampling, '_SYSFS_NODE_PATH', str(tmpdir))
+    monkeypatch.setattr(sampling, '_PAGE_SIZE_KIB', 4)
+    monkeypatch.setattr(numa, 'topology', topology)
+    monkeypatch.setattr(numa, 'memory_by_cell', no_libvirt)
+    monkeypatch.setattr(numa, 'free_pages_by_cell', no_libvirt)
+
+
+def test_numa_node_memory_sysfs(sysfs_nodes):
+    sample = sampling.NumaNodeMemorySample()
+    assert sample.nodesMemSample == {
+        '0': {
+            'memPercent': 60,
+            'memFree': '400',
+            'hugepages': {
+                4: {'freePages': 102400},
+                2048: {'freePages': 10},
+            },
+        },
+        '1': {
+            'memPercent': 60,
+            'memFree': '400',
+            'hugepages': {
+                4: {'freePages': 102400},
+                2048: {'freePages': 11},
+            },
+        },
+    }
+
+
+PROC_STAT = """\
+cpu  4350684 14521 1120299 20687999 677480 197238 48056 0 1383 0
+cpu0 1082143 1040 335283 19253788 628168 104752 21570 0 351 0
+cpu1 1010362 2065 294113 474697 18915 41743 9793 0 308 0
+cpu3 961889 4603 207289 486787 11732 20192 6916 0 511 0
+intr 238783451 19 0 0 0 0 0 0 0 1 0 0 0 0 0 0 0 0 0 0 0 0
+ctxt 690239751
+btime 1395249141
+"""
+
+
+def test_total_cpu_sample():
+    sample = sampling.TotalCpuSample(PROC_STAT)
+    assert sample.user == 4350684 + 14521
+    assert sample.sys == 1120299
+    assert sample.idle == 20687999
+
+
+def test_cpu_core_sample():
+    sample = sampling.CpuCoreSample(PROC_STAT)
+    assert sample.getCoreSample(0) == {
+        'user': 1082143, 'userNice': 1040, 'sys': 335283, 'idle': 19253788}
+    assert sample.getCoreSample('3') == {
+        'user': 961889, 'userNice': 4603, 'sys': 207289, 'idle': 486787}
+
+    # Offline core.
+    assert not sample.hasCore(2)
+    assert sample.getCoreSample(2) is None
+
+    # Unknown core.
+    assert not sample.hasCore(1024)
+    assert sample.getCoreSample(1024) is None
+
+    assert list(sample.jiffies('sys')[:4]) == [335283, 294113, 0, 207289]
+
+
+def test_cpu_core_sample_all_online():
+    stat = "\n".join(PROC_STAT.splitlines()[:3]) + "\n"
+    sample = sampling.CpuCoreSample(stat)
+    assert sample.hasCore(1)
+    assert not sample.hasCore(2)
+    assert sample.getCoreSample(1)['idle'] == 474697
+
+
+def test_cpu_core_sample_from_cores():
+    sample = sampling.CpuCoreSample.from_cores({
+        2: {'user': 1, 'sys': 2},
+        0: {'user': 3, 'sys': 4},
+    })
+    assert sample.hasCore(0)
+    assert not sample.hasCore(1)
+    assert sample.getCoreSample(2) == {
+        'user': 1, 'userNice': 0, 'sys': 2, 'idle': 0}
+    assert list(sample.jiffies('user')) == [3, 0, 1]
+
+
 class HostStatsMonitorTests(TestCaseBase):
     FAILED_SAMPLE = 3  # random 'small' value
     STOP_SAMPLE = 6  # ditto
@@ -0,0 +1,171 @@
+#
+# Copyright 2022 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import pytest
+
+from vdsm.virt import statsdelta
+
+
+def vm_stats(vm_id, **kw):
+    stats = {
+        "vmId": vm_id,
+        "vmName": "vm-" + vm_id,
+        "vmType": "kvm",
+        "status": "Up",
+        "elapsedTime": "1",
+        "network": {"vnet0": {"rx": "0", "tx": "0"}},
+    }
+    stats.update(kw)
+    return stats
+
+
+@pytest.fixture
+def tracker():
+    return statsdelta.StatsTracker(clock=lambda: 1000.0)
+
+
+def test_initial_generation(tracker):
+    delta = tracker.delta([], 0)
+    assert delta.generation == 1000001
+
+
+def test_full(tracker):
+    stats = [vm_stats("a"), vm_stats("b")]
+    delta = tracker.delta(stats, 0)
+    assert delta.full
+    assert delta.stats_list == stats
+    assert delta.removed == []
+
+
+def test_no_changes(tracker):
+    first = tracker.delta([vm_stats("a"), vm_stats("b")], 0)
+    delta = tracker.delta([vm_stats("a"), vm_stats("b")], first.generation)
+    assert delta.generation == first.generation + 1
+    assert not delta.full
+    assert delta.stats_list == []
+    assert delta.removed == []
+
+
+def test_changed_fields(tracker):
+    first = tracker.delta([vm_stats("a"), vm_stats("b")], 0)
+    delta = tracker.delta([
+        vm_stats("a", elapsedTime="2"),
+        vm_stats("b", network={"vnet0": {"rx": "1", "tx": "0"}}),
+    ], first.generation)
+    assert not delta.full
+    assert sorted(delta.stats_list, key=lambda s: s["vmId"]) == [
+        {"vmId": "a", "elapsedTime": "2"},
+        {"vmId": "b", "network": {"vnet0": {"rx": "1", "tx": "0"}}},
+    ]
+
+
+def test_changed_since_older_generation(tracker):
+    first = tracker.delta([vm_stats("a")], 0)
+    tracker.delta([vm_stats("a", elapsedTime="2")], first.generation)
+    tracker.delta([vm_stats("a", elapsedTime="2", status="Paused")],
+                  first.generation + 1)
+
+    # Client missed the last 2 reports, and should get both changes.
+    delta = tracker.delta(
+        [vm_stats("a", elapsedTime="2", status="Paused")], first.generation)
+    assert delta.stats_list == [
+        {"vmId": "a", "elapsedTime": "2", "status": "Paused"},
+    ]
+
+    # Client got the last report, and should get no changes.
+    delta = tracker.delta(
+        [vm_stats("a", elapsedTime="2", status="Paused")],
+        delta.generation)
+    assert delta.stats_list == []
+
+
+def test_added_vm(tracker):
+    first = tracker.delta([vm_stats("a")], 0)
+    delta = tracker.delta([vm_stats("a"), vm_stats("b")], first.generation)
+    assert not delta.full
+    assert delta.stats_list == [vm_stats("b")]
+
+
+def test_removed_vm(tracker):
+    first = tracker.delta([vm_stats("a"), vm_stats("b")], 0)
+    delta = tracker.delta([vm_stats("a")], first.generation)
+    assert delta.stats_list == []
+    assert delta.removed == ["b"]
+
+    delta = tracker.delta([vm_stats("a")], delta.generation)
+    assert delta.removed == []
+
+
+def test_removed_vm_added_again(tracker):
+    first = tracker.delta([vm_stats("a")], 0)
+    tracker.delta([], first.generation)
+    delta = tracker.delta([vm_stats("a")], first.generation)
+    assert delta.stats_list == [vm_stats("a")]
+    assert delta.removed == []
+
+
+def test_removed_field(tracker):
+    stats = vm_stats("a", migrationProgress=50)
+    first = tracker.delta([stats], 0)
+
+    # Clients cannot learn about removed field from a delta, so we report
+    # the complete stats.
+    delta = tracker.delta([vm_stats("a")], first.generation)
+    assert delta.stats_list == [vm_stats("a")]
+
+    delta = tracker.delta([vm_stats("a")], delta.generation)
+    assert delta.stats_list == []
+
+
+@pytest.mark.parametrize("since", [
+    # Generation from previous run.
+    999999,
+    # Generation from the future.
+    1000002,
+])
+def test_unknown_generation(tracker, since):
+    stats = [vm_stats("a")]
+    tracker.delta(stats, 0)
+    delta = tracker.delta(stats, since)
+    assert delta.full
+    assert delta.stats_list == stats
+
+
+def test_forget_removed():
+    tracker = statsdelta.StatsTracker(max_removed=2, clock=lambda: 1000.0)
+    first = tracker.delta([vm_stats("a"), vm_stats("b")], 0)
+    second = tracker.delta([vm_stats("b")], first.generation)
+    assert second.removed == ["a"]
+
+    tracker.delta([], second.generation)
+    third = tracker.delta([vm_stats("c")], second.generation)
+    assert third.removed == ["b"]
+
+    # Removing "c" forgets "a" and "b"; a client that may have missed them
+    # must get a full report.
+    delta = tracker.delta([], first.generation)
+    assert delta.full
+
+    # But a client that got the last report gets a delta.
+    delta = tracker.delta([], delta.generation)
+    assert not delta.full
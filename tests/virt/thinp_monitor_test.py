@@ -69,9 +69,11 @@ from vdsm import utils
 from vdsm.common import response
 from vdsm.common.config import config
 from vdsm.common.units import MiB, GiB
+from vdsm.storage import constants as sc
 from vdsm.virt.vmdevices.storage import Drive, DISK_TYPE, BLOCK_THRESHOLD
 from vdsm.virt.vmdevices import hwclass
 from vdsm.virt.utils import TimedAcquireLock
+from vdsm.virt import sampling
 from vdsm.virt import thinp
 from vdsm.virt import vmstatus
 from vdsm.virt.vm import Vm
@@ -228,6 +230,7 @@ def test_extend(tmp_config):
     assert drv.threshold_state == BLOCK_THRESHOLD.EXCEEDED
     assert len(vm.cif.irs.extensions) == 1
     check_extension(vdb, drives[1], vm.cif.irs.extensions[0])
+    assert vm.cif.irs.extensions[0][1]["priority"] == sc.EXTEND_EXCEEDED
     assert drv.threshold_state == BLOCK_THRESHOLD.EXCEEDED
 
     # Simulate completed extend operation, invoking callback
@@ -235,6 +238,209 @@ def test_extend(tmp_config):
     assert drv.threshold_state == BLOCK_THRESHOLD.SET
 
 
+def test_extend_enospc(tmp_config):
+    vm = FakeVM(drive_infos())
+    drives = vm.getDiskDevices()
+    drv = drives[1]
+
+    vm.volume_monitor.monitor_volumes()
+    assert drv.threshold_state == BLOCK_THRESHOLD.SET
+
+    # Simulate a write missing the block threshold event, pausing the vm.
+    vdb = vm.block_stats[2]
+    vdb['allocation'] = allocation_threshold_for_resize_mb(vdb, drv) + MiB
+    vm._pause_code = "ENOSPC"
+
+    vm.volume_monitor.on_enospc(drv)
+    assert drv.threshold_state == BLOCK_THRESHOLD.EXCEEDED
+    assert len(vm.cif.irs.extensions) == 1
+    check_extension(vdb, drv, vm.cif.irs.extensions[0])
+
+    # The paused vm extend is sent before other extends.
+    assert vm.cif.irs.extensions[0][1]["priority"] == sc.EXTEND_ENOSPC
+
+
+@pytest.fixture
+def stats_cache(monkeypatch):
+    cache = sampling.StatsCache()
+    monkeypatch.setattr(sampling, "stats_cache", cache)
+    return cache
+
+
+def test_monitor_volumes_sampled(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    stats_cache.put({vm.id: vm.raw_block_stats()}, stats_cache.clock())
+
+    # Use the block stats from the bulk stats sample.
+    vm.volume_monitor.monitor_volumes()
+    assert vm.block_stats_queries == 0
+    for drive in vm.getDiskDevices():
+        if drive.chunked:
+            assert drive.threshold_state == BLOCK_THRESHOLD.SET
+
+
+def test_monitor_volumes_stale_sample(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    max_age = config.getint("vars", "vm_watermark_interval")
+    stats_cache.put(
+        {vm.id: vm.raw_block_stats()}, stats_cache.clock() - max_age - 1)
+
+    vm.volume_monitor.monitor_volumes()
+    assert vm.block_stats_queries == 1
+
+
+def test_monitor_volumes_no_block_stats(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    # Block stats are not reported when using nowait and a domain job is
+    # running.
+    stats_cache.put({vm.id: {}}, stats_cache.clock())
+
+    vm.volume_monitor.monitor_volumes()
+    assert vm.block_stats_queries == 1
+
+
+def test_extend_ignores_sample(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    drv = vm.getDiskDevices()[1]
+    vm.volume_monitor.monitor_volumes()
+    assert vm.block_stats_queries == 1
+
+    vdb = vm.block_stats[2]
+    alloc = allocation_threshold_for_resize_mb(vdb, drv) + 1 * MiB
+    stats_cache.put({vm.id: vm.raw_block_stats()}, stats_cache.clock())
+    vdb['allocation'] = alloc
+
+    # Handling an event must use current block stats.
+    vm.volume_monitor.on_block_threshold(
+        'vdb[1]', '/virtio/1', alloc, 1 * MiB)
+    assert vm.block_stats_queries == 2
+    assert len(vm.cif.irs.extensions) == 1
+
+
+def test_monitor_vms(tmp_config, stats_cache):
+    vms = [FakeVM(drive_infos(), vm_id="vm-%d" % i) for i in range(3)]
+    conn = FakeConnection()
+
+    thinp.monitor_vms(conn, vms)
+
+    # All vms queried using one call.
+    assert conn.queries == [["vm-0", "vm-1", "vm-2"]]
+    for vm in vms:
+        assert vm.block_stats_queries == 0
+        for drive in vm.getDiskDevices():
+            if drive.chunked:
+                assert drive.threshold_state == BLOCK_THRESHOLD.SET
+
+
+def test_monitor_vms_sampled(tmp_config, stats_cache):
+    vms = [FakeVM(drive_infos(), vm_id="vm-%d" % i) for i in range(2)]
+    conn = FakeConnection()
+    stats_cache.put(
+        {"vm-0": vms[0].raw_block_stats()}, stats_cache.clock())
+
+    thinp.monitor_vms(conn, vms)
+
+    # Only the vm missing in the sample is queried.
+    assert conn.queries == [["vm-1"]]
+
+
+def test_monitor_vms_sampled_before_resize(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    conn = FakeConnection()
+    stats_cache.put({vm.id: vm.raw_block_stats()}, stats_cache.clock())
+
+    # The drive was extended after the sample was taken, so the sample
+    # reports the old size.
+    drive = vm.getDiskDevices()[0]
+    drive.resize_time = stats_cache.clock() + 1
+
+    thinp.monitor_vms(conn, [vm])
+
+    assert conn.queries == [[vm.id]]
+
+
+def test_monitor_vms_not_needed(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    vm.volume_monitor.disable()
+    conn = FakeConnection()
+
+    thinp.monitor_vms(conn, [vm])
+
+    assert conn.queries == []
+
+
+def test_monitor_vms_query_failure(tmp_config, stats_cache):
+    vms = [FakeVM(drive_infos(), vm_id="vm-%d" % i) for i in range(2)]
+    conn = FakeConnection()
+    conn.errors["domainListGetStats"] = fake.Error(
+        libvirt.VIR_ERR_NO_DOMAIN, "fake error")
+
+    skipped = thinp.monitor_vms(conn, vms)
+
+    # The vms are not queried again, since one of them may be blocked; the
+    # caller monitors them separately.
+    assert skipped == vms
+    for vm in vms:
+        assert vm.block_stats_queries == 0
+
+
+def test_monitor_vms_nowait(tmp_config, stats_cache):
+    vms = [FakeVM(drive_infos(), vm_id="vm-%d" % i) for i in range(3)]
+    conn = FakeConnection()
+    # vm-1 is busy with another job; libvirt does not wait for it, and
+    # reports only the stats it can get without qemu.
+    conn.busy.add("vm-1")
+
+    skipped = thinp.monitor_vms(conn, vms)
+
+    assert conn.flags[0] & libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_NOWAIT
+    assert skipped == [vms[1]]
+    for vm in vms[0], vms[2]:
+        for drive in vm.getDiskDevices():
+            if drive.chunked:
+                assert drive.threshold_state == BLOCK_THRESHOLD.SET
+    for drive in vms[1].getDiskDevices():
+        assert drive.threshold_state == BLOCK_THRESHOLD.UNSET
+
+
+def test_monitor_vms_sampled_incomplete(tmp_config, stats_cache):
+    vm = FakeVM(drive_infos())
+    conn = FakeConnection()
+    raw_stats = vm.raw_block_stats()
+    del raw_stats["block.0.allocation"]
+    stats_cache.put({vm.id: raw_stats}, stats_cache.clock())
+
+    thinp.monitor_vms(conn, [vm])
+
+    # The incomplete sample is not used.
+    assert conn.queries == [[vm.id]]
+
+
+def test_monitor_vms_extend_order(tmp_config, stats_cache):
+    vms = [FakeVM(drive_infos(), vm_id="vm-%d" % i) for i in range(2)]
+    extensions = []
+
+    for vm in vms:
+        def sendExtendMsg(poolID, volInfo, newSize, func, priority=None,
+                          vm=vm):
+            extensions.append((vm.id, volInfo["name"]))
+        vm.cif.irs.sendExtendMsg = sendExtendMsg
+
+    # Both vms need extension; vm-1 vdb has less free space.
+    vda = vms[0].block_stats[1]
+    drive = vms[0].getDiskDevices()[0]
+    vda["allocation"] = allocation_threshold_for_resize_mb(vda, drive) + MiB
+
+    vdb = vms[1].block_stats[2]
+    drive = vms[1].getDiskDevices()[1]
+    vdb["allocation"] = (
+        allocation_threshold_for_resize_mb(vdb, drive) + 100 * MiB)
+
+    thinp.monitor_vms(FakeConnection(), vms)
+
+    assert extensions == [("vm-1", "vdb"), ("vm-0", "vda")]
+
+
 def test_extend_no_allocation(tmp_config):
     vm = FakeVM(drive_infos())
     drives = vm.getDiskDevices()
@@ -490,6 +696,7 @@ def test_force_drive_threshold_state_exceeded(tmp_config):
     # And try to exend.
     assert len(vm.cif.irs.extensions) == 1
     check_extension(vda, drives[0], vm.cif.irs.extensions[0])
+    assert vm.cif.irs.extensions[0][1]["priority"] == sc.EXTEND_THRESHOLD
 
 
 def test_event_received_before_write_completes(tmp_config):
@@ -669,10 +876,10 @@ class FakeVM(Vm):
 
     log = logging.getLogger('test')
 
-    def __init__(self, drive_infos):
-        self._dom = FakeDomain()
+    def __init__(self, drive_infos, vm_id='volume_monitor_vm'):
+        self._dom = FakeDomain(self)
         self.cif = FakeClientIF(FakeIRS())
-        self.id = 'volume_monitor_vm'
+        self.id = vm_id
 
         # Simplify testing by dispatching on the calling thread.
         self.volume_monitor = thinp.VolumeMonitor(
@@ -680,6 +887,7 @@ class FakeVM(Vm):
             dispatch=lambda func, **kw: func())
 
         self.block_stats = {}
+        self.block_stats_queries = 0
 
         disks = []
         for drive_conf, block_info in drive_infos:
@@ -701,6 +909,7 @@ class FakeVM(Vm):
         self._guestCpuLock = TimedAcquireLock(self.id)
         self._resume_behavior = 'auto_resume'
         self._pause_time = None
+        self._pause_code = None
 
     # to reduce the amount of faking needed, we fake those methods
     # which are not relevant to the monitor_volumes() flow
@@ -715,6 +924,12 @@ class FakeVM(Vm):
         return False
 
     def query_block_stats(self):
+        self.block_stats_queries += 1
+        return self.raw_block_stats()
+
+    # Testing API.
+
+    def raw_block_stats(self):
         # Create libvirt response.
         raw_stats = {"block.count": len(self.block_stats)}
         for i, block_info in enumerate(self.block_stats.values()):
@@ -730,7 +945,8 @@ class FakeVM(Vm):
 
 class FakeDomain(object):
 
-    def __init__(self):
+    def __init__(self, vm):
+        self.vm = vm
         self._devices = etree.Element('devices')
         self._state = (libvirt.VIR_DOMAIN_RUNNING, )
         self.errors = {}
@@ -757,6 +973,15 @@ class FakeDomain(object):
     def setBlockThreshold(self, target, threshold):
         self.thresholds[target] = threshold
 
+    # Used by thinp.monitor_vms().
+
+    @property
+    def dom(self):
+        return self
+
+    def UUIDString(self):
+        return self.vm.id
+
     # Testing API.
 
     def add_drive(self, drive, block_info):
@@ -790,6 +1015,29 @@ class FakeDomain(object):
         etree.SubElement(disk, "alias", name=drive.alias)
 
 
+class FakeConnection(object):
+
+    def __init__(self):
+        self.queries = []
+        self.flags = []
+        self.errors = {}
+        self.busy = set()
+
+    @maybefail
+    def domainListGetStats(self, doms, stats=0, flags=0):
+        self.queries.append([dom.UUIDString() for dom in doms])
+        self.flags.append(flags)
+        result = []
+        for dom in doms:
+            raw_stats = dom.vm.raw_block_stats()
+            if dom.UUIDString() in self.busy:
+                for key in list(raw_stats):
+                    if key.endswith((".allocation", ".threshold")):
+                        del raw_stats[key]
+            result.append((dom, raw_stats))
+        return result
+
+
 class FakeClientIF(fake.ClientIF):
 
     def notify(self, event_id, params=None):
@@ -803,7 +1051,7 @@ class FakeIRS(object):
         self.refreshes = []
         self.volume_sizes = {}
 
-    def sendExtendMsg(self, poolID, volInfo, newSize, func):
+    def sendExtendMsg(self, poolID, volInfo, newSize, func, priority=None):
         self.extensions.append((poolID, volInfo, newSize, func))
 
     def refreshVolume(self, domainID, poolID, imageID, volumeID):
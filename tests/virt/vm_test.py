@@ -48,6 +48,7 @@ import vdsm.common.time
 
 from vdsm.virt import cpumanagement
 from vdsm.virt import periodic
+from vdsm.virt import sampling
 from vdsm.virt import utils
 from vdsm.virt import virdomain
 from vdsm.virt import vm
@@ -1097,6 +1098,153 @@ class TestVmStats(TestCaseBase):
             testvm.guestAgent.diskMappingHash += 1
             assert res['hash'] != testvm.getStats()['hash']
 
+    def testSampleStatsCached(self):
+        produced = []
+
+        def produce(vm, first_sample, last_sample, interval):
+            produced.append(last_sample)
+            return {}
+
+        stats_cache = sampling.StatsCache()
+        with MonkeyPatchScope([
+            (sampling, 'stats_cache', stats_cache),
+            (vmstats, 'produce', produce),
+        ]):
+            with fake.VM(_VM_PARAMS) as testvm:
+                testvm.getStats()
+                testvm.getStats()
+                assert len(produced) == 1
+
+                # New bulk sample invalidates the cached stats.
+                stats_cache.put({testvm.id: {}}, stats_cache.clock())
+                testvm.getStats()
+                assert len(produced) == 2
+
+    def testSampleStatsCachedLiveFields(self):
+        stats_cache = sampling.StatsCache()
+        drive = self._block_drive()
+        drive.truesize = drive.apparentsize = 1024**3
+        with MonkeyPatchScope([(sampling, 'stats_cache', stats_cache)]):
+            with fake.VM(_VM_PARAMS) as testvm:
+                testvm._devices[hwclass.DISK] = (drive,)
+                testvm._balloon_minimum = 256
+                testvm._balloon_target = 1024
+                sample = {
+                    'balloon.current': 1024,
+                    'block.count': 1,
+                    'block.0.name': drive.name,
+                    'block.0.path': drive.path,
+                    'block.0.rd.bytes': 0,
+                    'block.0.wr.bytes': 0,
+                }
+                stats_cache.put({testvm.id: sample}, stats_cache.clock())
+                stats_cache.put({testvm.id: sample}, stats_cache.clock())
+                stats = testvm.getStats()
+                assert stats['balloonInfo']['balloon_target'] == '1024'
+                assert 'ioTune' not in stats
+
+                # Change fields not computed from the sample, without adding
+                # a new sample.
+                testvm._balloon_target = 512
+                drive.iotune = {'total_bytes_sec': 1000}
+                drive.truesize = drive.apparentsize = 2 * 1024**3
+                stats = testvm.getStats()
+
+                assert stats['balloonInfo']['balloon_target'] == '512'
+                assert stats['ioTune'] == [{
+                    'name': drive.name,
+                    'path': drive.path,
+                    'ioTune': {'total_bytes_sec': '1000'},
+                }]
+                disk = stats['disks'][drive.name]
+                assert disk['truesize'] == str(2 * 1024**3)
+                assert disk['apparentsize'] == str(2 * 1024**3)
+
+    def _block_drive(self):
+        return vmdevices.storage.Drive(
+            self.log,
+            index=0,
+            device="disk",
+            path="/dev/domain/volume",
+            type=hwclass.DISK,
+            iface="virtio",
+            domainID=str(uuid.uuid4()),
+            imageID=str(uuid.uuid4()),
+            poolID=str(uuid.uuid4()),
+            volumeID=str(uuid.uuid4()),
+            diskType=DISK_TYPE.BLOCK,
+        )
+
+    def testUpdateDriveVolumeSampled(self):
+        stats_cache = sampling.StatsCache()
+        drive = self._block_drive()
+        with MonkeyPatchScope([(sampling, 'stats_cache', stats_cache)]):
+            with fake.VM(_VM_PARAMS) as testvm:
+                sample = {
+                    'block.count': 2,
+                    'block.0.name': drive.name,
+                    'block.0.path': drive.path,
+                    'block.0.physical': 3 * 1024**3,
+                    'block.1.name': drive.name,
+                    'block.1.path': '/dev/domain/parent',
+                    'block.1.physical': 1024**3,
+                }
+                stats_cache.put({testvm.id: sample}, stats_cache.clock())
+
+                def getVolumeSize(*args):
+                    raise AssertionError("Unexpected storage access")
+
+                testvm.getVolumeSize = getVolumeSize
+                testvm.updateDriveVolume(drive)
+
+                assert drive.apparentsize == 3 * 1024**3
+                assert drive.truesize == 3 * 1024**3
+
+    def testUpdateDriveVolumeSampledTopChanged(self):
+        stats_cache = sampling.StatsCache()
+        drive = self._block_drive()
+        with MonkeyPatchScope([(sampling, 'stats_cache', stats_cache)]):
+            with fake.VM(_VM_PARAMS) as testvm:
+                # Sample taken before the top volume was changed.
+                sample = {
+                    'block.count': 1,
+                    'block.0.name': drive.name,
+                    'block.0.path': '/dev/domain/old',
+                    'block.0.physical': 1024**3,
+                }
+                stats_cache.put({testvm.id: sample}, stats_cache.clock())
+
+                testvm.getVolumeSize = lambda *args: vm.VolumeSize(
+                    2 * 1024**3, 2 * 1024**3)
+                testvm.updateDriveVolume(drive)
+
+                assert drive.apparentsize == 2 * 1024**3
+                assert drive.truesize == 2 * 1024**3
+
+    def testUpdateDriveVolumeSampledBeforeResize(self):
+        stats_cache = sampling.StatsCache()
+        drive = self._block_drive()
+        with MonkeyPatchScope([(sampling, 'stats_cache', stats_cache)]):
+            with fake.VM(_VM_PARAMS) as testvm:
+                # Sample taken before the drive was extended.
+                sample = {
+                    'block.count': 1,
+                    'block.0.name': drive.name,
+                    'block.0.path': drive.path,
+                    'block.0.backingIndex': 0,
+                    'block.0.allocation': 0,
+                    'block.0.physical': 1024**3,
+                }
+                stats_cache.put({testvm.id: sample}, stats_cache.clock())
+                drive.resize_time = stats_cache.clock() + 1
+
+                testvm.getVolumeSize = lambda *args: vm.VolumeSize(
+                    2 * 1024**3, 2 * 1024**3)
+                testvm.updateDriveVolume(drive)
+
+                assert drive.apparentsize == 2 * 1024**3
+                assert drive.truesize == 2 * 1024**3
+
     @MonkeyPatch(vm, 'config',
                  make_config([('vars', 'vm_command_timeout', '10')]))
     def testMonitorTimeoutResponsive(self):
@@ -154,7 +154,8 @@ class IRS(object):
         del self.prepared_volumes[key]
         return response.success()
 
-    def sendExtendMsg(self, spUUID, volDict, newSize, callbackFunc):
+    def sendExtendMsg(self, spUUID, volDict, newSize, callbackFunc,
+                      priority=None):
         # Volume extend is done async using mailbox in real code, and the
         # caller verifies that volume size has been extended by given callback
         # function. For testing purpose this method only implements the API
@@ -573,20 +574,11 @@ class SampleWindow:
         return self._samples
 
 
-class CpuCoreSample(object):
-
-    def __init__(self, samples):
-        self._samples = samples
-
-    def getCoreSample(self, key):
-        return self._samples.get(key)
-
-
 class HostSample(object):
 
     def __init__(self, timestamp, samples):
         self.timestamp = timestamp
-        self.cpuCores = CpuCoreSample(samples)
+        self.cpuCores = sampling.CpuCoreSample.from_cores(samples)
 
 
 CREATED = "created"
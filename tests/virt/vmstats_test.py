@@ -290,6 +290,21 @@ class UtilsFunctionsTests(VmStatsTestCase):
         # and indeed indexes must change
         assert len(all_indexes) == len(self.samples)
 
+    def test_find_backing_chain(self):
+        # With backing chain stats, the top node is reported first, and the
+        # backing chain nodes use the same name.
+        bulk_stats = {
+            'block.count': 3,
+            'block.0.name': 'vda',
+            'block.0.backingIndex': 3,
+            'block.1.name': 'vda',
+            'block.1.backingIndex': 1,
+            'block.2.name': 'vdb',
+            'block.2.backingIndex': 2,
+        }
+        indexes = vmstats._find_bulk_stats_reverse_map(bulk_stats, 'block')
+        assert indexes == {'vda': 0, 'vdb': 2}
+
     def test_network_missing(self):
         # seen using SR-IOV
 
@@ -410,6 +425,33 @@ class NetworkStatsTests(VmStatsTestCase):
             vm, stats, self.bulk_stats, faulty_bulk_stats, 1
         )
 
+    def test_networks_bulk_sample(self):
+        nics = (
+            FakeNic(name='vnet0', model='virtio',
+                    mac_addr='00:1a:4a:16:01:51',
+                    is_hostdevice=False),
+            FakeNic(name='vnet1', model='virtio',
+                    mac_addr='00:1a:4a:16:01:52',
+                    is_hostdevice=False),
+        )
+        vm = FakeVM(nics=nics)
+        first, last = self.samples
+
+        expected = {}
+        vmstats.networks(vm, expected, first, last, 1)
+
+        stats = {}
+        vmstats.networks(vm, stats,
+                         vmstats.BulkSample(first),
+                         vmstats.BulkSample(last),
+                         1)
+
+        for nic_stats in expected['network'].values():
+            del nic_stats['sampleTime']
+        for nic_stats in stats['network'].values():
+            del nic_stats['sampleTime']
+        assert stats == expected
+
 
 class DiskStatsTests(VmStatsTestCase):
 
@@ -512,6 +554,49 @@ class DiskStatsTests(VmStatsTestCase):
         self.assertNotRaises(vmstats.tune_io, testvm, stats)
         assert stats
 
+    def test_disk_values(self):
+        drives = (FakeDrive(name='hdc', size=700 * MiB),)
+        testvm = FakeVM(drives=drives)
+
+        stats_before = copy.deepcopy(self.bulk_stats)
+        stats_after = copy.deepcopy(self.bulk_stats)
+        _ensure_delta(stats_before, stats_after, 'block.0.rd.reqs', 4)
+        _ensure_delta(stats_before, stats_after, 'block.0.rd.times', 400)
+        _ensure_delta(stats_before, stats_after, 'block.0.wr.bytes', 10 * KiB)
+
+        stats = {}
+        vmstats.disks(testvm, stats, stats_before, stats_after, 10)
+        disk = stats['disks']['hdc']
+        assert disk['readOps'] == '4'
+        assert disk['readLatency'] == '100.0'
+        assert disk['writeLatency'] == '0'
+        assert disk['writeRate'] == '1024.0'
+        assert disk['writtenBytes'] == str(10 * KiB)
+
+    def test_bulk_sample(self):
+        drives = (FakeDrive(name='hdc', size=700 * MiB),
+                  FakeDrive(name='vda', size=40 * GiB))
+        testvm = FakeVM(drives=drives)
+
+        for keys in [(),
+                     ('block.0.rd.bytes',),
+                     ('block.0.rd.times', 'block.1.wr.reqs')]:
+            partial_stats = self._drop_stats(keys)
+            stats_before = copy.deepcopy(partial_stats)
+            stats_after = copy.deepcopy(partial_stats)
+            _ensure_delta(stats_before, stats_after, 'block.1.rd.reqs', 4)
+            _ensure_delta(stats_before, stats_after, 'block.1.rd.times', 400)
+
+            expected = {}
+            vmstats.disks(testvm, expected, stats_before, stats_after, 10)
+
+            stats = {}
+            vmstats.disks(testvm, stats,
+                          vmstats.BulkSample(stats_before),
+                          vmstats.BulkSample(stats_after),
+                          10)
+            assert stats == expected
+
     def _drop_stats(self, keys):
         partial_stats = copy.deepcopy(self.bulk_stats)
         for key in keys: